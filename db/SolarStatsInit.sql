@@ -59,3 +59,72 @@ CREATE TABLE IF NOT EXISTS outputhistory (
   FOREIGN KEY (Inverter_ID) REFERENCES inverter(ID)
 );
 
+CREATE TABLE IF NOT EXISTS linkstats (
+  DateTime TEXT NOT NULL,
+  Inverter_ID INTEGER(8) NOT NULL,
+  Port TEXT NOT NULL,
+  Sent INTEGER(8),
+  Ok INTEGER(8),
+  CrcErrors INTEGER(8),
+  ShortFrames INTEGER(8),
+  BadFrames INTEGER(8),
+  Timeouts INTEGER(8),
+  Retries INTEGER(8),
+  Latency BLOB,
+  FOREIGN KEY (Inverter_ID) REFERENCES inverter(ID)
+);
+
+-- Samples queued for the central ingestion server (see forwarder.py)
+CREATE TABLE IF NOT EXISTS outbox (
+  Seq INTEGER PRIMARY KEY AUTOINCREMENT,
+  Inverter_ID INTEGER(8) NOT NULL,
+  DateTime TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS outboxstate (
+  Key TEXT PRIMARY KEY NOT NULL,
+  Value TEXT
+);
+
+-- Anomalies found in the samples (see anomaly.py)
+CREATE TABLE IF NOT EXISTS events (
+  ID INTEGER PRIMARY KEY AUTOINCREMENT,
+  Inverter_ID INTEGER(8) NOT NULL,
+  DateTime TEXT NOT NULL,
+  Kind TEXT NOT NULL,
+  Value REAL,
+  Expected REAL,
+  Message TEXT,
+  FOREIGN KEY (Inverter_ID) REFERENCES inverter(ID)
+);
+
+-- Energy counter at the start of each year ('2014') and month ('2014-06'), on the continuous scale
+-- of counter_state (see counters.py)
+CREATE TABLE IF NOT EXISTS counter_baseline (
+  Inverter_ID INTEGER(8) NOT NULL,
+  Period TEXT NOT NULL,
+  Baseline REAL NOT NULL,
+  PRIMARY KEY (Inverter_ID, Period),
+  FOREIGN KEY (Inverter_ID) REFERENCES inverter(ID)
+);
+
+-- Correction of the EnergyTotal counter for resets and wraps, and its last reading
+CREATE TABLE IF NOT EXISTS counter_state (
+  Inverter_ID INTEGER(8) PRIMARY KEY NOT NULL,
+  Offset REAL NOT NULL,
+  LastTotal REAL NOT NULL,
+  LastDateTime TEXT NOT NULL,
+  Resets INTEGER(8) NOT NULL,
+  FOREIGN KEY (Inverter_ID) REFERENCES inverter(ID)
+);
+
+-- Orientation (degrees; azimuth from north, clockwise) and peak power (kWp) of the PV array of an
+-- inverter, for its clear-sky output (see clearsky.py). Without a row, the array faces south at 35
+-- degrees, sized to the inverter's MaxOutput
+CREATE TABLE IF NOT EXISTS pvarray (
+  Inverter_ID INTEGER(8) PRIMARY KEY NOT NULL,
+  Tilt REAL NOT NULL,
+  Azimuth REAL NOT NULL,
+  PeakPower REAL,
+  FOREIGN KEY (Inverter_ID) REFERENCES inverter(ID)
+);
@@ -0,0 +1,76 @@
+#! /usr/bin/python
+# Benchmark of the analytics metrics (solarstats/analytics.py) on synthetic history: a number of
+# inverters sampled every 5 minutes during daylight, for a number of years. Each metric is timed on
+# all of it; the exit code is 1 when a metric takes longer than the budget. Loading from SQLite is
+# timed separately, on a database of one inverter (--load-days of samples)
+import argparse     # Command-line arguments
+import os, sys      # System utils
+import shutil       # Removing the scratch directory
+import sqlite3      # Database for the load benchmark
+import tempfile     # Scratch directory
+import time         # Wall clock
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'solarstats'))
+import analytics
+
+# Synthetic samples of numInverters inverters, ordered by inverter and time
+def synthetic_history(numInverters, years, step=300, seed=1):
+    random = numpy.random.RandomState(seed)
+    times = numpy.arange(1388534400, 1388534400 + int(years * 365.25 * 86400), step, dtype=numpy.int64)
+    hour = (times % 86400) / 3600.0
+    times = times[(hour >= 6) & (hour < 18)]   # Daylight only: the inverters are off at night
+    sun = numpy.sin((times % 86400 / 3600.0 - 6) / 12 * numpy.pi)
+    n = len(times) * numInverters
+    irradiance = numpy.tile(sun, numInverters) * random.uniform(0.3, 1.0, n)
+    values = {'VoltsPV1': 300 + 50 * irradiance, 'VoltsPV2': 300 + 50 * irradiance,
+              'CurrentPV1': 5 * irradiance, 'CurrentPV2': 4.5 * irradiance,
+              'Temperature': 20 + 40 * irradiance, 'FrequencyAC': numpy.full(n, 50.0)}
+    dc = values['VoltsPV1'] * values['CurrentPV1'] + values['VoltsPV2'] * values['CurrentPV2']
+    values['PowerAC'] = dc * random.uniform(0.9, 0.96, n)
+    values['PowerAC'][random.uniform(size=n) < 0.01] = numpy.nan     # Failed readings
+    inverterId = numpy.repeat(numpy.arange(1, numInverters + 1, dtype=numpy.int32), len(times))
+    return analytics.History(inverterId, numpy.tile(times, numInverters), values)
+
+def time_load(days):
+    scratchDir = tempfile.mkdtemp()
+    try:
+        conn = sqlite3.connect(os.path.join(scratchDir, 'bench.sqlt'))
+        conn.execute("CREATE TABLE inverterdata (Inverter_ID INTEGER, DateTime TEXT, " +
+                     ', '.join(c + ' REAL' for c in analytics.columns) + ")")
+        start = 1388534400
+        rows = ((1, time.strftime('%Y-%m-%d %H:%M:%S.000000', time.gmtime(t)), 1000.0, 300.0, 300.0, 2.0, 2.0, 30.0, 50.0)
+                for t in xrange(start, start + days * 86400, 300))
+        conn.executemany("INSERT INTO inverterdata VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.commit()
+        began = time.time()
+        history = analytics.load(conn)
+        return len(history), time.time() - began
+    finally:
+        shutil.rmtree(scratchDir)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the analytics metrics on synthetic inverter history')
+    parser.add_argument('--inverters', type=int, default=24, help='Number of inverters (default: 24)')
+    parser.add_argument('--years', type=float, default=10, help='Years of history (default: 10)')
+    parser.add_argument('--budget', type=float, default=1000, help='Time allowed per metric, in ms (default: 1000)')
+    parser.add_argument('--load-days', type=int, default=365, help='Days of samples in the load benchmark (default: 365)')
+    args = parser.parse_args()
+
+    history = synthetic_history(args.inverters, args.years)
+    print "%d samples of %d inverters over %g years" % (len(history), args.inverters, args.years)
+    metrics = [('efficiency', lambda: history.perInverter(analytics.efficiency(history))),
+               ('string imbalance', lambda: history.perInverter(analytics.string_imbalance(history))),
+               ('specific yield', lambda: analytics.specific_yield(history, dict((i, 3.0) for i in history.inverters))),
+               ('derating curve', lambda: analytics.derating_curve(history)),
+               ('availability', lambda: analytics.availability(history))]
+    over = False
+    for name, metric in metrics:
+        began = time.time()
+        metric()
+        elapsed = (time.time() - began) * 1000
+        over = over or elapsed > args.budget
+        print "%-18s %8.1f ms%s" % (name, elapsed, ' (over budget)' if elapsed > args.budget else '')
+    rows, elapsed = time_load(args.load_days)
+    print "%-18s %8.1f ms (%d rows from SQLite)" % ('load', elapsed * 1000, rows)
+    sys.exit(1 if over else 0)
@@ -0,0 +1,144 @@
+#! /usr/bin/python
+# Startup benchmark of the non-polling modes of solarstats.py (--help, --export, --graph, ...).
+# Each mode is started a number of times in a scratch directory, which holds a database with a day of
+# samples of inverter 1, so --export exports them; the median wall time above that of
+# the bare interpreter is compared with a budget, and the exit code is 1 when a mode is over it (so it
+# can run in a cron job or CI).
+# With --imports, the modules imported by each mode are listed with their own and cumulative import
+# time (Python 2 has no '-X importtime', so the imports are timed by a hook around __import__)
+import argparse     # Command-line arguments
+import datetime     # Sample times
+import os, sys      # System utils
+import shutil       # Removing the scratch directory
+import sqlite3      # Scratch database
+import subprocess   # Starting the modes
+import tempfile     # Scratch directory
+import time         # Wall clock
+
+scriptDir = os.path.dirname(os.path.abspath(__file__))
+solarStats = os.path.join(scriptDir, '..', 'solarstats', 'solarstats.py')
+initFile = os.path.join(scriptDir, '..', 'db', 'SolarStatsInit.sql')
+
+# Modes that must start quickly: (name, arguments, budget in ms or None for --budget). Export and graph
+# do their work on the scratch database, and export needs NumPy, so they get budgets of their own
+modes = [('help', ['--help'], None),
+         ('export', ['-e', '1'], 150.0),
+         ('graph', ['--graph'], None),
+         ('link-stats', ['--link-stats'], None),
+         ('show-trace', ['--show-trace', 'missing.trace'], None)]
+
+# Modules that are only needed for polling or serving, and must not be loaded by these modes
+pollingModules = ['serial', 'subprocess', 'socket', 'shutil', 'blacklinesolar3000',
+                  'mastervoltsoladin600', 'livefeed', 'htmlpage']
+
+# Runs solarstats.py (argv[1:]) with __import__ wrapped; on exit, writes one line per module that was
+# loaded to stderr: 'import <self us> <cumulative us> <depth> <name>'
+importHook = r'''
+import __builtin__, os, runpy, sys, time
+_import = __builtin__.__import__
+_stack = [0.0]
+_depth = [0]
+_lines = []
+def _timedImport(name, globals=None, locals=None, fromlist=None, level=-1):
+    known = len(sys.modules)
+    start = time.time()
+    _stack.append(0.0)
+    _depth[0] += 1
+    try:
+        return _import(name, globals, locals, fromlist, level)
+    finally:
+        _depth[0] -= 1
+        nested = _stack.pop()
+        total = time.time() - start
+        _stack[-1] += total
+        if len(sys.modules) > known:
+            _lines.append('import %d %d %d %s' % ((total - nested) * 1e6, total * 1e6, _depth[0], name or '.'))
+__builtin__.__import__ = _timedImport
+def _report():
+    sys.stderr.write('\n'.join(_lines) + '\n')
+    sys.stderr.write('modules %s\n' % ' '.join(sorted(m for m in sys.modules if sys.modules[m] is not None)))
+import atexit
+atexit.register(_report)
+sys.argv = sys.argv[1:]
+sys.path.insert(0, os.path.dirname(sys.argv[0]))
+runpy.run_path(sys.argv[0], run_name='__main__')
+'''
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Measure the startup time of the non-polling modes of solarstats.py')
+    parser.add_argument('--runs', type=int, default=20, help='Number of runs per mode (default: 20)')
+    parser.add_argument('--budget', type=float, default=60.0, help='Maximum median startup time per mode on top of the interpreter startup, in ms, for modes without a budget of their own (default: 60)')
+    parser.add_argument('--imports', action='store_true', help='List the slowest imports of each mode')
+    parser.add_argument('--top', type=int, default=15, help='Number of imports listed with --imports (default: 15)')
+    return parser.parse_args()
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.0
+
+# Scratch database of the modes: the tables, and a day of samples of inverter 1, one every 5 minutes
+def create_database(workDir):
+    conn = sqlite3.connect(os.path.join(workDir, 'SolarStats.sqlt'))
+    with open(initFile) as f:
+        conn.executescript(f.read())
+    start = datetime.datetime.now() - datetime.timedelta(days=1)
+    conn.executemany("INSERT INTO inverterdata (Inverter_ID, DateTime, PowerAC, EnergyToday, EnergyTotal, RawData) "
+                     "VALUES (1, ?, ?, ?, ?, '')",
+                     [(str(start + datetime.timedelta(minutes=5 * i)), 500.0, i / 100.0, 2500.0 + i / 100.0) for i in range(288)])
+    conn.commit()
+    conn.close()
+
+# Wall time (ms) of each run of a command
+def time_command(command, runs, workDir):
+    times = []
+    with open(os.devnull, 'w') as devnull:
+        for i in range(runs):
+            start = time.time()
+            subprocess.call(command, cwd=workDir, stdout=devnull, stderr=devnull)
+            times.append((time.time() - start) * 1000.0)
+    return times
+
+# Imports of a mode as [(self us, cumulative us, depth, name)], and the set of modules it loaded
+def import_profile(arguments, workDir):
+    process = subprocess.Popen([sys.executable, '-c', importHook, solarStats] + arguments, cwd=workDir,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output, errors = process.communicate()
+    imports = []
+    modules = set()
+    for line in errors.splitlines():
+        fields = line.split()
+        if fields and fields[0] == 'import':
+            imports.append((int(fields[1]), int(fields[2]), int(fields[3]), fields[4]))
+        elif fields and fields[0] == 'modules':
+            modules = set(fields[1:])
+    return imports, modules
+
+if __name__ == "__main__":
+    args = parse_args()
+    workDir = tempfile.mkdtemp(prefix='solarstats-bench-')
+    try:
+        create_database(workDir)
+        interpreter = median(time_command([sys.executable, '-c', 'pass'], args.runs, workDir))
+        print "Interpreter startup: %.1f ms (median of %d runs)" % (interpreter, args.runs)
+        print "%-12s %9s %9s %9s %9s  %s" % ('Mode', 'median', 'min', 'max', 'budget', '(ms above the interpreter)')
+        overBudget = []
+        for name, arguments, budget in modes:
+            budget = budget or args.budget
+            times = time_command([sys.executable, solarStats] + arguments, args.runs, workDir)
+            times = [t - interpreter for t in times]
+            result = median(times)
+            print "%-12s %9.1f %9.1f %9.1f %9.0f  %s" % (name, result, min(times), max(times), budget, 'OVER BUDGET' if result > budget else 'ok')
+            if result > budget:
+                overBudget.append(name)
+            if args.imports:
+                imports, modules = import_profile(arguments, workDir)
+                print "    Imports: %.1f ms" % (sum(i[1] for i in imports if i[2] == 0) / 1000.0)
+                for selfTime, cumulative, depth, module in sorted(imports, key=lambda i: -i[1])[:args.top]:
+                    print "    %8d %8d us  %s%s" % (selfTime, cumulative, '  ' * depth, module)
+                loaded = [module for module in pollingModules if module in modules]
+                if loaded:
+                    print "    Polling modules loaded: %s" % ', '.join(loaded)
+    finally:
+        shutil.rmtree(workDir)
+    sys.exit(1 if overBudget else 0)
@@ -4,7 +4,12 @@
 # FIXME: Modularise: main() report()
 
 # Import Python modules
-import argparse, binascii, datetime, logging, fnmatch, math, os, serial, sqlite3, subprocess, sys, time, shutil, string, struct
+import argparse, datetime, logging, time    # Command-line arguments; time conversions; general logging
+import os, sys, shutil                      # System utils
+import subprocess                           # For calling rrd / sqlite db creation
+import binascii, math, struct               # Frame encoding and decoding
+import sqlite3                              # Database connection
+# pyserial (openSerial) and fnmatch (archiving) are imported where they are used
 
 # Basic ModBus commands (\x is escape sequence for hex digits)
 read_holding_register = "\x03"
@@ -109,6 +114,7 @@ def parseArgs():
 # Connection details for the serial port; opens the port immediately
 # http://tubifex.nl/2013/04/read-mastervolt-soladin-600-with-python-pyserial/
 def openSerial(portID):
+    import serial   # Serial port communication
     try:
         serPort = serial.Serial(
             port=portID,
@@ -941,6 +947,7 @@ if __name__=="__main__":
     # End of day checks: archive graphs
     if (hour == 23 and minute == 55):
         # Copy the file to the 'archive' directory
+        import fnmatch
         logging.info("%s:%s: archiving graphs to '%s'", hour, minute, rrdArchDir)
         filenames = os.listdir(webDir)
         logging.debug("Found files: '%s'", filenames)
@@ -0,0 +1,193 @@
+# Analysis of the inverter history with NumPy. The samples are loaded from inverterdata in chunks
+# into one array per column (see History); the metrics work on whole arrays, without Python loops
+# over samples, and reduce per inverter with bincount. Ten years of 5-minute daylight samples of two
+# dozen inverters (12.6 million rows) take around half a second per metric (see
+# resources/analytics_bench.py); loading them from SQLite takes longer than that.
+# NumPy is only needed here: solarstats.py does not import this module
+import itertools    # Chunks of rows
+import numpy        # Column arrays
+
+
+# Columns loaded by default (besides the inverter and the time)
+columns = ('PowerAC', 'VoltsPV1', 'VoltsPV2', 'CurrentPV1', 'CurrentPV2', 'Temperature', 'FrequencyAC')
+
+minPower = 50.0     # DC power (W) below which efficiency and string imbalance are not determined
+maxGap = 900        # Longest interval (seconds) between samples that is integrated into the yield
+maxWatts = 1000000  # Highest AC power (W) in the derating curve; higher readings are counted as this
+
+
+class History:
+    # Samples of one or more inverters, ordered by inverter and time. time is in seconds since the
+    # epoch, of the local time in DateTime (so time // 86400 is the local day); missing values are NaN
+    def __init__(self, inverterId, time, values):
+        self.inverterId = inverterId
+        self.time = time
+        self.values = values                # Column name -> float64 array
+        # Inverters in order, and the position in inverters of each sample (samples are ordered by inverter)
+        first = numpy.ones(len(inverterId), dtype=bool)
+        first[1:] = inverterId[1:] != inverterId[:-1]
+        self.inverters = inverterId[first]
+        self.index = numpy.cumsum(first) - 1
+
+    def __len__(self):
+        return len(self.time)
+
+    def __getitem__(self, column):
+        return self.values[column]
+
+    # DC power of the second string; NaN where there is none: PV2 empty, or stored as zeros (the Soladin
+    # has one string, and stores 0.0 for the second)
+    def secondString(self):
+        volts, current = self['VoltsPV2'], self['CurrentPV2']
+        with numpy.errstate(invalid='ignore'):
+            return numpy.where((volts == 0) | (current == 0), numpy.nan, volts * current)
+
+    # DC power of both strings (or of the first, for inverters with one string)
+    def dcPower(self):
+        power = self['VoltsPV1'] * self['CurrentPV1']
+        second = self.secondString()
+        numpy.add(power, second, out=power, where=~numpy.isnan(second))
+        return power
+
+    # Mean of values per inverter (in the order of inverters), ignoring NaN
+    def perInverter(self, values):
+        valid = ~numpy.isnan(values)
+        counts = numpy.bincount(self.index[valid], minlength=len(self.inverters))
+        sums = numpy.bincount(self.index[valid], values[valid], minlength=len(self.inverters))
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            return sums / counts
+
+
+def query(columns, inverterId=None, start=None, end=None):
+    sql = "SELECT Inverter_ID, CAST(strftime('%s', DateTime) AS INTEGER), " + ', '.join(columns) + " FROM inverterdata"
+    conditions, parameters = [], []
+    for condition, value in (("Inverter_ID = ?", inverterId), ("DateTime >= ?", start), ("DateTime < ?", end)):
+        if value is not None:
+            conditions.append(condition)
+            parameters.append(value)
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    return sql + " ORDER BY Inverter_ID, DateTime", parameters
+
+# Samples from conn (a connection to the main database, or shards.connect), as History objects of at
+# most chunkSize rows. start and end are DateTimes ('2014-06-01'); end is not included
+def chunks(conn, inverterId=None, start=None, end=None, columns=columns, chunkSize=100000):
+    sql, parameters = query(columns, inverterId, start, end)
+    cursor = conn.execute(sql, parameters)
+    while True:
+        rows = cursor.fetchmany(chunkSize)
+        if not rows:
+            break
+        yield to_history(rows, columns)
+
+# The same from rows of query (for shards.select, which runs it on one shard at a time)
+def row_chunks(rows, columns=columns, chunkSize=100000):
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, chunkSize))
+        if not chunk:
+            break
+        yield to_history(chunk, columns)
+
+# History of rows of query
+def to_history(rows, columns):
+    table = numpy.array(rows, dtype=numpy.float64)      # NULL becomes NaN
+    return History(table[:, 0].astype(numpy.int32), table[:, 1].astype(numpy.int64),
+                   dict((column, table[:, i + 2]) for i, column in enumerate(columns)))
+
+def load(conn, inverterId=None, start=None, end=None, columns=columns, chunkSize=100000):
+    parts = list(chunks(conn, inverterId, start, end, columns, chunkSize))
+    if not parts:
+        return History(numpy.zeros(0, numpy.int32), numpy.zeros(0, numpy.int64),
+                       dict((column, numpy.zeros(0)) for column in columns))
+    return History(numpy.concatenate([p.inverterId for p in parts]), numpy.concatenate([p.time for p in parts]),
+                   dict((column, numpy.concatenate([p[column] for p in parts])) for column in columns))
+
+
+# DC to AC conversion efficiency per sample. NaN where the DC power is below minPower, and where it
+# is above 1 (AC and DC readings of a sample are not taken at the same moment)
+def efficiency(history, minPower=minPower):
+    dc = history.dcPower()
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        result = history['PowerAC'] / dc
+        result[(dc < minPower) | (result > 1.0)] = numpy.nan
+    return result
+
+# Imbalance between the two strings per sample: (P1 - P2) / (P1 + P2), from -1 (only PV2) to 1 (only
+# PV1). NaN where there is no second string or the DC power is below minPower
+def string_imbalance(history, minPower=minPower):
+    p1 = history['VoltsPV1'] * history['CurrentPV1']
+    p2 = history.secondString()
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        result = (p1 - p2) / (p1 + p2)
+        result[(p1 + p2 < minPower) | numpy.isnan(p2)] = numpy.nan
+    return result
+
+# Energy (kWh) per inverter and day, integrated from PowerAC; returns (days, energy), with days as
+# numpy.datetime64 dates and energy[i, d] for history.inverters[i] on days[d]. Intervals longer
+# than maxGap (missing samples) are not integrated
+def daily_energy(history, maxGap=maxGap):
+    if not len(history):
+        return numpy.zeros(0, 'datetime64[D]'), numpy.zeros((len(history.inverters), 0))
+    interval = numpy.diff(history.time)
+    valid = (interval > 0) & (interval <= maxGap) & (history.index[1:] == history.index[:-1])
+    power = history['PowerAC'][1:]
+    valid &= ~numpy.isnan(power)
+    day = history.time[1:] // 86400
+    firstDay = history.time.min() // 86400
+    numDays = int(history.time.max() // 86400 - firstDay + 1)
+    slot = history.index[1:][valid] * numDays + (day[valid] - firstDay)
+    energy = numpy.bincount(slot, power[valid] * interval[valid] / 3600000.0, minlength=len(history.inverters) * numDays)
+    days = numpy.arange(firstDay, firstDay + numDays).astype('datetime64[D]')
+    return days, energy.reshape(len(history.inverters), numDays)
+
+# Specific yield (kWh per kWp) per inverter and day; kwp maps inverter IDs to their peak power (kWp).
+# Inverters without a peak power get NaN. Returns (days, yields) as daily_energy
+def specific_yield(history, kwp, maxGap=maxGap):
+    days, energy = daily_energy(history, maxGap)
+    peak = numpy.array([kwp.get(int(i), numpy.nan) for i in history.inverters], dtype=numpy.float64)
+    return days, energy / peak[:, numpy.newaxis]
+
+# Temperature derating curve per temperature bin (edges in degrees): the mean efficiency and the
+# highest AC power reached (to the watt). Returns (centres, efficiency, maxPower, samples), NaN for
+# empty bins
+def derating_curve(history, edges=numpy.arange(10.0, 81.0, 5.0)):
+    edges = numpy.asarray(edges, dtype=numpy.float64)
+    numBins = len(edges) - 1
+    power = history['PowerAC']
+    eff = efficiency(history)
+    # Bin 1 to numBins; 0 below the edges or without power, numBins + 1 above them (or no temperature)
+    bins = numpy.searchsorted(edges, history['Temperature'], side='right')
+    noPower = numpy.isnan(power)
+    bins[noPower] = 0
+    effValid = ~numpy.isnan(eff)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        meanEff = (numpy.bincount(bins[effValid], eff[effValid], minlength=numBins + 2) /
+                   numpy.bincount(bins[effValid], minlength=numBins + 2))[1:-1]
+    # Samples per bin and watt; the highest power of a bin is its last watt with samples
+    watts = power.astype(numpy.int64)
+    watts[noPower | (watts < 0)] = 0
+    numpy.minimum(watts, maxWatts, out=watts)
+    width = int(watts.max()) + 1 if len(watts) else 1
+    counts = numpy.bincount(bins * width + watts, minlength=(numBins + 2) * width).reshape(numBins + 2, width)[1:-1]
+    samples = counts.sum(axis=1)
+    with numpy.errstate(invalid='ignore'):
+        maxPower = numpy.where(samples > 0, width - 1 - numpy.argmax(counts[:, ::-1] > 0, axis=1), numpy.nan)
+    return (edges[:-1] + edges[1:]) / 2, meanEff, maxPower, samples
+
+# Availability per inverter: the fraction of the intervals in which any inverter produced power
+# (daylight, as seen by the site) in which this inverter produced power as well
+def availability(history, interval=300, threshold=0.0):
+    with numpy.errstate(invalid='ignore'):
+        producing = history['PowerAC'] > threshold
+    slots = history.time[producing] // interval
+    index = history.index[producing]
+    numInverters = len(history.inverters)
+    if not len(slots):
+        return numpy.full(numInverters, numpy.nan)
+    site = numpy.zeros(int(slots.max() - slots.min()) + 1, dtype=bool)
+    site[slots - slots.min()] = True
+    # Samples are ordered by inverter and time, so an interval is new when it differs from the previous
+    first = numpy.ones(len(slots), dtype=bool)
+    first[1:] = (slots[1:] != slots[:-1]) | (index[1:] != index[:-1])
+    return numpy.bincount(index[first], minlength=numInverters) / float(site.sum())
@@ -0,0 +1,192 @@
+# Streaming anomaly detection on the decoded samples. Every sample updates a few running statistics
+# of its inverter (exponentially weighted mean and variance), in constant time and memory, and is
+# checked for:
+# - output drop: the power of an inverter relative to that of its siblings (the other inverters of
+#   the site) falls well below its usual ratio
+# - temperature rise: the temperature is far above its running mean
+# - grid excursions: AC voltage or frequency outside the limits of the grid
+# - repeated status flags: the inverter reports a fault status in several samples in a row
+# An event is raised when a condition starts (not for every sample it lasts), and stored in the
+# 'events' table. The state of the detector can be saved to a file, so that a collector started by
+# cron carries on where the previous run stopped
+import datetime # Event times
+import json     # Saved state
+import logging  # General logging
+import math     # Standard deviation
+import os       # State file
+import time     # Sample times
+
+
+createTable = ("CREATE TABLE IF NOT EXISTS events ("
+               "ID INTEGER PRIMARY KEY AUTOINCREMENT, Inverter_ID INTEGER(8) NOT NULL, DateTime TEXT NOT NULL, "
+               "Kind TEXT NOT NULL, Value REAL, Expected REAL, Message TEXT)")
+
+# Detection parameters
+alpha = 0.05                    # Weight of a new sample in the running statistics
+warmup = 20                     # Samples before an inverter's statistics are trusted
+threshold = 4.0                 # Standard deviations from the running mean that make an anomaly
+minPower = 50.0                 # AC power (W) of the inverter and its siblings below which output is not compared
+minDrop = 0.3                   # Smallest relative output drop that is reported
+minTemperatureRise = 8.0        # Smallest temperature rise (degrees above the running mean) that is reported
+gridVoltage = (207.0, 253.0)    # Grid voltage limits: 230 V +/- 10% (EN 50160)
+gridFrequency = (49.5, 50.5)    # Grid frequency limits: 50 Hz +/- 1% (EN 50160)
+repeatedStatus = 3              # Samples in a row with a fault status that make an event
+maxAge = 900                    # Seconds after which the power of a silent inverter no longer counts for its siblings
+
+
+class Ewma:
+    # Exponentially weighted mean and variance
+    def __init__(self, mean=None, var=0.0, count=0):
+        self.mean = mean
+        self.var = var
+        self.count = count
+
+    def update(self, value):
+        if self.mean is None:
+            self.mean = value
+        else:
+            diff = value - self.mean
+            incr = alpha * diff
+            self.mean += incr
+            self.var = (1 - alpha) * (self.var + diff * incr)
+        self.count += 1
+
+    def std(self):
+        return math.sqrt(self.var)
+
+    # Standard deviations of value from the mean (0 until the statistics are trusted)
+    def zScore(self, value):
+        if self.count < warmup or self.var <= 0:
+            return 0.0
+        return (value - self.mean) / self.std()
+
+    def asList(self):
+        return [self.mean, self.var, self.count]
+
+
+class InverterState:
+    def __init__(self):
+        self.ratio = Ewma()         # Power relative to the siblings
+        self.temperature = Ewma()
+        self.power = 0.0            # Latest power, counted for the siblings (see siblingPower)
+        self.time = 0.0             # Time of the latest sample
+        self.faults = 0             # Samples in a row with a fault status
+        self.active = set()         # Conditions that are going on (raised once)
+
+    # True when a condition starts
+    def starts(self, kind, condition):
+        if not condition:
+            self.active.discard(kind)
+            return False
+        if kind in self.active:
+            return False
+        self.active.add(kind)
+        return True
+
+    def asDict(self):
+        return {'ratio': self.ratio.asList(), 'temperature': self.temperature.asList(), 'power': self.power,
+                'time': self.time, 'faults': self.faults, 'active': sorted(self.active)}
+
+    @classmethod
+    def fromDict(cls, d):
+        state = cls()
+        state.ratio = Ewma(*d['ratio'])
+        state.temperature = Ewma(*d['temperature'])
+        state.power, state.time, state.faults = d['power'], d['time'], d['faults']
+        state.active = set(d['active'])
+        return state
+
+
+class Event:
+    def __init__(self, inverterId, kind, value, expected, message, dateTime=None):
+        self.inverterId = inverterId
+        self.kind = kind
+        self.value = value
+        self.expected = expected
+        self.message = message
+        self.dateTime = dateTime or str(datetime.datetime.now())
+
+    def __repr__(self):
+        return "Event(%s, %s, %s)" % (self.inverterId, self.kind, self.message)
+
+    def store(self, conn):
+        conn.execute(createTable)
+        conn.execute("INSERT INTO events (Inverter_ID, DateTime, Kind, Value, Expected, Message) VALUES (?,?,?,?,?,?)",
+                     (self.inverterId, self.dateTime, self.kind, self.value, self.expected, self.message))
+
+
+class Detector:
+    def __init__(self):
+        self.inverters = {}         # Inverter ID -> InverterState
+
+    def state(self, inverterId):
+        if inverterId not in self.inverters:
+            self.inverters[inverterId] = InverterState()
+        return self.inverters[inverterId]
+
+    # Sum of the latest power of the other inverters of the site, of those heard from in the last maxAge seconds
+    def siblingPower(self, inverterId, now):
+        return sum(state.power for i, state in self.inverters.items() if i != inverterId and now - state.time <= maxAge)
+
+    # Check a decoded sample (a results dict of a poll function: 'id', 'PowerAC', 'Temperature',
+    # 'VoltsAC1', 'FrequencyAC', 'statusOk', 'Status2'); returns the events it raises
+    def observe(self, results, now=None):
+        now = now or time.time()
+        inverterId = results['id']
+        state = self.state(inverterId)
+        events = []
+        power = results.get('PowerAC') or 0.0
+
+        # Output relative to the siblings
+        state.power, state.time = power, now
+        siblings = self.siblingPower(inverterId, now)
+        if power >= minPower and siblings >= minPower:
+            ratio = power / siblings
+            expected = state.ratio.mean
+            dropped = (state.ratio.zScore(ratio) < -threshold and ratio < expected * (1 - minDrop))
+            if state.starts('output_drop', dropped):
+                events.append(Event(inverterId, 'output_drop', ratio, expected,
+                                    "Output %.0f%% below the usual share of the site" % (100 * (1 - ratio / expected))))
+            state.ratio.update(ratio)
+
+        temperature = results.get('Temperature')
+        if temperature is not None:
+            expected = state.temperature.mean
+            hot = (state.temperature.zScore(temperature) > threshold and temperature - expected >= minTemperatureRise)
+            if state.starts('temperature_rise', hot):
+                events.append(Event(inverterId, 'temperature_rise', temperature, expected,
+                                    "Temperature %.1f, %.1f above normal" % (temperature, temperature - expected)))
+            state.temperature.update(temperature)
+
+        for kind, key, (low, high), unit in (('grid_voltage', 'VoltsAC1', gridVoltage, 'V'),
+                                             ('grid_frequency', 'FrequencyAC', gridFrequency, 'Hz')):
+            value = results.get(key)
+            if value and state.starts(kind, not low <= value <= high):
+                events.append(Event(inverterId, kind, value, (low + high) / 2,
+                                    "Grid %s %s%s outside %s-%s%s" % (kind[5:], value, unit, low, high, unit)))
+
+        state.faults = 0 if results.get('statusOk', True) else state.faults + 1
+        if state.starts('status', state.faults >= repeatedStatus):
+            events.append(Event(inverterId, 'status', results.get('Status2'), None,
+                                "Status '%s' in %d samples in a row" % (results.get('statusText'), state.faults)))
+
+        for event in events:
+            logging.warning("Inverter %s: %s", inverterId, event.message)
+        return events
+
+    # An inverter did not respond: its power no longer counts for its siblings
+    def missing(self, inverterId):
+        self.state(inverterId).power = 0.0
+
+    def load(self, stateFile):
+        try:
+            with open(stateFile, 'r') as f:
+                saved = json.load(f)
+            self.inverters = dict((int(i), InverterState.fromDict(d)) for i, d in saved.items())
+        except (IOError, ValueError, KeyError, TypeError):
+            return
+
+    def save(self, stateFile):
+        with open(stateFile + '.tmp', 'w') as f:
+            json.dump(dict((str(i), state.asDict()) for i, state in self.inverters.items()), f)
+        os.rename(stateFile + '.tmp', stateFile)
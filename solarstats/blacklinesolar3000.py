@@ -1,6 +1,7 @@
 import logging  # General logging
 import struct   # Used in the CRC calculation
 import solarutils
+from timing import timings
 
 class BlackLineSolar:
     def __init__(self):
@@ -87,7 +88,7 @@ class BlackLineSolar:
     def mb_readRegister(self, slaveAddress, functionCode, startRegister, numRegisters):
         pdu = functionCode + startRegister.zfill(4).decode('hex') + numRegisters.zfill(4).decode('hex')
         adu = slaveAddress.decode('hex') + pdu + self.calculateModbusCrc(slaveAddress.decode('hex') + pdu)
-        logging.debug("Command generated: %s ", self.su.printhex(adu))
+        logging.debug("Command generated: %s ", solarutils.LazyHex(adu))
         return adu
 
     # Generates the Read Holding Registers command (0x03) as per ModBus protocol
@@ -105,18 +106,46 @@ class BlackLineSolar:
         # Should at least expect 'address', 'function' and 'data length' bytes
         if len(response) < 3:
             logging.error("Error parsing response of length %d", len(response))
-            raise ValueError("Response length too short: %d", len(response))
+            raise solarutils.FrameLengthError("Response length too short: %d", len(response))
 
         address = response[0] # First field is address
         command = response[1] # First field is command
         byteCount = response[2] # Second field is byte count
         data = response[3:-2] # Remainder (minus last 2 CRC bytes) is data
+        if len(data) < ord(byteCount):
+            logging.error("Response truncated: %d data bytes, expecting %d", len(data), ord(byteCount))
+            raise solarutils.FrameLengthError("Response truncated: %d data bytes, expecting %d", len(data), ord(byteCount))
 
         # Check the CRC of the response; if incorrect, do not return message data
-        calcCrc = self.calculateModbusCrc(response[:-2])
+        with timings.span('crc', 'BLS3000'):
+            calcCrc = self.calculateModbusCrc(response[:-2])
         if calcCrc != response[-2] + response[-1]:
-            logging.error("Invalid CRC (expected: %s; actual: %s)! Ignoring response...", self.su.printhex(calcCrc), self.su.printhex(response[-2] + response[-1]))
-            raise ValueError("Invalid CRC (expected: %s; actual: %s))", self.su.printhex(calcCrc), self.su.printhex(response[-2] + response[-1]))
+            expected, actual = solarutils.LazyHex(calcCrc), solarutils.LazyHex(response[-2:])
+            logging.error("Invalid CRC (expected: %s; actual: %s)! Ignoring response...", expected, actual)
+            raise solarutils.CrcError("Invalid CRC (expected: %s; actual: %s))", expected, actual)
+
+        return (address, command, byteCount, data)
+
+    # Parse a Modbus TCP response (MBAP header and PDU; see transport). TCP does its own error checking,
+    # so there is no CRC. Returns the same fields as mb_parseResponse, with the unit ID as address
+    def mb_parseTcpResponse(self, response):
+        if len(response) < 9:
+            logging.error("Error parsing response of length %d", len(response))
+            raise solarutils.FrameLengthError("Response length too short: %d", len(response))
+
+        transactionId, protocol, length, unit = struct.unpack('>HHHB', response[:7])
+        if protocol != 0 or length != len(response) - 6:
+            raise ValueError("Invalid MBAP header (protocol %d, length %d)", protocol, length)
+        address = response[6]
+        command = response[7]
+        if ord(command) & 0x80:
+            logging.error("Modbus exception %d from unit %d", ord(response[8]), unit)
+            raise ValueError("Modbus exception %d from unit %d", ord(response[8]), unit)
+        byteCount = response[8]
+        data = response[9:]
+        if len(data) < ord(byteCount):
+            logging.error("Response truncated: %d data bytes, expecting %d", len(data), ord(byteCount))
+            raise solarutils.FrameLengthError("Response truncated: %d data bytes, expecting %d", len(data), ord(byteCount))
 
         return (address, command, byteCount, data)
 
@@ -0,0 +1,176 @@
+# Expected output of the PV arrays under a clear sky, for comparing with the measured power (the
+# performance ratio). The sun's position is computed for every step of a day at once (NOAA's
+# low-precision formulas), followed by the clear-sky irradiance (Haurwitz for the global, Meinel for
+# the direct irradiance), the irradiance on the plane of each array, and its output. The curves of a
+# day are cached on disk, so the astronomy is done once a day rather than every cycle.
+# The arrays are configured in the 'pvarray' table (tilt, azimuth, kWp); an inverter without a row
+# gets the default tilt and azimuth, and an array sized to its MaxOutput
+import hashlib      # Cache file names
+import logging      # General logging
+import math         # Degrees
+import os           # Cache files
+import sqlite3      # Array configuration
+import time         # Days
+import numpy        # Vectorised model
+
+import inverters
+
+
+createTable = ("CREATE TABLE IF NOT EXISTS pvarray ("
+               "Inverter_ID INTEGER(8) PRIMARY KEY NOT NULL, Tilt REAL NOT NULL, Azimuth REAL NOT NULL, PeakPower REAL)")
+
+defaultTilt = 35.0      # Degrees from horizontal
+defaultAzimuth = 180.0  # Degrees from north, clockwise (180 is south)
+systemFactor = 0.85     # Output of an array per kWp at 1000 W/m2, after temperature, wiring and inverter losses
+albedo = 0.2            # Ground reflection
+minExpected = 50.0      # Expected power (W) below which no performance ratio is given
+cacheDays = 31          # Cached curves older than this are removed
+modelVersion = 1        # Part of the cache file names; raise when the model changes
+
+
+class PvArray:
+    def __init__(self, inverterId, tilt=defaultTilt, azimuth=defaultAzimuth, peakPower=None, maxOutput=None):
+        self.inverterId = inverterId
+        self.tilt = tilt
+        self.azimuth = azimuth
+        self.peakPower = peakPower if peakPower is not None else (maxOutput or 0) / 1000.0    # kWp
+        self.maxOutput = maxOutput      # Inverter limit (W); None for no limit
+
+    def __repr__(self):
+        return "PvArray(%s, %g, %g, %g kWp)" % (self.inverterId, self.tilt, self.azimuth, self.peakPower)
+
+    def key(self):
+        return (self.inverterId, self.tilt, self.azimuth, self.peakPower, self.maxOutput)
+
+# The arrays of all inverters in the database
+def load_arrays(dbName):
+    configured = {}
+    conn = sqlite3.connect(dbName)
+    try:
+        conn.execute(createTable)
+        for inverterId, tilt, azimuth, peakPower in conn.execute("SELECT Inverter_ID, Tilt, Azimuth, PeakPower FROM pvarray"):
+            configured[inverterId] = (tilt, azimuth, peakPower)
+    finally:
+        conn.close()
+    return [PvArray(iv.id, *configured.get(iv.id, (defaultTilt, defaultAzimuth, None)), maxOutput=iv.maxOutput)
+            for iv in inverters.load_inverters(dbName)]
+
+
+# Zenith and azimuth (radians; azimuth from north, clockwise) of the sun at the given Unix times
+def solar_position(times, latitude, longitude):
+    n = numpy.asarray(times, dtype=numpy.float64) / 86400.0 - 10957.5     # Days since J2000.0
+    meanLongitude = numpy.radians((280.460 + 0.9856474 * n) % 360)
+    meanAnomaly = numpy.radians((357.528 + 0.9856003 * n) % 360)
+    eclipticLongitude = meanLongitude + numpy.radians(1.915 * numpy.sin(meanAnomaly) + 0.020 * numpy.sin(2 * meanAnomaly))
+    obliquity = numpy.radians(23.439 - 0.0000004 * n)
+    rightAscension = numpy.arctan2(numpy.cos(obliquity) * numpy.sin(eclipticLongitude), numpy.cos(eclipticLongitude))
+    declination = numpy.arcsin(numpy.sin(obliquity) * numpy.sin(eclipticLongitude))
+    siderealTime = numpy.radians((280.46061837 + 360.98564736629 * n + longitude) % 360)
+    hourAngle = siderealTime - rightAscension
+    lat = math.radians(latitude)
+    cosZenith = (math.sin(lat) * numpy.sin(declination) + math.cos(lat) * numpy.cos(declination) * numpy.cos(hourAngle))
+    zenith = numpy.arccos(numpy.clip(cosZenith, -1, 1))
+    azimuth = numpy.arctan2(numpy.sin(hourAngle), numpy.cos(hourAngle) * math.sin(lat) - numpy.tan(declination) * math.cos(lat)) + math.pi
+    return zenith, azimuth
+
+# Clear-sky global horizontal, direct normal and diffuse horizontal irradiance (W/m2) at zenith angles
+def clear_sky(zenith):
+    cosZenith = numpy.cos(zenith)
+    up = cosZenith > 0.01
+    ghi = numpy.zeros_like(cosZenith)
+    dni = numpy.zeros_like(cosZenith)
+    ghi[up] = 1098.0 * cosZenith[up] * numpy.exp(-0.057 / cosZenith[up])
+    airMass = 1.0 / (cosZenith[up] + 0.50572 * (96.07995 - numpy.degrees(zenith[up])) ** -1.6364)
+    dni[up] = 1353.0 * 0.7 ** (airMass ** 0.678)
+    dhi = numpy.maximum(ghi - dni * cosZenith, 0.0)
+    return ghi, dni, dhi
+
+# Output (W) of an array under a clear sky, at the sun positions
+def array_output(array, zenith, azimuth, ghi, dni, dhi):
+    tilt = math.radians(array.tilt)
+    cosIncidence = (numpy.cos(zenith) * math.cos(tilt) +
+                    numpy.sin(zenith) * math.sin(tilt) * numpy.cos(azimuth - math.radians(array.azimuth)))
+    irradiance = (dni * numpy.maximum(cosIncidence, 0.0) + dhi * (1 + math.cos(tilt)) / 2 +
+                  ghi * albedo * (1 - math.cos(tilt)) / 2)
+    power = irradiance * array.peakPower * systemFactor     # 1 kWp gives 1000 W at 1000 W/m2
+    if array.maxOutput:
+        power = numpy.minimum(power, array.maxOutput)
+    return power
+
+
+class ExpectedOutput:
+    def __init__(self, arrays, latitude, longitude, cacheDir=None, step=300):
+        self.arrays = arrays
+        self.rows = dict((array.inverterId, i) for i, array in enumerate(arrays))
+        self.latitude = latitude
+        self.longitude = longitude
+        self.cacheDir = cacheDir
+        self.step = step
+        config = repr((modelVersion, latitude, longitude, step, [array.key() for array in arrays]))
+        self.digest = hashlib.sha1(config).hexdigest()[:12]
+        self._curves = {}
+
+    # Times (Unix) of the steps of a local day ('2014-06-01')
+    def dayTimes(self, day):
+        start = time.mktime(time.strptime(day, '%Y-%m-%d'))
+        end = time.mktime(time.strptime(time.strftime('%Y-%m-%d', time.localtime(start + 90000)), '%Y-%m-%d'))
+        return numpy.arange(start, end, self.step)
+
+    def cacheFile(self, day):
+        return os.path.join(self.cacheDir, 'clearsky-%s-%s.npy' % (day, self.digest))
+
+    # Expected power (W) of every array, for every step of a day: (times, power[array, step])
+    def curves(self, day):
+        if day in self._curves:
+            return self._curves[day]
+        times = self.dayTimes(day)
+        power = None
+        if self.cacheDir:
+            try:
+                power = numpy.load(self.cacheFile(day))
+            except (IOError, ValueError):
+                pass
+        if power is None or power.shape != (len(self.arrays), len(times)):
+            zenith, azimuth = solar_position(times, self.latitude, self.longitude)
+            ghi, dni, dhi = clear_sky(zenith)
+            power = numpy.array([array_output(array, zenith, azimuth, ghi, dni, dhi) for array in self.arrays])
+            power = power.reshape(len(self.arrays), len(times))
+            if self.cacheDir:
+                self.save(day, power)
+        self._curves = {day: (times, power)}    # Only the current day is kept
+        return self._curves[day]
+
+    def save(self, day, power):
+        try:
+            if not os.path.isdir(self.cacheDir):
+                os.makedirs(self.cacheDir)
+            numpy.save(self.cacheFile(day), power)
+            logging.info("Computed clear-sky output of %s into '%s'", day, self.cacheFile(day))
+            limit = time.time() - cacheDays * 86400
+            for name in os.listdir(self.cacheDir):
+                path = os.path.join(self.cacheDir, name)
+                if name.startswith('clearsky-') and os.path.getmtime(path) < limit:
+                    os.remove(path)
+        except (IOError, OSError) as inst:
+            logging.error("Cannot cache clear-sky output in '%s': %s", self.cacheDir, inst)
+
+    # Expected power (W) of the array of an inverter at a Unix time (None for unknown inverters)
+    def expected(self, inverterId, when):
+        if inverterId not in self.rows:
+            return None
+        times, power = self.curves(time.strftime('%Y-%m-%d', time.localtime(when)))
+        return float(numpy.interp(when, times, power[self.rows[inverterId]]))
+
+    # Expected energy (kWh) of the array of an inverter on a day
+    def expectedEnergy(self, inverterId, day):
+        if inverterId not in self.rows:
+            return None
+        times, power = self.curves(day)
+        return float(power[self.rows[inverterId]].sum()) * self.step / 3600000.0
+
+    # Measured power relative to the expected power (None when too little is expected)
+    def performanceRatio(self, inverterId, power, when):
+        expected = self.expected(inverterId, when)
+        if expected is None or expected < minExpected:
+            return None
+        return power / expected
@@ -0,0 +1,146 @@
+# Energy counters: the EnergyTotal counter of an inverter is made continuous (corrected for resets,
+# such as a replaced or reinitialised inverter, and for wraps of the counter register), and the yield
+# of a year or month is the continuous counter minus its value at the start of the period, the
+# baseline. Baselines are stored in the 'counter_baseline' table when a period starts, and the
+# correction state in 'counter_state', so year-to-date and lifetime yields are available with every
+# sample, without scanning the history (which is done once per inverter, when it has no state yet).
+# Without a database connection, the counters are kept in memory only (for replaying stored samples)
+import logging  # General logging
+
+
+createTables = ["CREATE TABLE IF NOT EXISTS counter_baseline ("
+                "Inverter_ID INTEGER(8) NOT NULL, Period TEXT NOT NULL, Baseline REAL NOT NULL, "
+                "PRIMARY KEY (Inverter_ID, Period))",
+                "CREATE TABLE IF NOT EXISTS counter_state ("
+                "Inverter_ID INTEGER(8) PRIMARY KEY NOT NULL, Offset REAL NOT NULL, LastTotal REAL NOT NULL, "
+                "LastDateTime TEXT NOT NULL, Resets INTEGER(8) NOT NULL)"]
+
+resetTolerance = 1.0    # Drop of the counter (kWh) below which it is taken as noise rather than a reset
+wrapMargin = 0.05       # A drop from within this fraction of the register's range is a wrap
+
+# Periods of a DateTime with a baseline: year and month
+def periods(dateTime):
+    return (dateTime[:4], dateTime[:7])
+
+
+class CounterState:
+    def __init__(self, offset=0.0, lastTotal=None, lastDateTime=None, resets=0):
+        self.offset = offset            # Added to the counter to make it continuous
+        self.lastTotal = lastTotal      # Last counter value, as read
+        self.lastDateTime = lastDateTime
+        self.resets = resets
+
+    def continuous(self):
+        return self.offset + self.lastTotal
+
+    # Take in a counter reading; wrap is the range of the counter register (None if it does not
+    # wrap). Returns the kind of discontinuity ('reset' or 'wrap'), or None
+    def advance(self, total, dateTime, wrap=None):
+        kind = None
+        if self.lastTotal is not None and total < self.lastTotal - resetTolerance:
+            if wrap and self.lastTotal > wrap * (1 - wrapMargin):
+                self.offset += wrap
+                kind = 'wrap'
+            else:
+                self.offset += self.lastTotal   # Restarted from zero: the new reading was produced since
+                kind = 'reset'
+            self.resets += 1
+        elif self.lastTotal is not None and total < self.lastTotal:
+            total = self.lastTotal              # Noise; the counter does not go back
+        self.lastTotal = total
+        self.lastDateTime = dateTime
+        return kind
+
+
+class Counters:
+    # history(inverterId) returns the (DateTime, EnergyTotal) rows of an inverter in time order; it is
+    # used once per inverter, to build its state and baselines from the samples stored so far
+    def __init__(self, conn=None, history=None):
+        self.conn = conn
+        self.history = history
+        self.states = {}
+        self.baselines = {}     # (inverter ID, period) -> baseline, for the periods seen by this process
+        if conn is not None:
+            for statement in createTables:
+                conn.execute(statement)
+
+    def state(self, inverterId):
+        if inverterId not in self.states:
+            row = None
+            if self.conn is not None:
+                row = self.conn.execute("SELECT Offset, LastTotal, LastDateTime, Resets FROM counter_state WHERE Inverter_ID=?",
+                                        (inverterId,)).fetchone()
+            if row is not None:
+                self.states[inverterId] = CounterState(*row)
+            else:
+                self.states[inverterId] = self.rebuild(inverterId)
+        return self.states[inverterId]
+
+    def baseline(self, inverterId, period):
+        key = (inverterId, period)
+        if key not in self.baselines:
+            if self.conn is None:
+                return None
+            row = self.conn.execute("SELECT Baseline FROM counter_baseline WHERE Inverter_ID=? AND Period=?",
+                                    (inverterId, period)).fetchone()
+            if row is None:
+                return None
+            self.baselines[key] = row[0]
+        return self.baselines[key]
+
+    def setBaseline(self, inverterId, period, baseline):
+        if self.conn is not None:
+            self.conn.execute("INSERT OR REPLACE INTO counter_baseline (Inverter_ID, Period, Baseline) VALUES (?,?,?)",
+                              (inverterId, period, baseline))
+        self.baselines[(inverterId, period)] = baseline
+
+    # Replay the stored samples of an inverter
+    def rebuild(self, inverterId):
+        state = CounterState()
+        rows = self.history(inverterId) if self.history else []
+        count = 0
+        for dateTime, total in rows:
+            if total is not None:
+                self.advanceState(inverterId, state, total, str(dateTime))
+                count += 1
+        if count:
+            logging.info("Built energy counter baselines of inverter %s from %d samples", inverterId, count)
+            self.saveState(inverterId, state)
+        return state
+
+    def advanceState(self, inverterId, state, total, dateTime, wrap=None):
+        lastTotal = state.lastTotal
+        previous = state.continuous() if lastTotal is not None else None
+        kind = state.advance(total, dateTime, wrap)
+        if kind:
+            logging.warning("Energy counter of inverter %s: %s from %.2f to %.2f at %s; continuous counter at %.2f",
+                            inverterId, kind, lastTotal, total, dateTime, state.continuous())
+        for period in periods(dateTime):
+            if self.baseline(inverterId, period) is None:
+                # The yield of a period starts at the last reading before it
+                self.setBaseline(inverterId, period, previous if previous is not None else state.continuous())
+        return kind
+
+    def saveState(self, inverterId, state):
+        if self.conn is not None:
+            self.conn.execute("INSERT OR REPLACE INTO counter_state (Inverter_ID, Offset, LastTotal, LastDateTime, Resets) "
+                              "VALUES (?,?,?,?,?)", (inverterId, state.offset, state.lastTotal, state.lastDateTime, state.resets))
+
+    # Take in a sample; returns the yields (kWh): {'lifetime', 'year', 'month'}. Does not commit
+    def observe(self, inverterId, dateTime, total, wrap=None):
+        state = self.state(inverterId)
+        self.advanceState(inverterId, state, total, dateTime, wrap)
+        self.saveState(inverterId, state)
+        return self.yields(inverterId, dateTime)
+
+    def yields(self, inverterId, dateTime):
+        state = self.state(inverterId)
+        if state.lastTotal is None:
+            return {'lifetime': None, 'year': None, 'month': None}
+        continuous = state.continuous()
+        year, month = periods(dateTime)
+        result = {'lifetime': continuous}
+        for name, period in (('year', year), ('month', month)):
+            baseline = self.baseline(inverterId, period)
+            result[name] = continuous - baseline if baseline is not None else 0.0
+        return result
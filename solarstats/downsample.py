@@ -0,0 +1,195 @@
+# Downsampling of sample series for long-range charts. The samples of an inverter's metric are put
+# into buckets of a fixed width (aligned on multiples of it), and every bucket gives one point, chosen
+# by Largest-Triangle-Three-Buckets (LTTB), and its minimum and maximum (the envelope). The bucket
+# width is the smallest of resolutions that keeps a range within the requested number of points, so a
+# year gives as many points as a day. Series are cached per (inverter, metric, width) and extended
+# with the samples stored since: only the points of the last two buckets are chosen again, as LTTB
+# chooses a bucket's point by the point before it and the mean of the bucket after it.
+# Times are seconds since the epoch of the local time in DateTime, as in analytics
+import calendar     # Local time as seconds
+import logging      # Missing shards
+import threading    # Requests of the status server come in on threads
+import time         # Current time
+import numpy        # Vectorised buckets
+
+import analytics
+
+
+# Metrics that can be downsampled
+metrics = ('PowerAC', 'EnergyToday', 'EnergyTotal', 'Temperature', 'VoltsPV1', 'CurrentPV1', 'VoltsAC1', 'FrequencyAC')
+
+# Bucket widths (seconds); the smallest one giving at most the requested number of points is used
+resolutions = (60, 300, 900, 1800, 3600, 3 * 3600, 6 * 3600, 12 * 3600, 86400, 2 * 86400, 7 * 86400, 30 * 86400)
+
+maxPoints = 4000    # Most points returned for a range
+maxSeries = 64      # Cached series; all are dropped when there are more
+
+
+# Bucket width for a range of seconds in at most points buckets
+def resolution(seconds, points):
+    for width in resolutions:
+        if seconds <= width * (points - 1):
+            return width
+    return resolutions[-1]
+
+# Boundaries of the buckets of width seconds in times (ascending): bucket i holds the samples
+# bounds[i]:bounds[i + 1]
+def bucket_bounds(times, width):
+    ids = times // width
+    return numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(ids)) + 1, [len(times)]))
+
+# Index of the chosen sample of every bucket. anchor is the (time, value) chosen in the bucket before
+# the first one; without it, the first bucket gives its first sample. The last bucket gives its last
+def select_points(times, values, bounds, meanTimes, meanValues, anchor=None):
+    count = len(bounds) - 1
+    selected = numpy.empty(count, dtype=numpy.int64)
+    for b in xrange(count):
+        lo, hi = bounds[b], bounds[b + 1]
+        if b == count - 1:
+            selected[b] = hi - 1
+        elif anchor is None:
+            selected[b] = lo
+        else:
+            # Twice the area of the triangle (anchor, sample, mean of the next bucket), for every sample
+            ax, ay = anchor
+            area = numpy.abs((ax - meanTimes[b + 1]) * (values[lo:hi] - ay) - (ax - times[lo:hi]) * (meanValues[b + 1] - ay))
+            selected[b] = lo + numpy.argmax(area)
+        anchor = (times[selected[b]], values[selected[b]])
+    return selected
+
+# Local time now, as seconds
+def local_now():
+    return calendar.timegm(time.localtime())
+
+# DateTime of a time in seconds
+def date_time(t):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(t))
+
+
+class Series:
+    fields = ('bucket', 'time', 'value', 'minimum', 'maximum')
+
+    # The downsampled series of one metric of an inverter: per bucket (bucket number: start // width),
+    # the chosen sample (time, value) and the minimum and maximum
+    def __init__(self, width, start=0):
+        self.width = width
+        self.start = start          # Samples are loaded from here
+        self.lastTime = None        # Of the last sample added
+        self.bucket = numpy.zeros(0, dtype=numpy.int64)
+        self.time = numpy.zeros(0, dtype=numpy.int64)
+        self.value = numpy.zeros(0)
+        self.minimum = numpy.zeros(0)
+        self.maximum = numpy.zeros(0)
+        self._tailTimes = numpy.zeros(0, dtype=numpy.int64)     # Samples of the last two buckets
+        self._tailValues = numpy.zeros(0)
+
+    def __len__(self):
+        return len(self.bucket)
+
+    # Add samples (ascending times; samples up to lastTime and NaN values are left out)
+    def extend(self, times, values):
+        times = numpy.asarray(times, dtype=numpy.int64)
+        values = numpy.asarray(values, dtype=numpy.float64)
+        keep = ~numpy.isnan(values)
+        if self.lastTime is not None:
+            keep &= times > self.lastTime
+        if not keep.any():
+            return
+        times = numpy.concatenate((self._tailTimes, times[keep]))
+        values = numpy.concatenate((self._tailValues, values[keep]))
+
+        bounds = bucket_bounds(times, self.width)
+        starts = bounds[:-1]
+        counts = numpy.diff(bounds).astype(numpy.float64)
+        meanTimes = numpy.add.reduceat(times.astype(numpy.float64), starts) / counts
+        meanValues = numpy.add.reduceat(values, starts) / counts
+        # The buckets of the tail are replaced; the one before it anchors the first of them
+        kept = numpy.searchsorted(self.bucket, times[0] // self.width)
+        anchor = (self.time[kept - 1], self.value[kept - 1]) if kept else None
+        selected = select_points(times, values, bounds, meanTimes, meanValues, anchor)
+
+        for name, new in (('bucket', times[starts] // self.width), ('time', times[selected]), ('value', values[selected]),
+                          ('minimum', numpy.minimum.reduceat(values, starts)), ('maximum', numpy.maximum.reduceat(values, starts))):
+            setattr(self, name, numpy.concatenate((getattr(self, name)[:kept], new)))
+        tail = bounds[max(len(bounds) - 3, 0)]
+        self._tailTimes = times[tail:]
+        self._tailValues = values[tail:]
+        self.lastTime = int(times[-1])
+
+    # Drop the buckets before a time (those of the tail are kept)
+    def trim(self, before):
+        limit = numpy.searchsorted(self.bucket, before // self.width)
+        if len(self._tailTimes):
+            limit = min(limit, numpy.searchsorted(self.bucket, self._tailTimes[0] // self.width))
+        for name in self.fields:
+            setattr(self, name, getattr(self, name)[limit:])
+        self.start = max(self.start, before)
+
+    # Buckets starting in [start, end): {'bucket': width, 't': times, 'v': values, 'min': [...], 'max': [...]}
+    def window(self, start, end):
+        lo, hi = numpy.searchsorted(self.bucket, [start // self.width, (end - 1) // self.width + 1])
+        return {'bucket': self.width, 't': self.time[lo:hi].tolist(), 'v': self.value[lo:hi].tolist(),
+                'min': self.minimum[lo:hi].tolist(), 'max': self.maximum[lo:hi].tolist()}
+
+
+class Downsampler:
+    # connect(start, end) returns a connection to the inverter data between two DateTimes (end None
+    # for up to now), such as solarstats.connect_inverterdata. When a range spans more shards than
+    # can be attached (connect raises ValueError), select(sql, parameters, start, end) is used
+    # instead, which reads them one at a time, such as solarstats.select_inverterdata
+    def __init__(self, connect, maxPoints=maxPoints, select=None):
+        self.connect = connect
+        self.select = select
+        self.maxPoints = maxPoints
+        self.series = {}        # (inverter ID, metric, width) -> Series
+        self._lock = threading.Lock()
+
+    # Load the samples of a series from a time up to end (None for up to now). Returns False when
+    # (some of) the data could not be read (a shard is missing)
+    def load(self, series, inverterId, metric, start, end=None):
+        start, end = date_time(start), None if end is None else date_time(end)
+        try:
+            try:
+                conn = self.connect(start, end)
+            except ValueError:
+                if self.select is None:
+                    raise
+                sql, parameters = analytics.query((metric,), inverterId, start, end)
+                for chunk in analytics.row_chunks(self.select(sql, parameters, start, end), (metric,)):
+                    series.extend(chunk.time, chunk[metric])
+                return True
+            try:
+                for chunk in analytics.chunks(conn, inverterId, start, end, columns=(metric,)):
+                    series.extend(chunk.time, chunk[metric])
+            finally:
+                conn.close()
+        except IOError as inst:
+            logging.error("Cannot load %s of inverter %s from %s: %s", metric, inverterId, start, inst)
+            return False
+        return True
+
+    # Downsampled metric of an inverter from start to end (times in seconds; end None for up to now), in
+    # at most points points (see Series.window). Series that could not be loaded in full are not kept
+    def get(self, inverterId, metric, start, end=None, points=None):
+        if metric not in metrics:
+            raise ValueError("Unknown metric: %s" % metric)
+        points = max(2, min(points or self.maxPoints, self.maxPoints))
+        until = end if end is not None else local_now()
+        width = resolution(until - start, points)
+        first = start // width * width - width     # The bucket before the range anchors its first point
+        key = (inverterId, metric, width)
+        with self._lock:
+            series = self.series.get(key)
+            if series is None or series.start > first:
+                if len(self.series) >= maxSeries:
+                    self.series.clear()
+                series = self.series[key] = Series(width, first)
+                if not self.load(series, inverterId, metric, first, end):
+                    del self.series[key]
+            elif end is None or series.lastTime is None or end > series.lastTime:
+                self.load(series, inverterId, metric, series.lastTime if series.lastTime is not None else first, end)
+            if end is None:
+                series.trim(first)
+            result = series.window(start, until)
+        result.update({'inverter': inverterId, 'metric': metric})
+        return result
@@ -0,0 +1,163 @@
+# Store-and-forward of samples to a central ingestion server (see ingestserver). Every sample stored
+# by the collector is also queued in the 'outbox' table, in the same transaction; the queue holds
+# references to the 'inverterdata' rows, numbered by an increasing sequence number. The forwarder
+# sends the queue in compressed batches and removes what the server acknowledged, so samples collected
+# while the link is down are sent once it is back, oldest first
+import json     # Batch serialisation
+import logging  # General logging
+import os       # Outbox identity
+import time     # Retry times
+import urllib2  # HTTP client
+import zlib     # Batch compression
+
+
+createTables = ["CREATE TABLE IF NOT EXISTS outbox ("
+                "Seq INTEGER PRIMARY KEY AUTOINCREMENT, Inverter_ID INTEGER(8) NOT NULL, DateTime TEXT NOT NULL)",
+                "CREATE TABLE IF NOT EXISTS outboxstate (Key TEXT PRIMARY KEY NOT NULL, Value TEXT)"]
+
+# Queue a stored sample (the row of inverterdata with this inverter ID and time) for forwarding. Does
+# not commit: call it before committing the sample, so both are stored or neither is
+def enqueue(conn, inverterId, dateTime):
+    for statement in createTables:
+        conn.execute(statement)
+    conn.execute("INSERT INTO outbox (Inverter_ID, DateTime) VALUES (?,?)", (inverterId, dateTime))
+
+
+class Outbox:
+    def __init__(self, conn, maxPending=200000):
+        self.conn = conn
+        self.maxPending = maxPending    # Oldest samples are dropped beyond this (about a year for two inverters)
+        for statement in createTables:
+            conn.execute(statement)
+        conn.commit()
+        # Columns of inverterdata that are forwarded, DateTime first
+        self.columns = ['DateTime'] + [row[1] for row in conn.execute("PRAGMA table_info(inverterdata)")
+                                       if row[1] not in ('Inverter_ID', 'DateTime')]
+
+    def get(self, key, default=None):
+        row = self.conn.execute("SELECT Value FROM outboxstate WHERE Key=?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def set(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO outboxstate VALUES (?,?)", (key, str(value)))
+        self.conn.commit()
+
+    # Identifies this outbox; sequence numbers start over when the database is recreated, and the
+    # server tells the two apart by this
+    def identity(self):
+        identity = self.get('Id')
+        if identity is None:
+            identity = os.urandom(8).encode('hex')
+            self.set('Id', identity)
+        return identity
+
+    def pending(self):
+        return self.conn.execute("SELECT count(*) FROM outbox").fetchone()[0]
+
+    # Drop the oldest samples beyond maxPending; returns the number dropped
+    def trim(self):
+        excess = self.pending() - self.maxPending
+        if excess <= 0:
+            return 0
+        self.conn.execute("DELETE FROM outbox WHERE Seq IN (SELECT Seq FROM outbox ORDER BY Seq LIMIT ?)", (excess,))
+        self.conn.commit()
+        logging.warning("Forwarding outbox full; dropped the %d oldest samples", excess)
+        return excess
+
+    # The oldest queued samples, as (first seq, last seq, rows); each row is [seq, inverter ID] followed
+    # by the values of self.columns. Samples whose row no longer exists are left out (but are within
+    # the sequence range, so they are acknowledged with the batch)
+    def batch(self, size):
+        cursor = self.conn.execute("SELECT o.Seq, o.Inverter_ID, " + ', '.join('d.' + c for c in self.columns) +
+                                   " FROM outbox o LEFT JOIN inverterdata d ON d.Inverter_ID = o.Inverter_ID AND d.DateTime = o.DateTime"
+                                   " ORDER BY o.Seq LIMIT ?", (size,))
+        rows = cursor.fetchall()
+        if not rows:
+            return None, None, []
+        return rows[0][0], rows[-1][0], [list(row) for row in rows if row[2] is not None]
+
+    # Serial number, manufacturer and model of the inverters with the given IDs
+    def inverters(self, inverterIds):
+        info = {}
+        for inverterId in set(inverterIds):
+            row = self.conn.execute("SELECT i.SerialNumber, t.Manufacturer, t.Model FROM inverter i "
+                                    "LEFT JOIN invertertype t ON i.InverterType_ID = t.ID WHERE i.ID=?", (inverterId,)).fetchone()
+            info[str(inverterId)] = list(row) if row is not None else ['', None, None]
+        return info
+
+    # Remove the samples up to and including seq
+    def acknowledge(self, seq):
+        self.conn.execute("DELETE FROM outbox WHERE Seq <= ?", (seq,))
+        self.conn.commit()
+
+
+class ForwardError(Exception):
+    def __init__(self, message, retryAfter=None):
+        Exception.__init__(self, message)
+        self.retryAfter = retryAfter    # Seconds the server asked us to wait, if it is busy
+
+
+class Forwarder:
+    # url is the ingestion endpoint of the server (e.g. 'http://aggregator:8302/ingest'); site names
+    # this collector
+    def __init__(self, url, site, batchSize=500, timeout=10, retryDelay=60, maxRetryDelay=3600):
+        self.url = url
+        self.site = site
+        self.batchSize = batchSize
+        self.timeout = timeout
+        self.retryDelay = retryDelay        # First wait after a failure; doubles with each failure
+        self.maxRetryDelay = maxRetryDelay
+
+    # Compressed batch message
+    def message(self, outbox, first, last, rows):
+        batch = {'site': self.site, 'outbox': outbox.identity(), 'first': first, 'last': last,
+                 'columns': outbox.columns, 'inverters': outbox.inverters(row[1] for row in rows), 'rows': rows}
+        return zlib.compress(json.dumps(batch, separators=(',', ':')))
+
+    # Send a batch; returns the server's acknowledgement (a dict with 'ack', the last sequence number
+    # it has stored)
+    def post(self, body):
+        request = urllib2.Request(self.url, body, {'Content-Type': 'application/json', 'Content-Encoding': 'deflate'})
+        try:
+            response = urllib2.urlopen(request, timeout=self.timeout)
+            return json.loads(response.read())
+        except urllib2.HTTPError as inst:
+            retryAfter = inst.headers.get('Retry-After')
+            raise ForwardError('HTTP %d %s' % (inst.code, inst.msg), int(retryAfter) if retryAfter and retryAfter.isdigit() else None)
+        except (urllib2.URLError, IOError) as inst:
+            raise ForwardError(str(getattr(inst, 'reason', inst)))
+        except ValueError as inst:
+            raise ForwardError('Invalid acknowledgement: %s' % inst)
+
+    # Send the queued samples, at most maxBatches batches (the rest is left for the next run). Nothing
+    # is sent before the time set by an earlier failure or by the server. Returns the number of
+    # samples acknowledged
+    def drain(self, outbox, maxBatches=20, now=None):
+        now = now or time.time()
+        if float(outbox.get('NextAttempt', 0)) > now:
+            logging.debug("Forwarding postponed until %s", time.ctime(float(outbox.get('NextAttempt'))))
+            return 0
+        outbox.trim()
+        sent = 0
+        for i in range(maxBatches):
+            first, last, rows = outbox.batch(self.batchSize)
+            if first is None:
+                break
+            try:
+                ack = self.post(self.message(outbox, first, last, rows))['ack']
+            except (ForwardError, KeyError, TypeError) as inst:
+                self.postpone(outbox, now, getattr(inst, 'retryAfter', None))
+                logging.warning("Cannot forward samples to %s: %s (%d pending)", self.url, inst, outbox.pending())
+                return sent
+            outbox.acknowledge(ack)
+            sent += len(rows)
+        outbox.set('Failures', 0)
+        logging.info("Forwarded %d samples to %s (%d pending)", sent, self.url, outbox.pending())
+        return sent
+
+    # Wait before the next attempt: as long as the server asked, or longer after every failure
+    def postpone(self, outbox, now, retryAfter=None):
+        failures = int(outbox.get('Failures', 0))
+        delay = retryAfter if retryAfter is not None else min(self.retryDelay * 2 ** failures, self.maxRetryDelay)
+        outbox.set('Failures', failures + 1 if retryAfter is None else failures)
+        outbox.set('NextAttempt', now + delay)
@@ -0,0 +1,158 @@
+# Protocol trace: the raw frames sent to and received from the inverters, with time stamps, kept in a
+# fixed-size in-memory ring buffer. Nothing is formatted while tracing; the buffer is only written to
+# disk (in a compact binary format) when something goes wrong, or when asked to by a signal.
+# All frames can also be captured to a file, for replaying them later (see simulator.ReplayPort)
+import json     # Dump header
+import logging  # General logging
+import os       # File utils
+import struct   # Record packing
+import time     # Time stamps
+
+TX = 0  # Frame sent to an inverter
+RX = 1  # Frame received from an inverter (empty if nothing was received)
+PORT = 2    # Capture files only: the frame is the name of the port with the given number
+
+
+class FrameTrace:
+    magic = 'SSFT0001'
+    header = struct.Struct('<dBBH')     # Time stamp, direction, port number, frame length
+    frameSize = 68                      # Longest frame that is kept in full (a 31 register Modbus response is 67 bytes)
+
+    # slots is the number of frames kept; the oldest frame is overwritten first
+    def __init__(self, slots=256, enabled=True):
+        self.enabled = enabled
+        self.slots = slots
+        self.slotSize = self.header.size + self.frameSize
+        self.buffer = bytearray(slots * self.slotSize)
+        self.ports = []             # Port names; records refer to them by index
+        self._portIndex = {}
+        self.next = 0               # Slot written next
+        self.count = 0              # Number of frames recorded (may exceed slots)
+        self.capture = None         # CaptureFile that receives every frame, if any
+
+    def record(self, direction, port, frame):
+        if self.capture is not None:
+            self.capture.record(direction, port, frame)
+        if not self.enabled:
+            return
+        portIndex = self._portIndex.get(port)
+        if portIndex is None:
+            portIndex = self._portIndex[port] = len(self.ports)
+            self.ports.append(port)
+        offset = self.next * self.slotSize
+        self.header.pack_into(self.buffer, offset, time.time(), direction, portIndex, len(frame))
+        start = offset + self.header.size
+        kept = frame[:self.frameSize]
+        self.buffer[start:start + len(kept)] = kept
+        self.next = (self.next + 1) % self.slots
+        self.count += 1
+
+    # Records in chronological order: (time, direction, port, frame, length); frame is truncated to
+    # frameSize bytes, length is the length of the original frame
+    def records(self):
+        used = min(self.count, self.slots)
+        first = (self.next - used) % self.slots
+        for i in range(used):
+            offset = ((first + i) % self.slots) * self.slotSize
+            t, direction, portIndex, length = self.header.unpack_from(self.buffer, offset)
+            start = offset + self.header.size
+            yield t, direction, self.ports[portIndex], str(self.buffer[start:start + min(length, self.frameSize)]), length
+
+    # Write the buffer to fileName (atomically); returns the number of frames written
+    def dump(self, fileName, reason=''):
+        used = min(self.count, self.slots)
+        first = (self.next - used) % self.slots
+        head = json.dumps({'ports': self.ports, 'slotSize': self.slotSize, 'frameSize': self.frameSize,
+                           'frames': used, 'dropped': self.count - used, 'reason': reason, 'time': time.time()})
+        tmpFile = fileName + '.tmp'
+        with open(tmpFile, 'wb') as f:
+            f.write(self.magic + struct.pack('<I', len(head)) + head)
+            # The slots in chronological order: from the oldest to the end of the buffer, then from the start
+            if first + used <= self.slots:
+                f.write(self.buffer[first * self.slotSize:(first + used) * self.slotSize])
+            else:
+                f.write(self.buffer[first * self.slotSize:])
+                f.write(self.buffer[:self.next * self.slotSize])
+        os.rename(tmpFile, fileName)
+        logging.info("Dumped %d protocol frames to '%s' (%s)", used, fileName, reason or 'on request')
+        return used
+
+
+# Read a dump written by FrameTrace.dump; returns (header dict, [(time, direction, port, frame, length)])
+def read_dump(fileName):
+    with open(fileName, 'rb') as f:
+        data = f.read()
+    if data[:len(FrameTrace.magic)] != FrameTrace.magic:
+        raise ValueError("Not a frame trace: %s" % fileName)
+    offset = len(FrameTrace.magic)
+    headLength, = struct.unpack_from('<I', data, offset)
+    offset += 4
+    head = json.loads(data[offset:offset + headLength])
+    offset += headLength
+    records = []
+    slotSize = head['slotSize']
+    while offset + slotSize <= len(data):
+        t, direction, portIndex, length = FrameTrace.header.unpack_from(data, offset)
+        start = offset + FrameTrace.header.size
+        records.append((t, direction, head['ports'][portIndex], data[start:start + min(length, head['frameSize'])], length))
+        offset += slotSize
+    return head, records
+
+# Human-readable lines for the records of a trace
+def format_records(records):
+    lines = []
+    for t, direction, port, frame, length in records:
+        stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t)) + ('%.3f' % (t % 1))[1:]
+        hexFrame = ' '.join('%02X' % ord(c) for c in frame)
+        if length > len(frame):
+            hexFrame += ' ... (%d bytes)' % length
+        lines.append('%s %s %s %s' % (stamp, 'TX' if direction == TX else 'RX', port, hexFrame or '(nothing)'))
+    return lines
+
+
+class CaptureFile:
+    # Appends every frame to fileName, as a record with the same header as the trace slots, followed by
+    # the complete frame. Ports are numbered per capture session; a PORT record introduces each one, so
+    # sessions can be appended to the same file (one after the other: every record is flushed, but
+    # sessions writing at the same time mix up their port numbers)
+    magic = 'SSCP0001'
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self._file = open(fileName, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(self.magic)
+        self._portIndex = {}
+
+    def record(self, direction, port, frame, t=None):
+        portIndex = self._portIndex.get(port)
+        if portIndex is None:
+            portIndex = self._portIndex[port] = len(self._portIndex)
+            self._file.write(FrameTrace.header.pack(time.time(), PORT, portIndex, len(port)) + port)
+        self._file.write(FrameTrace.header.pack(t or time.time(), direction, portIndex, len(frame)) + frame)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+# Frames of a capture file, in order: (time, direction, port, frame)
+def read_capture(fileName):
+    magic = CaptureFile.magic
+    header = FrameTrace.header
+    with open(fileName, 'rb') as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError("Not a capture file: %s" % fileName)
+        ports = {}
+        while True:
+            head = f.read(header.size)
+            if len(head) < header.size:
+                return      # End of file (or a record cut short by a crash)
+            t, direction, portIndex, length = header.unpack(head)
+            frame = f.read(length)
+            if len(frame) < length:
+                return
+            if direction == PORT:
+                ports[portIndex] = frame
+            else:
+                yield t, direction, ports[portIndex], frame
@@ -0,0 +1,119 @@
+# Gap detection and filling for the sample series of an inverter. A series is read in chunks of
+# (times, values) arrays: times in Unix seconds, ascending; values with one column per quantity. The
+# gaps of a chunk (intervals between samples longer than maxInterval) are found in one vectorised
+# pass, and the missing samples, one every step seconds, are filled in by a strategy:
+# - 'next': a copy of the sample after the gap (what the RRD export has always done)
+# - 'linear': interpolated between the samples around the gap
+# - 'unknown': NaN (stored as 'U'nknown in an RRD)
+# - 'night': zero power while the inverter is asleep (the samples around the gap show no power);
+#   counters hold their last value. Gaps in daylight are unknown
+# The output is a chunk at a time as well, so rebuilding or exporting years of samples only needs
+# the memory of a chunk (and of its longest gap)
+import numpy        # Vectorised gap search and filling
+
+
+strategies = ('next', 'linear', 'unknown', 'night')
+
+nightPower = 10.0   # Power (W) below which the samples around a gap are taken as the inverter sleeping
+
+
+# Gaps in times: (start, end) index arrays, with times[start[i]] and times[end[i]] the samples around
+# gap i
+def find_gaps(times, maxInterval):
+    start = numpy.flatnonzero(numpy.diff(times) > maxInterval)
+    return start, start + 1
+
+# Missing samples of the gaps between the samples at start and end, every step seconds: (times, gap
+# index of each missing sample)
+def missing_times(times, start, end, step):
+    counts = (times[end] - times[start] - step // 2) // step    # Slots more than half a step from the next sample
+    counts = numpy.maximum(counts, 0)
+    gap = numpy.repeat(numpy.arange(len(start)), counts)
+    # Position of each missing sample within its gap: 1, 2, ... counts[gap]
+    first = numpy.cumsum(counts) - counts
+    position = numpy.arange(len(gap)) - first[gap] + 1
+    return times[start][gap] + position * step, gap
+
+# Values of the missing samples at fillTimes, in gap fillGap of the gaps (start, end). counters
+# lists the columns that are counters (energy), which do not fall to zero at night
+def fill_values(times, values, start, end, fillTimes, fillGap, strategy, powerColumn=0, counters=()):
+    before = values[start][fillGap]
+    after = values[end][fillGap]
+    if strategy == 'next':
+        return after
+    if strategy == 'linear':
+        fraction = ((fillTimes - times[start][fillGap]) / (times[end] - times[start]).astype(numpy.float64)[fillGap])
+        return before + (after - before) * fraction[:, numpy.newaxis]
+    filled = numpy.full(before.shape, numpy.nan)
+    if strategy == 'unknown':
+        return filled
+    if strategy == 'night':
+        asleep = ((numpy.nan_to_num(values[start, powerColumn]) < nightPower) &
+                  (numpy.nan_to_num(values[end, powerColumn]) < nightPower))[fillGap]
+        filled[asleep] = 0.0
+        for column in counters:
+            filled[asleep, column] = before[asleep, column]
+        return filled
+    raise ValueError("Unknown fill strategy: %s" % strategy)
+
+
+class GapFiller:
+    # Fills the gaps of one series, chunk by chunk; the last sample of a chunk is kept to find the
+    # gap between it and the next chunk
+    def __init__(self, step=300, maxInterval=None, strategy='next', maxGap=None, powerColumn=0, counters=()):
+        if strategy not in strategies:
+            raise ValueError("Unknown fill strategy: %s" % strategy)
+        self.step = step
+        self.maxInterval = maxInterval or step * 4 // 3    # Longer intervals are gaps
+        self.strategy = strategy
+        self.maxGap = maxGap        # Longer gaps (in seconds) are left alone (None fills all)
+        self.powerColumn = powerColumn
+        self.counters = counters
+        self.gaps = 0               # Gaps filled, and samples added
+        self.filled = 0
+        self._last = None           # Last sample of the previous chunk: (time, values)
+
+    # The chunk with its gaps (and the gap before it) filled: (times, values, filled), filled being
+    # True for the added samples
+    def fill(self, times, values):
+        times = numpy.asarray(times, dtype=numpy.int64)
+        if not len(times):
+            return times, numpy.zeros((0, 0)), numpy.zeros(0, dtype=bool)
+        values = numpy.asarray(values, dtype=numpy.float64).reshape(len(times), -1)
+        carried = 0
+        if self._last is not None:
+            times = numpy.concatenate(([self._last[0]], times))
+            values = numpy.concatenate((self._last[1][numpy.newaxis], values))
+            carried = 1
+        self._last = (times[-1], values[-1])
+
+        start, end = find_gaps(times, self.maxInterval)
+        if self.maxGap is not None:
+            short = times[end] - times[start] <= self.maxGap
+            start, end = start[short], end[short]
+        fillTimes, fillGap = missing_times(times, start, end, self.step)
+        fillValues = fill_values(times, values, start, end, fillTimes, fillGap, self.strategy,
+                                 self.powerColumn, self.counters)
+        self.gaps += len(numpy.unique(fillGap))
+        self.filled += len(fillTimes)
+
+        # Merge: the missing samples of gap i go before the sample at end[i]
+        where = numpy.searchsorted(times, fillTimes, side='right')
+        times = numpy.insert(times, where, fillTimes)[carried:]
+        values = numpy.insert(values, where, fillValues, axis=0)[carried:]
+        filled = numpy.zeros(len(times) + carried, dtype=bool)
+        filled[where + numpy.arange(len(where))] = True
+        return times, values, filled[carried:]
+
+
+# Filled chunks of a series, given as an iterable of (times, values) chunks
+def fill_series(chunks, step=300, strategy='next', **options):
+    filler = GapFiller(step, strategy=strategy, **options)
+    for times, values in chunks:
+        yield filler.fill(times, values)
+
+# Rows (time, values, filled) of filled chunks, one at a time
+def rows(filledChunks):
+    for times, values, filled in filledChunks:
+        for i in xrange(len(times)):
+            yield int(times[i]), values[i], bool(filled[i])
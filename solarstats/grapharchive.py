@@ -0,0 +1,124 @@
+# Content-addressed archive of the daily graphs. Every unique image is stored once (as a blob named
+# after its SHA-1), and a small index maps each date and graph name to a blob
+import bisect   # Date lookup
+import errno    # Error codes
+import fcntl    # Reflink (FICLONE) ioctl
+import hashlib  # Content hashes
+import json     # Index file
+import logging  # General logging
+import os       # File utils
+import re       # Legacy archive file names
+import shutil   # Fallback copy
+
+
+class GraphArchive:
+    indexName = 'index.json'
+    ficlone = 0x40049409        # Linux FICLONE ioctl: share the data blocks of another file (btrfs, xfs)
+
+    def __init__(self, archiveDir):
+        self.archiveDir = archiveDir
+        self.blobDir = os.path.join(archiveDir, 'blobs')
+        self.indexFile = os.path.join(archiveDir, self.indexName)
+        if not os.path.isdir(archiveDir):
+            os.makedirs(archiveDir)
+        try:
+            with open(self.indexFile, 'r') as f:
+                self.index = json.load(f)
+        except IOError:
+            self.index = {}
+        self._dates = sorted(self.index)
+
+    @staticmethod
+    def fileHash(fileName):
+        digest = hashlib.sha1()
+        with open(fileName, 'rb') as f:
+            for block in iter(lambda: f.read(65536), ''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def blobPath(self, blobHash, ext='.png'):
+        return os.path.join(self.blobDir, blobHash[:2], blobHash + ext)
+
+    # Place a copy of srcPath at destPath, sharing storage with the source where possible. A hardlink
+    # is safe because graphs are replaced by rename, never rewritten in place
+    def _store(self, srcPath, destPath):
+        tmpPath = destPath + '.tmp'
+        try:
+            os.link(srcPath, tmpPath)
+            os.rename(tmpPath, destPath)
+            return 'link'
+        except OSError:
+            pass
+        try:
+            with open(srcPath, 'rb') as src:
+                with open(tmpPath, 'wb') as dest:
+                    try:
+                        fcntl.ioctl(dest.fileno(), self.ficlone, src.fileno())
+                        method = 'reflink'
+                    except IOError:
+                        shutil.copyfileobj(src, dest)
+                        method = 'copy'
+            os.rename(tmpPath, destPath)
+            return method
+        finally:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+
+    # Archive an image for a date ('YYYY-MM-DD'); returns the blob hash. Unchanged images cost only an index entry
+    def add(self, date, srcPath, imgName=None):
+        imgName = imgName or os.path.basename(srcPath)
+        blobHash = self.fileHash(srcPath)
+        blobPath = self.blobPath(blobHash, os.path.splitext(imgName)[1])
+        if not os.path.isfile(blobPath):
+            try:
+                os.makedirs(os.path.dirname(blobPath))
+            except OSError as inst:
+                if inst.errno != errno.EEXIST:
+                    raise
+            method = self._store(srcPath, blobPath)
+            logging.debug("Stored new blob %s for '%s' (%s)", blobHash, imgName, method)
+        else:
+            logging.debug("Image '%s' for %s unchanged (blob %s)", imgName, date, blobHash)
+
+        if date not in self.index:
+            self.index[date] = {}
+            bisect.insort(self._dates, date)
+        self.index[date][imgName] = blobHash
+        return blobHash
+
+    # Write the index (atomically)
+    def save(self):
+        tmpFile = self.indexFile + '.tmp'
+        with open(tmpFile, 'w') as f:
+            json.dump(self.index, f, sort_keys=True, separators=(',', ':'))
+        os.rename(tmpFile, self.indexFile)
+
+    # Path of the image archived for date, or for the closest earlier date (None if there is none)
+    def get(self, date, imgName):
+        pos = bisect.bisect_right(self._dates, date)
+        while pos > 0:
+            pos -= 1
+            blobHash = self.index[self._dates[pos]].get(imgName)
+            if blobHash is not None:
+                return self.blobPath(blobHash, os.path.splitext(imgName)[1])
+        return None
+
+    def dates(self):
+        return list(self._dates)
+
+    # Import archived files in the old '<name>_<YYYY-MM-DD>.png' layout; returns the number of files
+    def importLegacy(self, legacyDir, remove=False):
+        pattern = re.compile(r'^(.+)_(\d{4}-\d{2}-\d{2})(\.\w+)$')
+        count = 0
+        for fileName in sorted(os.listdir(legacyDir)):
+            match = pattern.match(fileName)
+            if match is None:
+                continue
+            root, date, ext = match.groups()
+            srcPath = os.path.join(legacyDir, fileName)
+            self.add(date, srcPath, root + ext)
+            if remove:
+                os.remove(srcPath)
+            count += 1
+        self.save()
+        return count
@@ -0,0 +1,122 @@
+# Declarative RRDtool graph definitions for any number of inverters.
+# A graph is described by a list of metric rows; each row is expanded per inverter (and for the
+# total over all inverters), compiled into rrdtool arguments once, and cached.
+import time     # Time stamp in the graph comment
+
+
+class MetricRow:
+    # kind is one of 'actual' (the measured line), 'average'/'maximum' (VDEF lines) or 'yield' (scaled energy)
+    def __init__(self, kind, legend, colour=None, unit='W'):
+        self.kind = kind
+        self.legend = legend
+        self.colour = colour    # None means: use the inverter's own colour
+        self.unit = unit
+
+
+class GraphDefinition:
+    # Colours are assigned to inverters in order; the total uses totalColour
+    powerColours = ['#0000FF', '#FF0066', '#9900CC', '#CC6600', '#006666', '#666600', '#CC0000', '#3399FF']
+    yieldColours = ['#00CCFF', '#FF66FF', '#CC99FF', '#FFCC66', '#66CCCC', '#CCCC66', '#FF9999', '#99CCFF']
+    totalColour = '#000000'
+
+    rows = [MetricRow('actual', 'Actual'),
+            MetricRow('average', 'Average', '#FF6600'),
+            MetricRow('maximum', 'Maximum', '#00CC00'),
+            MetricRow('yield', 'Yield', unit='kW')]
+
+    # Graphs spanning less than two weeks show the daily yield, longer ones the total yield. The right
+    # axis shows the yield at rightAxisScale times the power scale, so energy is plotted at 1/scale
+    ranges = {'short': {'energy': 'nrg', 'rightAxisLabel': 'Daily yield (kW)', 'rightAxisScale': 0.005},
+              'long': {'energy': 'tot', 'rightAxisLabel': 'Total yield (kW)', 'rightAxisScale': 1.0}}
+    longRange = 60*60*24*7*2
+
+    _cache = {}
+
+    # inverters: list of inverters.Inverter. Above detailLimit inverters, the average and maximum rows
+    # are only drawn for the total, which keeps the number of graph elements linear in the inverter count
+    def __init__(self, inverters, width=720, height=250, detailLimit=4, stack=False):
+        self.inverters = list(inverters)
+        self.width = width
+        self.height = height
+        self.detailLimit = detailLimit
+        self.stack = stack
+
+    def rangeName(self, startTime, endTime):
+        return 'short' if (endTime - startTime) < self.longRange else 'long'
+
+    # Compiled (time independent) part of the rrdtool graph arguments for a range ('short' or 'long')
+    def compile(self, rangeName):
+        key = (tuple(iv.key() for iv in self.inverters), rangeName, self.width, self.height, self.detailLimit, self.stack)
+        if key not in self._cache:
+            self._cache[key] = tuple(self._compile(rangeName))
+        return self._cache[key]
+
+    def _compile(self, rangeName):
+        spec = self.ranges[rangeName]
+        energy = spec['energy']
+        scale = 1.0 / spec['rightAxisScale']
+        args = ['--imgformat', 'PNG', '--width', str(self.width), '--height', str(self.height),
+                '--units-exponent', '0', '--vertical-label', 'Solar Power (Watt)',
+                '--right-axis-label', spec['rightAxisLabel'], '--right-axis', '%g:0' % spec['rightAxisScale'],
+                '--right-axis-format', '%1.0lf']
+
+        # Data definitions: one DEF per data source, one VDEF per statistic
+        series = []     # (vname, legend, power colour, yield colour, dashed)
+        for i, iv in enumerate(self.inverters):
+            vname = 'i%d' % iv.id
+            args.append('DEF:%s=%s:%s:LAST' % (vname, iv.rrdFile, iv.dataSource('pow')))
+            args.append('DEF:%s_e=%s:%s:LAST' % (vname, iv.rrdFile, iv.dataSource(energy)))
+            series.append((vname, iv.label, self.powerColours[i % len(self.powerColours)],
+                           self.yieldColours[i % len(self.yieldColours)], i % 2 == 1))
+        if len(self.inverters) > 1:
+            names = [s[0] for s in series]
+            args.append('CDEF:total=' + self._sum(names))
+            args.append('CDEF:total_e=' + self._sum([n + '_e' for n in names]))
+            series.append(('total', 'Total', self.totalColour, self.totalColour, False))
+        for vname, label, powerColour, yieldColour, dashed in series:
+            args += ['VDEF:%s_avg=%s,AVERAGE' % (vname, vname), 'VDEF:%s_max=%s,MAXIMUM' % (vname, vname),
+                     'VDEF:%s_last=%s,LAST' % (vname, vname), 'VDEF:%s_emax=%s_e,MAXIMUM' % (vname, vname),
+                     'CDEF:%s_escaled=%s_e,%g,*' % (vname, vname, scale)]
+
+        # Graph elements, one legend row per metric
+        for row in self.rows:
+            entries = series
+            if row.kind in ('average', 'maximum') and len(self.inverters) > self.detailLimit:
+                entries = series[-1:]
+            elements = []
+            for n, (vname, label, powerColour, yieldColour, dashed) in enumerate(entries):
+                elements += self._elements(row, vname, label, powerColour, yieldColour, dashed, n)
+            elements[-1] = elements[-1][:-2] + '\\n'
+            args += elements
+        return args
+
+    # rrdtool RPN expression adding up the given vnames (unknown values count as zero)
+    @staticmethod
+    def _sum(vnames):
+        expression = vnames[0]
+        for vname in vnames[1:]:
+            expression += ',%s,ADDNAN' % vname
+        return expression
+
+    def _elements(self, row, vname, label, powerColour, yieldColour, dashed, n):
+        legend = '%s (%s)\\t' % (row.legend, label)
+        gprintFormat = '%2.1lf ' + row.unit + '\\t'
+        style = ':dashes' if dashed else ''
+        if row.kind == 'actual':
+            if self.stack and vname != 'total':
+                return ['AREA:%s%s:%s%s' % (vname, powerColour, legend, ':STACK' if n else ''),
+                        'GPRINT:%s_last:%s' % (vname, gprintFormat)]
+            return ['LINE1:%s%s:%s' % (vname, powerColour, legend), 'GPRINT:%s_last:%s' % (vname, gprintFormat)]
+        if row.kind == 'average':
+            return ['LINE1:%s_avg%s:%s%s' % (vname, row.colour, legend, style), 'GPRINT:%s_avg:%s' % (vname, gprintFormat)]
+        if row.kind == 'maximum':
+            return ['LINE1:%s_max%s:%s%s' % (vname, row.colour, legend, style), 'GPRINT:%s_max:%s' % (vname, gprintFormat)]
+        if row.kind == 'yield':
+            return ['LINE1:%s_escaled%s:%s' % (vname, yieldColour, legend), 'GPRINT:%s_emax:%s' % (vname, gprintFormat)]
+        raise ValueError("Unknown graph row kind: %s" % row.kind)
+
+    # Full argument list for 'rrdtool graph'
+    def args(self, imgName, startTime, endTime, imgTitle):
+        return (['graph', str(imgName), '--start', str(startTime), '--end', str(endTime), '--title', str(imgTitle)] +
+                list(self.compile(self.rangeName(startTime, endTime))) +
+                ['COMMENT:Generated on ' + str(time.strftime("%B %d, %Y (%H\:%M)"))])
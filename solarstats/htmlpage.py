@@ -0,0 +1,149 @@
+# Status page rendering. The page templates are parsed once into literal/field parts, and the
+# page is rendered into a single buffer for any number of inverters.
+import hashlib  # Content hash of the rendered page
+import string   # Formatter, used for parsing the templates
+import time     # Footer year
+
+
+class CompiledTemplate:
+    # text uses str.format syntax: {name} or {name:spec}
+    def __init__(self, text):
+        self.text = text
+        self.parts = [(literal, field, spec) for literal, field, spec, conversion in string.Formatter().parse(text)]
+
+    # Append the rendered template to buffer (a list of strings)
+    def renderInto(self, buffer, values):
+        for literal, field, spec in self.parts:
+            buffer.append(literal)
+            if field is not None:
+                buffer.append(format(values[field], spec))
+
+    def render(self, values):
+        buffer = []
+        self.renderInto(buffer, values)
+        return ''.join(buffer)
+
+
+class StatusPage:
+    # The kWh->CO2 conversion factor (0.44548) is taken from http://www.carbontrust.com/media/18223/ctl153_conversion_factors.pdf
+    co2PerKwh = 0.44548
+
+    head = CompiledTemplate(
+        '<HTML><HEAD><TITLE>{title}</TITLE></HEAD>\n'
+        '<BODY BGCOLOR="000066" TEXT="#E8EEFD" LINK="#FFFFFF" VLINK="#C6FDF4" ALINK="#0BBFFF">\n'
+        '<TABLE BORDER=1 CELLPADDING=1 CELLSPACING=2 BGCOLOR="#1A689D" BORDERCOLOR="#0DD3EA" ALIGN="center">\n'
+        '<TR><TD colspan="6"><CENTER><font size=5>{heading}</font><BR><font size=-1> Last update: {lastUpdate}</font></CENTER></TD><TR>\n'
+        '<TR><TD colspan="6"><CENTER>.</CENTER></TD></TR>\n')
+    inverterName = CompiledTemplate('<TR><TD>.</TD><TD colspan="4"><CENTER><font size=4>{name}<BR>')
+    inverterStatus = CompiledTemplate('<font size=-1>{statusText}</CENTER></FONT></TD><TD>.</TD><TR>\n')
+    inverterOff = CompiledTemplate('<FONT size=-1 COLOR=red>Inverter off (using last working values)</CENTER></FONT></TD><TD>.</TD><TR>\n')
+    inverterNow = CompiledTemplate(
+        '<TR><TD>PV Power</TD><TD>PV Voltage</TD><TD>PV Current</TD><TD>Temperature</TD><TD>Net Frequency</TD><TD>Net Voltage</TD></TR>\n'
+        '<TR><TD><SPAN ID="PowerAC{id}">{PowerAC}</SPAN> W</TD><TD><SPAN ID="VoltsPV1{id}">{VoltsPV1}</SPAN> V</TD>'
+        '<TD><SPAN ID="CurrentPV1{id}">{CurrentPV1}</SPAN> A</TD><TD><SPAN ID="Temperature{id}">{Temperature}</SPAN> &deg;C</TD>'
+        '<TD><SPAN ID="FrequencyAC{id}">{FrequencyAC}</SPAN> Hz</TD><TD><SPAN ID="VoltsAC1{id}">{VoltsAC1}</SPAN> V</TD></TR>\n')
+    inverterExpected = CompiledTemplate(
+        '<TR><TD colspan="3">Clear-sky output: {ExpectedPower} W</TD><TD colspan="3">Performance ratio: {performance}</TD></TR>\n')
+    inverterTotals = CompiledTemplate(
+        '<TR><TD colspan="3"><CENTER>Today</CENTER></TD><TD colspan="3"><CENTER>Total</CENTER></TD></TR>\n'
+        '<TR><TD>Time</TD><TD>Delivery</TD><TD>CO&#8322; reduction</TD><TD>Time</TD><TD>Delivery</TD><TD>CO&#8322; reduction</TD></TR>\n'
+        '<TR><TD>{minToday}</TD><TD>{EnergyToday} kWh</TD><TD>{co2Today:.2f} kg</TD><TD>{hrsTotal}</TD><TD>{EnergyTotal} kWh</TD><TD>{co2Total:.2f} kg</TD><TR>')
+    foot = CompiledTemplate(
+        '</TABLE><BR><CENTER><font size=-1>Uptime: {uptime}</font>\n'
+        '<BR><BR>\n'
+        '<FORM><INPUT TYPE="button" VALUE="Refresh" onClick="window.location.reload()" ></FORM><BR>'
+        '{graphs}'
+        '<BR><font size=-1>{footer}</font></center>{script}</body></html>\n')
+    graph = CompiledTemplate('<IMG src="{src}" alt="{alt}"><BR><BR>\n')
+    linkHead = CompiledTemplate(
+        '<TR><TD colspan="6"><CENTER>.</CENTER></TD></TR>\n'
+        '<TR><TD colspan="6"><CENTER><font size=4>Link quality</font><BR><font size=-1>Last 24 hours</font></CENTER></TD></TR>\n'
+        '<TR><TD>Inverter</TD><TD>Requests</TD><TD>OK</TD><TD>CRC / short / bad</TD><TD>Timeouts / retries</TD><TD>Latency p50 / p90</TD></TR>\n')
+    linkRow = CompiledTemplate(
+        '<TR><TD>{name}</TD><TD>{Sent}</TD><TD>{okPercent:.1f}%</TD><TD>{CrcErrors} / {ShortFrames} / {BadFrames}</TD>'
+        '<TD>{Timeouts} / {Retries}</TD><TD>{p50} / {p90} ms</TD></TR>\n')
+
+    # Applies the JSON deltas of the live feed (see livefeed) to the matching SPAN elements
+    liveScript = ('<SCRIPT>if (window.EventSource) { new EventSource("events").onmessage = function(e) {\n'
+                  '  var d = JSON.parse(e.data);\n'
+                  '  for (var k in d) { var el = document.getElementById(k + d.id); if (el) el.textContent = d[k]; }\n'
+                  '}; }</SCRIPT>\n')
+
+    graphs = [('solarStats_last24hrs.png', 'Last 24 hours'),
+              ('solarStats_last7days.png', 'Last 7 days'),
+              ('solarStats_last30days.png', 'Last 30 days'),
+              ('solarStats_lastyear.png', 'Last 365 days')]
+
+    # footer may contain strftime directives, e.g. 'The Dilapidation Crew - %Y'
+    # liveFeed adds a script that updates the current values from the server-sent event stream
+    def __init__(self, title='Home PV measurements', heading='Home PV', footer='', graphs=None, liveFeed=False):
+        self.title = title
+        self.heading = heading
+        self.footer = footer
+        if graphs is not None:
+            self.graphs = graphs
+        self.liveFeed = liveFeed
+
+    # Values shown in the 'Today'/'Total' rows of an inverter
+    def totals(self, iv):
+        return {'minToday': '%d:%02d' % (int(iv['MinToday']) / 60, int(iv['MinToday']) % 60),
+                'EnergyToday': iv['EnergyToday'],
+                'co2Today': float(iv['EnergyToday']) * self.co2PerKwh,
+                'hrsTotal': '%d:00' % int(float(iv['HrsTotal'])),
+                'EnergyTotal': iv['EnergyTotal'],
+                'co2Total': float(iv['EnergyTotal']) * self.co2PerKwh}
+
+    # Values shown in the clear-sky row of an inverter (see clearsky)
+    def expected(self, iv):
+        ratio = iv.get('PerformanceRatio')
+        return {'ExpectedPower': iv['ExpectedPower'],
+                'performance': '-' if ratio is None else '%d%%' % round(100 * ratio)}
+
+    # Render the inverter rows; inverters is a list of result dicts. Inverters that did not respond
+    # ('success' is False) must carry their last known MinToday, EnergyToday, HrsTotal and EnergyTotal
+    def renderInverters(self, inverters):
+        buffer = []
+        for iv in inverters:
+            self.inverterName.renderInto(buffer, iv)
+            if iv['success']:
+                self.inverterStatus.renderInto(buffer, iv)
+                self.inverterNow.renderInto(buffer, iv)
+                if iv.get('ExpectedPower') is not None:
+                    self.inverterExpected.renderInto(buffer, self.expected(iv))
+            else:
+                self.inverterOff.renderInto(buffer, iv)
+            self.inverterTotals.renderInto(buffer, self.totals(iv))
+        return ''.join(buffer)
+
+    # Render the link quality rows; links is a list of linkstats.LinkStats.asDict() results, with 'name' added
+    def renderLinks(self, links):
+        if not links:
+            return ''
+        buffer = []
+        self.linkHead.renderInto(buffer, {})
+        for link in links:
+            values = dict(link)
+            values['okPercent'] = 100.0 * link['Ok'] / link['Sent'] if link['Sent'] else 0.0
+            for p in ('p50', 'p90'):
+                values[p] = '-' if link[p] is None else link[p]
+            self.linkRow.renderInto(buffer, values)
+        return ''.join(buffer)
+
+    # Render the complete page. Returns (html, digest); the digest covers everything except the
+    # uptime, so pass lastUpdate at the resolution the page should be rewritten at (such as minutes)
+    def render(self, inverters, lastUpdate, uptime, links=None):
+        body = self.renderInverters(inverters) + self.renderLinks(links)
+        graphs = ''.join(self.graph.render({'src': src, 'alt': alt}) for src, alt in self.graphs)
+        footer = time.strftime(self.footer)
+
+        digest = hashlib.sha1()
+        for part in (self.title, self.heading, lastUpdate, body, graphs, footer):
+            digest.update(part)
+            digest.update('\0')
+
+        buffer = []
+        self.head.renderInto(buffer, {'title': self.title, 'heading': self.heading, 'lastUpdate': lastUpdate})
+        buffer.append(body)
+        self.foot.renderInto(buffer, {'uptime': uptime, 'graphs': graphs, 'footer': footer,
+                                      'script': self.liveScript if self.liveFeed else ''})
+        return ''.join(buffer), digest.hexdigest()
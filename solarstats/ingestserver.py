@@ -0,0 +1,183 @@
+# Central ingestion server: receives the sample batches of the collectors of all sites (see forwarder)
+# and stores them in one shared database with the collector schema. Inverters are identified by serial
+# number, manufacturer and model, so their IDs in the shared database do not depend on the site.
+# Inserts are idempotent (UNIQUE (Inverter_ID, DateTime)), so a batch that is sent again after a lost
+# acknowledgement does no harm
+import BaseHTTPServer   # HTTP server
+import SocketServer     # Threading mix-in
+import datetime         # Last seen times
+import json             # Batches and acknowledgements
+import logging          # General logging
+import sqlite3          # Shared database
+import threading        # Locks
+import zlib             # Batch compression
+
+
+class CentralStore:
+    createTables = ["CREATE TABLE IF NOT EXISTS ingestsite ("
+                    "Site TEXT PRIMARY KEY NOT NULL, Outbox TEXT, LastSeq INTEGER(8), LastSeen TEXT, Samples INTEGER(8))",
+                    "CREATE TABLE IF NOT EXISTS siteinverter ("
+                    "Site TEXT NOT NULL, LocalID INTEGER(8) NOT NULL, Inverter_ID INTEGER(8) NOT NULL, "
+                    "UNIQUE (Site, LocalID), FOREIGN KEY (Inverter_ID) REFERENCES inverter(ID))"]
+
+    # initFile is the collector's SQL init file, which creates the inverter and inverterdata tables
+    def __init__(self, dbName, initFile=None):
+        self.dbName = dbName
+        self.conn = sqlite3.connect(dbName, check_same_thread=False)
+        if initFile is not None:
+            with open(initFile, 'r') as f:
+                self.conn.executescript(f.read())
+        for statement in self.createTables:
+            self.conn.execute(statement)
+        self.conn.commit()
+        self.columns = set(row[1] for row in self.conn.execute("PRAGMA table_info(inverterdata)"))
+        self._lock = threading.Lock()   # One user of the connection at a time
+
+    def close(self):
+        self.conn.close()
+
+    # ID in the shared database of an inverter, given its serial number, manufacturer and model; added
+    # if it is new. Inverters without a serial number are told apart by site and local ID
+    def inverterId(self, site, localId, serialNumber, manufacturer, model):
+        serialNumber = serialNumber or '%s:%s' % (site, localId)
+        manufacturer = manufacturer or 'Unknown'
+        model = model or 'Unknown'
+        # The ID columns are not row ID aliases (INTEGER(8)), so new IDs are assigned here
+        self.conn.execute("INSERT OR IGNORE INTO invertertype (ID, Manufacturer, Model) "
+                          "SELECT coalesce(max(ID), 0) + 1, ?, ? FROM invertertype", (manufacturer, model))
+        typeId = self.conn.execute("SELECT ID FROM invertertype WHERE Manufacturer=? AND Model=?", (manufacturer, model)).fetchone()[0]
+        self.conn.execute("INSERT OR IGNORE INTO inverter (ID, SerialNumber, InverterType_ID) "
+                          "SELECT coalesce(max(ID), 0) + 1, ?, ? FROM inverter", (serialNumber, typeId))
+        inverterId = self.conn.execute("SELECT ID FROM inverter WHERE SerialNumber=? AND InverterType_ID=?",
+                                       (serialNumber, typeId)).fetchone()[0]
+        self.conn.execute("INSERT OR REPLACE INTO siteinverter VALUES (?,?,?)", (site, int(localId), inverterId))
+        return inverterId
+
+    # Store a batch (see forwarder.Forwarder.message) in one transaction. Samples up to the last
+    # sequence number stored for the site's outbox are skipped. Returns the acknowledgement:
+    # {'ack': last sequence number stored, 'inserted': new samples, 'duplicates': samples already stored}
+    def ingest(self, batch):
+        site, outbox, first, last = batch['site'], batch['outbox'], int(batch['first']), int(batch['last'])
+        columns = batch['columns']
+        keep = [i for i, name in enumerate(columns) if name in self.columns]    # Columns this database has
+        with self._lock:
+            row = self.conn.execute("SELECT Outbox, LastSeq FROM ingestsite WHERE Site=?", (site,)).fetchone()
+            lastSeq = row[1] if row is not None and row[0] == outbox else 0
+            if row is not None and row[0] != outbox:
+                logging.info("Site '%s' has a new outbox; its sequence numbers start over", site)
+            elif first > lastSeq + 1:
+                logging.warning("Site '%s' skipped samples %d to %d (dropped from its outbox)", site, lastSeq + 1, first - 1)
+            rows = [r for r in batch['rows'] if r[0] > lastSeq]
+            try:
+                ids = dict((localId, self.inverterId(site, localId, *info)) for localId, info in batch['inverters'].items())
+                before = self.conn.total_changes
+                self.conn.executemany("INSERT OR IGNORE INTO inverterdata (Inverter_ID, " + ', '.join(columns[i] for i in keep) + ") "
+                                      "VALUES (?, " + ', '.join('?' * len(keep)) + ")",
+                                      ([ids[str(r[1])]] + [r[2 + i] for i in keep] for r in rows))
+                inserted = self.conn.total_changes - before
+                ack = max(last, lastSeq)
+                self.conn.execute("INSERT OR REPLACE INTO ingestsite VALUES (?, ?, ?, ?, "
+                                  "coalesce((SELECT Samples FROM ingestsite WHERE Site=?), 0) + ?)",
+                                  (site, outbox, ack, str(datetime.datetime.now()), site, inserted))
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+        logging.debug("Ingested %d of %d samples from site '%s' (seq %d-%d)", inserted, len(batch['rows']), site, first, last)
+        return {'ack': ack, 'inserted': inserted, 'duplicates': len(rows) - inserted}
+
+    # Per site: last sequence number, last contact and number of samples stored
+    def sites(self):
+        with self._lock:    # The connection is shared with the writers
+            return [{'site': site, 'lastSeq': lastSeq, 'lastSeen': lastSeen, 'samples': samples}
+                    for site, lastSeq, lastSeen, samples in
+                    self.conn.execute("SELECT Site, LastSeq, LastSeen, Samples FROM ingestsite ORDER BY Site")]
+
+
+class IngestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        if self.path != '/ingest':
+            self.sendBody(404, 'text/plain', 'Not found\n')
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > self.server.maxBody:
+            self.close_connection = True
+            self.sendBody(413, 'text/plain', 'Batch too large\n')
+            return
+        body = self.rfile.read(length)
+        # Backpressure: a collector that finds the server busy retries later
+        if not self.server.admit():
+            self.sendBody(503, 'text/plain', 'Busy\n', {'Retry-After': str(self.server.retryAfter)})
+            return
+        try:
+            try:
+                if self.headers.get('Content-Encoding') == 'deflate':
+                    # Inflated up to maxBatch bytes: a small body must not blow up into gigabytes
+                    inflater = zlib.decompressobj()
+                    body = inflater.decompress(body, self.server.maxBatch)
+                    if inflater.unconsumed_tail:
+                        logging.warning("Rejected batch from %s: more than %d bytes inflated", self.address_string(),
+                                        self.server.maxBatch)
+                        self.sendBody(413, 'text/plain', 'Batch too large\n')
+                        return
+                batch = json.loads(body)
+                ack = self.server.store.ingest(batch)
+            except (zlib.error, ValueError, KeyError, TypeError, IndexError) as inst:
+                logging.warning("Rejected batch from %s: %s", self.address_string(), inst)
+                self.sendBody(400, 'text/plain', 'Invalid batch\n')
+                return
+            except sqlite3.Error as inst:
+                logging.error("Cannot store batch from %s: %s", self.address_string(), inst)
+                self.sendBody(503, 'text/plain', 'Cannot store batch\n', {'Retry-After': str(self.server.retryAfter)})
+                return
+        finally:
+            self.server.release()
+        self.sendBody(200, 'application/json', json.dumps(ack))
+
+    def do_GET(self):
+        if self.path == '/api/sites':
+            self.sendBody(200, 'application/json', json.dumps(self.server.store.sites()))
+        else:
+            self.sendBody(404, 'text/plain', 'Not found\n')
+
+    def sendBody(self, code, contentType, body, headers=None):
+        self.send_response(code)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug("HTTP %s - %s", self.address_string(), format % args)
+
+
+class IngestServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    # store: CentralStore. At most maxActive batches are handled at a time; further collectors are
+    # told to come back after retryAfter seconds. Batches are at most maxBody bytes as sent, and
+    # maxBatch bytes once inflated
+    def __init__(self, address, store, maxActive=4, retryAfter=30, maxBody=8 * 1024 * 1024, maxBatch=64 * 1024 * 1024):
+        BaseHTTPServer.HTTPServer.__init__(self, address, IngestRequestHandler)
+        self.store = store
+        self.maxActive = maxActive
+        self.retryAfter = retryAfter
+        self.maxBody = maxBody
+        self.maxBatch = maxBatch
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def admit(self):
+        with self._lock:
+            if self.active >= self.maxActive:
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
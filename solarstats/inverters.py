@@ -0,0 +1,64 @@
+# Inverter registry: the rows of the 'inverter' table, together with the names of
+# the RRD files and data sources that hold their measurements
+import logging  # General logging
+import re       # Parsing MaxOutput values such as '3000W'
+import sqlite3  # Database connection
+
+
+class Inverter:
+    # Inverters that predate the per-inverter naming scheme keep their original RRD files and data sources
+    legacy = {1: ('SolarStats_BLS.rrd', 'bls3000', 'BLS'),
+              2: ('SolarStats_Sol.rrd', 'sol600', 'Sol')}
+
+    # Metrics stored per inverter: AC power (W), energy today (kWh) and energy total (kWh)
+    metrics = ('pow', 'nrg', 'tot')
+
+    def __init__(self, inverterId, serialNumber='', manufacturer=None, model=None, maxOutput=None):
+        self.id = int(inverterId)
+        self.serialNumber = serialNumber
+        self.manufacturer = manufacturer
+        self.model = model
+        self.maxOutput = self.parseMaxOutput(maxOutput)
+
+        if self.id in self.legacy:
+            self.rrdFile, self.dsPrefix, self.label = self.legacy[self.id]
+        else:
+            self.rrdFile = 'SolarStats_%d.rrd' % self.id
+            self.dsPrefix = 'inv%d' % self.id
+            self.label = 'Inv%d' % self.id
+
+    def __repr__(self):
+        return "Inverter(%d, %s, %s)" % (self.id, self.label, self.rrdFile)
+
+    # MaxOutput is stored as either an integer or a string like '3000W'
+    @staticmethod
+    def parseMaxOutput(maxOutput):
+        if maxOutput is None:
+            return None
+        match = re.match(r'\s*(\d+(\.\d+)?)', str(maxOutput))
+        return float(match.group(1)) if match else None
+
+    # Name of the RRD data source for a metric ('pow', 'nrg' or 'tot')
+    def dataSource(self, metric):
+        return '%s_%s' % (self.dsPrefix, metric)
+
+    # Identifies everything that ends up in a graph or schema definition (used as cache key)
+    def key(self):
+        return (self.id, self.rrdFile, self.dsPrefix, self.label)
+
+
+# The two inverters of the original setup, for when no database is available
+def legacy_inverters():
+    return [Inverter(1), Inverter(2)]
+
+# Load all inverters from the 'inverter' table (joined with 'invertertype'), ordered by ID
+def load_inverters(dbName):
+    conn = sqlite3.connect(dbName)
+    try:
+        cursor = conn.execute("SELECT i.ID, i.SerialNumber, t.Manufacturer, t.Model, t.MaxOutput "
+                              "FROM inverter i LEFT JOIN invertertype t ON i.InverterType_ID = t.ID ORDER BY i.ID")
+        inverters = [Inverter(*row) for row in cursor]
+    finally:
+        conn.close()
+    logging.debug("Loaded inverters from '%s': %s", dbName, inverters)
+    return inverters
@@ -0,0 +1,135 @@
+# Serial link quality per inverter and port: frame counters and response latencies, collected
+# while polling and stored as one compact row per poll in the 'linkstats' table
+import array    # Packed latency histograms
+import datetime # Window start times
+import logging  # General logging
+import sqlite3  # Database connection
+
+
+class LinkStats:
+    # Counters, in the order of the table columns
+    counters = ('Sent', 'Ok', 'CrcErrors', 'ShortFrames', 'BadFrames', 'Timeouts', 'Retries')
+
+    # Upper bounds (in ms) of the latency buckets; the last (open) bucket is implicit. Latency is the
+    # time between sending a request and receiving the first byte of the response
+    latencyBuckets = (5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500, 1000)
+
+    keepDays = 30   # Days the rows of a poll are kept (the longest window reported is 7 days)
+
+    createTable = ("CREATE TABLE IF NOT EXISTS linkstats ("
+                   "DateTime TEXT NOT NULL, Inverter_ID INTEGER(8) NOT NULL, Port TEXT NOT NULL, "
+                   "Sent INTEGER(8), Ok INTEGER(8), CrcErrors INTEGER(8), ShortFrames INTEGER(8), BadFrames INTEGER(8), "
+                   "Timeouts INTEGER(8), Retries INTEGER(8), Latency BLOB, "
+                   "FOREIGN KEY (Inverter_ID) REFERENCES inverter(ID))")
+
+    def __init__(self, inverterId, port):
+        self.inverterId = int(inverterId)
+        self.port = port
+        self.counts = dict.fromkeys(self.counters, 0)
+        self.latency = [0] * (len(self.latencyBuckets) + 1)
+
+    def __repr__(self):
+        return "LinkStats(%d, %s, %s)" % (self.inverterId, self.port, self.counts)
+
+    def count(self, counter, n=1):
+        self.counts[counter] += n
+
+    def observeLatency(self, seconds):
+        ms = seconds * 1000.0
+        i = 0
+        while i < len(self.latencyBuckets) and ms > self.latencyBuckets[i]:
+            i += 1
+        self.latency[i] += 1
+
+    # Latency (in ms) below which p percent of the responses arrived; the upper bound of the bucket
+    # holding that response (None if there are no responses, or if it is in the open bucket)
+    def percentile(self, p):
+        total = sum(self.latency)
+        if total == 0:
+            return None
+        rank = total * p / 100.0
+        cumulative = 0
+        for bound, count in zip(self.latencyBuckets, self.latency):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return None
+
+    def merge(self, other):
+        for name in self.counters:
+            self.counts[name] += other.counts[name]
+        self.latency = [a + b for a, b in zip(self.latency, other.latency)]
+
+    # Latency histogram as a blob of 16-bit counts (26 bytes)
+    def packLatency(self):
+        return buffer(array.array('H', [min(count, 0xFFFF) for count in self.latency]).tostring())
+
+    def unpackLatency(self, blob):
+        counts = array.array('H')
+        counts.fromstring(str(blob))
+        if len(counts) == len(self.latency):
+            self.latency = [a + b for a, b in zip(self.latency, counts)]
+
+    def asDict(self):
+        result = {'id': self.inverterId, 'port': self.port}
+        result.update(self.counts)
+        for p in (50, 90, 99):
+            result['p%d' % p] = self.percentile(p)
+        return result
+
+    # Store the statistics of a poll, and drop the rows of polls more than keepDays before it
+    def store(self, conn, dateTime=None):
+        dateTime = dateTime or datetime.datetime.now()
+        conn.execute(self.createTable)
+        conn.execute("INSERT INTO linkstats VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+                     (str(dateTime), self.inverterId, self.port)
+                     + tuple(self.counts[name] for name in self.counters) + (self.packLatency(),))
+        conn.execute("DELETE FROM linkstats WHERE DateTime < ?", (str(dateTime - datetime.timedelta(days=self.keepDays)),))
+        conn.commit()
+        logging.debug("Stored link statistics: %s", self)
+
+
+# Windows reported by the CLI and the status server
+defaultWindows = [('1h', datetime.timedelta(hours=1)),
+                  ('24h', datetime.timedelta(days=1)),
+                  ('7d', datetime.timedelta(days=7))]
+
+# Totals per inverter and port over all polls since the given datetime, ordered by inverter ID
+def window(conn, since):
+    totals = {}
+    try:
+        cursor = conn.execute("SELECT Inverter_ID, Port, " + ', '.join(LinkStats.counters) + ", Latency "
+                              "FROM linkstats WHERE DateTime >= ?", (str(since),))
+    except sqlite3.OperationalError:
+        return []   # Database predates the linkstats table, and nothing was polled since
+    for row in cursor:
+        key = (row[0], row[1])
+        if key not in totals:
+            totals[key] = LinkStats(row[0], row[1])
+        stats = totals[key]
+        for name, value in zip(LinkStats.counters, row[2:-1]):
+            stats.counts[name] += value or 0
+        if row[-1] is not None:
+            stats.unpackLatency(row[-1])
+    return [totals[key] for key in sorted(totals)]
+
+# Totals for several windows, given as (name, timedelta) pairs; returns [(name, [LinkStats])]
+def windows(dbName, periods=defaultWindows, now=None):
+    now = now or datetime.datetime.now()
+    conn = sqlite3.connect(dbName)
+    try:
+        return [(name, window(conn, now - period)) for name, period in periods]
+    finally:
+        conn.close()
+
+# Rows for the link quality table of the status page: the last 24 hours of every inverter in
+# inverters (inverters.Inverter) that has statistics
+def page_rows(dbName, inverters, now=None):
+    labels = dict((iv.id, iv.label) for iv in inverters)
+    rows = []
+    for link in windows(dbName, defaultWindows[1:2], now)[0][1]:
+        if link.inverterId in labels:
+            row = link.asDict()
+            row['name'] = labels[link.inverterId]
+            rows.append(row)
+    return rows
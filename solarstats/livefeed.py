@@ -0,0 +1,138 @@
+# Live sample feed: the collector sends each decoded sample as a UDP datagram to the status
+# server, where a fan-out hub pushes compact JSON deltas to browsers over server-sent events
+import json         # Sample serialisation
+import logging      # General logging
+import Queue        # Bounded per-client queues
+import socket       # UDP transport between collector and server
+import threading    # Locks, receiver thread
+import time         # Sample time stamps
+
+
+# Fields of an inverter result that are published
+liveFields = ('PowerAC', 'EnergyToday', 'EnergyTotal', 'Temperature', 'VoltsPV1', 'CurrentPV1',
+              'VoltsAC1', 'FrequencyAC', 'Status2', 'success')
+
+# Reduce an inverter result dict to the published fields
+def sample_message(results):
+    message = {'id': results['id'], 't': int(time.time())}
+    for name in liveFields:
+        if name in results:
+            message[name] = results[name]
+    return message
+
+
+class Subscription:
+    def __init__(self, queueSize):
+        self.queue = Queue.Queue(queueSize)
+        self.dropped = False
+
+    # Next event (a string), or None after timeout seconds
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except Queue.Empty:
+            return None
+
+
+class FanoutHub:
+    # Each client has a queue of at most queueSize events; a client that falls that far behind is dropped
+    def __init__(self, queueSize=32):
+        self.queueSize = queueSize
+        self._subscribers = set()
+        self._last = {}             # Inverter ID -> last published sample
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def event(message):
+        return 'data: %s\n\n' % json.dumps(message, sort_keys=True, separators=(',', ':'))
+
+    # New client; its queue starts with the full last sample of every inverter (on top of the
+    # queueSize events it may fall behind)
+    def subscribe(self):
+        with self._lock:
+            subscription = Subscription(len(self._last) + self.queueSize)
+            for ivId in sorted(self._last):
+                subscription.queue.put_nowait(self.event(self._last[ivId]))
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def clientCount(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    # Publish a sample (a dict with at least 'id'); only the fields that changed are sent, with the
+    # ID and time ('t'). A sample in which nothing but the time changed is not sent
+    def publish(self, message):
+        with self._lock:
+            last = self._last.get(message['id'], {})
+            delta = dict((k, v) for k, v in message.items() if last.get(k) != v and k not in ('id', 't'))
+            self._last[message['id']] = dict(last, **message)
+            if not delta:
+                return
+            delta.update((k, message[k]) for k in ('id', 't') if k in message)
+            event = self.event(delta)
+            for subscription in list(self._subscribers):
+                try:
+                    subscription.queue.put_nowait(event)
+                except Queue.Full:
+                    logging.info("Dropping slow live feed client (%d events queued)", self.queueSize)
+                    subscription.dropped = True
+                    self._subscribers.discard(subscription)
+
+
+class SampleSender:
+    # Fire-and-forget: if no server is listening the datagram is simply lost
+    def __init__(self, address):
+        self.address = address
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, results):
+        try:
+            self.sock.sendto(json.dumps(sample_message(results), separators=(',', ':')), self.address)
+        except (socket.error, TypeError, ValueError) as inst:
+            logging.debug("Cannot send live sample: %s", inst)
+
+    def close(self):
+        self.sock.close()
+
+
+class SampleReceiver(threading.Thread):
+    # Receives samples from SampleSender and publishes them to hub; recent (optional
+    # ringbuffer.RecentSamples) keeps them as well
+    def __init__(self, address, hub, recent=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.hub = hub
+        self.recent = recent
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(address)
+        self.address = self.sock.getsockname()
+
+    def run(self):
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except socket.error:
+                return      # Socket closed
+            if not data:
+                return      # Socket shut down
+            try:
+                message = json.loads(data)
+                message['id'] = int(message['id'])
+            except (ValueError, KeyError, TypeError):
+                logging.warning("Ignoring malformed live sample (%d bytes)", len(data))
+                continue
+            if self.recent is not None:
+                self.recent.add(message)
+            self.hub.publish(message)
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)   # Wakes up the blocking recv
+        except socket.error:
+            pass
+        self.sock.close()
@@ -1,6 +1,7 @@
 import logging  # General logging
 import struct   # Used in the CRC calculation
 import solarutils
+from timing import timings
 
 class MasterVolt:
     def __init__(self):
@@ -48,20 +49,22 @@ class MasterVolt:
         # Fifth byte is the function code, each of which has a certain response length
         if len(response) < 5:
             logging.error("Response too short (%d) to determine function code", len(response))
-            raise ValueError("Response too short (%d) to determine function code", len(response))
+            raise solarutils.FrameLengthError("Response too short (%d) to determine function code", len(response))
 
         # Should expect at least a certain number of bytes
         fc = response[4]
         minLength = self.responseLength(fc)
         if len(response) < minLength:
             logging.error("Error parsing response of length %d, expecting at least %d bytes", len(response), minLength)
-            raise ValueError("Expected response length of %d for function %s, actual response length was %d", minLength, self.su.printhex(fc), len(response))
+            raise solarutils.FrameLengthError("Expected response length of %d for function %s, actual response length was %d", minLength, solarutils.LazyHex(fc), len(response))
 
         # Check the CRC of the response; if incorrect, do not return message data
-        calcCrc = self.calcCRC(response)
+        with timings.span('crc', 'Soladin600'):
+            calcCrc = self.calcCRC(response)
         if calcCrc != response[-1]:
-            logging.error("Invalid CRC (expected: %s; actual: %s)! Ignoring response...", self.su.printhex(calcCrc), self.su.printhex(response[-1]))
-            raise ValueError("Invalid CRC (expected: %s; actual: %s)", self.su.printhex(calcCrc), self.su.printhex(response[-1]))
+            expected, actual = solarutils.LazyHex(calcCrc), solarutils.LazyHex(response[-1])
+            logging.error("Invalid CRC (expected: %s; actual: %s)! Ignoring response...", expected, actual)
+            raise solarutils.CrcError("Invalid CRC (expected: %s; actual: %s)", expected, actual)
         #logging.debug("Calculated crc: %s; actual: %s", self.su.printhex(calcCrc), self.su.printhex(response[-1]))
 
         # Return source, destination and data (remove function and crc)
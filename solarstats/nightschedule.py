@@ -0,0 +1,160 @@
+# Night-time polling: between sunset and sunrise (computed for the site, see sun_times) an inverter
+# that stopped responding, or produces nothing, is taken to be asleep. It is then not polled every
+# cycle, but probed once every heartbeat seconds with a single request (no retries). The cycles it
+# sleeps through are written to the RRD in bulk at the next probe, as explicit night values (no
+# power, the energy counters holding), instead of a zeroed update and a full retry loop per cycle.
+# Around sunrise and sunset (margin seconds) every inverter is polled normally
+import calendar # UTC day
+import json     # Saved state
+import math     # Sun position
+import os       # State file
+import time     # Local day
+
+
+margin = 1800       # Seconds before sunrise and after sunset during which inverters are polled normally
+heartbeat = 1800    # Seconds between the probes of a sleeping inverter
+sleepPolls = 2      # Quiet polls (no response, or no power) after sunset before an inverter is taken to be asleep
+sunAltitude = -0.833    # Altitude (degrees) of the sun's centre at sunrise and sunset (refraction, solar disc)
+
+# Sunrise and sunset (Unix times) on the local day of when, at the site. The sun never rises
+# (sunrise == sunset) or never sets (a whole day) beyond the polar circles
+def sun_times(when, latitude, longitude):
+    year, month, day = time.localtime(when)[:3]
+    utcMidnight = calendar.timegm((year, month, day, 0, 0, 0))
+    n = (utcMidnight + 43200) / 86400.0 - 10957.5       # Days since J2000.0, at noon
+    meanLongitude = (280.460 + 0.9856474 * n) % 360
+    meanAnomaly = math.radians((357.528 + 0.9856003 * n) % 360)
+    eclipticLongitude = math.radians(meanLongitude + 1.915 * math.sin(meanAnomaly) + 0.020 * math.sin(2 * meanAnomaly))
+    obliquity = math.radians(23.439 - 0.0000004 * n)
+    rightAscension = math.degrees(math.atan2(math.cos(obliquity) * math.sin(eclipticLongitude), math.cos(eclipticLongitude)))
+    declination = math.asin(math.sin(obliquity) * math.sin(eclipticLongitude))
+    equationOfTime = (meanLongitude - rightAscension + 180) % 360 - 180    # Degrees; 1 degree is 4 minutes
+    noon = utcMidnight + 43200 - 240 * (longitude + equationOfTime)
+    lat = math.radians(latitude)
+    cosHourAngle = ((math.sin(math.radians(sunAltitude)) - math.sin(lat) * math.sin(declination)) /
+                    (math.cos(lat) * math.cos(declination)))
+    halfDay = 240 * math.degrees(math.acos(max(-1.0, min(1.0, cosHourAngle))))
+    return noon - halfDay, noon + halfDay
+
+# An inverter is quiet when it does not respond, or produces no power (BlackLine 'not running')
+def quiet(results):
+    return not results['success'] or not results.get('PowerAC')
+
+
+class PortState:
+    def __init__(self, inverterId=None, name=None, asleep=False, quietPolls=0, lastProbe=0, pending=None,
+                 energyToday=0.0, energyYear=0.0, lastDay=None):
+        self.inverterId = inverterId    # Of the inverter on the port, from its last poll
+        self.name = name
+        self.asleep = asleep
+        self.quietPolls = quietPolls
+        self.lastProbe = lastProbe
+        self.pending = pending or []    # Times of the cycles slept through, not yet written
+        self.energyToday = energyToday  # Counters of the last successful poll, held at night
+        self.energyYear = energyYear
+        self.lastDay = lastDay          # Local day of energyToday
+
+    def asDict(self):
+        return dict(self.__dict__)
+
+    @classmethod
+    def fromDict(cls, d):
+        return cls(**d)
+
+    # Values (for the RRD: power, energy today, energy this year) of a cycle slept through
+    def nightValue(self, t):
+        energyToday = self.energyToday if time.strftime('%Y-%m-%d', time.localtime(t)) == self.lastDay else 0.0
+        return '0:%s:%s' % (energyToday, self.energyYear)
+
+
+class NightSchedule:
+    def __init__(self, latitude, longitude):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.ports = {}
+        self._sun = (None, None)    # (local day, (sunrise, sunset))
+
+    def port(self, portID):
+        if portID not in self.ports:
+            self.ports[portID] = PortState()
+        return self.ports[portID]
+
+    def night(self, now):
+        day = time.strftime('%Y-%m-%d', time.localtime(now))
+        if self._sun[0] != day:
+            self._sun = (day, sun_times(now, self.latitude, self.longitude))
+        sunrise, sunset = self._sun[1]
+        return now < sunrise - margin or now > sunset + margin
+
+    # How to poll a port now: 'poll' (with retries), 'probe' (a single request) or 'skip'
+    def mode(self, portID, now):
+        state = self.port(portID)
+        if not self.night(now):
+            state.asleep = False
+            state.quietPolls = 0
+            return 'poll'
+        if not state.asleep:
+            return 'poll'
+        if now - state.lastProbe >= heartbeat:
+            return 'probe'
+        return 'skip'
+
+    # A cycle slept through
+    def skip(self, portID, now):
+        self.port(portID).pending.append(int(now))
+
+    # Results for the status page and the writer of a cycle slept through
+    def sleepingResults(self, portID):
+        state = self.port(portID)
+        return {'id': state.inverterId, 'name': state.name, 'success': False, 'asleep': True, 'nightTimes': []}
+
+    # Take in the results of a poll or probe: marks them 'asleep' (when the inverter is), and adds the
+    # 'nightValues' to write to the RRD: a list of (time, RRD values) of the cycles slept through
+    def record(self, portID, results, now, probe=False):
+        return self.nightValues(portID, self.observe(portID, results, now, probe), now)
+
+    # The first half of record, for where the inverter is polled (the worker of --supervise): marks the
+    # results 'asleep', and adds the times of the cycles slept through in 'nightTimes'
+    def observe(self, portID, results, now, probe=False):
+        state = self.port(portID)
+        state.inverterId = results.get('id', state.inverterId)
+        state.name = results.get('name', state.name)
+        if probe:
+            state.lastProbe = now
+        if quiet(results) and self.night(now):
+            state.quietPolls += 1
+            if not state.asleep and state.quietPolls >= sleepPolls:
+                state.asleep = True
+                state.lastProbe = now
+        else:
+            state.asleep = False
+            state.quietPolls = 0
+        if state.asleep and not results['success']:
+            state.pending.append(int(now))
+        results['asleep'] = state.asleep
+        results['nightTimes'] = state.pending
+        state.pending = []
+        return results
+
+    # The second half, for where the energy counters are kept (after track_energy; the writer of
+    # --supervise): holds the counters of successful results, and turns the 'nightTimes' into 'nightValues'
+    def nightValues(self, portID, results, now):
+        state = self.port(portID)
+        if results['success']:
+            state.energyToday = results.get('EnergyToday', state.energyToday)
+            state.energyYear = results.get('EnergyYear', state.energyYear)
+            state.lastDay = time.strftime('%Y-%m-%d', time.localtime(now))
+        results['nightValues'] = [(t, state.nightValue(t)) for t in results.pop('nightTimes', [])]
+        return results
+
+    def load(self, stateFile):
+        try:
+            with open(stateFile, 'r') as f:
+                self.ports = dict((portID, PortState.fromDict(d)) for portID, d in json.load(f).items())
+        except (IOError, ValueError, KeyError, TypeError):
+            return
+
+    def save(self, stateFile):
+        with open(stateFile + '.tmp', 'w') as f:
+            json.dump(dict((portID, state.asDict()) for portID, state in self.ports.items()), f)
+        os.rename(stateFile + '.tmp', stateFile)
@@ -0,0 +1,110 @@
+# Profiling of collection cycles: a deterministic profile (cProfile) or a statistical one (a signal
+# based stack sampler). Both produce a collapsed-stack file ('frame;frame;frame count' per line),
+# the input format of flame graph tools
+import cProfile # Deterministic profiler
+import os       # File names
+import pstats   # Profile statistics
+import signal   # Sampling timer
+
+
+# Name of a code location, as used in the collapsed stacks
+def frame_name(fileName, lineNo, funcName):
+    return '%s:%s:%d' % (os.path.basename(fileName), funcName, lineNo)
+
+
+class StackSampler:
+    # Samples the stack of the main thread every interval seconds of CPU time (SIGPROF). Time spent
+    # waiting for the serial ports is not CPU time, so it is not sampled
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.stacks = {}    # Tuple of frame names (outermost first) -> number of samples
+        self._previous = None
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(frame_name(code.co_filename, code.co_firstlineno, code.co_name))
+            frame = frame.f_back
+        key = tuple(reversed(stack))
+        self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def start(self):
+        self._previous = signal.signal(signal.SIGPROF, self._sample)
+        signal.siginterrupt(signal.SIGPROF, False)     # Restart serial port reads instead of failing them
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self._previous or signal.SIG_DFL)
+
+    def collapsed(self):
+        return dict((';'.join(stack), count) for stack, count in self.stacks.items())
+
+    # Functions with the most samples on the stack (inclusive), as [(name, samples)]
+    def top(self, limit=20):
+        inclusive = {}
+        for stack, count in self.stacks.items():
+            for name in set(stack):
+                inclusive[name] = inclusive.get(name, 0) + count
+        return sorted(inclusive.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+
+# Collapsed stacks from a cProfile profile. cProfile only records caller/callee pairs, so the time of
+# a function that is called from several places is attributed to each path in proportion to the
+# time spent through that caller. Values are in microseconds
+def pstats_collapsed(stats, maxDepth=64):
+    callees = {}
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+    collapsed = {}
+
+    def walk(func, path, fraction):
+        cc, nc, tt, ct, callers = stats.stats[func]
+        path = path + [frame_name(*func)]
+        selfTime = int(round(tt * fraction * 1e6))
+        if selfTime > 0:
+            key = ';'.join(path)
+            collapsed[key] = collapsed.get(key, 0) + selfTime
+        if len(path) >= maxDepth:
+            return
+        for callee, edgeTime in callees.get(func, []):
+            calleeTime = stats.stats[callee][3]
+            if calleeTime <= 0 or frame_name(*callee) in path:
+                continue    # Nothing to attribute, or recursion
+            share = edgeTime * fraction / calleeTime
+            if share * calleeTime >= 1e-6:
+                walk(callee, path, share)
+
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        if not callers:
+            walk(func, [], 1.0)
+    return collapsed
+
+def write_collapsed(fileName, collapsed):
+    with open(fileName, 'w') as f:
+        for stack in sorted(collapsed):
+            f.write('%s %d\n' % (stack, collapsed[stack]))
+
+
+# Run function() under the given profiler ('cprofile' or 'sample'). Writes <basePath>.collapsed, and
+# <basePath>.pstats for cProfile. Returns the profile: a pstats.Stats or a StackSampler
+def profile_call(function, profiler, basePath):
+    if profiler == 'cprofile':
+        profile = cProfile.Profile()
+        profile.runcall(function)
+        profile.dump_stats(basePath + '.pstats')
+        stats = pstats.Stats(basePath + '.pstats')
+        write_collapsed(basePath + '.collapsed', pstats_collapsed(stats))
+        return stats
+    if profiler == 'sample':
+        sampler = StackSampler()
+        sampler.start()
+        try:
+            function()
+        finally:
+            sampler.stop()
+        write_collapsed(basePath + '.collapsed', sampler.collapsed())
+        return sampler
+    raise ValueError("Unknown profiler: %s" % profiler)
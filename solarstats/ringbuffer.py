@@ -0,0 +1,130 @@
+# Recent samples per inverter, in memory: a fixed number of samples in one array per column, written
+# twice (at i and i + capacity), so the last n samples are always one contiguous slice. Appending is
+# O(1), and a window is a view on the arrays, without copying. Queries for the latest sample, today so
+# far or the last minutes are answered without reading SQLite or an RRD. The views are read-only,
+# and only valid until capacity more samples have been appended; RecentSamples, which is added to
+# while it is queried, returns copies
+import time         # Sample times; local midnight
+import threading    # Appended to by the live feed, read by request threads
+import numpy        # Column arrays
+
+
+# Columns kept (besides the time, in seconds since the epoch); missing values are NaN
+columns = ('PowerAC', 'EnergyToday', 'EnergyTotal', 'MinToday', 'HrsTotal', 'Temperature', 'VoltsPV1', 'CurrentPV1',
+           'VoltsAC1', 'FrequencyAC', 'Status2')
+
+defaultCapacity = 48 * 12   # 48 hours of samples, one every 5 minutes
+
+
+class RingBuffer:
+    def __init__(self, capacity=defaultCapacity, columns=columns):
+        self.capacity = capacity
+        self.columns = ('time',) + tuple(columns)
+        self.count = 0          # Samples appended so far
+        self._arrays = dict((name, numpy.full(2 * capacity, numpy.nan)) for name in self.columns)
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    # Append a sample (a dict of column values) taken at time t; samples come in time order
+    def append(self, t, sample):
+        i = self.count % self.capacity
+        for name in self.columns:
+            value = t if name == 'time' else sample.get(name)
+            value = numpy.nan if value is None else value
+            array = self._arrays[name]
+            array[i] = value
+            array[i + self.capacity] = value
+        self.count += 1
+
+    # The last n samples (all by default), oldest first: a read-only view per column
+    def view(self, n=None):
+        n = len(self) if n is None else min(n, len(self))
+        end = (self.count - 1) % self.capacity + self.capacity + 1
+        window = {}
+        for name in self.columns:
+            window[name] = self._arrays[name][end - n:end]
+            window[name].flags.writeable = False
+        return window
+
+    # The samples taken at or after time t
+    def since(self, t):
+        times = self.view()['time']
+        return self.view(len(times) - numpy.searchsorted(times, t))
+
+    # The last sample as a dict (None when empty)
+    def latest(self):
+        if not self.count:
+            return None
+        i = (self.count - 1) % self.capacity
+        return dict((name, self._arrays[name][i].item()) for name in self.columns)
+
+
+# Local midnight before time t
+def midnight(t):
+    return time.mktime(time.localtime(t)[:3] + (0, 0, 0, 0, 0, -1))
+
+
+class RecentSamples:
+    # A ring buffer per inverter, created as samples of an inverter come in
+    def __init__(self, capacity=defaultCapacity):
+        self.capacity = capacity
+        self.buffers = {}
+        self._lock = threading.Lock()
+
+    # Add a sample: an inverter result or live feed message, with its ID in 'id'. It is taken at 't'
+    # (seconds) or 'DateTime' (local time), or now; results of an inverter that did not respond are left out
+    def add(self, sample, now=None):
+        if not sample.get('success', True):
+            return
+        if 't' in sample:
+            t = sample['t']
+        elif 'DateTime' in sample:
+            t = time.mktime(time.strptime(str(sample['DateTime'])[:19], '%Y-%m-%d %H:%M:%S'))
+        else:
+            t = now if now is not None else time.time()
+        with self._lock:
+            buffer = self.buffers.get(sample['id'])
+            if buffer is None:
+                buffer = self.buffers[sample['id']] = RingBuffer(self.capacity)
+            elif buffer.count and t <= buffer.latest()['time']:
+                return      # Already have it (loaded, or received twice)
+            buffer.append(t, sample)
+
+    # Fill the buffers from the inverter data (conn: the main database) of the last hours, so
+    # queries can be answered from the start
+    def load(self, conn, hours=48, now=None):
+        start = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime((now or time.time()) - hours * 3600))
+        rows = conn.execute("SELECT Inverter_ID, DateTime, " + ', '.join(columns) + " FROM inverterdata "
+                            "WHERE DateTime >= ? ORDER BY DateTime", (start,))
+        for row in rows:
+            sample = dict(zip(columns, row[2:]))
+            sample.update({'id': row[0], 'DateTime': row[1]})
+            self.add(sample)
+
+    def latest(self, inverterId):
+        with self._lock:
+            buffer = self.buffers.get(inverterId)
+            return buffer.latest() if buffer is not None else None
+
+    # Samples of an inverter since time t (see RingBuffer.view), copied before another sample can be
+    # added; None for unknown inverters
+    def since(self, inverterId, t):
+        with self._lock:
+            buffer = self.buffers.get(inverterId)
+            if buffer is None:
+                return None
+            return dict((name, numpy.array(values)) for name, values in buffer.since(t).items())
+
+    def lastMinutes(self, inverterId, minutes, now=None):
+        return self.since(inverterId, (now if now is not None else time.time()) - minutes * 60)
+
+    def today(self, inverterId, now=None):
+        return self.since(inverterId, midnight(now if now is not None else time.time()))
+
+    # Highest value of a column today (None without samples today)
+    def todayMax(self, inverterId, column, now=None):
+        window = self.today(inverterId, now)
+        if window is None or not len(window[column]) or numpy.isnan(window[column]).all():
+            return None
+        return float(numpy.nanmax(window[column]))
@@ -0,0 +1,69 @@
+# RRD schema template, and bulk provisioning of one RRD file per inverter
+import logging      # General logging
+import os           # File utils
+import subprocess   # For calling rrdtool
+
+
+class RrdSchema:
+    # Data sources per inverter: (metric, type, min, max); the names are prefixed per inverter (see inverters)
+    dataSources = [('pow', 'GAUGE', 0, 'U'),    # AC power (W)
+                   ('nrg', 'GAUGE', 0, 'U'),    # Energy today (kWh)
+                   ('tot', 'GAUGE', 0, 'U')]    # Energy total, this year (kWh)
+
+    # Round-robin archives: (cf, xff, steps, rows); 1 day of 5 minute values, 2 weeks of 30 minute,
+    # 30 days of hourly and a year of daily consolidated values
+    archives = [('LAST', 0.5, 1, 288),
+                ('LAST', 0.5, 6, 336), ('MIN', 0.5, 6, 336), ('AVERAGE', 0.5, 6, 336), ('MAX', 0.5, 6, 336),
+                ('LAST', 0.5, 12, 720), ('MIN', 0.5, 12, 720), ('AVERAGE', 0.5, 12, 720), ('MAX', 0.5, 12, 720),
+                ('LAST', 0.5, 288, 365), ('MIN', 0.5, 288, 365), ('AVERAGE', 0.5, 288, 365), ('MAX', 0.5, 288, 365)]
+
+    def __init__(self, step=300, directory=''):
+        self.step = step
+        self.heartbeat = 2 * step
+        self.directory = directory
+
+    def rrdFile(self, inverter):
+        return os.path.join(self.directory, inverter.rrdFile)
+
+    def dataSourceNames(self, inverter):
+        return [inverter.dataSource(metric) for metric, dsType, dsMin, dsMax in self.dataSources]
+
+    # Arguments for 'rrdtool create' for a single inverter
+    def createArgs(self, inverter):
+        args = ['create', self.rrdFile(inverter), '--step', str(self.step), '--no-overwrite']
+        args += ['DS:%s:%s:%d:%s:%s' % (inverter.dataSource(metric), dsType, self.heartbeat, dsMin, dsMax)
+                 for metric, dsType, dsMin, dsMax in self.dataSources]
+        args += ['RRA:%s:%s:%d:%d' % rra for rra in self.archives]
+        return args
+
+    # Create the RRD files of all given inverters that do not have one yet. All files are created by
+    # a single rrdtool process (in pipe mode), or as built-in round-robin stores if rrdtool is missing.
+    # Returns the list of created files.
+    def provision(self, inverters, useRrdtool=True, storeName=None):
+        if useRrdtool:
+            missing = [iv for iv in inverters if not os.path.isfile(self.rrdFile(iv))]
+            if missing:
+                self._rrdtoolBatch([self.createArgs(iv) for iv in missing])
+            created = [self.rrdFile(iv) for iv in missing if os.path.isfile(self.rrdFile(iv))]
+        else:
+            import rrdstore
+            created = []
+            for iv in inverters:
+                fileName = storeName(self.rrdFile(iv)) if storeName else self.rrdFile(iv)
+                if os.path.isfile(fileName):
+                    continue
+                rrdstore.RoundRobinStore.create(fileName, self.dataSourceNames(iv), self.archives,
+                                                step=self.step, heartbeat=self.heartbeat)
+                created.append(fileName)
+        logging.info("Provisioned %d of %d RRD files: %s", len(created), len(inverters), created)
+        return created
+
+    # Run a batch of rrdtool commands through one 'rrdtool -' process; returns the per-command results
+    def _rrdtoolBatch(self, commands):
+        proc = subprocess.Popen(['rrdtool', '-'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output, _ = proc.communicate(''.join(' '.join(args) + '\n' for args in commands))
+        results = [line for line in output.splitlines() if line.startswith('OK') or line.startswith('ERROR')]
+        for args, result in zip(commands, results):
+            if result.startswith('ERROR'):
+                logging.error("rrdtool %s failed: %s", args[1], result)
+        return results
@@ -0,0 +1,267 @@
+# Pure-Python round-robin time-series store, backed by a NumPy memmap.
+# Mirrors the RRDtool semantics used by SolarStats (GAUGE data sources, LAST/MIN/AVERAGE/MAX
+# consolidation with an xff) so it can stand in wherever the rrdtool binary is missing.
+import json     # Header (static definition) serialisation
+import logging  # General logging
+import os       # File utils
+import struct   # Header length prefix
+import xml.etree.ElementTree as ElementTree    # Parsing 'rrdtool dump' output
+
+import numpy
+
+
+class RoundRobinStore:
+    magic = 'SSRRD001'
+    headerSize = 4096           # Bytes reserved for the magic, length prefix and JSON definition
+    consolidations = ('LAST', 'MIN', 'AVERAGE', 'MAX')
+
+    # Open an existing store. Use RoundRobinStore.create() to make a new one
+    def __init__(self, fileName, readOnly=False):
+        self.fileName = fileName
+        with open(fileName, 'rb') as f:
+            header = f.read(self.headerSize)
+        if header[:8] != self.magic:
+            raise ValueError("Not a round-robin store: %s" % fileName)
+        length = struct.unpack('<I', header[8:12])[0]
+        definition = json.loads(header[12:12 + length].decode('utf-8'))
+
+        self.step = definition['step']
+        self.heartbeat = definition['heartbeat']
+        self.dataSources = [str(ds) for ds in definition['dataSources']]
+        self.archives = [(str(cf), xff, steps, rows) for cf, xff, steps, rows in definition['archives']]
+
+        # Layout (all float64): [lastUpdate, pdpKnownSecs...] state, per-ds PDP accumulators,
+        # then per archive a CDP state block and a double-written data block (see _writeRow)
+        nds = len(self.dataSources)
+        self._mm = numpy.memmap(fileName, dtype=numpy.float64, mode='r' if readOnly else 'r+',
+                                offset=self.headerSize, shape=(self._dataSize(nds, self.archives),))
+        offset = 0
+        self._state = self._mm[offset:offset + 2]                   # lastUpdate, unused
+        offset += 2
+        self._pdp = self._mm[offset:offset + 2 * nds].reshape(2, nds)   # weighted sum, known seconds
+        offset += 2 * nds
+        self._cdp = []
+        self._data = []
+        for cf, xff, steps, rows in self.archives:
+            # CDP state: accumulated value, known PDP count, write position
+            self._cdp.append(self._mm[offset:offset + 2 * nds + 1])
+            offset += 2 * nds + 1
+            self._data.append(self._mm[offset:offset + 2 * rows * nds].reshape(2 * rows, nds))
+            offset += 2 * rows * nds
+
+    # Number of float64 values following the header for a given definition
+    @staticmethod
+    def _dataSize(nds, archives):
+        size = 2 + 2 * nds
+        for cf, xff, steps, rows in archives:
+            size += 2 * nds + 1 + 2 * rows * nds
+        return size
+
+    # Create a new store. archives is a list of (cf, xff, steps, rows) tuples, like RRDtool's RRA definitions
+    @classmethod
+    def create(cls, fileName, dataSources, archives, step=300, heartbeat=600, start=None):
+        for cf, xff, steps, rows in archives:
+            if cf not in cls.consolidations:
+                raise ValueError("Unsupported consolidation function: %s" % cf)
+
+        definition = json.dumps({'step': step,
+                                 'heartbeat': heartbeat,
+                                 'dataSources': list(dataSources),
+                                 'archives': [list(a) for a in archives]}).encode('utf-8')
+        if len(definition) + 12 > cls.headerSize:
+            raise ValueError("Store definition too large (%d bytes)" % len(definition))
+
+        nds = len(dataSources)
+        size = cls._dataSize(nds, archives)
+        with open(fileName, 'wb') as f:
+            f.write(cls.magic + struct.pack('<I', len(definition)) + definition)
+            f.write('\0' * (cls.headerSize - 12 - len(definition)))
+            f.truncate(cls.headerSize + 8 * size)
+
+        store = cls(fileName)
+        store._state[0] = (start if start is not None else 0)
+        store._pdp[:] = 0.0
+        for i, (cf, xff, steps, rows) in enumerate(archives):
+            store._resetCdp(i)
+            store._cdp[i][-1] = 0
+            store._data[i][:] = numpy.nan
+        store.flush()
+        logging.info("Created round-robin store %s (%d data sources, %d archives)", fileName, nds, len(archives))
+        return store
+
+    def flush(self):
+        self._mm.flush()
+
+    def close(self):
+        self.flush()
+        del self._mm
+
+    @property
+    def lastUpdate(self):
+        return int(self._state[0])
+
+    def _resetCdp(self, i):
+        cf = self.archives[i][0]
+        nds = len(self.dataSources)
+        acc = self._cdp[i][:nds]
+        if cf == 'MIN':
+            acc[:] = numpy.inf
+        elif cf == 'MAX':
+            acc[:] = -numpy.inf
+        elif cf == 'LAST':
+            acc[:] = numpy.nan
+        else:
+            acc[:] = 0.0
+        self._cdp[i][nds:2 * nds] = 0.0
+
+    # Write a row to the ring. Every row is stored twice (at pos and pos + rows), so the most
+    # recent 'rows' values are always available as one contiguous slice: data[pos + 1:pos + 1 + rows]
+    def _writeRow(self, i, values):
+        rows = self.archives[i][3]
+        pos = int(self._cdp[i][-1])
+        self._data[i][pos] = values
+        self._data[i][pos + rows] = values
+        self._cdp[i][-1] = (pos + 1) % rows
+
+    # Feed one primary data point (ending at pdpEnd) into all archives
+    def _pushPdp(self, pdpEnd, pdp):
+        nds = len(self.dataSources)
+        known = ~numpy.isnan(pdp)
+        index = pdpEnd // self.step
+        for i, (cf, xff, steps, rows) in enumerate(self.archives):
+            acc = self._cdp[i][:nds]
+            count = self._cdp[i][nds:2 * nds]
+            if cf == 'AVERAGE':
+                acc[known] += pdp[known]
+            elif cf == 'MIN':
+                acc[known] = numpy.minimum(acc[known], pdp[known])
+            elif cf == 'MAX':
+                acc[known] = numpy.maximum(acc[known], pdp[known])
+            else:
+                acc[known] = pdp[known]
+            count[known] += 1
+
+            # Rows are aligned to multiples of (steps * step), just like RRDtool
+            if index % steps == 0:
+                value = numpy.where(count > 0, acc, numpy.nan)
+                if cf == 'AVERAGE':
+                    value = numpy.where(count > 0, acc / numpy.maximum(count, 1), numpy.nan)
+                value[(steps - count) / float(steps) > xff] = numpy.nan
+                self._writeRow(i, value)
+                self._resetCdp(i)
+
+    # Close the PDP ending at pdpEnd, and emit it
+    def _finishPdp(self, pdpEnd):
+        weighted, knownSecs = self._pdp
+        # A PDP is known if at least half of the step has known values
+        pdp = numpy.where(knownSecs >= self.step / 2.0, weighted / numpy.maximum(knownSecs, 1), numpy.nan)
+        self._pushPdp(pdpEnd, pdp)
+        self._pdp[:] = 0.0
+
+    # Update the store with values at (integer) time stamp t. Values are GAUGE: each value covers the
+    # interval since the previous update, unless that interval exceeds the heartbeat (then it is unknown)
+    def update(self, t, values):
+        t = int(t)
+        values = numpy.array([numpy.nan if v is None or v == 'U' else float(v) for v in values])
+        if len(values) != len(self.dataSources):
+            raise ValueError("Expected %d values, got %d" % (len(self.dataSources), len(values)))
+        last = self.lastUpdate
+        if t <= last:
+            raise ValueError("Illegal attempt to update using time %d when last update time is %d" % (t, last))
+
+        if last == 0 or t - last > self.heartbeat:
+            values = values * numpy.nan
+        known = ~numpy.isnan(values)
+        contrib = numpy.where(known, values, 0.0)
+
+        # Split the interval (last, t] over the step boundaries it crosses
+        start = last if last else t - (t % self.step)
+        boundary = (start // self.step + 1) * self.step
+        while boundary <= t:
+            secs = boundary - start
+            self._pdp[0] += contrib * secs
+            self._pdp[1] += known * secs
+            self._finishPdp(boundary)
+            start = boundary
+            boundary += self.step
+        secs = t - start
+        self._pdp[0] += contrib * secs
+        self._pdp[1] += known * secs
+        self._state[0] = t
+
+    # End time of the most recent row of archive i
+    def _lastRowEnd(self, i):
+        resolution = self.step * self.archives[i][2]
+        return (self.lastUpdate // resolution) * resolution
+
+    # Select the archive RRDtool would use: the finest resolution with this cf that covers 'start'
+    def _selectArchive(self, cf, start, resolution=None):
+        candidates = [i for i, a in enumerate(self.archives) if a[0] == cf]
+        if not candidates:
+            raise ValueError("No archive with consolidation function %s" % cf)
+        candidates.sort(key=lambda i: self.archives[i][2])
+        if resolution is not None:
+            for i in candidates:
+                if self.step * self.archives[i][2] >= resolution:
+                    return i
+        for i in candidates:
+            steps, rows = self.archives[i][2:4]
+            if self._lastRowEnd(i) - self.step * steps * rows <= start:
+                return i
+        return candidates[-1]
+
+    # Fetch the consolidated values between start and end. Returns (times, values, dataSources), where
+    # times holds the row end times and values is a read-only view into the memmap (no copy is made)
+    def fetch(self, cf, start, end, resolution=None):
+        i = self._selectArchive(cf, start, resolution)
+        steps, rows = self.archives[i][2:4]
+        res = self.step * steps
+        lastEnd = self._lastRowEnd(i)
+        pos = int(self._cdp[i][-1])
+
+        # Row k of the contiguous window data[pos:pos + rows] ends at lastEnd - (rows - 1 - k) * res
+        firstEnd = lastEnd - (rows - 1) * res
+        lo = max(0, int(-(-(start - firstEnd) // res)))
+        hi = min(rows, int((end - firstEnd) // res) + 1)
+        if hi <= lo:
+            return numpy.empty(0, dtype=numpy.int64), self._data[i][0:0], self.dataSources
+        values = self._data[i][pos + lo:pos + hi]
+        values.flags.writeable = False
+        times = firstEnd + res * numpy.arange(lo, hi, dtype=numpy.int64)
+        return times, values, self.dataSources
+
+    # Convenience accessor for a single data source
+    def series(self, dataSource, cf, start, end, resolution=None):
+        times, values, names = self.fetch(cf, start, end, resolution)
+        return times, values[:, names.index(dataSource)]
+
+    # Import an 'rrdtool dump' XML file (or file object) into a new store
+    @classmethod
+    def fromDump(cls, dumpFile, fileName):
+        tree = ElementTree.parse(dumpFile)
+        root = tree.getroot()
+        step = int(root.findtext('step'))
+        lastUpdate = int(root.findtext('lastupdate'))
+        dsElements = root.findall('ds')
+        dataSources = [ds.findtext('name').strip() for ds in dsElements]
+        heartbeat = max([int(ds.findtext('minimal_heartbeat')) for ds in dsElements] or [2 * step])
+
+        archives = []
+        rowData = []
+        for rra in root.findall('rra'):
+            cf = rra.findtext('cf').strip()
+            steps = int(rra.findtext('pdp_per_row'))
+            xff = float(rra.find('params').findtext('xff'))
+            values = [[float(v.text) for v in row.findall('v')] for row in rra.find('database').findall('row')]
+            archives.append((cf, xff, steps, len(values)))
+            rowData.append(values)
+
+        store = cls.create(fileName, dataSources, archives, step=step, heartbeat=heartbeat)
+        for i, values in enumerate(rowData):
+            # Dumped rows are ordered oldest first, the last one ending at the last complete row
+            for row in values:
+                store._writeRow(i, numpy.array(row))
+        store._state[0] = lastUpdate
+        store.flush()
+        logging.info("Imported %d archives from RRDtool dump into %s", len(archives), fileName)
+        return store
@@ -0,0 +1,167 @@
+# Time-sharded storage of the inverter data. The main database keeps the inverter data of the current
+# period (year or month) and everything else; the data of earlier periods is moved to a shard per
+# period (SolarStats.2014.sqlt, ...), which is then made read-only. Shards can be moved to another
+# directory (off the SD card) or gzipped; they are looked up in the search path, and gzipped shards are
+# unpacked into a cache when needed.
+# Queries over a time range attach only the shards of that range, and see them together with the main
+# database as one 'inverterdata' (a temporary view, which takes precedence over the main table)
+import gzip     # Compressed shards
+import logging  # General logging
+import os       # File utils
+import re       # Table definition
+import shutil   # Unpacking shards
+import sqlite3  # Database connection
+import stat     # Read-only shards
+import tempfile # Shard cache
+
+maxAttached = 10    # SQLite's default limit on attached databases
+
+# Length of the DateTime prefix that identifies the shard of a row
+periodKeys = {'year': 4, 'month': 7}
+
+
+class ShardLayout:
+    # dbName is the main database; shards are named after it. searchPath lists further directories
+    # that hold shards (the directory of dbName is searched first)
+    def __init__(self, dbName, period='year', searchPath=None, cacheDir=None):
+        if period not in periodKeys:
+            raise ValueError("Unknown shard period: %s" % period)
+        self.dbName = dbName
+        self.period = period
+        self.keyLength = periodKeys[period]
+        self.searchPath = [os.path.dirname(os.path.abspath(dbName))] + list(searchPath or [])
+        self.cacheDir = cacheDir
+        base, self.extension = os.path.splitext(os.path.basename(dbName))
+        self.pattern = re.compile(re.escape(base) + r'\.(\d{4}(-\d\d)?)' + re.escape(self.extension) + r'(\.gz)?$')
+        self.base = base
+
+    # Shard of a DateTime ('2014-06-01 12:00:00.000000', or a prefix of it)
+    def key(self, dateTime):
+        return str(dateTime)[:self.keyLength]
+
+    # First DateTime after the period of a key
+    def nextKey(self, key):
+        if self.period == 'year':
+            return '%04d' % (int(key) + 1)
+        year, month = int(key[:4]), int(key[5:7])
+        return '%04d-%02d' % (year + month // 12, month % 12 + 1)
+
+    def fileName(self, key):
+        return '%s.%s%s' % (self.base, key, self.extension)
+
+    # Keys of all shards in the search path, in order
+    def keys(self):
+        keys = set()
+        for directory in self.searchPath:
+            try:
+                names = os.listdir(directory)
+            except OSError:
+                continue
+            for name in names:
+                match = self.pattern.match(name)
+                if match and len(match.group(1)) == self.keyLength:
+                    keys.add(match.group(1))
+        return sorted(keys)
+
+    # Keys of the shards holding data between start and end (DateTimes, or None for no limit)
+    def keysBetween(self, start=None, end=None):
+        return [key for key in self.keys()
+                if (start is None or key >= self.key(start)) and (end is None or key <= self.key(end))]
+
+    # File of a shard; gzipped shards are unpacked into the cache directory first
+    def locate(self, key):
+        for directory in self.searchPath:
+            path = os.path.join(directory, self.fileName(key))
+            if os.path.isfile(path):
+                return path
+            if os.path.isfile(path + '.gz'):
+                return self.unpack(path + '.gz')
+        raise IOError("Shard %s not found" % self.fileName(key))
+
+    def unpack(self, gzPath):
+        if self.cacheDir is None:
+            self.cacheDir = tempfile.mkdtemp(prefix='solarstats-shards-')
+        path = os.path.join(self.cacheDir, os.path.basename(gzPath)[:-3])
+        if not os.path.isfile(path) or os.path.getmtime(path) < os.path.getmtime(gzPath):
+            logging.info("Unpacking shard '%s' into '%s'", gzPath, self.cacheDir)
+            with gzip.open(gzPath, 'rb') as source:
+                with open(path + '.tmp', 'wb') as target:
+                    shutil.copyfileobj(source, target)
+            os.rename(path + '.tmp', path)
+        return path
+
+
+# Connection to the main database, with the shards of the given range attached and the view
+# 'inverterdata' over all of them. For reading only
+def connect(layout, start=None, end=None):
+    keys = layout.keysBetween(start, end)
+    if len(keys) > maxAttached:
+        raise ValueError("Range needs %d shards; at most %d can be attached (use select)" % (len(keys), maxAttached))
+    conn = sqlite3.connect(layout.dbName)
+    for i, key in enumerate(keys):
+        conn.execute("ATTACH DATABASE ? AS shard%d" % i, (layout.locate(key),))
+    conn.execute("CREATE TEMP VIEW inverterdata AS SELECT * FROM main.inverterdata" +
+                 ''.join(" UNION ALL SELECT * FROM shard%d.inverterdata" % i for i in range(len(keys))))
+    logging.debug("Opened '%s' with shards %s", layout.dbName, ', '.join(keys) or '(none)')
+    return conn
+
+# Rows of a query on 'inverterdata', run on every shard of the range in turn (oldest first), then on
+# the main database; for queries over more shards than can be attached. Each shard is attached on its
+# own, so a query ordered by DateTime returns its rows in order
+def select(layout, sql, parameters=(), start=None, end=None):
+    for key in layout.keysBetween(start, end):
+        conn = sqlite3.connect(layout.locate(key))
+        try:
+            for row in conn.execute(sql, parameters):
+                yield row
+        finally:
+            conn.close()
+    conn = sqlite3.connect(layout.dbName)
+    try:
+        for row in conn.execute(sql, parameters):
+            yield row
+    finally:
+        conn.close()
+
+# Definition of the inverterdata table, for creating it in schema
+def table_definition(conn, schema):
+    sql = conn.execute("SELECT sql FROM main.sqlite_master WHERE type='table' AND name='inverterdata'").fetchone()[0]
+    return re.sub(r'^CREATE TABLE (IF NOT EXISTS )?inverterdata', 'CREATE TABLE IF NOT EXISTS %s.inverterdata' % schema, sql)
+
+# Move the inverter data of periods before the current one from the main database into their shards,
+# which are made read-only. Rows still waiting to be forwarded (see forwarder) stay until they are
+# sent. Returns {key: rows moved}
+def rotate(layout, conn, now):
+    current = layout.key(now)
+    keys = [row[0] for row in conn.execute("SELECT DISTINCT substr(DateTime, 1, ?) FROM main.inverterdata "
+                                           "WHERE DateTime < ?", (layout.keyLength, current))]
+    hasOutbox = conn.execute("SELECT count(*) FROM main.sqlite_master WHERE type='table' AND name='outbox'").fetchone()[0]
+    waiting = (" AND NOT EXISTS (SELECT 1 FROM main.outbox o WHERE o.Inverter_ID = d.Inverter_ID AND o.DateTime = d.DateTime)"
+               if hasOutbox else "")
+    moved = {}
+    for key in keys:
+        shardFile = os.path.join(os.path.dirname(os.path.abspath(layout.dbName)), layout.fileName(key))
+        if not os.path.isfile(shardFile) and key in layout.keys():
+            # Moved or compressed; late rows stay in the main database, where queries still see them
+            logging.warning("Shard of %s is not in '%s'; keeping its late rows", key, os.path.dirname(shardFile))
+            continue
+        if os.path.isfile(shardFile):
+            os.chmod(shardFile, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IROTH)    # Late data for an old period
+        conn.execute("ATTACH DATABASE ? AS shard", (shardFile,))
+        try:
+            conn.execute(table_definition(conn, 'shard'))
+            period = (key, layout.nextKey(key))
+            conn.execute("INSERT OR IGNORE INTO shard.inverterdata SELECT * FROM main.inverterdata d "
+                         "WHERE DateTime >= ? AND DateTime < ?" + waiting, period)
+            count = conn.execute("DELETE FROM main.inverterdata WHERE rowid IN (SELECT rowid FROM main.inverterdata d "
+                                 "WHERE DateTime >= ? AND DateTime < ?" + waiting + ")", period).rowcount
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            conn.execute("DETACH DATABASE shard")
+        os.chmod(shardFile, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        moved[key] = count
+        logging.info("Moved %d rows of %s into shard '%s'", count, key, shardFile)
+    return moved
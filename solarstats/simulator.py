@@ -0,0 +1,258 @@
+# Simulated inverters on simulated serial ports, for running collection cycles (tests, profiling)
+# without the hardware. The simulated inverters answer the same requests as the real ones, with
+# valid CRCs, so the full decoding path is exercised. Captured traffic (see frametrace) can be
+# replayed through the same ports. SimulatedGateway puts simulated inverters behind a TCP gateway
+# (see transport)
+import select   # Requests that arrive together (gateway)
+import SocketServer # Simulated Ethernet gateway
+import sqlite3  # Simulator database
+import struct   # Register encoding
+import time     # Simulated response latency
+
+import blacklinesolar3000, frametrace, mastervoltsoladin600
+
+
+class SimulatedBlackLineSolar:
+    # Input register values, in engineering units (scaled as in BlackLineSolar.scaleFactors)
+    values = {'VoltsPV1': 312.5, 'VoltsPV2': 0.0, 'CurrentPV1': 4.2, 'CurrentPV2': 0.0, 'VoltsAC1': 231.4,
+              'VoltsAC2': 0.0, 'VoltsAC3': 0.0, 'CurrentAC1': 5.6, 'CurrentAC2': 0.0, 'CurrentAC3': 0.0,
+              'FrequencyAC': 50.02, 'PowerAC': 1287.0, 'EnergyToday': 6.4, 'EnergyTotal': 2650.3,
+              'MinToday': 412, 'HrsTotal': 4096, 'Temperature': 43.5, 'Iac-Shift': 0, 'DCI': 0,
+              'Status1': 0, 'Status2': 1}
+
+    def __init__(self, slaveAddress='02', values=None):
+        self.bls = blacklinesolar3000.BlackLineSolar()
+        self.slaveAddress = slaveAddress.decode('hex')
+        self.values = dict(self.values, **(values or {}))
+
+    # Register contents; double word values are split as the collector decodes them (high word 0)
+    def register(self, address):
+        name = self.bls.portContents.get(address, 'blank')
+        if name in ('blank', 'unknown'):
+            return 0
+        if self.bls.portContents.get(address + 1) == name:
+            return 0
+        return int(round(self.values[name] * self.bls.scaleFactors[name])) & 0xFFFF
+
+    def respond(self, request):
+        if len(request) != 8 or request[0] != self.slaveAddress or request[1] != self.bls.read_input_register:
+            return ''
+        if self.bls.calculateModbusCrc(request[:6]) != request[6:]:
+            return ''
+        start, count = struct.unpack('>HH', request[2:6])
+        data = ''.join(struct.pack('>H', self.register(address)) for address in range(start, start + count))
+        response = request[0:2] + chr(len(data)) + data
+        return response + self.bls.calculateModbusCrc(response)
+
+
+class SimulatedSoladin:
+    # Data of the stats (0xB6), max power (0xB9) and history (0x9A) responses, after the function code
+    # (see the Soladin decoding notes in mastervoltsoladin600)
+    responses = {'\xB6': 'F3 00 00 04 03 35 00 8A 13 F4 00 00 00 24 00 90 0B 00 1F DB BC 01 00 00 00',
+                 '\xB9': 'F3 00 00 20 00 00 00 1B 00 21 00 22 00 00 00 E5 02 7E 48 36 00 00 00 00 00',
+                 '\x9A': '54 05',
+                 '\xC1': 'F3 00 00'}
+
+    def __init__(self, slaveAddress='11 00'):
+        self.mv = mastervoltsoladin600.MasterVolt()
+        self.slaveAddress = self.mv.su.hexify(slaveAddress)
+        self.responses = dict((fc, self.mv.su.hexify(data)) for fc, data in self.responses.items())
+
+    def respond(self, request):
+        if len(request) < 9 or self.mv.calcCRC(request) != request[-1]:
+            return ''
+        fc = request[4]
+        if fc not in self.responses or (request[0:2] != self.slaveAddress and fc != self.mv.mvCmd_probe):
+            return ''
+        # Reply to the sender, from this inverter
+        response = request[2:4] + self.slaveAddress + fc + self.responses[fc] + '\x00'
+        return response[:-1] + self.mv.calcCRC(response)
+
+
+class SimulatedPort:
+    # Stands in for serial.Serial: each request written is answered by device, and the answer is read
+    # back one character at a time. latency (seconds) is spent before the first character is returned
+    def __init__(self, device, port='simulated', latency=0.0):
+        self.device = device
+        self.port = port
+        self.latency = latency
+        self._pending = ''
+        self._open = True
+
+    def __str__(self):
+        return "SimulatedPort(%s, %s)" % (self.port, self.device.__class__.__name__)
+
+    def write(self, data):
+        self._pending = self.device.respond(data)
+        self._first = True
+        return len(data)
+
+    def read(self, size=1):
+        if self._pending and self._first and self.latency:
+            time.sleep(self.latency)
+        self._first = False
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+    def isOpen(self):
+        return self._open
+
+    def close(self):
+        self._open = False
+
+
+class ReplayClock:
+    # Maps capture time stamps onto the wall clock, starting at the first captured frame
+    def __init__(self, firstTime):
+        self.offset = time.time() - firstTime
+
+    def waitUntil(self, captureTime):
+        delay = captureTime + self.offset - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class ReplayPort(SimulatedPort):
+    # Answers each request with the response that was captured for it. exchanges is a list of
+    # (request time, request, response time, response); with a clock (ReplayClock) the responses
+    # arrive at their captured times, otherwise immediately
+    def __init__(self, port, exchanges, clock=None):
+        SimulatedPort.__init__(self, None, port)
+        self.exchanges = exchanges
+        self.clock = clock
+        self.position = 0
+        self.mismatches = 0     # Requests that differ from the captured request
+        self._rxTime = None
+
+    def __str__(self):
+        return "ReplayPort(%s, %d/%d)" % (self.port, self.position, len(self.exchanges))
+
+    def remaining(self):
+        return len(self.exchanges) - self.position
+
+    def write(self, data):
+        if self.position >= len(self.exchanges):
+            self._pending = ''
+            return len(data)
+        txTime, request, self._rxTime, self._pending = self.exchanges[self.position]
+        self.position += 1
+        if data != request:
+            self.mismatches += 1
+        self._first = True
+        return len(data)
+
+    def read(self, size=1):
+        if self._first and self.clock is not None and self._rxTime is not None:
+            self.clock.waitUntil(self._rxTime)
+        return SimulatedPort.read(self, size)
+
+
+class SimulatedGatewayHandler(SocketServer.BaseRequestHandler):
+    def handle(self):
+        server = self.server
+        buffered = ''
+        while True:
+            try:
+                data = self.request.recv(4096)
+            except IOError:
+                return
+            if not data:
+                return
+            buffered += data
+            # Take in everything that was sent together, so pipelined requests can be answered out of order
+            while select.select([self.request], [], [], 0.01)[0]:
+                data = self.request.recv(4096)
+                if not data:
+                    break
+                buffered += data
+            requests, buffered = server.split(buffered)
+            if server.reorder:
+                requests.reverse()
+            if server.latency:
+                time.sleep(server.latency)
+            self.request.sendall(''.join(server.respond(request) for request in requests))
+
+
+class SimulatedGateway(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    # Stand-in for an Ethernet gateway with simulated BlackLine Solar inverters behind it, speaking
+    # Modbus TCP (or RTU over TCP, with rtu=True). With reorder, requests that arrive together are
+    # answered last first; latency (seconds) is spent before answering
+    daemon_threads = True
+    allow_reuse_address = True
+    mbapHeader = struct.Struct('>HHHB')
+
+    def __init__(self, address, devices, rtu=False, reorder=False, latency=0.0):
+        SocketServer.TCPServer.__init__(self, address, SimulatedGatewayHandler)
+        self.devices = dict((ord(device.slaveAddress), device) for device in devices)
+        self.rtu = rtu
+        self.reorder = reorder
+        self.latency = latency
+        self.requests = 0
+
+    # Complete requests at the start of data, and the rest
+    def split(self, data):
+        requests = []
+        while True:
+            if self.rtu:
+                size = 8    # Read and single write requests
+            elif len(data) >= self.mbapHeader.size:
+                size = 6 + self.mbapHeader.unpack(data[:self.mbapHeader.size])[2]
+            else:
+                break
+            if len(data) < size:
+                break
+            requests.append(data[:size])
+            data = data[size:]
+        return requests, data
+
+    def respond(self, request):
+        self.requests += 1
+        if self.rtu:
+            device = self.devices.get(ord(request[0]))
+            return device.respond(request) if device else ''
+        transactionId, protocol, length, unit = self.mbapHeader.unpack(request[:self.mbapHeader.size])
+        pdu = request[self.mbapHeader.size:]
+        device = self.devices.get(unit)
+        response = ''
+        if device is not None:
+            rtuRequest = chr(unit) + pdu
+            response = device.respond(rtuRequest + device.bls.calculateModbusCrc(rtuRequest))
+        if response:
+            pdu = response[1:-2]
+        else:
+            pdu = chr(ord(pdu[0]) | 0x80) + '\x0B'   # Gateway target device failed to respond
+        return self.mbapHeader.pack(transactionId, 0, len(pdu) + 1, unit) + pdu
+
+
+# Replay ports for the frames of a capture (see frametrace.read_capture), keyed by port name. Each
+# request is paired with the response that followed it on the same port
+def replay_ports(records, realTime=False):
+    clock = ReplayClock(records[0][0]) if realTime and records else None
+    exchanges = {}
+    for t, direction, port, frame in records:
+        portExchanges = exchanges.setdefault(port, [])
+        if direction == frametrace.TX:
+            portExchanges.append([t, frame, None, ''])
+        elif portExchanges and portExchanges[-1][2] is None:
+            portExchanges[-1][2:] = [t, frame]
+    return dict((port, ReplayPort(port, [tuple(e) for e in portExchanges], clock))
+                for port, portExchanges in exchanges.items())
+
+# The ports of the original setup, keyed by device name
+def simulated_ports(latency=0.0):
+    return {'/dev/ttyUSB0': SimulatedPort(SimulatedBlackLineSolar(), '/dev/ttyUSB0', latency),
+            '/dev/ttyUSB1': SimulatedPort(SimulatedSoladin(), '/dev/ttyUSB1', latency)}
+
+# Create a database (from the SQL init file) with the simulated inverters registered
+def create_database(dbName, initFile):
+    conn = sqlite3.connect(dbName)
+    try:
+        with open(initFile, 'r') as f:
+            conn.executescript(f.read())
+        conn.execute("INSERT OR IGNORE INTO invertertype VALUES (1, 'BlackLine Solar', '3000', '02', 'sim', 3000)")
+        conn.execute("INSERT OR IGNORE INTO invertertype VALUES (2, 'Soladin', '600', '11 00', 'sim', 600)")
+        conn.execute("INSERT OR IGNORE INTO inverter VALUES (1, 'SIM-BLS', 1)")
+        conn.execute("INSERT OR IGNORE INTO inverter VALUES (2, 'SIM-SOL', 2)")
+        conn.commit()
+    finally:
+        conn.close()
@@ -8,21 +8,25 @@
 
 # Import Python modules
 import argparse, time, datetime, logging    # Command-line arguments; time conversions; general logging
-import os, sys                              # System utils
-import fnmatch                              # File matching
-import subprocess                           # For calling rrd / sqlite db creation
-import shutil, string
+import os, sys, signal                      # System utils
 
 # Specific tools
-import serial   # Serial port communication
 import sqlite3  # Database connection
 
 # Import custom modules
-import blacklinesolar, mastervolt, solarutils
+import frametrace, graphdefs, inverters, linkstats, solarutils
+from timing import timings
+
+# Everything that only a polling run (or a single mode) needs is imported where it is used: pyserial,
+# the inverter drivers (see load_drivers), subprocess, shutil, the live feed (sockets, threads) and the
+# HTML page. The other modes (--export, --link-stats, --show-trace, --help, ...) start without them;
+# resources/startup_bench.py measures the startup time of these modes
 
 
 # Program data
 logFile        = "SolarStats.log"
+logLevel       = logging.DEBUG  # Frames are only formatted for the log at INFO level and below
+traceFile      = 'SolarStats.trace'     # Protocol trace, written on errors and on SIGUSR1 (None disables tracing)
 sqliteInitFile = 'SolarStatsInit.sql'
 sqliteDbName   = 'SolarStats.sqlt'
 rrdDbBLS      = 'SolarStats_BLS.rrd'
@@ -30,24 +34,80 @@ rrdDbSol      = 'SolarStats_Sol.rrd'
 workingDir     = '/home/pi/'
 rrdArchDir     = 'rrdGraphs/'
 webDir         = '/var/www/'
+blsPort        = '/dev/ttyUSB0'   # BlackLine Solar: serial port, or gateway as 'tcp://host[:502]' (Modbus TCP) or 'rtu+tcp://host:port'
+solPort        = '/dev/ttyUSB1'   # Soladin: serial port
 step           = 300        # Time (in seconds) between data requests; used in RRDtool, set as cron interval
 retries        = 3          # Number of times to retry (on failure) before giving up
+retryDelay     = 5          # Time (in seconds) to wait before retrying
+livePort       = 8301       # Local UDP port on which the status server receives live samples from the collector
+serverStep     = 300        # Maximum age (in seconds) of graphs served by the status server before they are redrawn
+metricsFile    = 'SolarStats.prom'          # Stage timings in Prometheus text format (None disables timing)
+timingStateFile = 'SolarStats.timing.json'  # Stage timing histograms, accumulated over runs
+htmlTitle      = 'Home PV'
+htmlFooter     = 'The Dilapidation Crew - %Y'    # strftime directives are expanded
+profileDir     = 'profile/' # Output of --profile: pstats and collapsed stacks per cycle
+rrdStoreExt    = '.rrs'     # Extension of the built-in round-robin store, used when rrdtool is not installed
+forwardUrl     = None       # Central ingestion server, e.g. 'http://aggregator:8302/ingest' (None disables forwarding)
+siteName       = os.uname()[1]              # Name of this site at the ingestion server
+ingestDbName   = 'SolarStatsCentral.sqlt'   # Shared database of the ingestion server (--ingest)
+shardPeriod    = None       # Move the inverter data of earlier years ('year') or months ('month') to read-only shards (None disables sharding)
+anomalyStateFile = 'SolarStats.anomaly.json'   # Running statistics of the anomaly detector (None disables detection)
+shardDirs      = []         # Further directories holding shards (moved off the SD card, or gzipped)
+siteLatitude   = 52.0       # Location of the PV arrays (degrees north), for their clear-sky output
+siteLongitude  = 5.0        # Degrees east; tilt, azimuth and kWp of the arrays are in the pvarray table
+clearskyDir    = None       # Daily clear-sky output curves, e.g. 'clearsky/'; enables the performance ratio in each cycle (needs NumPy)
+nightStateFile = 'SolarStats.night.json'    # Sleeping inverters, probed instead of polled at night (None polls all night)
+recentHours    = 48         # Hours of samples kept in memory by --supervise and --serve (0 disables)
 
 def parse_args():
     """ Parse command line arguments (http://docs.python.org/2/library/argparse.html#the-add-argument-method) """
     parser = argparse.ArgumentParser(description='Read and store data from the inverters attached to the device (currently the BlackLine Solar 3000 and MasterVolt Soladin 600)')
     parser.add_argument('-c', '--create', action='store_true', help='Creates and initialises the SQLite and RRDtool databases')
+    parser.add_argument('-p', '--provision', action='store_true', help='Creates the RRDtool databases of all inverters in the SQLite database')
     parser.add_argument('-g', '--graph', action='store_true', help='Draws the RRDtool graphs')
     parser.add_argument('-e', '--export', metavar='inverterID', help='Export the SQLite inverter power/ data of the selected inverter')
+    parser.add_argument('-l', '--link-stats', action='store_true', help='Show the serial link statistics (frames, errors, retries, latency) per inverter')
+    parser.add_argument('-i', '--import-dump', metavar='dumpFile', help='Import an RRDtool XML dump (rrdtool dump <file>.rrd) into the built-in round-robin store')
+    parser.add_argument('-s', '--serve', metavar='port', type=int, help='Run the HTTP status server (HTML page, JSON API and graphs) on the given port')
+    parser.add_argument('--profile', metavar='cycles', type=int, help='Run a number of collection cycles under a profiler, writing the profiles to ' + profileDir)
+    parser.add_argument('--profiler', choices=['cprofile', 'sample'], default='cprofile', help='Profiler used by --profile: cProfile (default), or a stack sampler with less overhead')
+    parser.add_argument('--simulate', action='store_true', help='Poll simulated inverters instead of the serial ports, using a scratch database and web directory')
+    parser.add_argument('--capture', metavar='captureFile', help='Append all frames sent to and received from the inverters to a capture file')
+    parser.add_argument('--replay', metavar='captureFile', help='Replay a capture file through the decoding and storage path (in a scratch directory), as fast as possible')
+    parser.add_argument('--real-time', action='store_true', help='Replay with the captured timing')
+    parser.add_argument('--show-trace', metavar='traceFile', nargs='?', const=traceFile, help='Print the frames in a protocol trace (default: ' + str(traceFile) + ')')
+    parser.add_argument('--supervise', action='store_true', help='Poll continuously, with one process per port and one process writing the databases (instead of one cycle per cron run)')
+    parser.add_argument('--forward', action='store_true', help='Send the samples queued for the ingestion server now')
+    parser.add_argument('--rotate-shards', action='store_true', help='Move the inverter data of earlier periods into their shards now (done every night)')
+    parser.add_argument('--performance', metavar='days', type=int, help='Print the daily yield of every inverter against its clear-sky yield, for the last days')
+    parser.add_argument('--ingest', metavar='port', type=int, help='Run the central ingestion server on the given port, storing the samples of all sites in ' + ingestDbName)
     parser.add_argument('-t', '--test', action='store_true', help='Run the testing function (beta!)')
     args = parser.parse_args()
+    if args.capture and args.supervise:
+        parser.error('--capture cannot be used with --supervise (the workers would write the same file)')
 
     logging.info("Args parsed: %s", args)
     return args
 
-# Connection details for the serial port; opens the port immediately
+# Simulated serial ports by device name (see simulator); used instead of the real ports when set
+serialPorts = None
+
+# Connection details for the serial port; opens the port immediately. Ports given as a URL are
+# Ethernet gateways (see transport)
 # http://tubifex.nl/2013/04/read-mastervolt-soladin-600-with-python-pyserial/
 def open_serialport(portID):
+    if serialPorts is not None:
+        return serialPorts.get(portID)
+    if '://' in portID:
+        import transport
+        try:
+            serPort = transport.open_port(portID)
+        except ValueError as inst:
+            logging.error('Error opening port: %s', inst.args[0])
+            return None
+        logging.info("Using gateway %s", str(serPort))
+        return serPort
+    import serial   # Serial port communication
     try:
         serPort = serial.Serial(
             port=portID,
@@ -66,33 +126,110 @@ def open_serialport(portID):
 
 # Send a hexadecimal command to a given port
 def send_command(port, command):
-    logging.info("Sending command to serial port: %s ", printhex(command))
+    logging.info("Sending command to serial port: %s ", solarutils.LazyHex(command))
+    frameTrace.record(frametrace.TX, port.port, command)
     port.write(command)
 
-# Read characters from a given port until no more are received
-def receive_command(port):
+# Read characters from a given port until no more are received. If link (a linkstats.LinkStats) is
+# given, the time until the first character arrives is recorded as the response latency
+def receive_command(port, link=None):
     data = []
+    start = time.time()
     ch = port.read()
+    if link is not None and len(ch) != 0:
+        link.observeLatency(time.time() - start)
     while len(ch) != 0:
         data.append(ch)
         ch = port.read()
 
+    frameTrace.record(frametrace.RX, port.port, ''.join(data))
     if len(data) > 0:
-        logging.info("Received: %s [len = %d]", printhex(data), len(data))
+        logging.info("Received: %s [len = %d]", solarutils.LazyHex(data), len(data))
     else:
         logging.warning("Serial port command requested, but none received")
 
     return data
 
+# Graphs drawn every hour: (image name, period in seconds, title)
+graphPeriods   = [('solarStats_last24hrs.png', 60*60*24, 'Last 24 hours'),
+                  ('solarStats_last7days.png', 60*60*24*7, 'Last 7 days'),
+                  ('solarStats_last30days.png', 60*60*24*30, 'Last 30 days'),
+                  ('solarStats_lastyear.png', 60*60*24*365, 'Last year')]
+
+# Inverter protocol instances; the drivers are created by load_drivers, when an inverter is polled
+bls = None
+sol = None
+su = solarutils.SolarUtils()
+printhex = su.printhex
+hex2int = su.hex2int
+
+def load_drivers():
+    global bls, sol
+    if bls is None:
+        import blacklinesolar3000, mastervoltsoladin600
+        bls = blacklinesolar3000.BlackLineSolar()
+        sol = mastervoltsoladin600.MasterVolt()
+
+# Raw frames of the most recent requests (see frametrace)
+frameTrace = frametrace.FrameTrace(enabled=traceFile is not None)
+
+# Write the protocol trace to traceFile
+def dump_trace(reason):
+    if not frameTrace.enabled or frameTrace.count == 0:
+        return
+    try:
+        frameTrace.dump(traceFile, reason)
+    except (IOError, OSError) as inst:
+        logging.error("Cannot write protocol trace '%s': %s", traceFile, inst.args[-1])
+
+# Print the frames of a protocol trace
+def show_trace(fileName):
+    try:
+        head, records = frametrace.read_dump(fileName)
+    except (IOError, ValueError) as inst:
+        print "Cannot read protocol trace '%s': %s" % (fileName, inst)
+        sys.exit(1)
+    print "%d frames (%d older frames dropped), written %s: %s" % (head['frames'], head['dropped'],
+        time.ctime(head['time']), head['reason'] or 'on request')
+    for line in frametrace.format_records(records):
+        print line
+
+# The status page (see htmlpage); created when first rendered
+statusPage = None
+def status_page():
+    global statusPage
+    if statusPage is None:
+        import htmlpage
+        statusPage = htmlpage.StatusPage(title=htmlTitle + ' measurements', heading=htmlTitle, footer=htmlFooter)
+    return statusPage
+
+# The inverters in the database (the two legacy ones when it has none); loaded once per run
+siteInverters = None
+def site_inverters():
+    global siteInverters
+    if siteInverters is None:
+        try:
+            siteInverters = inverters.load_inverters(sqliteDbName) or inverters.legacy_inverters()
+        except sqlite3.Error as inst:
+            logging.error("Cannot load inverters from '%s': %s", sqliteDbName, inst.args[0])
+            return inverters.legacy_inverters()
+    return siteInverters
+
+# Graph definition for all inverters in the database; compiled once per run (see graphdefs)
+graphDefinition = None
+def graph_definition():
+    global graphDefinition
+    if graphDefinition is None:
+        graphDefinition = graphdefs.GraphDefinition(site_inverters())
+    return graphDefinition
+
 # Generate RRD graphs. Lifted from solget.sh and http://sourceforge.net/apps/mediawiki/linknx/index.php?title=How_to_create_graphs_with_RRDTool
 def rrd_graph(imgName, startTime, endTime, imgTitle):
+    import subprocess
 
     # Create a RRDtool graph, using the Linux command
     try:
-        if (endTime - startTime) < 60*60*24*7*2:    # 24hr / 7 day graphs
-            rrdResult = subprocess.call(['rrdtool', 'graph', str(imgName), '--start', str(startTime), '--end', str(endTime), '--imgformat', 'PNG', '--width', str(720), '--height', str(250), '--title', str(imgTitle), '--units-exponent', str(0), '--vertical-label', 'Solar Power (Watt)', '--right-axis-label', 'Daily yield (kW)', '--right-axis', '0.005:0', '--right-axis-format', '%1.0lf', 'DEF:bls=' + rrdDbBLS + ':bls3000_pow:LAST', 'DEF:bls_nrg=' + rrdDbBLS + ':bls3000_nrg:LAST', 'DEF:sol=' + rrdDbSol + ':sol600_pow:LAST', 'DEF:sol_nrg=' + rrdDbSol + ':sol600_nrg:LAST', 'VDEF:bls_avg=bls,AVERAGE', 'VDEF:bls_max=bls,MAXIMUM', 'VDEF:bls_last=bls,LAST', 'VDEF:sol_avg=sol,AVERAGE', 'VDEF:sol_max=sol,MAXIMUM', 'VDEF:sol_last=sol,LAST', 'VDEF:bls_nrg_max=bls_nrg,MAXIMUM', 'VDEF:sol_nrg_max=sol_nrg,MAXIMUM', 'CDEF:scaled_bls_nrg=bls_nrg,200,*',  'CDEF:scaled_sol_nrg=sol_nrg,200,*', 'LINE1:bls#0000FF:Actual (BLS)\\t', 'GPRINT:bls_last:%2.1lf W\\t\\t', 'LINE1:sol#FF0066:Actual (Sol)\\t', 'GPRINT:sol_last:%2.1lf W\\n', 'LINE1:bls_avg#FF6600:Average (BLS)\\t', 'GPRINT:bls_avg:%2.1lf W\\t\\t', 'LINE1:sol_avg#FF6600:Average (Sol)\\t:dashes', 'GPRINT:sol_avg:%2.1lf W\\n', 'LINE1:bls_max#00CC00:Maximum (BLS)\\t', 'GPRINT:bls_max:%2.1lf W\\t', 'LINE1:sol_max#00CC00:Maximum (Sol)\\t:dashes', 'GPRINT:sol_max:%2.1lf W\\n', 'LINE1:scaled_bls_nrg#00CCFF:Yield (BLS)\\t', 'GPRINT:bls_nrg_max:%2.1lf kW\\t\\t', 'LINE1:scaled_sol_nrg#FF66FF:Yield (Sol)\\t', 'GPRINT:sol_nrg_max:%2.1lf kW\\n', 'COMMENT:Generated on ' + str(time.strftime("%B %d, %Y (%H\:%M)"))])
-        else:
-            rrdResult = subprocess.call(['rrdtool', 'graph', str(imgName), '--start', str(startTime), '--end', str(endTime), '--imgformat', 'PNG', '--width', str(720), '--height', str(250), '--title', str(imgTitle), '--units-exponent', str(0), '--vertical-label', 'Solar Power (Watt)', '--right-axis-label', 'Total yield (kW)', '--right-axis', '1:0', '--right-axis-format', '%1.0lf', 'DEF:bls=' + rrdDbBLS + ':bls3000_pow:LAST', 'DEF:bls_tot=' + rrdDbBLS + ':bls3000_tot:LAST', 'DEF:sol=' + rrdDbSol + ':sol600_pow:LAST', 'DEF:sol_tot=' + rrdDbSol + ':sol600_tot:LAST', 'VDEF:bls_avg=bls,AVERAGE', 'VDEF:bls_max=bls,MAXIMUM', 'VDEF:bls_last=bls,LAST', 'VDEF:sol_avg=sol,AVERAGE', 'VDEF:sol_max=sol,MAXIMUM', 'VDEF:sol_last=sol,LAST', 'VDEF:bls_tot_max=bls_tot,MAXIMUM', 'VDEF:sol_tot_max=sol_tot,MAXIMUM', 'CDEF:scaled_bls_tot=bls_tot,1,*',  'CDEF:scaled_sol_tot=sol_tot,1,*', 'LINE1:bls#0000FF:Actual (BLS)\\t', 'GPRINT:bls_last:%2.1lf W\\t\\t', 'LINE1:sol#FF0066:Actual (Sol)\\t', 'GPRINT:sol_last:%2.1lf W\\n', 'LINE1:bls_avg#FF6600:Average (BLS)\\t', 'GPRINT:bls_avg:%2.1lf W\\t\\t', 'LINE1:sol_avg#FF6600:Average (Sol)\\t:dashes', 'GPRINT:sol_avg:%2.1lf W\\n', 'LINE1:bls_max#00CC00:Maximum (BLS)\\t', 'GPRINT:bls_max:%2.1lf W\\t', 'LINE1:sol_max#00CC00:Maximum (Sol)\\t:dashes', 'GPRINT:sol_max:%2.1lf W\\n', 'LINE1:scaled_bls_tot#00CCFF:Yield (BLS)\\t', 'GPRINT:bls_tot_max:%2.1lf kW\\t\\t', 'LINE1:scaled_sol_tot#FF66FF:Yield (Sol)\\t', 'GPRINT:sol_tot_max:%2.1lf kW\\n', 'COMMENT:Generated on ' + str(time.strftime("%B %d, %Y (%H\:%M)"))])
+        rrdResult = subprocess.call(['rrdtool'] + graph_definition().args(imgName, startTime, endTime, imgTitle))
         logging.debug("Graph %s created; exit code is %s", imgName, rrdResult)
     except subprocess.CalledProcessError as inst:
         logging.error('Error creating RRD graph: %s', inst.args[0])
@@ -105,6 +242,96 @@ def rrd_graph(imgName, startTime, endTime, imgTitle):
         logging.error("Cannot move graph to '%s': %s", webDir, inst.args[0])
         print "%s : Cannot move graph!" % (datetime.datetime.now())
 
+# The rrdtool binary is optional; without it the built-in round-robin store (rrdstore) is used
+def rrdtool_available():
+    from distutils.spawn import find_executable
+    return find_executable('rrdtool') is not None
+
+def rrd_store_name(rrdDb):
+    return os.path.splitext(rrdDb)[0] + rrdStoreExt
+
+# Write results to a RRD db -- update using time of 'now' (N). Lifted from solget.sh
+def rrd_update(rrdDb, rrdWrite):
+    rrd_update_many(rrdDb, [(None, rrdWrite)])
+
+# Write a number of results to a RRD db at once; updates is a list of (Unix time, results) in time
+# order, a time of None being 'now'
+def rrd_update_many(rrdDb, updates):
+    rrdWrite = ' '.join(values for t, values in updates)
+    if rrdtool_available():
+        import subprocess
+        try:
+            rrdResult = subprocess.call(['rrdtool', 'update', rrdDb] +
+                                        ['%s:%s' % ('N' if t is None else int(t), values) for t, values in updates])
+            logging.debug("Data (%s) committed to RRD database; exit code is %s", rrdWrite, rrdResult)
+        except subprocess.CalledProcessError as inst:
+            logging.error('Error writing data to RRD: %s', inst.args[0])
+        return
+
+    import rrdstore
+    storeName = rrd_store_name(rrdDb)
+    if not os.path.isfile(storeName):
+        logging.error("RRDtool not found and no round-robin store '%s' exists (run with --create)", storeName)
+        return
+    try:
+        store = rrdstore.RoundRobinStore(storeName)
+        for t, values in updates:
+            store.update(time.time() if t is None else t, values.split(':'))
+        store.close()
+        logging.debug("Data (%s) committed to round-robin store %s", rrdWrite, storeName)
+    except ValueError as inst:
+        logging.error('Error writing data to round-robin store: %s', inst.args[0])
+
+# Convert an 'rrdtool dump' XML file into a round-robin store next to it
+def import_dump(dumpFile):
+    import rrdstore
+    storeName = rrd_store_name(dumpFile)
+    store = rrdstore.RoundRobinStore.fromDump(dumpFile, storeName)
+    print "Imported '%s' into '%s' (data sources: %s)" % (dumpFile, storeName, ', '.join(store.dataSources))
+    store.close()
+
+# Draw a single graph from graphPeriods, ending now (used for on-demand rendering)
+def render_graph(imgName):
+    for name, period, imgTitle in graphPeriods:
+        if name == imgName:
+            epochNow = int(time.time())
+            rrd_graph(imgName, epochNow - period, epochNow, imgTitle)
+
+# Run the embedded HTTP status server (see statusserver); graphs are drawn when requested
+def serve(port):
+    import livefeed, statusserver
+    samples = statusserver.LatestSamples(sqliteDbName, site_inverters(), maxAge=2*step)
+    hub = livefeed.FanoutHub()
+    recent = keep_recent_samples()
+    receiver = livefeed.SampleReceiver(('127.0.0.1', livePort), hub, recent)
+    receiver.start()
+    try:
+        import downsample
+        downsampler = downsample.Downsampler(connect_inverterdata, select=select_inverterdata)
+    except ImportError:
+        logging.warning("NumPy is not installed; no downsampled series (/api/series)")
+        downsampler = None
+    server = statusserver.StatusServer(('', port), samples, status_page(), webDir, renderGraph=render_graph,
+                                       graphMaxAge=serverStep, uptime=os_uptime, hub=hub,
+                                       metricsFile=os.path.abspath(metricsFile) if metricsFile else None,
+                                       downsampler=downsampler, recent=recent)
+    logging.info("Status server listening on port %d", port)
+    print "Status server listening on port %d" % port
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+        receiver.close()
+
+# Send a decoded sample to the live feed of a running status server (no-op if none is running)
+liveSender = None
+def publish_sample(results):
+    global liveSender
+    if liveSender is None:
+        import livefeed
+        liveSender = livefeed.SampleSender(('127.0.0.1', livePort))
+    liveSender.send(results)
+
 def os_uptime():
     with open('/proc/uptime', 'r') as f:
         uptime_seconds = float(f.readline().split()[0])
@@ -113,72 +340,92 @@ def os_uptime():
     return uptime_string
 
 # Generate HTML page. Lifted from solget.sh
-# The kWh->CO2 conversion factor (0.44548) is taken from http://www.carbontrust.com/media/18223/ctl153_conversion_factors.pdf
-def create_html(iv1, iv2):
+# inverterResults is a list of result dicts (one per inverter, with its database ID in 'id'). The
+# page is only written when its content changed since the last run (see htmlpage.StatusPage.render)
+def create_html(inverterResults):
+    import shutil
     tempFile = 'index.tmp'
+    htmlDest = os.path.join(webDir, 'index.html')
+    digestFile = htmlDest + '.sha1'
+
+    # Inverters that are off show their last known values
+    ivs = []
+    for i, iv in enumerate(inverterResults):
+        if not iv['success']:
+            ivId = iv.get('id', i + 1)
+            iv = dict(iv)
+            iv['MinToday'] = int(last_value(ivId, "MinToday", True))
+            iv['EnergyToday'] = last_value(ivId, "EnergyToday", True)
+            iv['HrsTotal'] = last_value(ivId, "HrsTotal", False)
+            iv['EnergyTotal'] = last_value(ivId, "EnergyTotal", False)
+        ivs.append(iv)
 
-    uptime = os_uptime()
-    ivFirstHeader = '<TR><TD>PV Power</TD><TD>PV Voltage</TD><TD>PV Current</TD><TD>Temperature</TD><TD>Net Frequency</TD><TD>Net Voltage</TD></TR>\n'
-    ivSecondHeader = '<TR><TD colspan="3"><CENTER>Today</CENTER></TD><TD colspan="3"><CENTER>Total</CENTER></TD></TR>\n'
-    ivSecondHeader += '<TR><TD>Time</TD><TD>Delivery</TD><TD>CO&#8322; reduction</TD><TD>Time</TD><TD>Delivery</TD><TD>CO&#8322; reduction</TD></TR>\n'
+    try:
+        links = linkstats.page_rows(sqliteDbName, site_inverters())
+    except sqlite3.Error as inst:
+        logging.error("Cannot read link statistics: %s", inst.args[0])
+        links = None
+    html, digest = status_page().render(ivs, time.strftime('%a %b %d %H:%M %Y'), os_uptime(), links)
+    try:
+        with open(digestFile, 'r') as f:
+            if f.read().strip() == digest and os.path.isfile(htmlDest):
+                logging.debug("HTML page '%s' unchanged, not rewriting", htmlDest)
+                return
+    except IOError:
+        pass
 
-    htmlDest = os.path.join(webDir, 'index.html')
     logging.debug("Creating HTML code in '%s'", tempFile)
     with open(tempFile, 'w') as htmlFile:
-        htmlFile.write('<HTML><HEAD><TITLE>Home PV measurements</TITLE></HEAD>\n')
-        htmlFile.write('<BODY BGCOLOR="000066" TEXT="#E8EEFD" LINK="#FFFFFF" VLINK="#C6FDF4" ALINK="#0BBFFF" BACKGROUND="$BGIMG">\n')
-        htmlFile.write('<TABLE BORDER=1 CELLPADDING=1 CELLSPACING=2 BGCOLOR="#1A689D" BORDERCOLOR="#0DD3EA" ALIGN="center">\n')
-        htmlFile.write('<TR><TD colspan="6"><CENTER><font size=5>Home PV</font><BR><font size=-1> Last update: ' + str(time.asctime()) + '</font></CENTER></TD><TR>\n')
-        htmlFile.write('<TR><TD colspan="6"><CENTER>.</CENTER></TD></TR>\n')
-
-        i = 1
-        for iv in (iv1, iv2):
-            htmlFile.write('<TR><TD>.</TD><TD colspan="4"><CENTER><font size=4>' + iv['name'] + '<BR>')
-            if iv['success']:
-                htmlFile.write('<font size=-1>' + iv['statusText'] + '</CENTER></FONT></TD><TD>.</TD><TR>\n')
-            else:
-                htmlFile.write('<FONT size=-1 COLOR=red>Inverter off (using last working values)</CENTER></FONT></TD><TD>.</TD><TR>\n')
-            if iv['success']:
-                htmlFile.write(ivFirstHeader)
-                htmlFile.write('<TR><TD>' + str(iv['PowerAC']) + ' W</TD><TD>' + str(iv['VoltsPV1']) + ' V</TD><TD>' + str(iv['CurrentPV1']) + ' A</TD><TD>' + str(iv['Temperature']) + ' &deg;C</TD><TD>' + str(iv['FrequencyAC']) + ' Hz</TD><TD>' + str(iv['VoltsAC1']) + ' V</TD></TR>\n')
-            htmlFile.write(ivSecondHeader)
-            if iv['success']:
-                minToday = str(int(iv['MinToday']/60)) + ':' + str(int(iv['MinToday'] % 60)).zfill(2)
-                energToday = str(iv['EnergyToday'])
-                coToday = str("{0:.2f}".format(iv['EnergyToday'] * 0.44548))
-                hrsTotal = str(int(iv['HrsTotal'])) + ':00'
-                energTotal = str(iv['EnergyTotal'])
-                coTotal = str("{0:.2f}".format(iv['EnergyTotal'] * 0.44548))
-            else:
-                dbMinToday = int(latest_db_values(i, "MinToday", True))
-                minToday = str(int(dbMinToday)/60) + ':' + str(int(dbMinToday % 60)).zfill(2)
-                energToday = str(latest_db_values(i, "EnergyToday", True))
-                coToday = str("{0:.2f}".format(float(energToday) * 0.44548))
-                hrsTotal = str(latest_db_values(i, "HrsTotal", False)) + ':00'
-                energTotal = str(latest_db_values(i, "EnergyTotal", False))
-                coTotal = str("{0:.2f}".format(float(energTotal) * 0.44548))
-            htmlFile.write('<TR><TD>' + minToday + '</TD><TD>'  + energToday + ' kWh</TD><TD>' + coToday + ' kg</TD><TD>' + hrsTotal + '</TD><TD>' + energTotal + ' kWh</TD><TD>' + coTotal +' kg</TD><TR>')
-            i += 1
-
-        # Remaining table
-        htmlFile.write('</TABLE><BR><CENTER><font size=-1>Uptime: ' + uptime + '</font>\n')
-        htmlFile.write('<BR><BR>\n')
-        htmlFile.write('<FORM><INPUT TYPE="button" VALUE="Refresh" onClick="window.location.reload()" ></FORM><BR>')
-        htmlFile.write('<IMG src="solarStats_last24hrs.png" alt="Last 24 hours"><BR><BR>\n')
-        htmlFile.write('<IMG src="solarStats_last7days.png" alt="Last 7 days"><BR><BR>\n')
-        htmlFile.write('<IMG src="solarStats_last30days.png" alt="Last 30 days"><BR><BR>\n')
-        htmlFile.write('<IMG src="solarStats_lastyear.png" alt="Last 365 days"><BR><BR>\n')
-        htmlFile.write('<BR><font size=-1>The Dilapidation Crew - 2013</font></center></body></html>\n')
+        htmlFile.write(html)
 
     try:
         shutil.move(tempFile, htmlDest)
         logging.debug("Moving complete HTML page from  '%s' to '%s'", tempFile, htmlDest)
+        with open(digestFile, 'w') as f:
+            f.write(digest)
     except IOError as inst:
         logging.error("Cannot move HTML page from  '%s' to '%s': %s", tempFile, htmlDest, inst.args[0])
         print "%s : Cannot move HTML page!" % (datetime.datetime.now())
 
     return
 
+# Recent samples of the inverters, in memory (see ringbuffer). Kept by the long-running modes only:
+# the writer of --supervise and the status server; a cron run reads SQLite
+recentSamples = None
+def keep_recent_samples():
+    global recentSamples
+    if not recentHours:
+        return None
+    try:
+        import ringbuffer
+    except ImportError:
+        logging.warning("NumPy is not installed; recent samples are read from SQLite")
+        return None
+    recentSamples = ringbuffer.RecentSamples(recentHours * 3600 // step)
+    try:
+        conn = sqlite3.connect(sqliteDbName)
+        recentSamples.load(conn, recentHours)
+        conn.close()
+    except sqlite3.Error as inst:
+        logging.error("Cannot load recent samples: %s", inst.args[0])
+    return recentSamples
+
+def remember_sample(results):
+    if recentSamples is not None:
+        recentSamples.add(results)
+
+# Last known value of a column of an inverter (the highest today if useDate): from the recent samples
+# when they have it, else from SQLite (see latest_db_values)
+def last_value(inverter, columnName, useDate):
+    if recentSamples is not None:
+        if useDate:
+            value = recentSamples.todayMax(inverter, columnName)
+        else:
+            value = (recentSamples.latest(inverter) or {}).get(columnName)
+        if value is not None and value == value:    # Not NaN
+            return value
+    return latest_db_values(inverter, columnName, useDate)
+
 def latest_db_values(inverter, columnName, useDate):
     currdate = str(datetime.date.today().strftime("%Y-%m-%d")) + "%"
     conn = sqlite3.connect(sqliteDbName)
@@ -200,6 +447,8 @@ def latest_db_values(inverter, columnName, useDate):
 
 # Initialise. Runs the SQLite, RRDtool database generation. Needs to only run once, or when a reset is required.
 def create_databases():
+    import subprocess
+    load_drivers()
     # Create a SQLite database, using the Linux command
     # `sqlite3 SolarStats.sqlt < SolarStatsInit.sql`
     if os.path.isfile(sqliteInitFile):
@@ -214,19 +463,10 @@ def create_databases():
         print "Cannot create SQLite database, init file does not exist: %s" % sqliteInitFile
         sys.exit(1)
 
-    # Create a RRDtool database, using the Linux command
-    try:
-        rrdResult = subprocess.call(['rrdtool', 'create', rrdDbBLS, '--step', str(step), 'DS:bls3000:GAUGE:600:U:U', 'RRA:LAST:0.5:1:288', 'RRA:LAST:0.5:6:336', 'RRA:MIN:0.5:6:336', 'RRA:AVERAGE:0.5:6:336', 'RRA:MAX:0.5:6:336', 'RRA:LAST:0.5:12:720', 'RRA:MIN:0.5:12:720', 'RRA:AVERAGE:0.5:12:720', 'RRA:MAX:0.5:12:720', 'RRA:LAST:0.5:288:365', 'RRA:MIN:0.5:288:365', 'RRA:AVERAGE:0.5:288:365', 'RRA:MAX:0.5:288:365'])
-        logging.info("Attempt to create RRDtool db %s: exit code is %s", rrdDbBLS, rrdResult)
-    except subprocess.CalledProcessError as inst:
-        logging.error('Error creating RRDtool db: %s', inst.args[0])
-        print 'Error creating RRDtool db: %s' % inst.args[0]
-        sys.exit(1)
-
     ###
     # BLS3000
     ###
-    serPort = open_serialport('/dev/ttyUSB0')
+    serPort = open_serialport(blsPort)
     if serPort is None:
         print "%s : Cannot open serial port, exiting..." % (datetime.datetime.now())
         sys.exit()
@@ -283,7 +523,7 @@ def create_databases():
     ###
     # Soladin600
     ###
-    serPort = open_serialport('/dev/ttyUSB1')
+    serPort = open_serialport(solPort)
     if serPort is None:
         print "%s : Cannot open serial port, exiting..." % (datetime.datetime.now())
         sys.exit()
@@ -329,52 +569,251 @@ def create_databases():
     conn.close()
     logging.debug('Closed connection to database')
 
+    # Create the RRD files for the inverters just added
+    provision_databases()
+
     # Add cronjob:
     # >crontab -e
     # >*/5 * * * * /home/pi/SolarStats.py >> /home/pi/SolarConsole.log 2>&1
     # >crontab -l (list jobs)
 
 
-# Exports the SQLite power data into a flat text file, using Unix epoch time
-def export_data(inverterID):
-    exportFile = 'solarInv_' + str(inverterID) + '.dmp'
+# Create the RRD files (or round-robin stores, if rrdtool is missing) of all inverters in the
+# SQLite database. Existing files are left alone, so this can be run again after adding inverters.
+def provision_databases():
+    import rrdschema
+    try:
+        ivs = inverters.load_inverters(sqliteDbName)
+    except sqlite3.Error as inst:
+        logging.error("Cannot load inverters from '%s': %s", sqliteDbName, inst.args[0])
+        print "Cannot load inverters from '%s': %s" % (sqliteDbName, inst.args[0])
+        sys.exit(1)
+
+    schema = rrdschema.RrdSchema(step=step)
+    created = schema.provision(ivs, useRrdtool=rrdtool_available(), storeName=rrd_store_name)
+    print "Provisioned %d RRD files for %d inverters" % (len(created), len(ivs))
+
+# The SQL init file: in the working directory, or else the one in the source tree
+def init_file():
+    if os.path.isfile(sqliteInitFile):
+        return os.path.abspath(sqliteInitFile)
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'db', 'SolarStatsInit.sql')
+
+# Switch to simulated inverters (or the given ports), in a scratch directory that holds the database,
+# RRD files and web pages; the real ones are left alone. Returns the scratch directory
+def use_simulator(ports=None):
+    global serialPorts, webDir, siteInverters
+    import rrdschema, simulator, tempfile
+    initFile = init_file()
+    scratchDir = tempfile.mkdtemp(prefix='solarstats-sim-')
+    os.chdir(scratchDir)
+    simulator.create_database(sqliteDbName, initFile)
+    rrdschema.RrdSchema(step=step).provision(inverters.load_inverters(sqliteDbName), useRrdtool=rrdtool_available(),
+                                             storeName=rrd_store_name)
+    serialPorts = ports if ports is not None else simulator.simulated_ports()
+    webDir = scratchDir
+    siteInverters = None
+    logging.info("Using simulated inverters in '%s'", scratchDir)
+    print "Using simulated inverters in '%s'" % scratchDir
+    return scratchDir
+
+# Feed a capture file (see --capture) through the protocol parsers, decoders and storage, polling the
+# inverters until their captured traffic runs out. Reports the throughput
+def replay_capture(captureFile, realTime=False):
+    global retryDelay
+    import simulator
+    records = list(frametrace.read_capture(os.path.abspath(captureFile)))
+    ports = simulator.replay_ports(records, realTime)
+    scratchDir = use_simulator(ports)
+    if not realTime:
+        retryDelay = 0
     conn = sqlite3.connect(sqliteDbName)
-    cursor = conn.cursor()
-    logging.info('Connected to SQLite database "%s; exporting data for inverter %s"', sqliteDbName, inverterID)
+    conn.execute("PRAGMA synchronous=OFF")  # Scratch database; no need to survive a crash
+    polls = [(poll, portID, rrdDb) for portID, poll, rrdDb in supervised_ports() if portID in ports]
+    for portID in sorted(set(ports) - set(portID for poll, portID, rrdDb in polls)):
+        print "No inverter is polled on captured port %s (%d exchanges); not replayed" % (portID, ports[portID].remaining())
+    cycles = valid = 0
+    start = time.time()
+    while any(ports[portID].remaining() for poll, portID, rrdDb in polls):
+        before = sum(ports[portID].remaining() for poll, portID, rrdDb in polls)
+        for poll, portID, rrdDb in polls:
+            if ports[portID].remaining():
+                results = poll(conn, portID)
+                track_energy(conn, results)
+                store_rrd(rrdDb, results)
+                valid += results['success']
+        cycles += 1
+        if sum(ports[portID].remaining() for poll, portID, rrdDb in polls) == before:
+            break       # Nothing consumed; the rest of the capture does not match the polls
+    elapsed = max(time.time() - start, 1e-6)
+    conn.close()
+    mismatches = sum(port.mismatches for port in ports.values())
+    print "Replayed %d frames in %d cycles (%d valid polls, %d unexpected requests) in %.2fs: %.0f frames/s" % (
+        len(records), cycles, valid, mismatches, elapsed, len(records) / elapsed)
+    print "Decoded data is in '%s'" % os.path.join(scratchDir, sqliteDbName)
+
+# Run a number of collection cycles under a profiler ('cprofile' or 'sample'). Each cycle writes
+# cycle<n>.collapsed (and cycle<n>.pstats for cProfile) to profileDir; the top functions are printed
+def profile_cycles(cycles, profiler, simulate):
+    import profiling, pstats
+    outDir = os.path.abspath(profileDir)
+    if not os.path.isdir(outDir):
+        os.makedirs(outDir)
+    if simulate:
+        use_simulator()
+    conn = sqlite3.connect(sqliteDbName)
+    for cycle in range(1, cycles + 1):
+        basePath = os.path.join(outDir, 'cycle%d' % cycle)
+        profiling.profile_call(lambda: collect_cycle(conn), profiler, basePath)
+        print "Cycle %d: profile written to %s.*" % (cycle, basePath)
+    conn.close()
+
+    # Summary over all cycles
+    if profiler == 'cprofile':
+        stats = pstats.Stats(*[os.path.join(outDir, 'cycle%d.pstats' % cycle) for cycle in range(1, cycles + 1)])
+        stats.sort_stats('cumulative').print_stats(20)
+    else:
+        sampler = profiling.StackSampler()
+        for cycle in range(1, cycles + 1):
+            with open(os.path.join(outDir, 'cycle%d.collapsed' % cycle), 'r') as f:
+                for line in f:
+                    stack, count = line.rsplit(' ', 1)
+                    key = tuple(stack.split(';'))
+                    sampler.stacks[key] = sampler.stacks.get(key, 0) + int(count)
+        total = sum(sampler.stacks.values())
+        print "%8s %6s  %s" % ('Samples', '%', 'Function (inclusive)')
+        for name, count in sampler.top(20):
+            print "%8d %5.1f%%  %s" % (count, 100.0 * count / total, name)
+
+# Print the serial link statistics of all inverters, for the last hour, day and week
+def print_link_stats():
+    print "%-6s %-4s %-14s %6s %6s %5s %5s %5s %5s %5s %6s %6s %6s" % ('Window', 'Inv', 'Port', 'Sent', 'Ok', 'CRC', 'Short', 'Bad',
+                                                                    'Tmout', 'Retry', 'p50ms', 'p90ms', 'p99ms')
+    for name, stats in linkstats.windows(sqliteDbName):
+        for link in stats:
+            c = link.counts
+            print "%-6s %-4d %-14s %6d %6d %5d %5d %5d %5d %5d %6s %6s %6s" % (name, link.inverterId, link.port, c['Sent'], c['Ok'],
+                c['CrcErrors'], c['ShortFrames'], c['BadFrames'], c['Timeouts'], c['Retries'],
+                link.percentile(50) or '-', link.percentile(90) or '-', link.percentile(99) or '-')
+
+# Print the daily yield of every inverter against its clear-sky yield (see clearsky), for the last days
+def print_performance(days):
+    import clearsky
+    model = clearsky.ExpectedOutput(clearsky.load_arrays(sqliteDbName), siteLatitude, siteLongitude, clearskyDir, step)
+    start = datetime.date.today() - datetime.timedelta(days=days - 1)
+    rows = select_inverterdata("SELECT substr(DateTime, 1, 10), Inverter_ID, max(EnergyToday) FROM inverterdata "
+                               "WHERE DateTime >= ? GROUP BY substr(DateTime, 1, 10), Inverter_ID", (str(start),))
+    print "%-10s %-4s %9s %9s %6s" % ('Day', 'Inv', 'Yield', 'Clear-sky', 'Ratio')
+    for day, inverterId, energy in sorted(rows):
+        expected = model.expectedEnergy(inverterId, day)
+        if expected is None:
+            print "%-10s %-4d %9.2f %9s %6s" % (day, inverterId, energy, '-', '-')
+        else:
+            print "%-10s %-4d %9.2f %9.2f %5.0f%%" % (day, inverterId, energy, expected, 100 * energy / expected if expected else 0)
+
+# Archive the graphs of a day (today by default) from the web directory. Unchanged images are stored
+# only once (see grapharchive)
+def archive_graphs(day=None):
+    import fnmatch, grapharchive
+    logging.info("Archiving graphs to '%s'", rrdArchDir)
+    archive = grapharchive.GraphArchive(os.path.join(os.getcwd(), rrdArchDir))
+    migrated = archive.importLegacy(archive.archiveDir, remove=True)    # Graphs archived by older versions
+    if migrated:
+        logging.info("Moved %d previously archived graphs into the archive store", migrated)
+    day = day or time.strftime("%Y-%m-%d")
+    for imgName in fnmatch.filter(os.listdir(webDir), 'solarStats*.png'):
+        try:
+            archive.add(day, os.path.join(webDir, imgName))
+            logging.debug("Archived '%s' from '%s' to '%s'", imgName, webDir, rrdArchDir)
+        except (IOError, OSError) as inst:
+            logging.error("Cannot archive file '%s' from '%s' to '%s': %s", imgName, webDir, rrdArchDir, inst.args[-1])
+    archive.save()
+
+# End of day checks: archive the graphs of the day, move the data of a finished year (or month) into its shard
+def end_of_day(conn, day=None):
+    archive_graphs(day)
+    rotate_shards(conn)
+
+# Layout of the database shards (see shards), or None when sharding is disabled
+def shard_layout():
+    if not shardPeriod:
+        return None
+    import shards
+    return shards.ShardLayout(sqliteDbName, shardPeriod, shardDirs)
+
+# Move the inverter data of earlier periods into their shards
+def rotate_shards(conn):
+    layout = shard_layout()
+    if layout is None:
+        return {}
+    import shards
+    try:
+        return shards.rotate(layout, conn, datetime.datetime.now())
+    except (sqlite3.Error, IOError, OSError) as inst:
+        logging.error("Cannot move inverter data into shards: %s", inst)
+        return {}
+
+# Rows of a query on the inverter data of all periods (main database and shards), oldest shard first.
+# start and end (DateTimes) limit the shards read to those of a range
+def select_inverterdata(sql, parameters=(), start=None, end=None):
+    layout = shard_layout()
+    if layout is not None:
+        import shards
+        return shards.select(layout, sql, parameters, start, end)
+    return select_rows(sqliteDbName, sql, parameters)
+
+# Rows of a query on a database, which is closed once they have all been read
+def select_rows(dbName, sql, parameters=()):
+    conn = sqlite3.connect(dbName)
+    try:
+        for row in conn.execute(sql, parameters):
+            yield row
+    finally:
+        conn.close()
+
+# Connection to the inverter data between two DateTimes (end None for up to now), with the shards
+# of the range attached (see shards.connect)
+def connect_inverterdata(start=None, end=None):
+    layout = shard_layout()
+    if layout is not None:
+        import shards
+        return shards.connect(layout, start, end)
+    return sqlite3.connect(sqliteDbName)
+
+# Exports the SQLite power data into a flat text file of rrdtool updates, using Unix epoch time. Gaps
+# in the data are filled with copies of the next sample (works better than 'U'nknown values; see gaps)
+def export_data(inverterID, exportFile=None):
+    import itertools, numpy, counters, gaps
+    exportFile = exportFile or 'solarInv_' + str(inverterID) + '.dmp'
+    logging.info('Exporting data for inverter %s from SQLite database "%s" and its shards', inverterID, sqliteDbName)
 
     # Retrieve power data from db
     t = (inverterID)
     db = rrdDbBLS if (inverterID == "1") else rrdDbSol
-
-    prevTime = 1381744532   # Start time for inserting rows (2013-10-14 11:55:32)
+    rows = select_inverterdata("SELECT CAST(strftime('%s', DateTime, 'utc') AS INTEGER), DateTime, PowerAC, EnergyToday, EnergyTotal "
+                               "FROM inverterdata WHERE inverter_ID is (?) ORDER BY DateTime", t)
+    energy = counters.Counters()    # Energy of the year, replayed from the samples (as stored in counter_baseline)
+    filler = gaps.GapFiller(step, maxInterval=400, strategy='next')
     with open(exportFile, 'w+') as dumpFile:
-        for row in cursor.execute('SELECT DateTime, PowerAC, EnergyToday, EnergyTotal FROM inverterdata WHERE inverter_ID is (?) ORDER BY DateTime', t):
-            unixTime = int(time.mktime(datetime.datetime.strptime(row[0].decode(), "%Y-%m-%d %H:%M:%S.%f").timetuple()))
-
-            # Reset yearly values (on 1-2-2014)
-            tot = str(row[3])
-            if unixTime > 1391208900:    # 31-01-2014 23:55
-                if inverterID == 1:
-                    tot = str(row[3] - 2188.7)
-                else:
-                    tot = str(row[3] - 364.31)
-            # Check for time gaps
-            diffTime = unixTime - prevTime
-            if (diffTime > 400):
-                # Insert missing rows
-                print "Missing rows: " + str(diffTime) + "; inserting " + str(len(range(prevTime + step, unixTime - step, step))) + " rows..."
-                for i in range(prevTime + step, unixTime - step, step):
-                    normTime = datetime.datetime.fromtimestamp(i).strftime("%Y-%m-%d %H:%M:%S.%f")
-                    dumpFile.write('rrdtool update ' + db + ' ' + str(i) + ":" + str(row[1]) + ":" + str(row[2]) + ":" + tot +'\n')    # Copy next value into missing (works better than 'U'nknown value)
-                    #dumpFile.write(normTime + "," + str(i) + "," + str(row[1]) + "," + str(row[2]) + ", FIXED" + '\n')
-
-            dumpFile.write('rrdtool update ' + db + ' ' + str(unixTime) + ":" + str(row[1]) + ":" + str(row[2]) + ":" + tot +'\n')
-            #dumpFile.write('Time: ' + str(row[0]) + '\t Power: ' + str(row[1]) + '\t Etoday: ' + str(row[2]) + '\t Etotal: ' + str(row[3]) + '\n')
-            #dumpFile.write(str(row[0]) + "," + str(unixTime) + "," + str(row[1]) + "," + str(row[2]) + '\n')
-            prevTime = max(prevTime, unixTime)     # Ensure the prevTime only gets overwritten past the start time
+        while True:
+            chunk = list(itertools.islice(rows, 10000))
+            if not chunk:
+                break
+            table = numpy.array([(unixTime, power, today, None if total is None else energy.observe(inverterID, dateTime, total)['year'])
+                                 for unixTime, dateTime, power, today, total in chunk], dtype=numpy.float64)
+            times, values, filled = filler.fill(table[:, 0].astype(numpy.int64), table[:, 1:])
+            for unixTime, (power, today, tot) in itertools.izip(times.tolist(), values.tolist()):
+                dumpFile.write('rrdtool update %s %d:%s:%s:%s\n' % (db, unixTime, rrd_value(power), rrd_value(today), rrd_value(tot)))
+    logging.info("Exported to '%s'; filled %d gaps with %d rows", exportFile, filler.gaps, filler.filled)
+    print "Filled %d gaps with %d rows" % (filler.gaps, filler.filled)
+
+# Value in an rrdtool update: 'U'nknown for missing values
+def rrd_value(value):
+    return 'U' if value != value else str(value)
 
 # Run a testing function
 def test_inverter():
+    load_drivers()
 
     serPort = open_serialport('/dev/ttyUSB1')
     if serPort is None:
@@ -422,105 +861,167 @@ def queryPrintRegister(serPort, slaveAddress, startRegister, numRegisters):
         i += 2
 """
 
-########
-### MAIN
-########
-if __name__=="__main__":
-    # Log file for reference
-    logging.basicConfig(filename=logFile, level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
-    logging.info('Logging started...')
-
-    # Script-specific 'cronjobs'
-    hour = datetime.datetime.now().hour
-    minute = datetime.datetime.now().minute
-
-    # Create inverter instances
-    bls = blacklinesolar.BlackLineSolar()
-    sol = mastervolt.MasterVolt()
-
-    args = parse_args()
-
-    if args.create:
-        create_databases()
-        sys.exit()
-
-    if args.export:
-        if int(args.export) in [1, 2]:    # Currently only existing inverterIDs
-            export_data(args.export)
-        else:
-            print "Non-existent inverter ID (" + args.export + "); exiting..."
-        sys.exit()
-
-    if args.test:
-        test_inverter()
-        sys.exit()
-
-    # Create graphs every hour, or when asked by the user
-    if (args.graph or minute == 0):
-        logging.debug("Creating RRD graphs (crontime is %s:%s)...", hour, minute)
-        epochNow=int(time.time()) # Seconds since epoch
-        logging.info("Creating RRD graphs, using end time %i", epochNow)
-        rrd_graph('solarStats_last24hrs.png', epochNow - 60*60*24, epochNow, 'Last 24 hours')
-        rrd_graph('solarStats_last7days.png', epochNow - 60*60*24*7, epochNow, 'Last 7 days')
-        rrd_graph('solarStats_last30days.png', epochNow - 60*60*24*30, epochNow, 'Last 30 days')
-        rrd_graph('solarStats_lastyear.png', epochNow - 60*60*24*365, epochNow, 'Last year')
-        if args.graph:
-            sys.exit()
-
-    print "End of main due to testing"
-    sys.exit()
-
-    # Open database
-    conn = sqlite3.connect(sqliteDbName)
+# Status texts of the Soladin600, by status bit (checked in this order)
+soladinStatus = [(0x001, "Solar input voltage too high"),
+                 (0x002, "Solar input voltage too low"),
+                 (0x004, "No input from mains"),
+                 (0x008, "Mains voltage too high"),
+                 (0x010, "Mains voltage too low"),
+                 (0x020, "Mains frequency too high"),
+                 (0x040, "Mains frequency too low"),
+                 (0x080, "Temperature error"),
+                 (0x100, "Hardware error"),
+                 (0x200, "Starting up"),
+                 (0x400, "Max solar output"),
+                 (0x800, "Max output")]
+soladinNormal = 0x200 | 0x400 | 0x800   # Status bits that are no fault
+
+# Status text of the BlackLine Solar 3000, and whether it is no fault: not running is normal while
+# there is no power (at night)
+def blacklinesolar_status(status, power):
+    if status == 1:
+        return "Inverter in operation", True
+    if status == 0:
+        return "Inverter not running", not power
+    return 'Unknown: ' + str(status), False
+
+# The same for the Soladin600; its solar input voltage is too low while there is no power (at night)
+def soladin_status(statBits, power):
+    if statBits == 0:
+        return "Inverter in operation", True
+    normal = soladinNormal | (0x002 if not power else 0)
+    for bit, text in soladinStatus:
+        if statBits & bit:
+            return text, (statBits & ~normal) == 0
+    return 'Unknown: ' + str(statBits), False
+
+# Send a command and parse the response with parse (a driver's parse method). Returns the parsed
+# response, or None if no valid response was received. The outcome is counted in link
+def query_inverter(serPort, command, parse, name, link):
+    with timings.span('request', name):
+        send_command(serPort, command)
+        link.count('Sent')
+        response = ''.join(receive_command(serPort, link))
+    if len(response) == 0:
+        link.count('Timeouts')
+        return None
+    try:
+        with timings.span('parse', name):
+            parsed = parse(response)
+    except solarutils.CrcError as inst:
+        link.count('CrcErrors')
+        logging.error("Invalid response from %s: %s", name, inst.args[0])
+        return None
+    except solarutils.FrameLengthError as inst:
+        link.count('ShortFrames')
+        logging.error("Invalid response from %s: %s", name, inst.args[0])
+        return None
+    except ValueError as inst:
+        link.count('BadFrames')
+        logging.error("Invalid response from %s: %s", name, inst.args[0])
+        return None
+    link.count('Ok')
+    return parsed
+
+# Wait before retrying a failed request; only counted as a retry when another attempt follows
+def retry_wait(name, retriesLeft, link):
+    logging.error("Invalid response, aborting loop; retries left: '%s'...", retriesLeft)
+    if retriesLeft:
+        link.count('Retries')
+        with timings.span('retry_wait', name):
+            time.sleep(retryDelay)
+
+# Retrieve the slave address of an inverter from the db
+def slave_address(conn, inverterID):
     cursor = conn.cursor()
-    logging.info('Connected to SQLite database "%s"', sqliteDbName)
-    print "Using log file '" + logFile + "'; database '" + sqliteDbName + "'; RRD files '" + rrdDbBLS + "'; '" + rrdDbSol + "'"
-
-    # Blackline Solar
-    serPort = open_serialport('/dev/ttyUSB0')
-    if serPort is None:
-        print "%s : Cannot open serial port USB0..." % (datetime.datetime.now())
-
-    # Retrieve slave address from db
-    t = ('1')
-    cursor.execute('SELECT BusAddress FROM invertertype WHERE ID=?', t)
-    slaveAddress = cursor.fetchone()[0]
-    logging.info('Using slave addres "%s" from db', printhex(slaveAddress))
-    if slaveAddress is None:
+    cursor.execute('SELECT BusAddress FROM invertertype WHERE ID=?', (str(inverterID),))
+    row = cursor.fetchone()
+    if row is None or row[0] is None:
         print "%s : Cannot read slave address..." % (datetime.datetime.now())
+        return None
+    logging.info('Using slave address "%s" from db', row[0])
+    return row[0]
+
+# Write a row of inverter data to SQLite
+def store_results(conn, t, name):
+    logging.debug("Writing results to database: %s", t)
+    with timings.span('sqlite', name):
+        conn.execute("INSERT INTO inverterdata VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", t)
+        if forwardUrl:
+            import forwarder
+            forwarder.enqueue(conn, t[0], t[1])
+        conn.commit()
+    logging.debug("Data committed to database")
 
+# Send the samples queued in the outbox to the ingestion server (see forwarder); what cannot be sent
+# now stays queued for the next run
+def forward_samples(conn):
+    import forwarder
+    try:
+        with timings.span('forward'):
+            return forwarder.Forwarder(forwardUrl, siteName).drain(forwarder.Outbox(conn))
+    except sqlite3.Error as inst:
+        logging.error("Cannot forward samples: %s", inst.args[0])
+        return 0
+
+# Run the central ingestion server (see ingestserver)
+def serve_ingest(port):
+    import ingestserver
+    store = ingestserver.CentralStore(ingestDbName, init_file())
+    server = ingestserver.IngestServer(('', port), store)
+    logging.info("Ingestion server listening on port %d, storing in '%s'", port, ingestDbName)
+    print "Ingestion server listening on port %d, storing in '%s'" % (port, ingestDbName)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+        store.close()
+
+# Write the link statistics of a poll to SQLite
+def store_link_stats(conn, link, name):
+    if link.counts['Sent'] == 0:
+        return
+    try:
+        with timings.span('sqlite', name):
+            link.store(conn)
+    except sqlite3.Error as inst:
+        logging.error("Cannot store link statistics of %s: %s", name, inst.args[0])
+
+# Poll the BlackLine Solar 3000; returns its results ('success' is False if it did not respond).
+# attempts is the number of requests sent before giving up (retries by default)
+def poll_blacklinesolar(conn, portID, attempts=None):
+    load_drivers()
     resultsBLS = {}
+    resultsBLS['id'] = 1
     resultsBLS['name'] = "BLS3000"
     resultsBLS['success'] = False
-    while retries != 0:
-        if serPort is None:
-            logging.error("No serial port available, aborting data query...")
-            retries = 0
-            continue
-        rData = 0;
 
+    with timings.span('serial_open', resultsBLS['name']):
+        serPort = open_serialport(portID)
+    if serPort is None:
+        print "%s : Cannot open serial port %s..." % (datetime.datetime.now(), portID)
+        logging.error("No serial port available, aborting data query...")
+        return resultsBLS
+    slaveAddress = slave_address(conn, resultsBLS['id'])
+    link = linkstats.LinkStats(resultsBLS['id'], portID)
+    parse = bls.mb_parseTcpResponse if getattr(serPort, 'framing', 'rtu') == 'mbap' else bls.mb_parseResponse
+
+    retriesLeft = attempts or retries
+    while slaveAddress is not None and retriesLeft != 0:
         # Inverter data ("02 04 00 0A 00 1F 91 F3")
         logging.debug("Sending inverter data request ADU")
         startRegister = "0A"
         numRegisters = "1F"
-        command = mb_ReadInputRegisters(slaveAddress, startRegister, numRegisters)
-        send_command(serPort, command)
-        bytes = receive_command(serPort)
-
-        rAddress, rCommand, rByteCount, rData = mb_parseResponse(bytes)
-        if rData == -1: # CRC error, break here to retry command
-            retries -= 1
-            logging.error("CRC error, aborting loop; retries left: '%s'...", retries)
-            time.sleep(5)
-            continue
-        if rData is None: # Message error, break here to stop loop
-            retries -= 1
-            logging.error("Message error, aborting loop; retries left: '%s'...", retries)
-            time.sleep(5)
+        command = bls.mb_readInputRegisters(slaveAddress, startRegister, numRegisters)
+        response = query_inverter(serPort, command, parse, resultsBLS['name'], link)
+        if response is None: # CRC or message error, retry command
+            retriesLeft -= 1
+            retry_wait(resultsBLS['name'], retriesLeft, link)
             continue
-        logging.info("Inverter data response (data): %s", printhex(rData))
+        rAddress, rCommand, rByteCount, rData = response
+        logging.info("Inverter data response (data): %s", solarutils.LazyHex(rData))
         # Success, so no need for retries
-        retries = 0
+        retriesLeft = 0
         resultsBLS['success'] = True
 
         # Decode inverter data
@@ -528,94 +1029,67 @@ if __name__=="__main__":
         i = 0
         address = 0x0A
         while i < int((rByteCount.encode('hex')), 16):
-            name = portContents[address]
+            name = bls.portContents[address]
             if (name == 'blank') or (name == 'unknown'):
                 i += 2
                 address += 1
                 continue
 
             if resultsBLS.has_key(name): # Some items are double words, so add the previously added item
-                resultsBLS[name] = ((resultsBLS[name] * scaleFactors[name]) + int(rData[i].encode('hex') + rData[i+1].encode('hex'), 16)) / scaleFactors[name]
+                resultsBLS[name] = ((resultsBLS[name] * bls.scaleFactors[name]) + int(rData[i].encode('hex') + rData[i+1].encode('hex'), 16)) / bls.scaleFactors[name]
             else:
-                resultsBLS[name] = int(rData[i].encode('hex') + rData[i+1].encode('hex'), 16) / scaleFactors[name]
+                resultsBLS[name] = int(rData[i].encode('hex') + rData[i+1].encode('hex'), 16) / bls.scaleFactors[name]
             i += 2
             address += 1
 
         logging.info("Decoded inverter data response: %s", resultsBLS)
-        #print "%s : %s" % (datetime.datetime.now(), resultsBLS)
 
         # Parse the status. Note that we're inverting the status here for the HTML page (0 = success)
-        resultsBLS['statusText'] = 'Unknown: ' + str(resultsBLS['Status2'])
-         #FIXME use case
-        if resultsBLS['Status2'] == 0:
-            resultsBLS['statusText'] = "Inverter not running"
-        if resultsBLS['Status2'] == 1:
-            resultsBLS['statusText'] = "Inverter in operation"
+        resultsBLS['statusText'], resultsBLS['statusOk'] = blacklinesolar_status(resultsBLS['Status2'], resultsBLS['PowerAC'])
+        resultsBLS['counterWrap'] = 2**32 / bls.scaleFactors['EnergyTotal']    # Two registers
 
         # Write results to SQLite
         t=('1', str(datetime.datetime.now()), resultsBLS['VoltsPV1'], resultsBLS['VoltsPV2'], resultsBLS['CurrentPV1'], resultsBLS['CurrentPV2'], resultsBLS['VoltsAC1'], resultsBLS['VoltsAC2'], resultsBLS['VoltsAC3'], resultsBLS['CurrentAC1'], resultsBLS['CurrentAC2'], resultsBLS['CurrentAC3'], resultsBLS['FrequencyAC'], resultsBLS['PowerAC'], resultsBLS['EnergyToday'], resultsBLS['EnergyTotal'], resultsBLS['MinToday'], resultsBLS['HrsTotal'], resultsBLS['Temperature'], resultsBLS['Iac-Shift'], resultsBLS['DCI'], resultsBLS['Status1'], resultsBLS['Status2'], printhex(rData))
-        logging.debug("Writing results to database: %s", t)
+        store_results(conn, t, resultsBLS['name'])
+        resultsBLS['DateTime'] = t[1]
 
-        cursor.execute("INSERT INTO inverterdata VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", t)
-        conn.commit()
-        logging.debug("Data committed to database")
-
-    # while retries
     logging.info("Closing connection to serial port")
-    if serPort is not None:
-        serPort.close()
-
-    # Write results to RRD db -- update using time of 'now' (N). Lifted from solget.sh
-    rrdWrite = str(0) + ":" + str(0) + ":" + str(0)
-    if resultsBLS['success']:
-        rrdWrite = str(resultsBLS['PowerAC']) + ":" + str(resultsBLS['EnergyToday']) + ":" + str(resultsBLS['EnergyTotal'] - 2188.7)
-    try:
-        rrdResult = subprocess.call(['rrdtool', 'update', rrdDbBLS, 'N:' + rrdWrite])
-        logging.debug("Data (%s) committed to RRD database; exit code is %s", rrdWrite, rrdResult)
-    except subprocess.CalledProcessError as inst:
-        logging.error('Error writing data to RRD: %s', inst.args[0])
-
-    # Soladin
-    serPort = open_serialport('/dev/ttyUSB1')
-    if serPort is None:
-        print "%s : Cannot open serial port USB1..." % (datetime.datetime.now())
-
-    # Retrieve slave address from db
-    t = ('2')
-    cursor.execute('SELECT BusAddress FROM invertertype WHERE ID=?', t)
-    slaveAddress = cursor.fetchone()[0]
-    logging.info('Using slave addres "%s" from db', printhex(slaveAddress))
-    if slaveAddress is None:
-        print "%s : Cannot read slave address..." % (datetime.datetime.now())
+    serPort.close()
+    store_link_stats(conn, link, resultsBLS['name'])
+    return resultsBLS
 
-    retries = 3
+# Poll the Soladin 600; returns its results ('success' is False if it did not respond).
+# attempts is the number of requests sent before giving up (retries by default)
+def poll_soladin(conn, portID, attempts=None):
+    load_drivers()
     sourceAddress = "00 00"
     resultsSol = {}
+    resultsSol['id'] = 2
     resultsSol['name'] = "Soladin600"
     resultsSol['success'] = False
-    while retries != 0:
-        if serPort is None:
-            logging.error("No serial port available, aborting data query...")
-            retries = 0
-            continue
-        command = mv_generateCommand(slaveAddress, sourceAddress, mvCmd_stats)
-        send_command(serPort, command)
-        bytes = receive_command(serPort)
-        dest, src, response = mv_parseResponse(bytes, mvCmd_stats)
-        if response == -1: # CRC error, break here to retry command
-            retries -= 1
-            logging.error("CRC error, aborting loop; retries left: '%s'...", retries)
-            time.sleep(5)
-            continue
-        if response is None: # Message error, break here to stop loop
-            retries -= 1
-            logging.error("Message error, aborting loop; retries left: '%s'...", retries)
-            time.sleep(5)
+
+    with timings.span('serial_open', resultsSol['name']):
+        serPort = open_serialport(portID)
+    if serPort is None:
+        print "%s : Cannot open serial port %s..." % (datetime.datetime.now(), portID)
+        logging.error("No serial port available, aborting data query...")
+        return resultsSol
+    slaveAddress = slave_address(conn, resultsSol['id'])
+    link = linkstats.LinkStats(resultsSol['id'], portID)
+
+    retriesLeft = attempts or retries
+    while slaveAddress is not None and retriesLeft != 0:
+        command = sol.generateCommand(slaveAddress, sourceAddress, sol.mvCmd_stats)
+        parsed = query_inverter(serPort, command, sol.parseResponse, resultsSol['name'], link)
+        if parsed is None: # CRC or message error, retry command
+            retriesLeft -= 1
+            retry_wait(resultsSol['name'], retriesLeft, link)
             continue
+        dest, src, response = parsed
 
         # Decode inverter data
         logging.debug("Decoding mv_inverter data response...")
-        statBits = hex2int((response[1:3])               # 1,2
+        statBits = hex2int(response[1:3])               # 1,2
         uSol = hex2int(response[3:5]) / 10.0            # 3,4
         iSol = hex2int(response[5:7]) / 100.0           # 5,6
         fNet = hex2int(response[7:9]) / 100.0           # 7,8
@@ -635,141 +1109,423 @@ if __name__=="__main__":
         resultsSol["Temperature"] = tSol
         resultsSol["EnergyTotal"] = wTot
         resultsSol["HrsTotal"] = hTot
+        resultsSol['counterWrap'] = 2**24 / 100.0     # Three bytes
 
         # Parse the status.
-         #FIXME use case
-        resultsSol['statusText'] = 'Unknown: ' + str(statBits)
-        if statBits == 0:
-            resultsSol['statusText'] = "Inverter in operation"
-        elif statBits & 0x001:
-            resultsSol['statusText'] = "Solar input voltage too high"
-        elif statBits & 0x002:
-            resultsSol['statusText'] = "Solar input voltage too low"
-        elif statBits & 0x004:
-            resultsSol['statusText'] = "No input from mains"
-        elif statBits & 0x008:
-            resultsSol['statusText'] = "Mains voltage too high"
-        elif statBits & 0x010:
-            resultsSol['statusText'] = "Mains voltage too low"
-        elif statBits & 0x020:
-            resultsSol['statusText'] = "Mains frequency too high"
-        elif statBits & 0x040:
-            resultsSol['statusText'] = "Mains frequency too low"
-        elif statBits & 0x080:
-            resultsSol['statusText'] = "Temperature error"
-        elif statBits & 0x100:
-            resultsSol['statusText'] = "Hardware error"
-        elif statBits & 0x200:
-            resultsSol['statusText'] = "Starting up"
-        elif statBits & 0x400:
-            resultsSol['statusText'] = "Max solar output"
-        elif statBits & 0x800:
-            resultsSol['statusText'] = "Max output"
-
-        """
-        print "Stat:\t" + str(statBits)
-        print "Panel volt:\t" + str(uSol)
-        print "Panel curr:\t" + str(iSol)
-        print "Panel pwr:\t" + str(uSol*iSol)
-        print "Net freq:\t" + str(fNet)
-        print "Net volt:\t" + str(uNet)
-        print "Convert pwr:\t" + str(wSol)
-        print "Convert temp:\t" + str(tSol)
-        print "Convert total:\t" + str(wTot)
-        print "Runtime:\t" + str(hTot)
-        """
-
-        command = mv_generateCommand(slaveAddress, sourceAddress, mvCmd_maxpow)
-        send_command(serPort, command)
-        bytes = receive_command(serPort)
-        dest, src, response2 = mv_parseResponse(bytes, mvCmd_maxpow)
-        if response2 == -1: # CRC error, break here to retry command
-            retries -= 1
-            logging.error("CRC error, aborting loop; retries left: '%s'...", retries)
-            time.sleep(5)
-            continue
-        if response2 is None: # Message error, break here to stop loop
-            retries -= 1
-            logging.error("Message error, aborting loop; retries left: '%s'...", retries)
-            time.sleep(5)
-            continue
+        resultsSol['statusText'], resultsSol['statusOk'] = soladin_status(statBits, wSol)
 
+        command = sol.generateCommand(slaveAddress, sourceAddress, sol.mvCmd_maxpow)
+        parsed = query_inverter(serPort, command, sol.parseResponse, resultsSol['name'], link)
+        if parsed is None: # CRC or message error, retry command
+            retriesLeft -= 1
+            retry_wait(resultsSol['name'], retriesLeft, link)
+            continue
+        dest, src, response2 = parsed
         mPow = hex2int(response2[19:21]) / 1.0
-        # print "MaxPow:\t" + str(mPow)
 
-        command = mv_generateCommand(slaveAddress, sourceAddress, mvCmd_hisdat)
-        send_command(serPort, command)
-        bytes = receive_command(serPort)
-        dest, src, response3 = mv_parseResponse(bytes, mvCmd_hisdat)
-        if response3 == -1: # CRC error, break here to retry command
-            retries -= 1
-            logging.error("CRC error, aborting loop; retries left: '%s'...", retries)
-            time.sleep(5)
-            continue
-        if response3 is None: # Message error, break here to stop loop
-            retries -= 1
-            logging.error("Message error, aborting loop; retries left: '%s'...", retries)
-            time.sleep(5)
+        command = sol.generateCommand(slaveAddress, sourceAddress, sol.mvCmd_hisdat)
+        parsed = query_inverter(serPort, command, sol.parseResponse, resultsSol['name'], link)
+        if parsed is None: # CRC or message error, retry command
+            retriesLeft -= 1
+            retry_wait(resultsSol['name'], retriesLeft, link)
             continue
+        dest, src, response3 = parsed
 
         mTod = hex2int(response3[0]) * 5.0 # Daily operation * 5 minutes
         wTod = hex2int(response3[1]) / 100.0
-        #print "Min today:\t" + str(mTod)
-        #print "Pwr today:\t" + str(wTod)
         results2 = [statBits, uSol, iSol, fNet, uNet, wSol, wTot, tSol, hTot, "$", mPow, "$", mTod, wTod]
         logging.info("Decoded inverter data response: %s", results2)
         resultsSol['EnergyToday'] = wTod
         resultsSol['MinToday'] = mTod
 
         response = printhex(response) + " $ " + printhex(response2) + " $ " + printhex(response3)
-        logging.info("Inverter data response (data): %s", printhex(response))
+        logging.info("Inverter data response (data): %s", response)
         # Success, so no need for retries
-        retries = 0
+        retriesLeft = 0
         resultsSol['success'] = True
 
-        conn = sqlite3.connect(sqliteDbName)
-        cursor = conn.cursor()
-        logging.info('Connected to SQLite database "%s"', sqliteDbName)
-
         t=('2', str(datetime.datetime.now()), uSol, '0.0', iSol, '0.0', uNet, '0.0', '0.0', '0.0', '0.0', '0.0', fNet, wSol, wTod, wTot, mTod, hTot, tSol, '0.0', '0.0', statBits, '0.0', response)
-        logging.debug("Writing results to database: %s", t)
-
-        cursor.execute("INSERT INTO inverterdata VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", t)
-        conn.commit()
-        logging.debug("Data committed to database")
+        store_results(conn, t, resultsSol['name'])
+        resultsSol['DateTime'] = t[1]
 
-    # while retries
     logging.info("Closing connection to serial port")
-    if serPort is not None:
-        serPort.close()
+    serPort.close()
+    store_link_stats(conn, link, resultsSol['name'])
+    return resultsSol
+
+# Keep the energy counter of an inverter (see counters), and add its yield of this year and its
+# lifetime yield (corrected for counter resets) to the results
+energyCounters = None
+def track_energy(conn, results):
+    global energyCounters
+    if not results['success']:
+        return
+    import counters
+    if energyCounters is None or energyCounters.conn is not conn:
+        history = lambda inverterId: select_inverterdata("SELECT DateTime, EnergyTotal FROM inverterdata "
+                                                         "WHERE Inverter_ID=? ORDER BY DateTime", (inverterId,))
+        energyCounters = counters.Counters(conn, history)
+    try:
+        yields = energyCounters.observe(results['id'], results.get('DateTime') or str(datetime.datetime.now()),
+                                        results['EnergyTotal'], results.get('counterWrap'))
+        conn.commit()
+    except sqlite3.Error as inst:
+        logging.error("Cannot update energy counters: %s", inst.args[0])
+        return
+    results['EnergyYear'] = yields['year']
+    results['EnergyLifetime'] = yields['lifetime']
+
+# Add the clear-sky output of an inverter's array (see clearsky) and its performance ratio to the
+# results, when clearskyDir is set (the model needs NumPy, which slows down the start of every cron
+# run). The model is set up on first use, from the pvarray table; its daily curves are cached in
+# clearskyDir, so a cron run only reads the curve of the day
+expectedOutput = None
+def add_performance(results):
+    global expectedOutput
+    if not clearskyDir or not results['success']:
+        return
+    if expectedOutput is None:
+        try:
+            import clearsky
+            expectedOutput = clearsky.ExpectedOutput(clearsky.load_arrays(sqliteDbName), siteLatitude, siteLongitude,
+                                                     clearskyDir, step)
+        except ImportError:
+            logging.warning("NumPy is not installed; no clear-sky output")
+            expectedOutput = False
+        except sqlite3.Error as inst:
+            logging.error("Cannot read the PV arrays: %s", inst.args[0])
+            return
+    if not expectedOutput:
+        return
+    now = time.time()
+    with timings.span('clearsky', results['name']):
+        expected = expectedOutput.expected(results['id'], now)
+    if expected is not None:
+        results['ExpectedPower'] = int(round(expected))
+        results['PerformanceRatio'] = expectedOutput.performanceRatio(results['id'], results['PowerAC'], now)
+
+# Write the results of an inverter to its RRD db; zeroes if it did not respond. The cycles a sleeping
+# inverter was not polled in (see scheduled_poll) are written along with the results of its probe
+def store_rrd(rrdDb, results):
+    updates = list(results.get('nightValues', []))
+    if results['success']:
+        updates.append((None, str(results['PowerAC']) + ":" + str(results['EnergyToday']) + ":" + str(results.get('EnergyYear', 0))))
+    elif not results.get('asleep'):
+        updates.append((None, str(0) + ":" + str(0) + ":" + str(0)))
+    if updates:
+        with timings.span('rrd_update', results['name']):
+            rrd_update_many(rrdDb, updates)
+
+# The night schedule (see nightschedule), loaded from stateFile (default nightStateFile) on first use,
+# and saved there by save_night_state
+nightSchedule = None
+nightScheduleFile = None
+def night_schedule(stateFile=None):
+    global nightSchedule, nightScheduleFile
+    if nightSchedule is None:
+        import nightschedule
+        nightSchedule = nightschedule.NightSchedule(siteLatitude, siteLongitude)
+        nightScheduleFile = stateFile or nightStateFile
+        nightSchedule.load(nightScheduleFile)
+    return nightSchedule
+
+# Poll an inverter, or not: at night, an inverter that went to sleep is only probed once in a while
+# (a single attempt), and not polled in the cycles between. The results still lack their 'nightValues'
+# (see NightSchedule.nightValues, which needs the energy counters)
+def night_poll(conn, portID, poll, stateFile=None):
+    schedule = night_schedule(stateFile)
+    now = time.time()
+    mode = schedule.mode(portID, now)
+    if mode == 'skip':
+        logging.debug("Inverter on %s is asleep; not polling", portID)
+        schedule.skip(portID, now)
+        return schedule.sleepingResults(portID)
+    results = poll(conn, portID, 1 if mode == 'probe' else None)
+    return schedule.observe(portID, results, now, mode == 'probe')
+
+# Poll an inverter, keeping its energy counters (see track_energy), following the night schedule
+def scheduled_poll(conn, portID, poll):
+    if not nightStateFile:
+        results = poll(conn, portID)
+        track_energy(conn, results)
+        return results
+    results = night_poll(conn, portID, poll)
+    track_energy(conn, results)
+    return night_schedule().nightValues(portID, results, time.time())
+
+def save_night_state():
+    if nightSchedule is not None:
+        try:
+            nightSchedule.save(nightScheduleFile)
+        except (IOError, OSError) as inst:
+            logging.error("Cannot save night schedule to '%s': %s", nightScheduleFile, inst)
+
+# Check the results of an inverter for anomalies (see anomaly), and store the events found. The
+# detector's state is loaded from anomalyStateFile on first use, and saved by save_anomaly_state
+detector = None
+def detect_anomalies(conn, results):
+    global detector
+    if not anomalyStateFile:
+        return []
+    if detector is None:
+        import anomaly
+        detector = anomaly.Detector()
+        detector.load(anomalyStateFile)
+    if not results['success']:
+        detector.missing(results['id'])
+        return []
+    with timings.span('anomaly', results['name']):
+        events = detector.observe(results)
+        if events:
+            try:
+                for event in events:
+                    event.store(conn)
+                conn.commit()
+            except sqlite3.Error as inst:
+                logging.error("Cannot store events: %s", inst.args[0])
+    return events
+
+def save_anomaly_state():
+    if detector is not None:
+        try:
+            detector.save(anomalyStateFile)
+        except (IOError, OSError) as inst:
+            logging.error("Cannot save anomaly detector state to '%s': %s", anomalyStateFile, inst)
 
-    # Write results to RRD db -- update using time of 'now' (N). Lifted from solget.sh
-    rrdWrite = str(0) + ":" + str(0) + ":" + str(0)
-    if resultsSol['success']:
-        rrdWrite = str(resultsSol["PowerAC"]) + ":" +  str(resultsSol['EnergyToday']) + ":" + str(resultsSol["EnergyTotal"] - 364.31)
+# One collection cycle (see poll_cycle); the protocol trace is written when an inverter does not
+# respond properly
+def collect_cycle(conn):
     try:
-        rrdResult = subprocess.call(['rrdtool', 'update', rrdDbSol, 'N:' + rrdWrite])
-        logging.debug("Data (%s) committed to RRD database; exit code is %s", rrdWrite, rrdResult)
-    except subprocess.CalledProcessError as inst:
-        logging.error('Error writing data to RRD: %s', inst.args[0])
+        results = poll_cycle(conn)
+    except Exception:
+        dump_trace('exception')
+        raise
+    failed = [r['name'] for r in results if not r['success']]
+    if failed:
+        dump_trace('no valid response from ' + ', '.join(failed))
+    return results
+
+# Poll all inverters, store their data and update the HTML page
+def poll_cycle(conn):
+    resultsBLS = scheduled_poll(conn, blsPort, poll_blacklinesolar)
+    add_performance(resultsBLS)
+    store_rrd(rrdDbBLS, resultsBLS)
+    publish_sample(resultsBLS)
+    detect_anomalies(conn, resultsBLS)
+
+    resultsSol = scheduled_poll(conn, solPort, poll_soladin)
+    add_performance(resultsSol)
+    store_rrd(rrdDbSol, resultsSol)
+    publish_sample(resultsSol)
+    detect_anomalies(conn, resultsSol)
+    save_anomaly_state()
+    save_night_state()
 
     # Update HTML page
-    create_html(resultsBLS, resultsSol)
+    with timings.span('html'):
+        create_html([resultsBLS, resultsSol])
+    return [resultsBLS, resultsSol]
+
+# Ports polled by the supervisor (--supervise): (port, poll function, RRD file). Every port gets its
+# own worker process; add a line per serial adapter
+def supervised_ports():
+    return [(blsPort, poll_blacklinesolar, rrdDbBLS),
+            (solPort, poll_soladin, rrdDbSol)]
+
+# Night schedule state file of the worker of a port: SolarStats.night.json -> SolarStats.night.dev_ttyUSB0.json
+def port_night_state_file(port):
+    base, ext = os.path.splitext(nightStateFile)
+    return '%s.%s%s' % (base, ''.join(c if c.isalnum() else '_' for c in port).strip('_'), ext)
+
+# Poll a supervised port, following the night schedule (runs in the worker of the port, which keeps
+# the schedule of its port in a state file of its own)
+def poll_port(conn, port):
+    for portID, poll, rrdDb in supervised_ports():
+        if portID == port:
+            if not nightStateFile:
+                return poll(conn, port)
+            results = night_poll(conn, port, poll, port_night_state_file(port))
+            save_night_state()
+            return results
+
+# Store the results of a supervised port (runs in the writer, which keeps the energy counters of the
+# night schedule in nightStateFile)
+def store_port_results(conn, port, results):
+    for portID, poll, rrdDb in supervised_ports():
+        if portID == port:
+            track_energy(conn, results)
+            if nightStateFile:
+                night_schedule().nightValues(port, results, time.time())
+            add_performance(results)
+            store_rrd(rrdDb, results)
+    remember_sample(results)
+    publish_sample(results)
+    detect_anomalies(conn, results)
+
+# Update the HTML page once all ports have been polled (runs in the writer), and save the stage timings
+# of the cycle, the workers' included (see supervisor). The first cycle of a day ends the day before
+cycleDay = None
+def finish_cycle(conn, cycle, results):
+    global cycleDay
+    create_html(results)
+    save_anomaly_state()
+    save_night_state()
+    if forwardUrl:
+        forward_samples(conn)
+    day = time.strftime('%Y-%m-%d', time.localtime(cycle))
+    if cycleDay is not None and day != cycleDay:
+        end_of_day(conn, cycleDay)
+    cycleDay = day
+    if timings.enabled:
+        logging.info("Cycle timings: %s", timings.summary())
+        timings.save(timingStateFile, metricsFile)
+        timings.cycle = []
+
+# Set up the writer of --supervise: load the recent samples (runs in the writer process, also after a restart)
+def start_writer(conn):
+    keep_recent_samples()
+
+# Poll all ports every step seconds, one worker process per port (see supervisor)
+def supervise():
+    import supervisor
+    ports = [port for port, poll, rrdDb in supervised_ports()]
+    sup = supervisor.Supervisor(ports, poll_port, sqliteDbName, interval=step, handleResult=store_port_results,
+                                handleCycle=finish_cycle, handleStart=start_writer)
+    logging.info("Supervising %d ports: %s", len(ports), ', '.join(ports))
+    print "Supervising %d ports: %s" % (len(ports), ', '.join(ports))
+    sup.run()
+
+########
+### MAIN
+########
+if __name__=="__main__":
+    # Log file for reference
+    logging.basicConfig(filename=logFile, level=logLevel, format='%(asctime)s - %(levelname)s - %(message)s')
+    logging.info('Logging started...')
+
+    # Script-specific 'cronjobs'
+    hour = datetime.datetime.now().hour
+    minute = datetime.datetime.now().minute
+
+    args = parse_args()
+
+    if args.create:
+        create_databases()
+        sys.exit()
+
+    if args.provision:
+        provision_databases()
+        sys.exit()
+
+    if args.export:
+        if int(args.export) in [1, 2]:    # Currently only existing inverterIDs
+            export_data(args.export)
+        else:
+            print "Non-existent inverter ID (" + args.export + "); exiting..."
+        sys.exit()
+
+    if args.link_stats:
+        print_link_stats()
+        sys.exit()
+
+    if args.serve:
+        serve(args.serve)
+        sys.exit()
+
+    if args.ingest:
+        serve_ingest(args.ingest)
+        sys.exit()
+
+    if args.forward:
+        if not forwardUrl:
+            print "No ingestion server configured (forwardUrl)"
+            sys.exit(1)
+        conn = sqlite3.connect(sqliteDbName)
+        print "Forwarded %d samples" % forward_samples(conn)
+        conn.close()
+        sys.exit()
+
+    if args.performance:
+        print_performance(args.performance)
+        sys.exit()
+
+    if args.rotate_shards:
+        conn = sqlite3.connect(sqliteDbName)
+        for key, count in sorted(rotate_shards(conn).items()):
+            print "Moved %d rows into the shard of %s" % (count, key)
+        conn.close()
+        sys.exit()
+
+    if args.import_dump:
+        import_dump(args.import_dump)
+        sys.exit()
+
+    if args.test:
+        test_inverter()
+        sys.exit()
+
+    if args.show_trace:
+        show_trace(args.show_trace)
+        sys.exit()
+
+    # Write the protocol trace when asked to (kill -USR1 <pid>)
+    signal.signal(signal.SIGUSR1, lambda signum, frame: dump_trace('signal'))
+
+    if args.replay:
+        replay_capture(args.replay, args.real_time)
+        sys.exit()
+
+    if args.capture:
+        import atexit
+        frameTrace.capture = frametrace.CaptureFile(args.capture)
+        atexit.register(frameTrace.capture.close)
+
+    if args.profile:
+        profile_cycles(args.profile, args.profiler, args.simulate)
+        sys.exit()
+
+    if args.simulate:
+        use_simulator()
+
+    if metricsFile:
+        timings.enabled = True
+        timings.load(timingStateFile)
+
+    if args.supervise:
+        supervise()
+        sys.exit()
+
+    # Create graphs every hour, or when asked by the user
+    if (args.graph or minute == 0):
+        logging.debug("Creating RRD graphs (crontime is %s:%s)...", hour, minute)
+        epochNow=int(time.time()) # Seconds since epoch
+        logging.info("Creating RRD graphs, using end time %i", epochNow)
+        for imgName, period, imgTitle in graphPeriods:
+            with timings.span('graph'):
+                rrd_graph(imgName, epochNow - period, epochNow, imgTitle)
+    if args.graph or not args.simulate:
+        if timings.enabled:
+            timings.save(timingStateFile, metricsFile)
+        if not args.graph:
+            print "End of main due to testing"
+        sys.exit()
+
+    # Open database
+    conn = sqlite3.connect(sqliteDbName)
+    logging.info('Connected to SQLite database "%s"', sqliteDbName)
+    print "Using log file '" + logFile + "'; database '" + sqliteDbName + "'; RRD files '" + rrdDbBLS + "'; '" + rrdDbSol + "'"
+
+    collect_cycle(conn)
+    if forwardUrl:
+        forward_samples(conn)
 
-    # End of day checks: archive graphs
     if (hour == 23 and minute == 55):
-        # Copy the file to the 'archive' directory
-        logging.info("%s:%s: archiving graphs to '%s'", hour, minute, rrdArchDir)
-        filenames = os.listdir(webDir)
-        logging.debug("Found files: '%s'", filenames)
-        try:
-            for imgName in fnmatch.filter(filenames, 'solarStats*.png'):
-                root, ext = os.path.splitext(imgName)
-                shutil.copy(os.path.join(webDir, imgName), os.path.join(os.getcwd(), rrdArchDir, root + "_" + str(time.strftime("%Y-%m-%d")) + ext))
-                logging.debug("Copying/renaming file '%s' from '%s' to '%s'", imgName, webDir, rrdArchDir)
-        except IOError as inst:
-            logging.error("Cannot copy/archive file '%s' from '%s' to '%s': %s", imgName, webDir, rrdArchDir, inst.args[0])
+        end_of_day(conn)
 
     # Closedown
     logging.info("Closing connection to database")
     conn.close()
+
+    if timings.enabled:
+        logging.info("Cycle timings: %s", timings.summary())
+        timings.save(timingStateFile, metricsFile)
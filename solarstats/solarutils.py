@@ -3,6 +3,15 @@ import logging  # General logging
 import math     # Math utils (pow)
 
 
+# Errors raised when parsing inverter responses. Both are ValueErrors, so callers that only care
+# whether a response is valid can keep catching ValueError
+class CrcError(ValueError):
+    pass
+
+class FrameLengthError(ValueError):
+    pass
+
+
 class SolarUtils:
     def __init__(self):
         pass
@@ -49,3 +58,18 @@ class SolarUtils:
         return result
         #return int(inp, 16)
         # For \xFF encoded strings: ord('\xFF')
+
+
+# Hex representation of data that is only built when it is used, so it can be passed to logging
+# calls without formatting anything when the log record is not emitted:
+#   logging.info("Received: %s", LazyHex(data))
+class LazyHex:
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return _utils.printhex(self.data)
+
+_utils = SolarUtils()
@@ -0,0 +1,358 @@
+# Embedded HTTP status server: serves the status page from memory, the latest per-inverter
+# state as JSON, the recent samples, downsampled series for charts and the graphs, with
+# ETag/If-None-Match and gzip support
+import BaseHTTPServer   # HTTP server
+import SocketServer     # Threading mix-in
+import calendar         # Series ranges
+import gzip             # Response compression
+import hashlib          # ETags
+import json             # JSON API
+import logging          # General logging
+import os               # File utils
+import sqlite3          # Database connection
+import StringIO         # In-memory gzip buffer
+import sys              # Exception info
+import threading        # Locks
+import time             # Sample age
+import urlparse         # Request path parsing
+
+import linkstats        # Serial link statistics
+
+
+class LatestSamples:
+    columns = ['DateTime', 'VoltsPV1', 'VoltsPV2', 'CurrentPV1', 'CurrentPV2', 'VoltsAC1', 'FrequencyAC', 'PowerAC',
+               'EnergyToday', 'EnergyTotal', 'MinToday', 'HrsTotal', 'Temperature', 'Status1', 'Status2']
+
+    # Latest sample per inverter, read from the SQLite database. The samples are cached until the
+    # database file changes, so polling clients do not cause any queries; whether they are recent
+    # enough is decided for every request
+    def __init__(self, dbName, inverters, maxAge=600):
+        self.dbName = dbName
+        self.inverters = inverters
+        self.maxAge = maxAge        # Samples older than this (in seconds) mark the inverter as off
+        self._version = None
+        self._samples = []          # (sample, time of the sample or None)
+        self._lock = threading.Lock()
+
+    # Version of the data; changes whenever the database is written to
+    def version(self):
+        try:
+            st = os.stat(self.dbName)
+        except OSError:
+            return None
+        return '%x-%x' % (int(st.st_mtime * 1000), st.st_size)
+
+    # Returns (version, samples), where samples is a list of dicts (one per inverter). The version also
+    # changes when a sample gets too old
+    def get(self, now=None):
+        version = self.version()
+        with self._lock:
+            if version != self._version:
+                self._samples = self._load()
+                self._version = version
+            loaded = self._samples
+        now = now or time.time()
+        samples = [dict(sample, success=sampleTime is not None and now - sampleTime <= self.maxAge)
+                   for sample, sampleTime in loaded]
+        return '%s-%s' % (version, ''.join('1' if sample['success'] else '0' for sample in samples)), samples
+
+    def _load(self):
+        samples = []
+        conn = sqlite3.connect(self.dbName)
+        try:
+            for iv in self.inverters:
+                row = conn.execute("SELECT " + ', '.join(self.columns) + " FROM inverterdata WHERE Inverter_ID=? "
+                                   "ORDER BY DateTime DESC LIMIT 1", (iv.id,)).fetchone()
+                sample = dict.fromkeys(self.columns[1:], 0)
+                sample.update({'id': iv.id, 'name': iv.label, 'success': False, 'statusText': 'No data'})
+                sampleTime = None
+                if row is not None:
+                    sample.update((name, value) for name, value in zip(self.columns, row) if value is not None)
+                    sampleTime = time.mktime(time.strptime(row[0][:19], "%Y-%m-%d %H:%M:%S"))
+                    sample['statusText'] = 'Last sample: %s' % row[0][:19]
+                samples.append((sample, sampleTime))
+        finally:
+            conn.close()
+        return samples
+
+
+class StatusRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.respond(self.route)
+
+    # The headers of GET, without the body; the event stream is not started
+    def do_HEAD(self):
+        self.respond(lambda path, query: self.sendEventHeaders()
+                     if path == '/events' and self.server.hub is not None else self.route(path, query))
+
+    # Answer a request with handler(path, query). When it fails before the response was started, a
+    # 500 is sent; after that, the connection is closed, as the client already got (part of) a response
+    def respond(self, handler):
+        self.responded = False
+        url = urlparse.urlparse(self.path)
+        try:
+            handler(url.path, url.query)
+        except Exception:
+            logging.exception("Error handling request for %s", self.path)
+            if self.responded:
+                self.close_connection = True
+            else:
+                self.sendBody(500, 'text/plain', 'Internal error\n')
+
+    def route(self, path, query):
+        if path in ('/', '/index.html'):
+            self.sendCached('text/html; charset=utf-8', *self.server.page())
+        elif path == '/api/inverters':
+            self.sendCached('application/json', *self.server.json())
+        elif path == '/api/linkstats':
+            self.sendCached('application/json', *self.server.linkStats())
+        elif path == '/api/series' and self.server.downsampler is not None:
+            self.sendSeries(urlparse.parse_qs(query))
+        elif path == '/api/recent' and self.server.recent is not None:
+            self.sendRecent(urlparse.parse_qs(query))
+        elif path == '/metrics' and self.server.metricsFile is not None:
+            self.sendMetrics()
+        elif path == '/events' and self.server.hub is not None:
+            self.sendEvents()
+        elif path.endswith('.png') and '/' not in path[1:]:
+            self.sendGraph(path[1:], urlparse.parse_qs(query).get('v'))
+        else:
+            self.sendBody(404, 'text/plain', 'Not found\n')
+
+    def send_response(self, code, message=None):
+        self.responded = True
+        BaseHTTPServer.BaseHTTPRequestHandler.send_response(self, code, message)
+
+    # Send a body that is identified by etag, honouring If-None-Match and Accept-Encoding
+    def sendCached(self, contentType, etag, body, cacheControl='no-cache'):
+        headers = {'ETag': etag, 'Cache-Control': cacheControl}
+        if self.headers.get('If-None-Match') == etag:
+            self.sendBody(304, contentType, '', headers)
+            return
+        if 'gzip' in self.headers.get('Accept-Encoding', '') and not contentType.startswith('image/'):
+            body = self.server.gzipped(etag, body)
+            headers['Content-Encoding'] = 'gzip'
+            headers['Vary'] = 'Accept-Encoding'
+        self.sendBody(200, contentType, body, headers)
+
+    def sendBody(self, code, contentType, body, headers=None):
+        self.send_response(code)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def sendSeries(self, query):
+        try:
+            result = self.server.series(query)
+        except ValueError as inst:
+            self.sendBody(400, 'text/plain', '%s\n' % inst.args[0])
+            return
+        self.sendCached('application/json', *result)
+
+    # Recent samples of an inverter from memory: ?inverter=1&minutes=60 (the default), or &today=1
+    def sendRecent(self, query):
+        try:
+            inverterId = int(query.get('inverter', ['1'])[0])
+            minutes = float(query.get('minutes', ['60'])[0])
+        except ValueError:
+            self.sendBody(400, 'text/plain', 'Invalid inverter or minutes\n')
+            return
+        if query.get('today', ['0'])[0] not in ('', '0'):
+            window = self.server.recent.today(inverterId)
+        else:
+            window = self.server.recent.lastMinutes(inverterId, minutes)
+        if window is None:
+            self.sendBody(404, 'text/plain', 'No recent samples of inverter %d\n' % inverterId)
+            return
+        body = json.dumps(dict((name, [None if v != v else v for v in values.tolist()]) for name, values in window.items()),
+                          sort_keys=True, separators=(',', ':'))
+        self.sendBody(200, 'application/json', body, {'Cache-Control': 'no-cache'})
+
+    # Graphs requested with their render time (?v=...) never change, so they can be cached 'forever'
+    def sendGraph(self, imgName, version):
+        fileName = self.server.graph(imgName)
+        if fileName is None:
+            self.sendBody(404, 'text/plain', 'Not found\n')
+            return
+        st = os.stat(fileName)
+        etag = '"%x-%x"' % (int(st.st_mtime), st.st_size)
+        cacheControl = 'public, max-age=31536000' if version == [str(int(st.st_mtime))] else 'no-cache'
+        if self.headers.get('If-None-Match') == etag:
+            self.sendBody(304, 'image/png', '', {'ETag': etag, 'Cache-Control': cacheControl})
+            return
+        with open(fileName, 'rb') as f:
+            body = f.read()
+        self.sendBody(200, 'image/png', body, {'ETag': etag, 'Cache-Control': cacheControl})
+
+    # Stage timings of the collector (see timing), as written after each cycle
+    def sendMetrics(self):
+        try:
+            with open(self.server.metricsFile, 'r') as f:
+                body = f.read()
+        except IOError:
+            self.sendBody(404, 'text/plain', 'No metrics yet\n')
+            return
+        self.sendBody(200, 'text/plain; version=0.0.4', body, {'Cache-Control': 'no-cache'})
+
+    # Server-sent events: stream the live feed until the client goes away or is dropped as too slow
+    def sendEvents(self):
+        self.sendEventHeaders()
+        subscription = self.server.hub.subscribe()
+        try:
+            self.wfile.write('retry: 10000\n\n')
+            while not subscription.dropped:
+                event = subscription.get(self.server.keepAlive)
+                self.wfile.write(event if event is not None else ': keep-alive\n\n')
+                self.wfile.flush()
+        except (IOError, OSError):
+            pass    # Client disconnected
+        finally:
+            self.server.hub.unsubscribe(subscription)
+
+    def sendEventHeaders(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        logging.debug("HTTP %s - %s", self.address_string(), format % args)
+
+
+class StatusServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    # samples: LatestSamples; page: htmlpage.StatusPage; renderGraph: optional callable(imgName) that
+    # (re)draws a graph into graphDir, called on demand when a graph is older than graphMaxAge seconds
+    # hub: optional livefeed.FanoutHub, served at /events; metricsFile: optional Prometheus text file, served at /metrics
+    # downsampler: optional downsample.Downsampler, served at /api/series; recent: optional
+    # ringbuffer.RecentSamples, served at /api/recent
+    def __init__(self, address, samples, page, graphDir, renderGraph=None, graphMaxAge=300, uptime=None, hub=None,
+                 metricsFile=None, downsampler=None, recent=None):
+        BaseHTTPServer.HTTPServer.__init__(self, address, StatusRequestHandler)
+        self.downsampler = downsampler
+        self.recent = recent
+        self.hub = hub
+        self.metricsFile = metricsFile
+        self.keepAlive = 15             # Seconds between keep-alive comments on idle event streams
+        self.samples = samples
+        self.statusPage = page
+        self.graphDir = graphDir
+        self.renderGraph = renderGraph
+        self.graphMaxAge = graphMaxAge
+        self.uptime = uptime or (lambda: '')
+        self._cache = {}                # name -> (key, etag, body)
+        self._gzipCache = {}            # etag -> gzipped body
+        self._lock = threading.Lock()
+        self._graphLock = threading.Lock()
+
+    # Request errors are caught in the handler; what gets here are clients that went away mid-response
+    def handle_error(self, request, client_address):
+        logging.debug("Connection from %s closed: %s", client_address[0], sys.exc_info()[1])
+
+    def _cached(self, name, key, build):
+        with self._lock:
+            entry = self._cache.get(name)
+            if entry is not None and entry[0] == key:
+                return entry[1], entry[2]
+        body = build()
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()[:16]
+        with self._lock:
+            if len(self._cache) > 64:
+                self._cache.clear()
+            self._cache[name] = (key, etag, body)
+        return etag, body
+
+    # (etag, body) of the status page. Graph sources carry their render time, so browsers refetch a
+    # graph only after it was redrawn
+    def page(self):
+        version, samples = self.samples.get()
+        graphs = []
+        for src, alt in self.statusPage.graphs:
+            fileName = os.path.join(self.graphDir, src)
+            mtime = int(os.stat(fileName).st_mtime) if os.path.isfile(fileName) else 0
+            graphs.append(('%s?v=%d' % (src, mtime), alt))
+        key = (version, tuple(graphs))
+
+        def build():
+            page = self.statusPage.__class__(self.statusPage.title, self.statusPage.heading, self.statusPage.footer, graphs,
+                                             liveFeed=self.hub is not None)
+            links = linkstats.page_rows(self.samples.dbName, self.samples.inverters)
+            return page.render(samples, time.asctime(), self.uptime(), links)[0]
+        return self._cached('page', key, build)
+
+    # (etag, body) of the JSON representation of the latest samples
+    def json(self):
+        version, samples = self.samples.get()
+        return self._cached('json', version, lambda: json.dumps(samples, sort_keys=True, separators=(',', ':')))
+
+    # (etag, body) of the serial link statistics, per window: {"1h": [{...}, ...], "24h": ..., "7d": ...}
+    def linkStats(self):
+        version = self.samples.version()
+
+        def build():
+            stats = linkstats.windows(self.samples.dbName)
+            return json.dumps(dict((name, [link.asDict() for link in links]) for name, links in stats),
+                              sort_keys=True, separators=(',', ':'))
+        return self._cached('linkstats', version, build)
+
+    # (etag, body) of a downsampled series, for the parameters of /api/series: inverter, metric
+    # (PowerAC by default), points, and days (a range ending now) or start and end (DateTimes, such as
+    # '2014-06-01'). Raises ValueError for invalid parameters
+    def series(self, query):
+        def parameter(name, default=None):
+            return query[name][0] if name in query else default
+
+        def seconds(dateTime):
+            for format in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+                try:
+                    return calendar.timegm(time.strptime(dateTime, format))
+                except ValueError:
+                    pass
+            raise ValueError("Invalid date: %s" % dateTime)
+        try:
+            inverterId = int(parameter('inverter', 1))
+            points = int(parameter('points', 0)) or None
+            days = float(parameter('days', 0))
+        except ValueError:
+            raise ValueError("Invalid inverter, points or days")
+        metric = parameter('metric', 'PowerAC')
+        if parameter('start') is not None:
+            start = seconds(parameter('start'))
+            end = seconds(parameter('end')) if parameter('end') is not None else None
+            get = lambda: self.downsampler.get(inverterId, metric, start, end, points)
+        else:
+            span = int((days or 1) * 86400)
+            get = lambda: self.downsampler.get(inverterId, metric, calendar.timegm(time.localtime()) - span, None, points)
+        return self._cached('series %r' % sorted(query.items()), self.samples.version(),
+                            lambda: json.dumps(get(), sort_keys=True, separators=(',', ':')))
+
+    def gzipped(self, etag, body):
+        with self._lock:
+            if etag in self._gzipCache:
+                return self._gzipCache[etag]
+        buf = StringIO.StringIO()
+        with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=6, mtime=0) as f:
+            f.write(body)
+        with self._lock:
+            if len(self._gzipCache) > 16:
+                self._gzipCache.clear()
+            self._gzipCache[etag] = buf.getvalue()
+        return buf.getvalue()
+
+    # Path of a graph, redrawn first if it is missing or stale (and a renderer is available)
+    def graph(self, imgName):
+        fileName = os.path.join(self.graphDir, imgName)
+        if self.renderGraph is not None:
+            with self._graphLock:
+                if not os.path.isfile(fileName) or time.time() - os.stat(fileName).st_mtime > self.graphMaxAge:
+                    self.renderGraph(imgName)
+        return fileName if os.path.isfile(fileName) else None
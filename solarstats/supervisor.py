@@ -0,0 +1,203 @@
+# Process-per-port collection: a supervisor runs one worker process per serial port, each polling its
+# port every interval seconds, and one writer process that owns the SQLite database (and whatever else
+# is written per sample, such as the RRD files). Workers send their database writes and decoded
+# results to the writer over a pipe (multiprocessing.Queue), so polling and decoding scale with the
+# cores while there is only one database writer. Workers and writer that die are restarted, with a
+# delay that doubles with every crash
+import logging          # General logging
+import multiprocessing  # Worker processes, pipe channel
+import signal           # Worker shutdown
+import sqlite3          # Database connection
+import time             # Poll schedule, restart delays
+from timing import timings
+
+
+class Blob(str):
+    # BLOB parameter on its way to the writer (buffer objects cannot be pickled)
+    pass
+
+
+# Authorizer actions of statements that only read (SQLITE_FUNCTION and SQLITE_RECURSIVE are not in
+# the sqlite3 module); pragmas read when they are not given a value
+readActions = (sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, 31, 33)
+
+
+class ChannelConnection:
+    # Stands in for the sqlite3 connection in a worker: queries are answered by a local (reading)
+    # connection, everything else goes to the writer, which replays it in order on its connection.
+    # Statements are told apart by what they do: the reader's authorizer refuses the ones that write
+    # while they are prepared, before they run
+    def __init__(self, channel, dbName):
+        self.channel = channel
+        self.reader = sqlite3.connect(dbName)
+        self.reader.set_authorizer(self.authorize)
+        self._writes = False
+
+    def authorize(self, action, arg1, arg2, database, source):
+        if action in readActions or (action == sqlite3.SQLITE_PRAGMA and arg2 is None):
+            return sqlite3.SQLITE_OK
+        self._writes = True
+        return sqlite3.SQLITE_DENY
+
+    # A cursor with the rows of a query; None for writes, which are sent to the writer
+    def execute(self, sql, parameters=()):
+        self._writes = False
+        try:
+            return self.reader.execute(sql, parameters)
+        except sqlite3.DatabaseError:
+            if not self._writes:
+                raise
+        self.channel.put(('sql', sql, tuple(Blob(p) if isinstance(p, buffer) else p for p in parameters)))
+
+    def cursor(self):
+        return self.reader.cursor()     # For queries only (writes on it are refused)
+
+    def commit(self):
+        self.channel.put(('commit',))
+
+    def close(self):
+        self.reader.close()
+
+
+# Worker process: poll(conn, port) every interval seconds, at multiples of interval (like cron), and
+# send the results to the writer, with the stages timed while polling (see timing). Stops when
+# stopping (a multiprocessing.Event) is set, or after cycles polls, if given
+def worker_main(port, poll, channel, dbName, interval, stopping, cycles=None):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)    # The supervisor stops the workers
+    conn = ChannelConnection(channel, dbName)
+    polled = 0
+    while cycles is None or polled < cycles:
+        cycle = (int(time.time() / interval) + 1) * interval
+        stopping.wait(max(0, cycle - time.time()))
+        if stopping.is_set():
+            break
+        timings.cycle = []
+        results = poll(conn, port)
+        channel.put(('result', cycle, port, results, timings.cycle))
+        polled += 1
+    conn.close()
+
+# Writer process: applies the workers' database writes, adds their stage timings to its own, and passes
+# their results to handleResult(conn, port, results). Once every port has reported for a cycle (or a later cycle has started),
+# handleCycle(conn, cycle, results) is called with the time of the cycle and the results in the order
+# of ports. handleStart(conn) is called before the first message. Stops on None
+def writer_main(channel, dbName, ports, handleResult=None, handleCycle=None, handleStart=None):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    conn = sqlite3.connect(dbName)
+    if handleStart is not None:
+        handleStart(conn)
+    cycles = {}     # Cycle -> {port: results}
+    while True:
+        message = channel.get()
+        if message is None:
+            break
+        if message[0] == 'sql':
+            try:
+                conn.execute(message[1], tuple(buffer(p) if isinstance(p, Blob) else p for p in message[2]))
+            except sqlite3.Error as inst:
+                logging.error("Cannot store sample: %s", inst.args[0])
+        elif message[0] == 'commit':
+            conn.commit()
+        elif message[0] == 'result':
+            cycle, port, results, spans = message[1:]
+            for stage, inverter, seconds in spans:
+                timings.observe(stage, inverter, seconds)
+            if handleResult is not None:
+                handleResult(conn, port, results)
+            cycles.setdefault(cycle, {})[port] = results
+            for done in sorted(cycles):
+                if len(cycles[done]) < len(ports) and done >= cycle:
+                    break
+                reported = cycles.pop(done)
+                if handleCycle is not None:
+                    handleCycle(conn, done, [reported[p] for p in ports if p in reported])
+    conn.commit()
+    conn.close()
+
+
+class Child:
+    def __init__(self, name, target, args):
+        self.name = name
+        self.target = target
+        self.args = args
+        self.process = None
+        self.started = None
+        self.crashes = 0        # Consecutive crashes
+        self.restartAt = 0
+
+    def start(self, now):
+        self.process = multiprocessing.Process(target=self.target, args=self.args, name=self.name)
+        self.process.daemon = True
+        self.process.start()
+        self.started = now
+        logging.info("Started %s (pid %d)", self.name, self.process.pid)
+
+
+class Supervisor:
+    # ports: the ports to poll; poll(conn, port) polls one and returns its results (it runs in the
+    # worker of the port). handleResult, handleCycle and handleStart run in the writer (see writer_main)
+    def __init__(self, ports, poll, dbName, interval=300, handleResult=None, handleCycle=None, handleStart=None,
+                 restartDelay=5, maxRestartDelay=300, stableTime=600):
+        self.channel = multiprocessing.Queue()
+        self.stopping = multiprocessing.Event()
+        self.restartDelay = restartDelay
+        self.maxRestartDelay = maxRestartDelay
+        self.stableTime = stableTime    # A child that ran this long (in seconds) has its crashes forgotten
+        self.writer = Child('writer', writer_main, (self.channel, dbName, ports, handleResult, handleCycle, handleStart))
+        self.workers = [Child('worker %s' % port, worker_main, (port, poll, self.channel, dbName, interval, self.stopping))
+                        for port in ports]
+
+    def children(self):
+        return [self.writer] + self.workers
+
+    # Restart children that exited; returns the number of children running
+    def check(self, now=None):
+        now = now or time.time()
+        running = 0
+        for child in self.children():
+            if child.process is not None:
+                if child.process.is_alive():
+                    if child.crashes and now - child.started >= self.stableTime:
+                        child.crashes = 0
+                    running += 1
+                    continue
+                child.process.join()
+                child.crashes += 1
+                child.restartAt = now + min(self.restartDelay * 2 ** (child.crashes - 1), self.maxRestartDelay)
+                logging.error("%s exited (code %s); restarting in %d seconds", child.name, child.process.exitcode,
+                              child.restartAt - now)
+                child.process = None
+            if now >= child.restartAt:
+                child.start(now)
+                running += 1
+        return running
+
+    # Run until interrupted (KeyboardInterrupt, or SIGTERM)
+    def run(self, checkInterval=1.0):
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stopRunning())
+        self._running = True
+        try:
+            while self._running:
+                self.check()
+                time.sleep(checkInterval)
+        except KeyboardInterrupt:
+            pass
+        self.stop()
+
+    def stopRunning(self):
+        self._running = False
+
+    # Stop the workers (after their current poll), then let the writer finish what they sent
+    def stop(self, timeout=30):
+        self.stopping.set()
+        for child in self.workers:
+            if child.process is not None:
+                child.process.join(timeout)
+                if child.process.is_alive():
+                    child.process.terminate()
+        if self.writer.process is not None and self.writer.process.is_alive():
+            self.channel.put(None)
+            self.writer.process.join(timeout)
+            if self.writer.process.is_alive():
+                self.writer.process.terminate()
+        logging.info("Supervisor stopped")
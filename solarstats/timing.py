@@ -0,0 +1,129 @@
+# Lightweight per-stage timing of the collection cycle. Durations are aggregated into histograms per
+# (stage, inverter), kept across runs in a small state file, and exported in the Prometheus text format
+import json     # State file
+import logging  # General logging
+import os       # File utils
+import time     # Clock
+
+
+class Histogram:
+    # Upper bounds (seconds) of the histogram buckets; the last (+Inf) bucket is implicit
+    buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, counts=None, total=0.0, count=0):
+        self.counts = list(counts) if counts else [0] * (len(self.buckets) + 1)
+        self.total = total
+        self.count = count
+
+    def observe(self, seconds):
+        i = 0
+        while i < len(self.buckets) and seconds > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.total += seconds
+        self.count += 1
+
+
+class _Span:
+    __slots__ = ('timings', 'stage', 'inverter', 'start')
+
+    def __init__(self, timings, stage, inverter):
+        self.timings = timings
+        self.stage = stage
+        self.inverter = inverter
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.timings.observe(self.stage, self.inverter, time.time() - self.start)
+        return False
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        return False
+
+
+class Timings:
+    _noSpan = _NoSpan()     # Shared by all disabled spans, so a disabled span allocates nothing
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.histograms = {}    # (stage, inverter) -> Histogram
+        self.cycle = []         # (stage, inverter, seconds) observed in this run
+
+    # Context manager timing a stage, e.g. 'with timings.span("sqlite", "BLS3000"):'
+    def span(self, stage, inverter=''):
+        if not self.enabled:
+            return self._noSpan
+        return _Span(self, stage, inverter)
+
+    def observe(self, stage, inverter, seconds):
+        if not self.enabled:
+            return
+        key = (stage, inverter)
+        if key not in self.histograms:
+            self.histograms[key] = Histogram()
+        self.histograms[key].observe(seconds)
+        self.cycle.append((stage, inverter, seconds))
+
+    # One line with the total time per stage (and inverter) in this run
+    def summary(self):
+        totals = {}
+        for stage, inverter, seconds in self.cycle:
+            key = stage + ('[%s]' % inverter if inverter else '')
+            totals[key] = totals.get(key, 0.0) + seconds
+        return ' '.join('%s=%.3fs' % (key, totals[key]) for key in sorted(totals))
+
+    # Histograms in the Prometheus text exposition format
+    def prometheus(self, prefix='solarstats_stage_seconds'):
+        lines = ['# HELP %s Duration of the collection cycle stages.' % prefix, '# TYPE %s histogram' % prefix]
+        for (stage, inverter), hist in sorted(self.histograms.items()):
+            labels = 'stage="%s",inverter="%s"' % (stage, inverter)
+            cumulative = 0
+            for bound, count in zip(Histogram.buckets, hist.counts):
+                cumulative += count
+                lines.append('%s_bucket{%s,le="%g"} %d' % (prefix, labels, bound, cumulative))
+            lines.append('%s_bucket{%s,le="+Inf"} %d' % (prefix, labels, hist.count))
+            lines.append('%s_sum{%s} %.6f' % (prefix, labels, hist.total))
+            lines.append('%s_count{%s} %d' % (prefix, labels, hist.count))
+        return '\n'.join(lines) + '\n'
+
+    # Merge the histograms kept by earlier runs
+    def load(self, stateFile):
+        try:
+            with open(stateFile, 'r') as f:
+                state = json.load(f)
+        except (IOError, ValueError):
+            return
+        for stage, inverter, counts, total, count in state:
+            if len(counts) != len(Histogram.buckets) + 1:
+                continue    # Bucket layout changed; start over
+            key = (str(stage), str(inverter))
+            hist = self.histograms.setdefault(key, Histogram())
+            hist.counts = [a + b for a, b in zip(hist.counts, counts)]
+            hist.total += total
+            hist.count += count
+
+    def save(self, stateFile, promFile=None):
+        state = [[stage, inverter, hist.counts, hist.total, hist.count]
+                 for (stage, inverter), hist in sorted(self.histograms.items())]
+        self._atomicWrite(stateFile, json.dumps(state))
+        if promFile:
+            self._atomicWrite(promFile, self.prometheus())
+        logging.debug("Saved stage timings to '%s'", stateFile)
+
+    @staticmethod
+    def _atomicWrite(fileName, content):
+        with open(fileName + '.tmp', 'w') as f:
+            f.write(content)
+        os.rename(fileName + '.tmp', fileName)
+
+
+# Shared instance, used by the collector and the drivers; disabled until enabled by the collector
+timings = Timings()
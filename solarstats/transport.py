@@ -0,0 +1,234 @@
+# Modbus transports for inverters behind Ethernet gateways: Modbus TCP (MBAP header instead of the
+# address and CRC of an RTU frame) and RTU over TCP (RTU frames, CRC included, tunnelled through the
+# gateway). Connections are pooled per gateway. Modbus TCP requests can be pipelined: several are sent
+# before the first response arrives, and responses are matched to requests by transaction ID, so the
+# slaves behind one gateway can be polled without waiting a round trip for each (ModbusTcpClient.pipeline).
+# The ports (see open_port) stand in for a serial port, so the collector polls through them unchanged.
+# The collector polls one inverter per port, so it sends one request at a time (transact); pipeline is
+# for polling several slaves behind one gateway, which the collector does not do yet
+import logging  # General logging
+import socket   # TCP connections
+import struct   # MBAP header
+import threading    # Locks
+import urlparse # Port URLs
+
+mbapHeader = struct.Struct('>HHHB')     # Transaction ID, protocol ID (0), length (of unit ID and PDU), unit ID
+
+
+class TransportError(IOError):
+    pass
+
+
+# Read exactly size bytes from sock
+def receive_exactly(sock, size):
+    data = []
+    received = 0
+    while received < size:
+        chunk = sock.recv(size - received)
+        if not chunk:
+            raise TransportError("Connection closed by gateway")
+        data.append(chunk)
+        received += len(chunk)
+    return ''.join(data)
+
+
+class ConnectionPool:
+    # Open connections, by gateway address; a connection is used by one transaction (or pipeline) at a time
+    def __init__(self, timeout=2.0, maxIdle=4):
+        self.timeout = timeout      # Connect and response timeout, in seconds
+        self.maxIdle = maxIdle      # Idle connections kept per gateway
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, address):
+        with self._lock:
+            idle = self._idle.get(address)
+            if idle:
+                return idle.pop()
+        try:
+            sock = socket.create_connection(address, self.timeout)
+        except socket.error as inst:
+            raise TransportError("Cannot connect to %s:%d: %s" % (address[0], address[1], inst))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    # Return a connection to the pool; broken connections (timeouts, errors) are closed, as stray
+    # responses may still arrive on them
+    def release(self, address, sock, broken=False):
+        if not broken:
+            with self._lock:
+                idle = self._idle.setdefault(address, [])
+                if len(idle) < self.maxIdle:
+                    idle.append(sock)
+                    return
+        sock.close()
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for sock in idle:
+                    sock.close()
+            self._idle = {}
+
+# Shared by all clients
+pool = ConnectionPool()
+
+
+class ModbusTcpClient:
+    def __init__(self, address, connections=None, window=8):
+        self.address = address
+        self.connections = connections or pool
+        self.window = window        # Requests in flight on a connection
+        self._transactionId = 0
+        self._lock = threading.Lock()
+
+    def nextTransactionId(self):
+        with self._lock:
+            self._transactionId = (self._transactionId + 1) & 0xFFFF
+            return self._transactionId
+
+    # MBAP frame of a request
+    def frame(self, transactionId, unit, pdu):
+        return mbapHeader.pack(transactionId, 0, len(pdu) + 1, unit) + pdu
+
+    def receiveFrame(self, sock):
+        header = receive_exactly(sock, mbapHeader.size)
+        transactionId, protocol, length, unit = mbapHeader.unpack(header)
+        if protocol != 0 or length < 2:
+            raise TransportError("Invalid MBAP header (protocol %d, length %d)" % (protocol, length))
+        return transactionId, header + receive_exactly(sock, length - 1)
+
+    # Send requests ((unit, pdu) pairs) on one connection, at most window at a time; returns the response
+    # frames in the order of the requests (None for requests without a response before the timeout)
+    def pipeline(self, requests):
+        responses = [None] * len(requests)
+        pending = {}    # Transaction ID -> index of the request
+        sock = self.connections.acquire(self.address)
+        broken = False
+        try:
+            sent = 0
+            while sent < len(requests) or pending:
+                while sent < len(requests) and len(pending) < self.window:
+                    transactionId = self.nextTransactionId()
+                    pending[transactionId] = sent
+                    sock.sendall(self.frame(transactionId, *requests[sent]))
+                    sent += 1
+                transactionId, frame = self.receiveFrame(sock)
+                if transactionId in pending:
+                    responses[pending.pop(transactionId)] = frame
+                else:
+                    logging.warning("Discarding response with unknown transaction ID %d from %s", transactionId, self.address[0])
+        except socket.timeout:
+            broken = True
+            logging.warning("Timeout waiting for %d responses from %s", len(pending), self.address[0])
+        except (socket.error, TransportError):
+            broken = True
+            raise
+        finally:
+            self.connections.release(self.address, sock, broken)
+        return responses
+
+    def transact(self, unit, pdu):
+        return self.pipeline([(unit, pdu)])[0]
+
+
+class RtuOverTcpClient:
+    # RTU frames carry no transaction ID, so transactions on a gateway follow each other
+    def __init__(self, address, connections=None):
+        self.address = address
+        self.connections = connections or pool
+        self._lock = threading.Lock()
+
+    # Read an RTU response; its length follows from the function code (and byte count)
+    def receiveFrame(self, sock):
+        head = receive_exactly(sock, 2)
+        functionCode = ord(head[1])
+        if functionCode & 0x80:
+            rest = 3                # Exception code, CRC
+        elif functionCode in (0x01, 0x02, 0x03, 0x04):
+            head += receive_exactly(sock, 1)
+            rest = ord(head[2]) + 2 # Data, CRC
+        else:
+            rest = 6                # Writes echo address and quantity (or value), CRC
+        return head + receive_exactly(sock, rest)
+
+    # Send an RTU frame; returns the response frame ('' if none arrived before the timeout)
+    def transact(self, adu):
+        with self._lock:
+            sock = self.connections.acquire(self.address)
+            broken = False
+            try:
+                sock.sendall(adu)
+                return self.receiveFrame(sock)
+            except socket.timeout:
+                broken = True
+                return ''
+            except (socket.error, TransportError):
+                broken = True
+                raise
+            finally:
+                self.connections.release(self.address, sock, broken)
+
+
+class TcpPort:
+    # Stands in for serial.Serial: the response to each frame written is read back one character at a time
+    def __init__(self, url):
+        self.port = url
+        self._pending = ''
+        self._open = True
+
+    def __str__(self):
+        return "%s(%s)" % (self.__class__.__name__, self.port)
+
+    def write(self, data):
+        try:
+            self._pending = self.transact(data) or ''
+        except (socket.error, TransportError) as inst:
+            logging.error("Transaction with %s failed: %s", self.port, inst)
+            self._pending = ''
+        return len(data)
+
+    def read(self, size=1):
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+    def isOpen(self):
+        return self._open
+
+    def close(self):
+        self._open = False      # The connection stays in the pool
+
+
+class ModbusTcpPort(TcpPort):
+    framing = 'mbap'    # Responses are MBAP frames (see BlackLineSolar.mb_parseTcpResponse)
+
+    def __init__(self, url, address, connections=None):
+        TcpPort.__init__(self, url)
+        self.client = ModbusTcpClient(address, connections)
+
+    # The drivers build RTU frames; their PDU (without address and CRC) is sent in an MBAP frame
+    def transact(self, adu):
+        return self.client.transact(ord(adu[0]), adu[1:-2])
+
+
+class RtuOverTcpPort(TcpPort):
+    framing = 'rtu'
+
+    def __init__(self, url, address, connections=None):
+        TcpPort.__init__(self, url)
+        self.client = RtuOverTcpClient(address, connections)
+
+    def transact(self, adu):
+        return self.client.transact(adu)
+
+
+# Port for a URL: 'tcp://gateway[:502]' (Modbus TCP) or 'rtu+tcp://gateway:port' (RTU over TCP)
+def open_port(url, connections=None):
+    parsed = urlparse.urlparse(url)
+    if parsed.scheme == 'tcp':
+        return ModbusTcpPort(url, (parsed.hostname, parsed.port or 502), connections)
+    if parsed.scheme == 'rtu+tcp':
+        if parsed.port is None:
+            raise ValueError("RTU over TCP needs a port number: %s" % url)
+        return RtuOverTcpPort(url, (parsed.hostname, parsed.port), connections)
+    raise ValueError("Unknown transport: %s" % url)
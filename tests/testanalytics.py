@@ -0,0 +1,83 @@
+#! /usr/bin/python
+
+import math
+import os
+import sqlite3
+import unittest
+try:
+    from solarstats import analytics
+except ImportError:
+    analytics = None
+
+initFile = os.path.join(os.path.dirname(__file__), '..', 'db', 'SolarStatsInit.sql')
+
+def nan_equal(a, b):
+    return len(a) == len(b) and all((math.isnan(x) and math.isnan(y)) or abs(x - y) < 1e-9 for x, y in zip(a, b))
+
+@unittest.skipUnless(analytics, "numpy not installed")
+class TestAnalytics(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        with open(initFile) as f:
+            self.conn.executescript(f.read())
+        # (inverter, DateTime, PowerAC, VoltsPV1, VoltsPV2, CurrentPV1, CurrentPV2, Temperature)
+        samples = [(1, '2014-06-01 12:00:00.000000', 900.0, 200.0, 200.0, 3.0, 2.0, 32.0),
+                   (1, '2014-06-01 12:05:00.000000', 1800.0, 200.0, 200.0, 5.0, 5.0, 47.0),
+                   (1, '2014-06-01 12:10:00.000000', None, 200.0, 200.0, 5.0, 5.0, 48.0),    # Failed reading
+                   (1, '2014-06-02 12:00:00.000000', 20.0, 10.0, 10.0, 1.0, 1.0, 20.0),      # Too little DC power
+                   (2, '2014-06-01 12:05:00.000000', 450.0, 250.0, None, 2.0, None, 31.0),   # One string
+                   (2, '2014-06-01 13:00:00.000000', 600.0, 250.0, None, 3.0, None, 33.0)]
+        self.conn.executemany("INSERT INTO inverterdata (Inverter_ID, DateTime, PowerAC, VoltsPV1, VoltsPV2, "
+                              "CurrentPV1, CurrentPV2, Temperature, RawData) VALUES (?, ?, ?, ?, ?, ?, ?, ?, '')", samples)
+        self.history = analytics.load(self.conn, chunkSize=4)
+
+    def test_load(self):
+        h = self.history
+        self.assertEqual(len(h), 6)
+        self.assertEqual(list(h.inverters), [1, 2])
+        self.assertEqual(list(h.index), [0, 0, 0, 0, 1, 1])
+        self.assertEqual(h.time[1] - h.time[0], 300)
+        self.assertEqual(h.time[0] % 86400, 12 * 3600)     # Local time
+        self.assertTrue(math.isnan(h['PowerAC'][2]))
+        self.assertEqual(len(analytics.load(self.conn, inverterId=2, start='2014-06-01 13:00')), 1)
+        self.assertEqual(len(analytics.load(self.conn, end='2014-01-01')), 0)
+
+    def test_efficiency(self):
+        eff = analytics.efficiency(self.history)
+        self.assertTrue(nan_equal(eff, [0.9, 0.9, float('nan'), float('nan'), 0.9, 0.8]))
+        self.assertTrue(nan_equal(self.history.perInverter(eff), [0.9, 0.85]))
+
+    def test_stringImbalance(self):
+        imbalance = analytics.string_imbalance(self.history)
+        self.assertTrue(nan_equal(imbalance, [0.2, 0.0, 0.0, float('nan'), float('nan'), float('nan')]))
+
+    def test_secondStringZero(self):
+        self.conn.execute("INSERT INTO inverterdata (Inverter_ID, DateTime, PowerAC, VoltsPV1, VoltsPV2, CurrentPV1, "
+                          "CurrentPV2, RawData) VALUES (3, '2014-06-01 12:00:00.000000', 450.0, 250.0, 0.0, 2.0, 0.0, '')")
+        history = analytics.load(self.conn, inverterId=3)       # Soladin: one string, PV2 stored as 0.0
+        self.assertTrue(nan_equal(analytics.string_imbalance(history), [float('nan')]))
+        self.assertTrue(nan_equal(history.dcPower(), [500.0]))
+
+    def test_specificYield(self):
+        days, yields = analytics.specific_yield(self.history, {1: 2.0})
+        self.assertEqual([str(d) for d in days], ['2014-06-01', '2014-06-02'])
+        self.assertAlmostEqual(yields[0, 0], 1800.0 * 300 / 3600000 / 2.0)    # One interval; the NaN one is skipped
+        self.assertEqual(yields[0, 1], 0.0)
+        self.assertTrue(math.isnan(yields[1, 0]))      # No peak power for inverter 2
+        days, energy = analytics.daily_energy(self.history)
+        self.assertEqual(energy[1, 0], 0.0)             # 55 minutes apart: a gap
+
+    def test_deratingCurve(self):
+        centres, eff, maxPower, samples = analytics.derating_curve(self.history, edges=[20, 30, 40, 50])
+        self.assertEqual(list(centres), [25, 35, 45])
+        self.assertEqual(list(samples), [1, 3, 1])     # The failed reading is not counted
+        self.assertTrue(nan_equal(eff, [float('nan'), (0.9 + 0.9 + 0.8) / 3, 0.9]))
+        self.assertEqual(list(maxPower), [20, 900, 1800])
+
+    def test_availability(self):
+        self.assertTrue(nan_equal(analytics.availability(self.history), [0.75, 0.5]))
+        self.assertTrue(all(math.isnan(a) for a in analytics.availability(self.history, threshold=5000)))
+
+if __name__ == '__main__':
+    unittest.main()
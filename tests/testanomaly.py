@@ -0,0 +1,114 @@
+#! /usr/bin/python
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from solarstats import anomaly
+
+initFile = os.path.join(os.path.dirname(__file__), '..', 'db', 'SolarStatsInit.sql')
+
+def sample(inverterId, power, temperature=40.0, voltage=230.0, frequency=50.0, statusOk=True):
+    return {'id': inverterId, 'PowerAC': power, 'Temperature': temperature, 'VoltsAC1': voltage,
+            'FrequencyAC': frequency, 'statusOk': statusOk, 'Status2': 0 if statusOk else 8,
+            'statusText': 'Inverter in operation' if statusOk else 'Grid failure'}
+
+class TestAnomaly(unittest.TestCase):
+
+    def setUp(self):
+        self.detector = anomaly.Detector()
+        self.now = 1000000.0
+
+    # Normal operation: inverter 1 produces about twice as much as inverter 2
+    def warmUp(self, samples=30):
+        for i in range(samples):
+            self.now += 60
+            self.assertEqual(self.detector.observe(sample(1, 1000.0 + i % 3 * 20, 40.0 + i % 2), self.now), [])
+            self.assertEqual(self.detector.observe(sample(2, 500.0 + i % 2 * 10, 40.0 + i % 3), self.now), [])
+
+    def kinds(self, results):
+        return [event.kind for event in self.detector.observe(results, self.now)]
+
+    def test_ewma(self):
+        stats = anomaly.Ewma()
+        for value in [10.0] * 50:
+            stats.update(value)
+        self.assertEqual(stats.mean, 10.0)
+        self.assertEqual(stats.zScore(100.0), 0.0)      # No variance
+        stats.update(12.0)
+        self.assertGreater(stats.zScore(20.0), 4)
+        self.assertEqual(anomaly.Ewma().zScore(100.0), 0.0)     # Not warmed up
+
+    def test_outputDrop(self):
+        self.warmUp()
+        self.now += 60
+        self.assertEqual(self.kinds(sample(1, 1000.0)), [])
+        self.assertEqual(self.kinds(sample(2, 200.0)), ['output_drop'])
+        self.now += 60
+        self.assertEqual(self.kinds(sample(2, 200.0)), [])      # Raised once
+        self.assertIn('output_drop', self.detector.inverters[2].active)
+
+    def test_siblingMissing(self):
+        self.warmUp()
+        self.detector.missing(1)
+        self.now += 60
+        self.assertEqual(self.kinds(sample(2, 200.0)), [])      # No sibling to compare with
+        self.assertEqual(self.detector.siblingPower(2, self.now), 0.0)
+
+    def test_siblingSilent(self):
+        self.warmUp()
+        self.now += anomaly.maxAge + 60
+        self.assertEqual(self.kinds(sample(2, 200.0)), [])      # Inverter 1 has not been heard from since
+        self.assertEqual(self.detector.siblingPower(2, self.now), 0.0)
+        self.assertEqual(self.kinds(sample(1, 1000.0)), [])
+        self.assertEqual(self.detector.siblingPower(2, self.now), 1000.0)
+
+    def test_temperatureRise(self):
+        self.warmUp()
+        self.now += 60
+        self.assertEqual(self.kinds(sample(1, 1000.0, temperature=42.0)), [])
+        self.assertEqual(self.kinds(sample(1, 1000.0, temperature=60.0)), ['temperature_rise'])
+
+    def test_gridExcursions(self):
+        self.assertEqual(self.kinds(sample(1, 1000.0, voltage=255.0)), ['grid_voltage'])
+        self.assertEqual(self.kinds(sample(1, 1000.0, voltage=256.0, frequency=50.6)), ['grid_frequency'])
+        self.assertEqual(self.kinds(sample(1, 1000.0)), [])
+        self.assertEqual(self.kinds(sample(1, 1000.0, voltage=200.0)), ['grid_voltage'])     # Again
+
+    def test_repeatedStatus(self):
+        self.assertEqual(self.kinds(sample(1, 0.0, statusOk=False)), [])
+        self.assertEqual(self.kinds(sample(1, 0.0, statusOk=False)), [])
+        events = self.detector.observe(sample(1, 0.0, statusOk=False), self.now)
+        self.assertEqual([e.kind for e in events], ['status'])
+        self.assertEqual(events[0].value, 8)
+        self.assertEqual(self.kinds(sample(1, 0.0, statusOk=False)), [])
+        self.assertEqual(self.kinds(sample(1, 0.0)), [])
+        self.assertEqual(self.detector.inverters[1].faults, 0)
+
+    def test_stateFileAndEvents(self):
+        tmpDir = tempfile.mkdtemp()
+        try:
+            self.warmUp()
+            stateFile = os.path.join(tmpDir, 'anomaly.json')
+            self.detector.save(stateFile)
+            restored = anomaly.Detector()
+            restored.load(stateFile)
+            self.assertEqual(restored.siblingPower(2, self.now), self.detector.siblingPower(2, self.now))
+            self.assertEqual(restored.inverters[1].ratio.asList(), self.detector.inverters[1].ratio.asList())
+            self.now += 60
+            events = restored.observe(sample(2, 200.0), self.now)
+            conn = sqlite3.connect(os.path.join(tmpDir, 'test.sqlt'))
+            with open(initFile) as f:
+                conn.executescript(f.read())
+            for event in events:
+                event.store(conn)
+            conn.commit()
+            self.assertEqual(conn.execute("SELECT Inverter_ID, Kind FROM events").fetchall(), [(2, u'output_drop')])
+            conn.close()
+            anomaly.Detector().load(os.path.join(tmpDir, 'missing.json'))
+        finally:
+            shutil.rmtree(tmpDir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -48,6 +48,26 @@ class TestBlacklinesolar(unittest.TestCase):
         with self.assertRaises(ValueError):
             self.assertEqual(self.bls.mb_parseResponse("\xFF\x03\x02\x00\x02\x10\x52"))
 
+    def test_mb_parseResponseErrors(self):
+        with self.assertRaises(solarutils.FrameLengthError):
+            self.bls.mb_parseResponse("\xFF\x03")
+        with self.assertRaises(solarutils.FrameLengthError):     # Byte count says 4, only 2 received
+            self.bls.mb_parseResponse("\xFF\x03\x04\x00\x02\x10\x51")
+        with self.assertRaises(solarutils.CrcError):
+            self.bls.mb_parseResponse("\xFF\x03\x02\x00\x02\x10\x52")
+
+    def test_mb_parseTcpResponse(self):
+        self.assertEqual(self.bls.mb_parseTcpResponse("\x00\x07\x00\x00\x00\x09\x02\x04\x06\x42\x06\x12\x43\x50\x30"),
+                         ("\x02", "\x04", "\x06", "\x42\x06\x12\x43\x50\x30"))
+        with self.assertRaises(solarutils.FrameLengthError):
+            self.bls.mb_parseTcpResponse("\x00\x07\x00\x00\x00\x03\x02\x04")
+        with self.assertRaises(solarutils.FrameLengthError):     # Byte count says 6, only 2 received
+            self.bls.mb_parseTcpResponse("\x00\x07\x00\x00\x00\x05\x02\x04\x06\x42\x06")
+        with self.assertRaises(ValueError):     # Length field does not match
+            self.bls.mb_parseTcpResponse("\x00\x07\x00\x00\x00\x08\x02\x04\x06\x42\x06\x12\x43\x50\x30")
+        with self.assertRaises(ValueError):     # Exception 0x0B: gateway target failed to respond
+            self.bls.mb_parseTcpResponse("\x00\x07\x00\x00\x00\x03\x02\x84\x0B")
+
     def test_busQueryCommand(self):
         self.assertEqual(self.bls.busQueryCommand(), "\xFF\x03\x00\x3C\x00\x01\x51\xD8")
         
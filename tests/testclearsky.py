@@ -0,0 +1,85 @@
+#! /usr/bin/python
+
+import calendar
+import math
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+try:
+    import numpy
+    from solarstats import clearsky
+except ImportError:
+    clearsky = None
+
+initFile = os.path.join(os.path.dirname(__file__), '..', 'db', 'SolarStatsInit.sql')
+
+# Solar noon at 52N 5E on the summer solstice of 2014, and midnight
+noon = calendar.timegm((2014, 6, 21, 11, 41, 30))
+midnight = noon - 12 * 3600
+
+@unittest.skipUnless(clearsky, "numpy not installed")
+class TestClearSky(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.arrays = [clearsky.PvArray(1, maxOutput=3000.0), clearsky.PvArray(2, tilt=0.0, peakPower=0.6)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def model(self, arrays=None, cacheDir=None):
+        return clearsky.ExpectedOutput(arrays or self.arrays, 52.0, 5.0, cacheDir)
+
+    def test_solarPosition(self):
+        zenith, azimuth = clearsky.solar_position([noon, midnight], 52.0, 5.0)
+        self.assertAlmostEqual(math.degrees(zenith[0]), 52.0 - 23.44, delta=0.3)
+        self.assertAlmostEqual(math.degrees(azimuth[0]), 180.0, delta=1.0)
+        self.assertGreater(math.degrees(zenith[1]), 90.0)
+
+    def test_clearSky(self):
+        ghi, dni, dhi = clearsky.clear_sky(numpy.radians([0.0, 60.0, 95.0]))
+        self.assertAlmostEqual(ghi[0], 1037, delta=1)
+        self.assertAlmostEqual(dni[0], 947, delta=1)
+        self.assertTrue(ghi[1] < ghi[0] and dni[1] < dni[0])
+        self.assertEqual((ghi[2], dni[2], dhi[2]), (0.0, 0.0, 0.0))
+
+    def test_expected(self):
+        model = self.model()
+        self.assertEqual(model.expected(1, midnight), 0.0)
+        self.assertIsNone(model.performanceRatio(1, 0.0, midnight))
+        self.assertTrue(2400 < model.expected(1, noon) < 3000)   # 3.0 kWp, sized to MaxOutput
+        oversized = self.model([clearsky.PvArray(1, peakPower=4.0, maxOutput=3000.0)])
+        self.assertEqual(oversized.expected(1, noon), 3000.0)  # Clipped at MaxOutput
+        self.assertLess(model.expected(2, noon), 600.0 * clearsky.systemFactor)
+        self.assertAlmostEqual(oversized.performanceRatio(1, 1500.0, noon), 0.5)
+        self.assertIsNone(model.expected(3, noon))
+        self.assertTrue(15 < model.expectedEnergy(1, '2014-06-21') < 25)
+
+    def test_cache(self):
+        cacheDir = os.path.join(self.tmpDir, 'clearsky')
+        model = self.model(cacheDir=cacheDir)
+        times, power = model.curves('2014-06-21')
+        self.assertEqual(os.listdir(cacheDir), [os.path.basename(model.cacheFile('2014-06-21'))])
+        self.assertEqual(power.shape, (2, 288))
+        numpy.save(model.cacheFile('2014-06-21'), power / 2)
+        self.assertEqual(self.model(cacheDir=cacheDir).curves('2014-06-21')[1].max(), power.max() / 2)  # Read back, not computed
+        other = self.model([clearsky.PvArray(1, tilt=20.0, maxOutput=3000.0)], cacheDir)
+        self.assertNotEqual(other.cacheFile('2014-06-21'), model.cacheFile('2014-06-21'))
+
+    def test_loadArrays(self):
+        dbName = os.path.join(self.tmpDir, 'test.sqlt')
+        conn = sqlite3.connect(dbName)
+        with open(initFile) as f:
+            conn.executescript(f.read())
+        conn.executemany("INSERT INTO invertertype VALUES (?,?,?,?,?,?)", [(1, 'KLNE', '3.0kW', '02', '5.03', '3000W'), (2, 'Soladin', '600', '11 00', '1.00', '600W')])
+        conn.executemany("INSERT INTO inverter VALUES (?,?,?)", [(1, '420612435030', 1), (2, '0001_0002', 2)])
+        conn.execute("INSERT INTO pvarray VALUES (2, 15, 90, 0.5)")
+        conn.commit()
+        conn.close()
+        arrays = clearsky.load_arrays(dbName)
+        self.assertEqual([a.key() for a in arrays], [(1, 35.0, 180.0, 3.0, 3000.0), (2, 15.0, 90.0, 0.5, 600.0)])
+
+if __name__ == '__main__':
+    unittest.main()
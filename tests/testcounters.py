@@ -0,0 +1,70 @@
+#! /usr/bin/python
+
+import os
+import sqlite3
+import unittest
+from solarstats import counters
+
+initFile = os.path.join(os.path.dirname(__file__), '..', 'db', 'SolarStatsInit.sql')
+
+class TestCounters(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        with open(initFile) as f:
+            self.conn.executescript(f.read())
+        self.history = []   # (DateTime, EnergyTotal) of inverter 1
+        self.counters = counters.Counters(self.conn, lambda inverterId: self.history if inverterId == 1 else [])
+
+    def test_state(self):
+        state = counters.CounterState()
+        self.assertIsNone(state.advance(100.0, '2014-01-01'))
+        self.assertIsNone(state.advance(99.5, '2014-01-02'))     # Noise
+        self.assertEqual(state.lastTotal, 100.0)
+        self.assertEqual(state.advance(3.0, '2014-01-03'), 'reset')
+        self.assertEqual(state.continuous(), 103.0)
+        state = counters.CounterState(lastTotal=167700.0)
+        self.assertEqual(state.advance(10.0, '2014-01-03', wrap=167772.16), 'wrap')
+        self.assertAlmostEqual(state.continuous(), 167782.16)
+
+    def test_yearToDate(self):
+        self.assertEqual(self.counters.observe(1, '2013-12-31 16:00:00.000000', 2188.7),
+                         {'lifetime': 2188.7, 'year': 0.0, 'month': 0.0})
+        yields = self.counters.observe(1, '2014-01-01 12:00:00.000000', 2190.0)
+        self.assertAlmostEqual(yields['year'], 1.3)     # Since the last reading of 2013
+        yields = self.counters.observe(1, '2014-02-01 12:00:00.000000', 2250.0)
+        self.assertAlmostEqual(yields['year'], 61.3)
+        self.assertAlmostEqual(yields['month'], 60.0)
+        self.assertEqual(self.conn.execute("SELECT Period, Baseline FROM counter_baseline ORDER BY Period").fetchall(),
+                         [(u'2013', 2188.7), (u'2013-12', 2188.7), (u'2014', 2188.7), (u'2014-01', 2188.7), (u'2014-02', 2190.0)])
+
+    def test_resetKeepsYield(self):
+        self.counters.observe(1, '2014-03-01 12:00:00.000000', 500.0)
+        self.counters.observe(1, '2014-03-02 12:00:00.000000', 510.0)
+        yields = self.counters.observe(1, '2014-03-03 12:00:00.000000', 4.0)   # Inverter replaced
+        self.assertEqual(yields['year'], 14.0)
+        self.assertEqual(yields['lifetime'], 514.0)
+        self.assertEqual(self.conn.execute("SELECT Offset, LastTotal, Resets FROM counter_state").fetchone(), (510.0, 4.0, 1))
+
+    def test_stateIsStored(self):
+        self.counters.observe(1, '2014-03-01 12:00:00.000000', 500.0)
+        self.counters.observe(1, '2014-03-02 12:00:00.000000', 2.0)
+        self.history = None     # Not scanned again
+        restarted = counters.Counters(self.conn)
+        self.assertEqual(restarted.observe(1, '2014-03-03 12:00:00.000000', 12.0)['year'], 12.0)
+
+    def test_rebuildFromHistory(self):
+        self.history = [('2013-06-01 12:00:00.000000', 100.0), ('2013-12-31 12:00:00.000000', 364.31),
+                        ('2014-01-02 12:00:00.000000', 365.0), ('2014-01-03 12:00:00.000000', None)]
+        yields = self.counters.observe(1, '2014-01-04 12:00:00.000000', 366.0)
+        self.assertAlmostEqual(yields['year'], 366.0 - 364.31)
+        self.assertAlmostEqual(self.counters.baseline(1, '2014'), 364.31)
+        self.assertEqual(self.counters.yields(2, '2014-01-04'), {'lifetime': None, 'year': None, 'month': None})
+
+    def test_inMemory(self):
+        energy = counters.Counters()
+        energy.observe('2', '2013-12-31 12:00:00.000000', 10.0)
+        self.assertEqual(energy.observe('2', '2014-01-01 12:00:00.000000', 15.0)['year'], 5.0)
+
+if __name__ == '__main__':
+    unittest.main()
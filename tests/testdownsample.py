@@ -0,0 +1,127 @@
+#! /usr/bin/python
+
+import calendar
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+try:
+    import numpy
+    from solarstats import downsample, shards
+except ImportError:
+    downsample = None
+
+initFile = os.path.join(os.path.dirname(__file__), '..', 'db', 'SolarStatsInit.sql')
+
+@unittest.skipUnless(downsample, "numpy not installed")
+class TestDownsample(unittest.TestCase):
+
+    def setUp(self):
+        # A day of samples every 300 s: a sine with a spike at noon
+        self.times = numpy.arange(0, 86400, 300) + 1400000000 // 86400 * 86400
+        self.values = 1000 * numpy.sin(numpy.arange(len(self.times)) / 20.0) + 1000
+        self.values[144] = 5000.0
+
+    def test_resolution(self):
+        self.assertEqual(downsample.resolution(86400, 2000), 60)
+        self.assertEqual(downsample.resolution(30 * 86400, 2000), 1800)
+        self.assertEqual(downsample.resolution(365 * 86400, 2000), 6 * 3600)
+
+    def test_lttb(self):
+        series = downsample.Series(3600)
+        series.extend(self.times, self.values)
+        self.assertEqual(len(series), 24)
+        self.assertIn(5000.0, series.value)                 # The spike is chosen
+        self.assertEqual(series.maximum.max(), 5000.0)
+        self.assertEqual(series.time[0], self.times[0])     # First and last sample
+        self.assertEqual(series.time[-1], self.times[-1])
+        self.assertTrue((series.minimum <= series.value).all() and (series.value <= series.maximum).all())
+
+    def test_incremental(self):
+        whole = downsample.Series(1800)
+        whole.extend(self.times, self.values)
+        series = downsample.Series(1800)
+        for lo, hi in [(0, 1), (1, 7), (7, 50), (50, 51), (51, 200), (200, len(self.times))]:
+            series.extend(self.times[lo:hi], self.values[lo:hi])
+        series.extend(self.times[100:120], self.values[100:120])     # Samples already added are left out
+        for name in downsample.Series.fields:
+            self.assertEqual(getattr(series, name).tolist(), getattr(whole, name).tolist())
+
+    def test_nanAndTrim(self):
+        values = self.values.copy()
+        values[:12] = numpy.nan
+        series = downsample.Series(3600)
+        series.extend(self.times, values)
+        self.assertEqual(len(series), 23)
+        series.trim(self.times[0] + 12 * 3600)
+        self.assertEqual(len(series), 12)
+        window = series.window(self.times[0] + 20 * 3600, self.times[0] + 86400)
+        self.assertEqual(len(window['t']), 4)
+        self.assertEqual(window['bucket'], 3600)
+
+    def test_downsampler(self):
+        tmpDir = tempfile.mkdtemp()
+        try:
+            dbName = os.path.join(tmpDir, 'test.sqlt')
+            conn = sqlite3.connect(dbName)
+            with open(initFile) as f:
+                conn.executescript(f.read())
+            now = calendar.timegm(time.localtime()) // 300 * 300
+            rows = [(1, downsample.date_time(now - 300 * i), 100.0 + i % 7, '') for i in range(1, 2000)]
+            conn.executemany("INSERT INTO inverterdata (Inverter_ID, DateTime, PowerAC, RawData) VALUES (?,?,?,?)", rows)
+            conn.commit()
+            sampler = downsample.Downsampler(lambda start, end: sqlite3.connect(dbName))
+            result = sampler.get(1, 'PowerAC', now - 7 * 86400, points=100)
+            self.assertEqual(result['bucket'], 3 * 3600)
+            self.assertLessEqual(len(result['t']), 100)
+            self.assertEqual((result['inverter'], result['metric']), (1, 'PowerAC'))
+            # New samples are added to the cached series
+            conn.execute("INSERT INTO inverterdata (Inverter_ID, DateTime, PowerAC, RawData) VALUES (1, ?, 9000.0, '')",
+                         (downsample.date_time(now),))
+            conn.commit()
+            conn.close()
+            result = sampler.get(1, 'PowerAC', now - 7 * 86400, points=100)
+            self.assertEqual(result['max'][-1], 9000.0)
+            self.assertEqual(len(sampler.series), 1)
+            self.assertRaises(ValueError, sampler.get, 1, 'RawData', now - 86400)
+        finally:
+            shutil.rmtree(tmpDir)
+
+    def test_manyShards(self):
+        tmpDir = tempfile.mkdtemp()
+        try:
+            # A year in month shards: more than can be attached at once
+            layout = shards.ShardLayout(os.path.join(tmpDir, 'SolarStats.sqlt'), 'month')
+            start = calendar.timegm((2013, 1, 1, 0, 0, 0))
+            for name in [layout.dbName] + [layout.fileName('2013-%02d' % month) for month in range(1, 13)]:
+                conn = sqlite3.connect(os.path.join(tmpDir, name))
+                with open(initFile) as f:
+                    conn.executescript(f.read())
+                key = name[len('SolarStats.'):len('SolarStats.2013-01')]
+                rows = [(1, downsample.date_time(start + 21600 * i), float(i), '') for i in range(4 * 365)]
+                conn.executemany("INSERT INTO inverterdata (Inverter_ID, DateTime, PowerAC, RawData) VALUES (?,?,?,?)",
+                                 [row for row in rows if row[1][:7] == key])
+                conn.commit()
+                conn.close()
+            sampler = downsample.Downsampler(lambda start, end: shards.connect(layout, start, end),
+                                             select=lambda sql, parameters, start, end: shards.select(layout, sql, parameters, start, end))
+            result = sampler.get(1, 'PowerAC', start, start + 365 * 86400, points=400)
+            self.assertEqual(result['max'][-1], 4 * 365 - 1.0)
+            self.assertEqual(result['min'][0], 0.0)
+            self.assertRaises(ValueError, downsample.Downsampler(lambda start, end: shards.connect(layout, start, end)).get,
+                              1, 'PowerAC', start, start + 365 * 86400)
+        finally:
+            shutil.rmtree(tmpDir)
+
+    def test_missingShard(self):
+        def connect(start, end):
+            raise IOError("Shard SolarStats.2013.sqlt not found")
+        sampler = downsample.Downsampler(connect)
+        now = downsample.local_now()
+        self.assertEqual(sampler.get(1, 'PowerAC', now - 86400)['t'], [])
+        self.assertEqual(sampler.series, {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+#! /usr/bin/python
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+from solarstats import forwarder
+from solarstats import ingestserver
+
+initFile = os.path.join(os.path.dirname(__file__), '..', 'db', 'SolarStatsInit.sql')
+
+class TestForwarder(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.conn = sqlite3.connect(os.path.join(self.tmpDir, 'site.sqlt'))
+        with open(initFile) as f:
+            self.conn.executescript(f.read())
+        self.conn.execute("INSERT INTO invertertype VALUES (1, 'BlackLine Solar', '3000', '02', '1.0', 3000)")
+        self.conn.execute("INSERT INTO inverter VALUES (1, 'BLS-1234', 1)")
+        self.store = ingestserver.CentralStore(os.path.join(self.tmpDir, 'central.sqlt'), initFile)
+        self.server = ingestserver.IngestServer(('127.0.0.1', 0), self.store)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d/ingest' % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.store.close()
+        self.conn.close()
+        shutil.rmtree(self.tmpDir)
+
+    def addSamples(self, count, start=0):
+        for i in range(start, start + count):
+            dateTime = '2014-06-01 12:%02d:00' % i
+            self.conn.execute("INSERT INTO inverterdata (Inverter_ID, DateTime, PowerAC, RawData) VALUES (1, ?, ?, '')",
+                              (dateTime, 1000.0 + i))
+            forwarder.enqueue(self.conn, 1, dateTime)
+        self.conn.commit()
+
+    def centralRows(self):
+        return self.store.conn.execute("SELECT Inverter_ID, DateTime, PowerAC FROM inverterdata ORDER BY DateTime").fetchall()
+
+    def test_drainInBatches(self):
+        self.addSamples(25)
+        outbox = forwarder.Outbox(self.conn)
+        sent = forwarder.Forwarder(self.url, 'site1', batchSize=10).drain(outbox)
+        self.assertEqual(sent, 25)
+        self.assertEqual(outbox.pending(), 0)
+        rows = self.centralRows()
+        self.assertEqual(len(rows), 25)
+        self.assertEqual(rows[3][1:], ('2014-06-01 12:03:00', 1003.0))
+
+    def test_maxBatches(self):
+        self.addSamples(25)
+        outbox = forwarder.Outbox(self.conn)
+        self.assertEqual(forwarder.Forwarder(self.url, 'site1', batchSize=10).drain(outbox, maxBatches=2), 20)
+        self.assertEqual(outbox.pending(), 5)
+
+    def test_linkDown(self):
+        self.addSamples(5)
+        outbox = forwarder.Outbox(self.conn)
+        down = forwarder.Forwarder('http://127.0.0.1:1/ingest', 'site1', retryDelay=60)
+        self.assertEqual(down.drain(outbox, now=1000.0), 0)
+        self.assertEqual(outbox.pending(), 5)
+        self.assertEqual(float(outbox.get('NextAttempt')), 1060.0)
+        self.assertEqual(down.drain(outbox, now=1030.0), 0)     # Still waiting
+        down.drain(outbox, now=1061.0)
+        self.assertEqual(float(outbox.get('NextAttempt')), 1181.0)  # Backs off
+
+        # Link back up: everything queued meanwhile is sent, in order
+        self.addSamples(3, start=5)
+        up = forwarder.Forwarder(self.url, 'site1')
+        self.assertEqual(up.drain(outbox, now=2000.0), 8)
+        self.assertEqual(len(self.centralRows()), 8)
+        self.assertEqual(outbox.get('Failures'), '0')
+
+    def test_serverBusy(self):
+        self.addSamples(3)
+        outbox = forwarder.Outbox(self.conn)
+        self.server.maxActive = 0
+        self.assertEqual(forwarder.Forwarder(self.url, 'site1').drain(outbox, now=1000.0), 0)
+        self.assertEqual(float(outbox.get('NextAttempt')), 1000.0 + self.server.retryAfter)
+        self.assertEqual(outbox.pending(), 3)
+
+    def test_resendIsIdempotent(self):
+        self.addSamples(4)
+        outbox = forwarder.Outbox(self.conn)
+        fwd = forwarder.Forwarder(self.url, 'site1')
+        first, last, rows = outbox.batch(10)
+        body = fwd.message(outbox, first, last, rows)
+        self.assertEqual(fwd.post(body), {'ack': 4, 'inserted': 4, 'duplicates': 0})
+        self.assertEqual(fwd.post(body)['inserted'], 0)     # Acknowledgement lost; sent again
+        self.assertEqual(len(self.centralRows()), 4)
+
+    def test_trim(self):
+        self.addSamples(5)
+        outbox = forwarder.Outbox(self.conn, maxPending=3)
+        self.assertEqual(outbox.trim(), 2)
+        self.assertEqual(outbox.batch(10)[0], 3)
+
+    def test_deletedSampleIsAcknowledged(self):
+        self.addSamples(3)
+        self.conn.execute("DELETE FROM inverterdata WHERE DateTime='2014-06-01 12:01:00'")
+        self.conn.commit()
+        first, last, rows = forwarder.Outbox(self.conn).batch(10)
+        self.assertEqual((first, last), (1, 3))
+        self.assertEqual([row[0] for row in rows], [1, 3])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+#! /usr/bin/python
+
+import os
+import shutil
+import tempfile
+import unittest
+from solarstats import frametrace
+
+class TestFrameTrace(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.traceFile = os.path.join(self.tmpDir, 'test.trace')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def test_record(self):
+        trace = frametrace.FrameTrace(slots=4)
+        trace.record(frametrace.TX, '/dev/ttyUSB0', '\x02\x04\x00\x0A\x00\x1F\x91\xF3')
+        trace.record(frametrace.RX, '/dev/ttyUSB0', '')
+        records = list(trace.records())
+        self.assertEqual([(r[1], r[2], r[3], r[4]) for r in records],
+                         [(frametrace.TX, '/dev/ttyUSB0', '\x02\x04\x00\x0A\x00\x1F\x91\xF3', 8),
+                          (frametrace.RX, '/dev/ttyUSB0', '', 0)])
+
+    def test_wrap(self):
+        trace = frametrace.FrameTrace(slots=3)
+        for i in range(7):
+            trace.record(frametrace.TX, 'port%d' % (i % 2), chr(i))
+        self.assertEqual([r[3] for r in trace.records()], ['\x04', '\x05', '\x06'])
+        self.assertEqual([r[2] for r in trace.records()], ['port0', 'port1', 'port0'])
+
+        self.assertEqual(trace.dump(self.traceFile, 'test'), 3)
+        head, records = frametrace.read_dump(self.traceFile)
+        self.assertEqual(head['dropped'], 4)
+        self.assertEqual(head['reason'], 'test')
+        self.assertEqual(records, list(trace.records()))
+
+    def test_longFrame(self):
+        trace = frametrace.FrameTrace(slots=2)
+        trace.record(frametrace.RX, 'p', 'x' * 100)
+        t, direction, port, frame, length = list(trace.records())[0]
+        self.assertEqual((len(frame), length), (trace.frameSize, 100))
+        self.assertTrue(frametrace.format_records([(t, direction, port, frame, length)])[0].endswith('... (100 bytes)'))
+
+    def test_disabled(self):
+        trace = frametrace.FrameTrace(enabled=False)
+        trace.record(frametrace.TX, 'p', '\x01')
+        self.assertEqual(list(trace.records()), [])
+
+    def test_formatRecords(self):
+        line = frametrace.format_records([(0.0, frametrace.RX, '/dev/ttyUSB1', '\x00\xC5', 2)])[0]
+        self.assertTrue(line.endswith(' RX /dev/ttyUSB1 00 C5'))
+
+    def test_notATrace(self):
+        with open(self.traceFile, 'wb') as f:
+            f.write('garbage')
+        with self.assertRaises(ValueError):
+            frametrace.read_dump(self.traceFile)
+
+    def test_capture(self):
+        captureFile = os.path.join(self.tmpDir, 'test.cap')
+        for session in range(2):    # Sessions append to the same file
+            capture = frametrace.CaptureFile(captureFile)
+            capture.record(frametrace.TX, '/dev/ttyUSB%d' % session, '\x01\x02', 1000.0 + session)
+            capture.record(frametrace.RX, '/dev/ttyUSB%d' % session, 'x' * 100, 1000.5 + session)
+            capture.close()
+        records = list(frametrace.read_capture(captureFile))
+        self.assertEqual(records, [(1000.0, frametrace.TX, '/dev/ttyUSB0', '\x01\x02'),
+                                   (1000.5, frametrace.RX, '/dev/ttyUSB0', 'x' * 100),
+                                   (1001.0, frametrace.TX, '/dev/ttyUSB1', '\x01\x02'),
+                                   (1001.5, frametrace.RX, '/dev/ttyUSB1', 'x' * 100)])
+
+        # A record cut short ends the capture
+        with open(captureFile, 'ab') as f:
+            f.write('\x00' * 5)
+        self.assertEqual(len(list(frametrace.read_capture(captureFile))), 4)
+
+    def test_captureFlushed(self):
+        captureFile = os.path.join(self.tmpDir, 'test.cap')
+        capture = frametrace.CaptureFile(captureFile)
+        capture.record(frametrace.TX, '/dev/ttyUSB0', '\x01\x02', 1000.0)
+        self.assertEqual(len(list(frametrace.read_capture(captureFile))), 1)     # Before it is closed
+        capture.close()
+
+    def test_traceToCapture(self):
+        captureFile = os.path.join(self.tmpDir, 'test.cap')
+        trace = frametrace.FrameTrace(enabled=False)
+        trace.capture = frametrace.CaptureFile(captureFile)
+        trace.record(frametrace.TX, 'p', '\x01')
+        trace.capture.close()
+        self.assertEqual([r[3] for r in frametrace.read_capture(captureFile)], ['\x01'])
+        self.assertEqual(trace.count, 0)
+
+if __name__ == '__main__':
+    unittest.main()
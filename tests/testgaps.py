@@ -0,0 +1,74 @@
+#! /usr/bin/python
+
+import math
+import unittest
+try:
+    import numpy
+    from solarstats import gaps
+except ImportError:
+    gaps = None
+
+@unittest.skipUnless(gaps, "numpy not installed")
+class TestGaps(unittest.TestCase):
+
+    # Samples every 300 s with a gap of 1200 s (three missing) after the second one
+    times = [0, 300, 1500, 1800]
+    values = [[100.0, 5.0], [200.0, 6.0], [600.0, 10.0], [700.0, 11.0]]
+
+    def fill(self, strategy, **options):
+        return gaps.GapFiller(300, strategy=strategy, **options).fill(self.times, self.values)
+
+    def test_findGaps(self):
+        start, end = gaps.find_gaps(numpy.array([0, 300, 1500, 1800, 2500]), 400)
+        self.assertEqual(list(start), [1, 3])
+        self.assertEqual(list(end), [2, 4])
+        fillTimes, fillGap = gaps.missing_times(numpy.array([0, 300, 1500, 1800, 2500]), start, end, 300)
+        self.assertEqual(list(fillTimes), [600, 900, 1200, 2100])   # 2400 is less than half a step before 2500
+        self.assertEqual(list(fillGap), [0, 0, 0, 1])
+
+    def test_next(self):
+        times, values, filled = self.fill('next')
+        self.assertEqual(list(times), [0, 300, 600, 900, 1200, 1500, 1800])
+        self.assertEqual(list(values[:, 0]), [100.0, 200.0, 600.0, 600.0, 600.0, 600.0, 700.0])
+        self.assertEqual(list(filled), [False, False, True, True, True, False, False])
+
+    def test_linear(self):
+        times, values, filled = self.fill('linear')
+        self.assertEqual(list(values[2:5, 0]), [300.0, 400.0, 500.0])
+        self.assertEqual(list(values[2:5, 1]), [7.0, 8.0, 9.0])
+
+    def test_unknown(self):
+        times, values, filled = self.fill('unknown')
+        self.assertTrue(numpy.isnan(values[2:5]).all())
+        self.assertFalse(numpy.isnan(values[filled == False]).any())
+
+    def test_night(self):
+        self.values = [[100.0, 5.0], [0.0, 6.0], [2.0, 6.0], [300.0, 7.0]]
+        times, values, filled = self.fill('night', counters=(1,))
+        self.assertEqual(values[2:5].tolist(), [[0.0, 6.0]] * 3)     # Asleep: no power, the counter holds
+        self.values[1][0] = 200.0
+        times, values, filled = self.fill('night', counters=(1,))
+        self.assertTrue(numpy.isnan(values[2:5]).all())                 # Daylight gap: unknown
+
+    def test_maxGap(self):
+        times, values, filled = self.fill('next', maxGap=900)
+        self.assertEqual(list(times), self.times)
+
+    def test_chunks(self):
+        # The gap between two chunks is filled in the second one
+        chunks = [(self.times[:2], self.values[:2]), (self.times[2:], self.values[2:])]
+        output = list(gaps.rows(gaps.fill_series(chunks, 300, 'linear')))
+        self.assertEqual([t for t, v, f in output], [0, 300, 600, 900, 1200, 1500, 1800])
+        self.assertEqual([f for t, v, f in output].count(True), 3)
+        self.assertEqual(output[3][1][0], 400.0)
+
+    def test_counts(self):
+        filler = gaps.GapFiller(300)
+        filler.fill([0, 300, 1500, 3000], [[1.0]] * 4)
+        self.assertEqual((filler.gaps, filler.filled), (2, 7))
+        self.assertRaises(ValueError, gaps.GapFiller, 300, strategy='previous')
+        times, values, filled = filler.fill([], [])
+        self.assertEqual(len(times), 0)
+
+if __name__ == '__main__':
+    unittest.main()
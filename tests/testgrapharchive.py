@@ -0,0 +1,66 @@
+#! /usr/bin/python
+
+import os
+import shutil
+import tempfile
+import unittest
+from solarstats import grapharchive
+
+class TestGraphArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.webDir = os.path.join(self.tmpDir, 'www')
+        os.mkdir(self.webDir)
+        self.archive = grapharchive.GraphArchive(os.path.join(self.tmpDir, 'archive'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def writeImage(self, imgName, content):
+        fileName = os.path.join(self.webDir, imgName)
+        with open(fileName + '.new', 'wb') as f:
+            f.write(content)
+        os.rename(fileName + '.new', fileName)     # As rrd_graph does
+        return fileName
+
+    def blobCount(self):
+        return sum(len(files) for root, dirs, files in os.walk(self.archive.blobDir))
+
+    def test_deduplicate(self):
+        self.archive.add('2014-01-01', self.writeImage('year.png', 'A'))
+        self.archive.add('2014-01-02', self.writeImage('year.png', 'A'))
+        self.archive.add('2014-01-02', self.writeImage('day.png', 'B'))
+        self.archive.add('2014-01-03', self.writeImage('year.png', 'C'))
+        self.assertEqual(self.blobCount(), 3)
+
+        with open(self.archive.get('2014-01-02', 'year.png'), 'rb') as f:
+            self.assertEqual(f.read(), 'A')
+        with open(self.archive.get('2014-01-03', 'year.png'), 'rb') as f:
+            self.assertEqual(f.read(), 'C')
+
+    def test_lookup(self):
+        self.archive.add('2014-01-01', self.writeImage('day.png', 'A'))
+        self.archive.add('2014-01-05', self.writeImage('day.png', 'B'))
+        self.archive.save()
+
+        archive = grapharchive.GraphArchive(self.archive.archiveDir)
+        self.assertEqual(archive.dates(), ['2014-01-01', '2014-01-05'])
+        self.assertEqual(archive.get('2014-01-03', 'day.png'), archive.get('2014-01-01', 'day.png'))
+        self.assertIsNone(archive.get('2013-12-31', 'day.png'))
+        self.assertIsNone(archive.get('2014-01-05', 'week.png'))
+
+    def test_blobSurvivesReplace(self):
+        self.archive.add('2014-01-01', self.writeImage('day.png', 'A'))
+        self.writeImage('day.png', 'B')
+        with open(self.archive.get('2014-01-01', 'day.png'), 'rb') as f:
+            self.assertEqual(f.read(), 'A')
+
+    def test_importLegacy(self):
+        for name, content in [('day_2014-01-01.png', 'A'), ('day_2014-01-02.png', 'A'), ('notes.txt', '')]:
+            with open(os.path.join(self.archive.archiveDir, name), 'wb') as f:
+                f.write(content)
+        self.assertEqual(self.archive.importLegacy(self.archive.archiveDir, remove=True), 2)
+        self.assertEqual(self.blobCount(), 1)
+        self.assertEqual(self.archive.dates(), ['2014-01-01', '2014-01-02'])
+        self.assertFalse(os.path.exists(os.path.join(self.archive.archiveDir, 'day_2014-01-01.png')))
@@ -0,0 +1,53 @@
+#! /usr/bin/python
+
+import unittest
+from solarstats import graphdefs
+from solarstats import inverters
+
+class TestGraphDefinition(unittest.TestCase):
+
+    def setUp(self):
+        self.gd = graphdefs.GraphDefinition(inverters.legacy_inverters())
+
+    def test_legacyDataSources(self):
+        args = self.gd.compile('short')
+        self.assertIn('DEF:i1=SolarStats_BLS.rrd:bls3000_pow:LAST', args)
+        self.assertIn('DEF:i2_e=SolarStats_Sol.rrd:sol600_nrg:LAST', args)
+        self.assertIn('CDEF:i1_escaled=i1_e,200,*', args)
+        self.assertIn('0.005:0', args)
+
+        args = self.gd.compile('long')
+        self.assertIn('DEF:i1_e=SolarStats_BLS.rrd:bls3000_tot:LAST', args)
+        self.assertIn('CDEF:i1_escaled=i1_e,1,*', args)
+
+    def test_rangeName(self):
+        self.assertEqual(self.gd.rangeName(0, 60*60*24*7), 'short')
+        self.assertEqual(self.gd.rangeName(0, 60*60*24*30), 'long')
+
+    def test_total(self):
+        args = self.gd.compile('short')
+        self.assertIn('CDEF:total=i1,i2,ADDNAN', args)
+        self.assertIn('GPRINT:total_emax:%2.1lf kW\\n', args)
+        single = graphdefs.GraphDefinition([inverters.Inverter(1)]).compile('short')
+        self.assertFalse([a for a in single if 'total' in a])
+
+    def test_cached(self):
+        other = graphdefs.GraphDefinition(inverters.legacy_inverters())
+        self.assertIs(self.gd.compile('short'), other.compile('short'))
+
+    def test_scaling(self):
+        fleet = [inverters.Inverter(i) for i in range(1, 41)]
+        args = graphdefs.GraphDefinition(fleet, detailLimit=4).compile('short')
+        self.assertEqual(len([a for a in args if a.startswith('DEF:')]), 80)
+        averages = [a for a in args if a.startswith('LINE1:') and '_avg' in a]
+        self.assertEqual(averages, ['LINE1:total_avg#FF6600:Average (Total)\\t'])
+
+    def test_stack(self):
+        args = graphdefs.GraphDefinition(inverters.legacy_inverters(), stack=True).compile('short')
+        self.assertIn('AREA:i1#0000FF:Actual (BLS)\\t', args)
+        self.assertIn('AREA:i2#FF0066:Actual (Sol)\\t:STACK', args)
+
+    def test_args(self):
+        args = self.gd.args('img.png', 0, 86400, 'Last 24 hours')
+        self.assertEqual(args[:8], ['graph', 'img.png', '--start', '0', '--end', '86400', '--title', 'Last 24 hours'])
+        self.assertTrue(args[-1].startswith('COMMENT:Generated on '))
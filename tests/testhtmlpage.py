@@ -0,0 +1,70 @@
+#! /usr/bin/python
+
+import unittest
+from solarstats import htmlpage
+
+class TestCompiledTemplate(unittest.TestCase):
+
+    def test_render(self):
+        template = htmlpage.CompiledTemplate('<TD>{name}</TD><TD>{value:.2f} kg</TD>')
+        self.assertEqual(template.render({'name': 'BLS', 'value': 1.005}), '<TD>BLS</TD><TD>1.00 kg</TD>')
+        self.assertEqual(template.render({'name': 'Sol', 'value': 2}), '<TD>Sol</TD><TD>2.00 kg</TD>')
+        with self.assertRaises(KeyError):
+            template.render({'name': 'BLS'})
+
+
+class TestStatusPage(unittest.TestCase):
+
+    def setUp(self):
+        self.page = htmlpage.StatusPage(footer='Footer %Y')
+        self.ivOn = {'id': 1, 'name': 'BLS3000', 'success': True, 'statusText': 'Inverter in operation',
+                     'PowerAC': 1234.5, 'VoltsPV1': 300.1, 'CurrentPV1': 4.1, 'Temperature': 41.0, 'FrequencyAC': 50.01,
+                     'VoltsAC1': 231.0, 'MinToday': 125, 'EnergyToday': 10.0, 'HrsTotal': 1000.0, 'EnergyTotal': 2000.0}
+        self.ivOff = {'id': 2, 'name': 'Soladin600', 'success': False, 'MinToday': 60, 'EnergyToday': '1.5',
+                      'HrsTotal': '12', 'EnergyTotal': '364.31'}
+
+    def test_render(self):
+        html, digest = self.page.render([self.ivOn, self.ivOff], 'now', '1 day')
+        self.assertIn('<SPAN ID="PowerAC1">1234.5</SPAN> W', html)
+        self.assertIn('<TD>2:05</TD><TD>10.0 kWh</TD><TD>4.45 kg</TD><TD>1000:00</TD>', html)
+        self.assertIn('Inverter off (using last working values)', html)
+        self.assertIn('<TD>1:00</TD><TD>1.5 kWh</TD>', html)
+        self.assertNotIn('%Y', html)
+        self.assertEqual(html.count('<IMG'), 4)
+        self.assertNotIn('EventSource', html)
+
+    def test_expected(self):
+        html, digest = self.page.render([self.ivOn], 'now', '1 day')
+        self.assertNotIn('Clear-sky output', html)
+        html, digest = self.page.render([dict(self.ivOn, ExpectedPower=1500, PerformanceRatio=0.823)], 'now', '1 day')
+        self.assertIn('Clear-sky output: 1500 W</TD><TD colspan="3">Performance ratio: 82%', html)
+        html, digest = self.page.render([dict(self.ivOn, ExpectedPower=0, PerformanceRatio=None)], 'now', '1 day')
+        self.assertIn('Performance ratio: -', html)
+
+    def test_liveFeed(self):
+        page = htmlpage.StatusPage(liveFeed=True)
+        html, digest = page.render([self.ivOn], 'now', '1 day')
+        self.assertIn('new EventSource("events")', html)
+
+    def test_links(self):
+        html, digest = self.page.render([self.ivOn], 'now', '1 day')
+        self.assertNotIn('Link quality', html)
+        links = [{'id': 1, 'name': 'BLS', 'port': '/dev/ttyUSB0', 'Sent': 8, 'Ok': 6, 'CrcErrors': 1, 'ShortFrames': 0,
+                  'BadFrames': 0, 'Timeouts': 1, 'Retries': 2, 'p50': 20, 'p90': None, 'p99': None}]
+        html, digest2 = self.page.render([self.ivOn], 'now', '1 day', links)
+        self.assertIn('<TR><TD>BLS</TD><TD>8</TD><TD>75.0%</TD><TD>1 / 0 / 0</TD><TD>1 / 2</TD><TD>20 / - ms</TD></TR>', html)
+        self.assertNotEqual(digest, digest2)
+
+    def test_anyNumberOfInverters(self):
+        ivs = [dict(self.ivOn, name='Inverter %d' % i) for i in range(10)]
+        html, digest = self.page.render(ivs, 'now', '1 day')
+        self.assertEqual(html.count('Inverter in operation'), 10)
+
+    def test_digest(self):
+        html1, digest1 = self.page.render([self.ivOn], 'now', '1 day')
+        html2, digest2 = self.page.render([self.ivOn], 'now', '2 days')
+        self.assertNotEqual(html1, html2)
+        self.assertEqual(digest1, digest2)
+        self.assertNotEqual(self.page.render([self.ivOn], 'later', '2 days')[1], digest1)   # The last update is shown
+        html3, digest3 = self.page.render([dict(self.ivOn, PowerAC=1000.0)], 'now', '2 days')
+        self.assertNotEqual(digest1, digest3)
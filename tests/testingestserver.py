@@ -0,0 +1,116 @@
+#! /usr/bin/python
+
+import httplib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import zlib
+from solarstats import ingestserver
+
+initFile = os.path.join(os.path.dirname(__file__), '..', 'db', 'SolarStatsInit.sql')
+
+class TestCentralStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.store = ingestserver.CentralStore(os.path.join(self.tmpDir, 'central.sqlt'), initFile)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmpDir)
+
+    def batch(self, site, first, last, inverters, rows, outbox='a'):
+        return {'site': site, 'outbox': outbox, 'first': first, 'last': last, 'columns': ['DateTime', 'PowerAC', 'RawData'],
+                'inverters': inverters, 'rows': rows}
+
+    def test_inverterMapping(self):
+        # The same inverter (by serial number) reported by two sites, with different local IDs
+        self.store.ingest(self.batch('a', 1, 1, {'1': ['SN1', 'BlackLine Solar', '3000']}, [[1, 1, '2014-06-01 12:00:00', 1000.0, '']]))
+        self.store.ingest(self.batch('b', 1, 2, {'7': ['SN1', 'BlackLine Solar', '3000'], '8': ['SN2', 'Soladin', '600']},
+                                     [[1, 7, '2014-06-01 12:05:00', 1100.0, ''], [2, 8, '2014-06-01 12:05:00', 300.0, '']]))
+        rows = self.store.conn.execute("SELECT i.SerialNumber, d.PowerAC FROM inverterdata d JOIN inverter i ON i.ID = d.Inverter_ID "
+                                       "ORDER BY d.DateTime, i.SerialNumber").fetchall()
+        self.assertEqual(rows, [('SN1', 1000.0), ('SN1', 1100.0), ('SN2', 300.0)])
+
+    def test_noSerialNumber(self):
+        self.store.ingest(self.batch('a', 1, 1, {'1': ['', None, None]}, [[1, 1, '2014-06-01 12:00:00', 1000.0, '']]))
+        self.store.ingest(self.batch('b', 1, 1, {'1': ['', None, None]}, [[1, 1, '2014-06-01 12:00:00', 900.0, '']]))
+        self.assertEqual(self.store.conn.execute("SELECT count(*) FROM inverterdata").fetchone()[0], 2)
+
+    def test_sequence(self):
+        inverters = {'1': ['SN1', 'BlackLine Solar', '3000']}
+        rows = [[1, 1, '2014-06-01 12:00:00', 1000.0, ''], [2, 1, '2014-06-01 12:05:00', 1100.0, '']]
+        self.assertEqual(self.store.ingest(self.batch('a', 1, 2, inverters, rows)), {'ack': 2, 'inserted': 2, 'duplicates': 0})
+        # Sent again: acknowledged without storing anything
+        self.assertEqual(self.store.ingest(self.batch('a', 1, 2, inverters, rows)), {'ack': 2, 'inserted': 0, 'duplicates': 0})
+        # A new outbox (recreated database) starts over, but rows already stored are not duplicated
+        self.assertEqual(self.store.ingest(self.batch('a', 1, 2, inverters, rows, outbox='b')), {'ack': 2, 'inserted': 0, 'duplicates': 2})
+        self.assertEqual(self.store.sites()[0]['samples'], 2)
+
+    def test_unknownColumns(self):
+        batch = self.batch('a', 1, 1, {'1': ['SN1', 'X', 'Y']}, [[1, 1, '2014-06-01 12:00:00', 1000.0, '', 42]])
+        batch['columns'].append('NewColumn')
+        self.assertEqual(self.store.ingest(batch)['inserted'], 1)
+
+
+class TestIngestServer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.store = ingestserver.CentralStore(os.path.join(self.tmpDir, 'central.sqlt'), initFile)
+        self.server = ingestserver.IngestServer(('127.0.0.1', 0), self.store)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.store.close()
+        shutil.rmtree(self.tmpDir)
+
+    def request(self, method, path, body=None, headers=None):
+        conn = httplib.HTTPConnection('127.0.0.1', self.server.server_address[1])
+        conn.request(method, path, body, headers or {})
+        response = conn.getresponse()
+        data = response.read()
+        conn.close()
+        return response, data
+
+    def test_ingest(self):
+        batch = {'site': 'a', 'outbox': 'x', 'first': 1, 'last': 1, 'columns': ['DateTime', 'PowerAC', 'RawData'],
+                 'inverters': {'1': ['SN1', 'BlackLine Solar', '3000']}, 'rows': [[1, 1, '2014-06-01 12:00:00', 1000.0, '']]}
+        response, data = self.request('POST', '/ingest', zlib.compress(json.dumps(batch)), {'Content-Encoding': 'deflate'})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(json.loads(data)['ack'], 1)
+        response, data = self.request('GET', '/api/sites')
+        self.assertEqual([site['site'] for site in json.loads(data)], ['a'])
+
+    def test_invalidBatch(self):
+        response, data = self.request('POST', '/ingest', 'not json')
+        self.assertEqual(response.status, 400)
+        response, data = self.request('POST', '/ingest', json.dumps({'site': 'a'}))
+        self.assertEqual(response.status, 400)
+
+    def test_busy(self):
+        self.server.maxActive = 0
+        response, data = self.request('POST', '/ingest', '{}')
+        self.assertEqual(response.status, 503)
+        self.assertEqual(response.getheader('Retry-After'), str(self.server.retryAfter))
+
+    def test_tooLarge(self):
+        self.server.maxBody = 10
+        response, data = self.request('POST', '/ingest', 'x' * 11)
+        self.assertEqual(response.status, 413)
+
+    def test_inflatedTooLarge(self):
+        self.server.maxBatch = 1000
+        response, data = self.request('POST', '/ingest', zlib.compress(' ' * 100000), {'Content-Encoding': 'deflate'})
+        self.assertEqual(response.status, 413)
+        self.assertEqual(self.server.active, 0)
+
+if __name__ == '__main__':
+    unittest.main()
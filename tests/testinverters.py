@@ -0,0 +1,40 @@
+#! /usr/bin/python
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from solarstats import inverters
+
+class TestInverters(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.dbName = os.path.join(self.tmpDir, 'test.sqlt')
+        conn = sqlite3.connect(self.dbName)
+        with open(os.path.join(os.path.dirname(__file__), '..', 'db', 'SolarStatsInit.sql')) as f:
+            conn.executescript(f.read())
+        conn.executemany("INSERT INTO invertertype VALUES (?,?,?,?,?,?)", [(1, 'KLNE', '3.0kW', '02', '5.03', '3000W'), (2, 'Soladin', '600', '11 00', '1.00', '600W')])
+        conn.executemany("INSERT INTO inverter VALUES (?,?,?)", [(1, '420612435030', 1), (2, '0001_0002', 2), (3, 'ABC', 1)])
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def test_loadInverters(self):
+        ivs = inverters.load_inverters(self.dbName)
+        self.assertEqual([iv.id for iv in ivs], [1, 2, 3])
+        self.assertEqual(ivs[0].rrdFile, 'SolarStats_BLS.rrd')
+        self.assertEqual(ivs[1].dataSource('pow'), 'sol600_pow')
+        self.assertEqual(ivs[2].rrdFile, 'SolarStats_3.rrd')
+        self.assertEqual(ivs[2].dataSource('tot'), 'inv3_tot')
+        self.assertEqual(ivs[2].manufacturer, 'KLNE')
+        self.assertEqual(ivs[0].maxOutput, 3000.0)
+
+    def test_parseMaxOutput(self):
+        self.assertEqual(inverters.Inverter.parseMaxOutput('600W'), 600.0)
+        self.assertEqual(inverters.Inverter.parseMaxOutput(3000), 3000.0)
+        self.assertIsNone(inverters.Inverter.parseMaxOutput(None))
+        self.assertIsNone(inverters.Inverter.parseMaxOutput('unknown'))
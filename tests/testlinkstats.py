@@ -0,0 +1,79 @@
+#! /usr/bin/python
+
+import datetime
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from solarstats import inverters, linkstats
+
+class TestLinkStats(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.dbName = os.path.join(self.tmpDir, 'test.sqlt')
+        self.now = datetime.datetime(2014, 6, 1, 12, 0, 0)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def poll(self, inverterId, port, latencies, **counts):
+        link = linkstats.LinkStats(inverterId, port)
+        for name, n in counts.items():
+            link.count(name, n)
+        for seconds in latencies:
+            link.observeLatency(seconds)
+        return link
+
+    def test_percentile(self):
+        link = self.poll(1, '/dev/ttyUSB0', [0.004] * 5 + [0.04] * 4 + [2.0])
+        self.assertEqual(link.percentile(50), 5)
+        self.assertEqual(link.percentile(90), 50)
+        self.assertEqual(link.percentile(99), None)     # Open bucket
+        self.assertEqual(linkstats.LinkStats(1, 'x').percentile(50), None)
+
+    def test_merge(self):
+        link = self.poll(1, '/dev/ttyUSB0', [0.004], Sent=2, Ok=1, CrcErrors=1)
+        link.merge(self.poll(1, '/dev/ttyUSB0', [0.25], Sent=1, Ok=1))
+        self.assertEqual(link.counts['Sent'], 3)
+        self.assertEqual(link.counts['CrcErrors'], 1)
+        self.assertEqual(sum(link.latency), 2)
+
+    def test_store_window(self):
+        conn = sqlite3.connect(self.dbName)
+        self.assertEqual(linkstats.window(conn, self.now), [])  # No table yet
+        self.poll(1, '/dev/ttyUSB0', [0.02], Sent=2, Ok=1, Timeouts=1, Retries=1).store(conn, self.now - datetime.timedelta(days=2))
+        self.poll(1, '/dev/ttyUSB0', [0.02, 0.02, 0.02], Sent=3, Ok=3).store(conn, self.now - datetime.timedelta(minutes=5))
+        self.poll(2, '/dev/ttyUSB1', [0.2], Sent=4, Ok=1, ShortFrames=2, BadFrames=1).store(conn, self.now - datetime.timedelta(minutes=5))
+        conn.close()
+
+        stats = dict(linkstats.windows(self.dbName, now=self.now))
+        self.assertEqual([(l.inverterId, l.port) for l in stats['1h']], [(1, '/dev/ttyUSB0'), (2, '/dev/ttyUSB1')])
+        self.assertEqual(stats['1h'][0].counts['Sent'], 3)
+        self.assertEqual(stats['7d'][0].counts['Sent'], 5)
+        self.assertEqual(stats['7d'][0].counts['Timeouts'], 1)
+        self.assertEqual(sum(stats['7d'][0].latency), 4)
+        self.assertEqual(stats['1h'][1].asDict()['ShortFrames'], 2)
+        self.assertEqual(stats['1h'][1].asDict()['p50'], 200)
+
+        rows = linkstats.page_rows(self.dbName, inverters.legacy_inverters(), now=self.now)
+        self.assertEqual([(row['name'], row['Sent']) for row in rows], [('BLS', 3), ('Sol', 4)])
+
+    def test_retention(self):
+        conn = sqlite3.connect(self.dbName)
+        self.poll(1, '/dev/ttyUSB0', [], Sent=1).store(conn, self.now - datetime.timedelta(days=40))
+        self.poll(1, '/dev/ttyUSB0', [], Sent=1).store(conn, self.now - datetime.timedelta(days=20))
+        self.poll(1, '/dev/ttyUSB0', [], Sent=1).store(conn, self.now)
+        self.assertEqual(conn.execute("SELECT count(*) FROM linkstats").fetchone()[0], 2)
+        conn.close()
+
+    def test_packLatency(self):
+        link = self.poll(1, '/dev/ttyUSB0', [0.001, 0.3, 5.0])
+        self.assertEqual(len(link.packLatency()), 2 * (len(linkstats.LinkStats.latencyBuckets) + 1))
+        other = linkstats.LinkStats(1, '/dev/ttyUSB0')
+        other.unpackLatency(link.packLatency())
+        self.assertEqual(other.latency, link.latency)
+
+if __name__ == '__main__':
+    unittest.main()
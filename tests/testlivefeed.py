@@ -0,0 +1,75 @@
+#! /usr/bin/python
+
+import json
+import time
+import unittest
+from solarstats import livefeed
+
+class TestFanoutHub(unittest.TestCase):
+
+    def setUp(self):
+        self.hub = livefeed.FanoutHub(queueSize=2)
+
+    def events(self, subscription):
+        result = []
+        event = subscription.get(0)
+        while event is not None:
+            result.append(json.loads(event[len('data: '):]))
+            event = subscription.get(0)
+        return result
+
+    def test_deltas(self):
+        client = self.hub.subscribe()
+        self.hub.publish({'id': 1, 'PowerAC': 100.0, 'Temperature': 40.0})
+        self.hub.publish({'id': 1, 'PowerAC': 120.0, 'Temperature': 40.0})
+        self.hub.publish({'id': 1, 'PowerAC': 120.0, 'Temperature': 40.0})     # Unchanged, not sent
+        self.assertEqual(self.events(client), [{'id': 1, 'PowerAC': 100.0, 'Temperature': 40.0}, {'id': 1, 'PowerAC': 120.0}])
+
+    def test_snapshot(self):
+        self.hub.publish({'id': 1, 'PowerAC': 100.0, 'Temperature': 40.0})
+        self.hub.publish({'id': 1, 'PowerAC': 120.0})
+        client = self.hub.subscribe()
+        self.assertEqual(self.events(client), [{'id': 1, 'PowerAC': 120.0, 'Temperature': 40.0}])
+
+    def test_unchangedWithTime(self):
+        client = self.hub.subscribe()
+        self.hub.publish({'id': 1, 't': 1000, 'PowerAC': 100.0})
+        self.hub.publish({'id': 1, 't': 1300, 'PowerAC': 100.0})     # Only the time changed, not sent
+        self.hub.publish({'id': 1, 't': 1600, 'PowerAC': 110.0})
+        self.assertEqual(self.events(client), [{'id': 1, 't': 1000, 'PowerAC': 100.0}, {'id': 1, 't': 1600, 'PowerAC': 110.0}])
+
+    def test_snapshotOfManyInverters(self):
+        for ivId in range(40):
+            self.hub.publish({'id': ivId, 'PowerAC': 100.0})
+        client = self.hub.subscribe()
+        self.assertEqual(len(self.events(client)), 40)
+        self.assertFalse(client.dropped)
+
+    def test_dropSlowClient(self):
+        slow = self.hub.subscribe()
+        fast = self.hub.subscribe()
+        for power in range(3):
+            self.hub.publish({'id': 1, 'PowerAC': power})
+            self.events(fast)
+        self.assertTrue(slow.dropped)
+        self.assertFalse(fast.dropped)
+        self.assertEqual(self.hub.clientCount(), 1)
+
+    def test_udp(self):
+        receiver = livefeed.SampleReceiver(('127.0.0.1', 0), self.hub)
+        receiver.start()
+        client = self.hub.subscribe()
+        sender = livefeed.SampleSender(receiver.address)
+        sender.send({'id': 2, 'name': 'Soladin600', 'PowerAC': 321.0, 'success': True})
+        event = client.get(5)
+        sender.close()
+        receiver.close()
+        receiver.join(5)
+        message = json.loads(event[len('data: '):])
+        self.assertEqual(message['PowerAC'], 321.0)
+        self.assertNotIn('name', message)
+        self.assertFalse(receiver.is_alive())
+
+    def test_sampleMessage(self):
+        message = livefeed.sample_message({'id': 1, 'PowerAC': 1.0, 'RawData': 'FF'})
+        self.assertEqual(sorted(message), ['PowerAC', 'id', 't'])
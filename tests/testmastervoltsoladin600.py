@@ -2,6 +2,7 @@
 
 import unittest
 from solarstats import mastervoltsoladin600
+from solarstats import solarutils
 
 class TestMastervolt(unittest.TestCase):
 
@@ -45,6 +46,14 @@ class TestMastervolt(unittest.TestCase):
         with self.assertRaises(ValueError):     # Incorrect CRC
             self.assertEqual(self.mv.parseResponse("\x00\x00\x11\x00\xC1\xF3\x00\x00\xC6"))
 
+    def test_parseResponseErrors(self):
+        with self.assertRaises(solarutils.FrameLengthError):
+            self.mv.parseResponse("\x00\x00\x11\x00")
+        with self.assertRaises(solarutils.FrameLengthError):
+            self.mv.parseResponse("\x00\x00\x11\x00\xB4\xF3\x00\x00\xC5")
+        with self.assertRaises(solarutils.CrcError):
+            self.mv.parseResponse("\x00\x00\x11\x00\xC1\xF3\x00\x00\xC6")
+
     def test_busQueryCommand(self):
         self.assertEqual(self.mv.busQueryCommand(), "\x00\x00\x00\x00\xC1\x00\x00\x00\xC1")
         
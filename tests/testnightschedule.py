@@ -0,0 +1,95 @@
+#! /usr/bin/python
+
+import calendar
+import os
+import shutil
+import tempfile
+import unittest
+from solarstats import nightschedule
+
+noon = calendar.timegm((2014, 6, 21, 12, 0, 0))
+
+def sample(power=None):
+    if power is None:
+        return {'id': 1, 'name': 'BLS3000', 'success': False}
+    return {'id': 1, 'name': 'BLS3000', 'success': True, 'PowerAC': power, 'EnergyToday': 12.5, 'EnergyYear': 900.0}
+
+class TestNightSchedule(unittest.TestCase):
+
+    def setUp(self):
+        self.schedule = nightschedule.NightSchedule(52.0, 5.0)
+        sunrise, self.sunset = nightschedule.sun_times(noon, 52.0, 5.0)
+        self.now = self.sunset + nightschedule.margin + 60
+
+    def poll(self, results):
+        mode = self.schedule.mode('/dev/ttyUSB0', self.now)
+        if mode == 'skip':
+            self.schedule.skip('/dev/ttyUSB0', self.now)
+            results = self.schedule.sleepingResults('/dev/ttyUSB0')
+        else:
+            results = self.schedule.record('/dev/ttyUSB0', results, self.now, mode == 'probe')
+        self.now += 300
+        return mode, results
+
+    def test_sunTimes(self):
+        sunrise, sunset = nightschedule.sun_times(noon, 52.0, 5.0)
+        self.assertAlmostEqual(sunrise, calendar.timegm((2014, 6, 21, 3, 17, 0)), delta=300)
+        self.assertAlmostEqual(sunset, calendar.timegm((2014, 6, 21, 20, 3, 0)), delta=300)
+        sunrise, sunset = nightschedule.sun_times(noon, 80.0, 5.0)
+        self.assertEqual(sunset - sunrise, 86400)      # Midnight sun
+        sunrise, sunset = nightschedule.sun_times(noon, -80.0, 5.0)
+        self.assertEqual(sunset, sunrise)               # Polar night
+
+    def test_daytime(self):
+        self.now = noon
+        for i in range(5):
+            self.assertEqual(self.poll(sample())[0], 'poll')
+
+    def test_sleepAndProbe(self):
+        self.assertEqual(self.poll(sample(0.0)), ('poll', dict(sample(0.0), asleep=False, nightValues=[])))
+        mode, results = self.poll(sample())
+        self.assertTrue(results['asleep'])
+        self.assertEqual(results['nightValues'], [(int(self.now - 300), '0:12.5:900.0')])
+        polls = [self.poll(sample()) for i in range(6)]
+        self.assertEqual([mode for mode, results in polls], ['skip'] * 5 + ['probe'])
+        # The cycles slept through are written with the (failed) probe
+        self.assertEqual(len(polls[-1][1]['nightValues']), 6)
+        self.assertEqual(self.schedule.port('/dev/ttyUSB0').pending, [])
+
+    def test_wakeUp(self):
+        self.poll(sample())
+        self.poll(sample())
+        self.now += nightschedule.heartbeat
+        mode, results = self.poll(sample(150.0))
+        self.assertEqual(mode, 'probe')
+        self.assertFalse(results['asleep'])
+        self.assertEqual(self.poll(sample(150.0))[0], 'poll')
+        # Sunrise wakes everything up
+        self.poll(sample())
+        self.poll(sample())
+        self.now = noon
+        self.assertEqual(self.poll(sample())[0], 'poll')
+
+    def test_nightValueAfterMidnight(self):
+        self.poll(sample(0.0))
+        state = self.schedule.port('/dev/ttyUSB0')
+        self.assertEqual(state.nightValue(self.now), '0:12.5:900.0')
+        self.assertEqual(state.nightValue(self.now + 86400), '0:0.0:900.0')
+
+    def test_stateFile(self):
+        tmpDir = tempfile.mkdtemp()
+        try:
+            self.poll(sample())
+            self.poll(sample())
+            stateFile = os.path.join(tmpDir, 'night.json')
+            self.schedule.save(stateFile)
+            restored = nightschedule.NightSchedule(52.0, 5.0)
+            restored.load(stateFile)
+            self.assertEqual(restored.mode('/dev/ttyUSB0', self.now), 'skip')
+            self.assertEqual(restored.sleepingResults('/dev/ttyUSB0')['name'], 'BLS3000')
+            nightschedule.NightSchedule(52.0, 5.0).load(os.path.join(tmpDir, 'missing.json'))
+        finally:
+            shutil.rmtree(tmpDir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+#! /usr/bin/python
+
+import os
+import shutil
+import tempfile
+import unittest
+from solarstats import profiling
+
+def busy(n):
+    return sum(i * i for i in range(n))
+
+def workload():
+    for i in range(20):
+        busy(20000)
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.basePath = os.path.join(self.tmpDir, 'cycle1')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def readCollapsed(self):
+        collapsed = {}
+        with open(self.basePath + '.collapsed') as f:
+            for line in f:
+                stack, count = line.rsplit(' ', 1)
+                collapsed[stack] = int(count)
+        return collapsed
+
+    def test_cprofile(self):
+        stats = profiling.profile_call(workload, 'cprofile', self.basePath)
+        self.assertTrue(os.path.isfile(self.basePath + '.pstats'))
+        self.assertGreater(stats.total_tt, 0)
+        collapsed = self.readCollapsed()
+        busyStacks = [stack for stack in collapsed if stack.split(';')[-1].startswith('testprofiling.py:<genexpr>')]
+        self.assertTrue(busyStacks)
+        self.assertTrue(all('testprofiling.py:workload:' in stack and 'testprofiling.py:busy:' in stack for stack in busyStacks))
+
+    def test_sample(self):
+        sampler = profiling.profile_call(workload, 'sample', self.basePath)
+        self.assertFalse(os.path.isfile(self.basePath + '.pstats'))
+        self.assertGreater(sum(self.readCollapsed().values()), 0)
+        names = [name for name, count in sampler.top()]
+        self.assertTrue(any(name.startswith('testprofiling.py:workload:') for name in names))
+
+    def test_unknownProfiler(self):
+        with self.assertRaises(ValueError):
+            profiling.profile_call(workload, 'perf', self.basePath)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+#! /usr/bin/python
+
+import datetime
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+try:
+    import numpy
+    from solarstats import ringbuffer
+except ImportError:
+    ringbuffer = None
+
+initFile = os.path.join(os.path.dirname(__file__), '..', 'db', 'SolarStatsInit.sql')
+
+@unittest.skipUnless(ringbuffer, "numpy not installed")
+class TestRingBuffer(unittest.TestCase):
+
+    def fill(self, buffer, count, start=1000):
+        for i in range(count):
+            buffer.append(start + 300 * i, {'PowerAC': float(i), 'EnergyToday': i / 10.0})
+
+    def test_append(self):
+        buffer = ringbuffer.RingBuffer(5)
+        self.assertEqual(len(buffer.view()['PowerAC']), 0)
+        self.assertIsNone(buffer.latest())
+        self.fill(buffer, 3)
+        self.assertEqual(buffer.view()['PowerAC'].tolist(), [0.0, 1.0, 2.0])
+        self.fill(buffer, 5, 1900)      # Wraps around
+        self.assertEqual(len(buffer), 5)
+        self.assertEqual(buffer.view()['PowerAC'].tolist(), [0.0, 1.0, 2.0, 3.0, 4.0])
+        self.assertEqual(buffer.view(2)['time'].tolist(), [1900 + 900, 1900 + 1200])
+        self.assertTrue(numpy.isnan(buffer.view()['Temperature']).all())
+        self.assertEqual(buffer.latest()['PowerAC'], 4.0)
+
+    def test_zeroCopy(self):
+        buffer = ringbuffer.RingBuffer(4)
+        for count in range(1, 12):
+            buffer.append(count, {'PowerAC': float(count)})
+            window = buffer.view()
+            self.assertEqual(window['PowerAC'].tolist(), [float(c) for c in range(max(1, count - 3), count + 1)])
+            self.assertIs(window['PowerAC'].base, buffer._arrays['PowerAC'])
+            self.assertFalse(window['PowerAC'].flags.writeable)
+
+    def test_since(self):
+        buffer = ringbuffer.RingBuffer(10)
+        self.fill(buffer, 8)
+        self.assertEqual(buffer.since(1000 + 300 * 6)['PowerAC'].tolist(), [6.0, 7.0])
+        self.assertEqual(len(buffer.since(0)['PowerAC']), 8)
+        self.assertEqual(len(buffer.since(10 ** 10)['PowerAC']), 0)
+
+    def test_recentSamples(self):
+        recent = ringbuffer.RecentSamples(100)
+        now = time.time()
+        recent.add({'id': 1, 'success': True, 'PowerAC': 500.0, 'EnergyToday': 2.5}, now - 600)
+        recent.add({'id': 1, 't': now - 300, 'PowerAC': 600.0, 'EnergyToday': 2.6})    # Live feed message
+        recent.add({'id': 1, 't': now - 300, 'PowerAC': 600.0, 'EnergyToday': 2.6})    # Received twice
+        recent.add({'id': 1, 'success': False}, now)
+        self.assertEqual(recent.buffers[1].count, 2)
+        self.assertEqual(recent.lastMinutes(1, 7, now)['PowerAC'].tolist(), [600.0])
+        self.assertEqual(recent.latest(1)['EnergyToday'], 2.6)
+        if ringbuffer.midnight(now) <= now - 600:
+            self.assertEqual(recent.todayMax(1, 'EnergyToday', now), 2.6)
+        self.assertIsNone(recent.todayMax(1, 'EnergyToday', now + 2 * 86400))
+        self.assertIsNone(recent.latest(2))
+        self.assertIsNone(recent.since(2, 0))
+        window = recent.since(1, 0)     # A copy, not changed by samples added later
+        recent.add({'id': 1, 't': now + 300, 'PowerAC': 700.0})
+        self.assertEqual(window['PowerAC'].tolist(), [500.0, 600.0])
+        self.assertIsNot(window['PowerAC'].base, recent.buffers[1]._arrays['PowerAC'])
+
+    def test_load(self):
+        tmpDir = tempfile.mkdtemp()
+        try:
+            conn = sqlite3.connect(os.path.join(tmpDir, 'test.sqlt'))
+            with open(initFile) as f:
+                conn.executescript(f.read())
+            now = datetime.datetime.now()
+            rows = [(2, str(now - datetime.timedelta(hours=h)), 100.0 * h, '') for h in (50, 3, 2, 1)]
+            conn.executemany("INSERT INTO inverterdata (Inverter_ID, DateTime, PowerAC, RawData) VALUES (?,?,?,?)", rows)
+            recent = ringbuffer.RecentSamples()
+            recent.load(conn, 48)
+            conn.close()
+            self.assertEqual(recent.since(2, 0)['PowerAC'].tolist(), [300.0, 200.0, 100.0])
+        finally:
+            shutil.rmtree(tmpDir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+#! /usr/bin/python
+
+import os
+import shutil
+import tempfile
+import unittest
+from distutils.spawn import find_executable
+from solarstats import inverters
+from solarstats import rrdschema
+from solarstats import rrdstore
+
+class TestRrdSchema(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.schema = rrdschema.RrdSchema(step=300, directory=self.tmpDir)
+        self.fleet = [inverters.Inverter(i) for i in range(1, 41)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def test_createArgs(self):
+        args = self.schema.createArgs(inverters.Inverter(1))
+        self.assertEqual(args[:5], ['create', os.path.join(self.tmpDir, 'SolarStats_BLS.rrd'), '--step', '300', '--no-overwrite'])
+        self.assertEqual(args[5:8], ['DS:bls3000_pow:GAUGE:600:0:U', 'DS:bls3000_nrg:GAUGE:600:0:U', 'DS:bls3000_tot:GAUGE:600:0:U'])
+        self.assertIn('RRA:AVERAGE:0.5:288:365', args)
+        self.assertEqual(len(args), 8 + len(self.schema.archives))
+
+    def test_provisionStores(self):
+        created = self.schema.provision(self.fleet, useRrdtool=False)
+        self.assertEqual(len(created), 40)
+        store = rrdstore.RoundRobinStore(os.path.join(self.tmpDir, 'SolarStats_3.rrd'))
+        self.assertEqual(store.dataSources, ['inv3_pow', 'inv3_nrg', 'inv3_tot'])
+        self.assertEqual(len(store.archives), len(self.schema.archives))
+
+        # Idempotent: nothing left to create
+        self.assertEqual(self.schema.provision(self.fleet, useRrdtool=False), [])
+
+    @unittest.skipUnless(find_executable('rrdtool'), "rrdtool not installed")
+    def test_provisionRrdtool(self):
+        created = self.schema.provision(self.fleet)
+        self.assertEqual(len(created), 40)
+        self.assertEqual(self.schema.provision(self.fleet), [])
@@ -0,0 +1,95 @@
+#! /usr/bin/python
+
+import os
+import shutil
+import tempfile
+import unittest
+import StringIO
+import numpy
+from solarstats import rrdstore
+
+dump = """<?xml version="1.0" encoding="utf-8"?>
+<rrd>
+    <version>0003</version>
+    <step>300</step>
+    <lastupdate>1400000100</lastupdate>
+    <ds>
+        <name> sol600_pow </name>
+        <type>GAUGE</type>
+        <minimal_heartbeat>600</minimal_heartbeat>
+    </ds>
+    <rra>
+        <cf>AVERAGE</cf>
+        <pdp_per_row>1</pdp_per_row>
+        <params><xff>5.0000000000e-01</xff></params>
+        <database>
+            <row><v>NaN</v></row>
+            <row><v>1.0000000000e+02</v></row>
+            <row><v>2.0000000000e+02</v></row>
+        </database>
+    </rra>
+</rrd>
+"""
+
+class TestRoundRobinStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.fileName = os.path.join(self.tmpDir, 'test.rrs')
+        self.archives = [('LAST', 0.5, 1, 10), ('AVERAGE', 0.5, 2, 5), ('MIN', 0.5, 2, 5), ('MAX', 0.5, 2, 5)]
+        self.store = rrdstore.RoundRobinStore.create(self.fileName, ['pow', 'nrg'], self.archives, step=300, start=3000)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def test_consolidation(self):
+        for i, value in enumerate([10, 20, 30, 40]):
+            self.store.update(3000 + 300 * (i + 1), [value, i])
+
+        times, values = self.store.series('pow', 'LAST', 3300, 4200)
+        self.assertEqual(list(times), [3300, 3600, 3900, 4200])
+        self.assertEqual(list(values), [10, 20, 30, 40])
+
+        times, values = self.store.series('pow', 'AVERAGE', 3600, 4200)
+        self.assertEqual(list(times), [3600, 4200])
+        self.assertEqual(list(values), [15, 35])
+        self.assertEqual(list(self.store.series('pow', 'MIN', 3600, 4200)[1]), [10, 30])
+        self.assertEqual(list(self.store.series('pow', 'MAX', 3600, 4200)[1]), [20, 40])
+
+    def test_heartbeat(self):
+        self.store.update(3300, [10, 0])
+        self.store.update(4500, [10, 0])    # Gap larger than the heartbeat, so unknown
+        times, values = self.store.series('pow', 'LAST', 3300, 4500)
+        self.assertEqual(values[0], 10)
+        self.assertTrue(numpy.isnan(values[1:]).all())
+
+    def test_illegalUpdate(self):
+        self.store.update(3300, [1, 1])
+        with self.assertRaises(ValueError):
+            self.store.update(3300, [2, 2])
+        with self.assertRaises(ValueError):
+            self.store.update(3600, [2])
+
+    def test_zeroCopyFetch(self):
+        for i in range(25):     # Wraps the 10-row archive more than twice
+            self.store.update(3000 + 300 * (i + 1), [i, i])
+        times, values, names = self.store.fetch('LAST', 0, 3000 + 300 * 25)
+        self.assertEqual(len(values), 10)
+        self.assertEqual(list(values[:, 0]), range(15, 25))
+        self.assertFalse(values.flags.owndata)
+        self.assertFalse(values.flags.writeable)
+
+    def test_persistence(self):
+        self.store.update(3300, [5, 6])
+        self.store.close()
+        store = rrdstore.RoundRobinStore(self.fileName, readOnly=True)
+        self.assertEqual(store.lastUpdate, 3300)
+        self.assertEqual(store.dataSources, ['pow', 'nrg'])
+        self.assertEqual(list(store.fetch('LAST', 3300, 3300)[1][0]), [5, 6])
+
+    def test_fromDump(self):
+        store = rrdstore.RoundRobinStore.fromDump(StringIO.StringIO(dump), os.path.join(self.tmpDir, 'dump.rrs'))
+        times, values = store.series('sol600_pow', 'AVERAGE', 0, 1400000100)
+        self.assertEqual(list(times), [1399999500, 1399999800, 1400000100])
+        self.assertTrue(numpy.isnan(values[0]))
+        self.assertEqual(list(values[1:]), [100, 200])
@@ -0,0 +1,103 @@
+#! /usr/bin/python
+
+import gzip
+import os
+import shutil
+import sqlite3
+import stat
+import tempfile
+import unittest
+from solarstats import shards
+
+initFile = os.path.join(os.path.dirname(__file__), '..', 'db', 'SolarStatsInit.sql')
+
+class TestShards(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.dbName = os.path.join(self.tmpDir, 'SolarStats.sqlt')
+        self.conn = sqlite3.connect(self.dbName)
+        with open(initFile) as f:
+            self.conn.executescript(f.read())
+        for day, power in [('2013-12-31', 10.0), ('2014-06-01', 20.0), ('2014-12-31', 30.0), ('2015-01-02', 40.0)]:
+            self.conn.execute("INSERT INTO inverterdata (Inverter_ID, DateTime, PowerAC, RawData) VALUES (1, ?, ?, '')",
+                              (day + ' 12:00:00.000000', power))
+        self.conn.commit()
+        self.layout = shards.ShardLayout(self.dbName, 'year')
+
+    def tearDown(self):
+        self.conn.close()
+        for name in os.listdir(self.tmpDir):
+            os.chmod(os.path.join(self.tmpDir, name), stat.S_IRUSR | stat.S_IWUSR)
+        shutil.rmtree(self.tmpDir)
+
+    def powers(self, conn, sql="SELECT PowerAC FROM inverterdata ORDER BY DateTime"):
+        return [row[0] for row in conn.execute(sql)]
+
+    def test_keys(self):
+        monthly = shards.ShardLayout(self.dbName, 'month')
+        self.assertEqual(monthly.key('2014-06-01 12:00:00.000000'), '2014-06')
+        self.assertEqual(monthly.nextKey('2014-12'), '2015-01')
+        self.assertEqual(self.layout.nextKey('2014'), '2015')
+        self.assertEqual(self.layout.fileName('2014'), 'SolarStats.2014.sqlt')
+        self.assertRaises(ValueError, shards.ShardLayout, self.dbName, 'week')
+
+    def test_rotate(self):
+        moved = shards.rotate(self.layout, self.conn, '2015-01-03 00:00:00')
+        self.assertEqual(moved, {'2013': 1, '2014': 2})
+        self.assertEqual(self.layout.keys(), ['2013', '2014'])
+        self.assertEqual(self.powers(self.conn), [40.0])     # Only the current year stays
+        shardFile = os.path.join(self.tmpDir, 'SolarStats.2014.sqlt')
+        self.assertFalse(os.stat(shardFile).st_mode & stat.S_IWUSR)     # Read-only
+        # Late data for an old year goes into its shard as well
+        self.conn.execute("INSERT INTO inverterdata (Inverter_ID, DateTime, PowerAC, RawData) VALUES (1, '2014-12-31 13:00:00.000000', 35.0, '')")
+        self.conn.commit()
+        self.assertEqual(shards.rotate(self.layout, self.conn, '2015-01-03'), {'2014': 1})
+        self.assertEqual(self.powers(sqlite3.connect(shardFile)), [20.0, 30.0, 35.0])
+
+    def test_rotateKeepsOutbox(self):
+        self.conn.execute("INSERT INTO outbox (Inverter_ID, DateTime) VALUES (1, '2014-12-31 12:00:00.000000')")
+        self.conn.commit()
+        self.assertEqual(shards.rotate(self.layout, self.conn, '2015-01-03'), {'2013': 1, '2014': 1})
+        self.assertEqual(self.powers(self.conn), [30.0, 40.0])  # Not forwarded yet
+
+    def test_connect(self):
+        shards.rotate(self.layout, self.conn, '2015-01-03')
+        conn = shards.connect(self.layout, '2014-01-01', '2015-12-31')
+        self.assertEqual(self.powers(conn), [20.0, 30.0, 40.0])     # 2013 is not attached
+        self.assertEqual([row[1] for row in conn.execute("PRAGMA database_list")], ['main', 'temp', 'shard0'])
+        conn.close()
+        conn = shards.connect(self.layout)
+        self.assertEqual(self.powers(conn), [10.0, 20.0, 30.0, 40.0])
+        conn.close()
+
+    def test_attachLimit(self):
+        monthly = shards.ShardLayout(self.dbName, 'month')
+        for month in range(1, shards.maxAttached + 2):
+            open(os.path.join(self.tmpDir, monthly.fileName('2014-%02d' % month)), 'w').close()
+        self.assertRaises(ValueError, shards.connect, monthly)
+        shards.connect(monthly, '2014-01', '2014-%02d' % shards.maxAttached).close()
+
+    def test_movedAndCompressed(self):
+        shards.rotate(self.layout, self.conn, '2015-01-03')
+        archiveDir = os.path.join(self.tmpDir, 'archive')
+        os.mkdir(archiveDir)
+        shardFile = os.path.join(self.tmpDir, 'SolarStats.2013.sqlt')
+        with open(shardFile, 'rb') as source:
+            with gzip.open(os.path.join(archiveDir, 'SolarStats.2013.sqlt.gz'), 'wb') as target:
+                shutil.copyfileobj(source, target)
+        os.chmod(shardFile, stat.S_IWUSR)
+        os.remove(shardFile)
+        layout = shards.ShardLayout(self.dbName, 'year', [archiveDir], os.path.join(self.tmpDir, 'cache'))
+        os.mkdir(layout.cacheDir)
+        self.assertEqual(layout.keys(), ['2013', '2014'])
+        conn = shards.connect(layout)
+        self.assertEqual(self.powers(conn), [10.0, 20.0, 30.0, 40.0])
+        conn.close()
+        self.assertEqual(list(shards.select(layout, "SELECT PowerAC FROM inverterdata ORDER BY DateTime")),
+                         [(10.0,), (20.0,), (30.0,), (40.0,)])
+        shutil.rmtree(layout.cacheDir)
+        shutil.rmtree(archiveDir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+#! /usr/bin/python
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from solarstats import blacklinesolar3000
+from solarstats import frametrace
+from solarstats import inverters
+from solarstats import mastervoltsoladin600
+from solarstats import simulator
+
+class TestSimulator(unittest.TestCase):
+
+    def setUp(self):
+        self.bls = blacklinesolar3000.BlackLineSolar()
+        self.mv = mastervoltsoladin600.MasterVolt()
+
+    def read(self, port):
+        data = ''
+        ch = port.read()
+        while ch:
+            data += ch
+            ch = port.read()
+        return data
+
+    def test_blackLineSolar(self):
+        port = simulator.SimulatedPort(simulator.SimulatedBlackLineSolar())
+        port.write(self.bls.mb_readInputRegisters("02", "0A", "1F"))
+        address, command, byteCount, data = self.bls.mb_parseResponse(self.read(port))
+        self.assertEqual(ord(byteCount), 0x3E)
+        self.assertEqual(data[24:26], '\x32\x46')       # PowerAC (0x16): 1287.0 W * 10
+        self.assertEqual(data[-2:], '\x00\x01')         # Status2: in operation
+
+    def test_blackLineSolarIgnoresOthers(self):
+        port = simulator.SimulatedPort(simulator.SimulatedBlackLineSolar())
+        port.write(self.bls.mb_readInputRegisters("03", "0A", "1F"))
+        self.assertEqual(self.read(port), '')
+        port.write(self.bls.mb_readInputRegisters("02", "0A", "1F")[:-1] + '\x00')
+        self.assertEqual(self.read(port), '')
+
+    def test_soladin(self):
+        port = simulator.SimulatedPort(simulator.SimulatedSoladin())
+        for cmd in (self.mv.mvCmd_stats, self.mv.mvCmd_maxpow, self.mv.mvCmd_hisdat):
+            port.write(self.mv.generateCommand("11 00", "00 00", cmd))
+            dest, src, data = self.mv.parseResponse(self.read(port))
+            self.assertEqual((dest, src), ('\x00\x00', '\x11\x00'))
+        self.assertEqual(data, '\x54\x05')
+        port.write(self.mv.generateCommand("12 00", "00 00", self.mv.mvCmd_stats))
+        self.assertEqual(self.read(port), '')
+
+    def test_createDatabase(self):
+        tmpDir = tempfile.mkdtemp()
+        try:
+            dbName = os.path.join(tmpDir, 'sim.sqlt')
+            initFile = os.path.join(os.path.dirname(__file__), '..', 'db', 'SolarStatsInit.sql')
+            simulator.create_database(dbName, initFile)
+            simulator.create_database(dbName, initFile)     # Idempotent
+            self.assertEqual([iv.id for iv in inverters.load_inverters(dbName)], [1, 2])
+        finally:
+            shutil.rmtree(tmpDir)
+
+    def test_replay(self):
+        records = [(1.0, frametrace.TX, '/dev/ttyUSB1', 'req1'),
+                   (1.1, frametrace.RX, '/dev/ttyUSB1', 'resp1'),
+                   (2.0, frametrace.TX, '/dev/ttyUSB0', 'reqA'),
+                   (3.0, frametrace.TX, '/dev/ttyUSB1', 'req2'),     # Timed out
+                   (4.0, frametrace.TX, '/dev/ttyUSB1', 'req3'),
+                   (4.2, frametrace.RX, '/dev/ttyUSB1', 'resp3')]
+        ports = simulator.replay_ports(records)
+        self.assertEqual(sorted(ports), ['/dev/ttyUSB0', '/dev/ttyUSB1'])
+        port = ports['/dev/ttyUSB1']
+        self.assertEqual(port.remaining(), 3)
+        port.write('req1')
+        self.assertEqual(self.read(port), 'resp1')
+        port.write('other')
+        self.assertEqual(self.read(port), '')
+        port.write('req3')
+        self.assertEqual(self.read(port), 'resp3')
+        self.assertEqual((port.remaining(), port.mismatches), (0, 1))
+        port.write('req4')
+        self.assertEqual(self.read(port), '')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,238 @@
+#! /usr/bin/python
+
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from solarstats import linkstats, solarstats
+
+class TestStartup(unittest.TestCase):
+
+    # Modules only needed for polling or serving; the other modes must start without them
+    pollingModules = ['serial', 'subprocess', 'socket', 'shutil', 'fnmatch', 'blacklinesolar3000',
+                      'mastervoltsoladin600', 'livefeed', 'htmlpage', 'rrdschema']
+
+    def loadedModules(self, code):
+        repoDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+        output = subprocess.check_output([sys.executable, '-c', code + '\nimport sys\nprint " ".join(sys.modules)'],
+                                         cwd=repoDir)
+        return set(name.split('.')[-1] for name in output.split())
+
+    def test_importIsLean(self):
+        loaded = self.loadedModules('from solarstats import solarstats')
+        self.assertEqual([m for m in self.pollingModules if m in loaded], [])
+
+    def test_loadDrivers(self):
+        loaded = self.loadedModules('from solarstats import solarstats\nsolarstats.load_drivers()')
+        self.assertIn('blacklinesolar3000', loaded)
+        self.assertIn('mastervoltsoladin600', loaded)
+        self.assertNotIn('serial', loaded)
+
+    def test_statusPage(self):
+        page = solarstats.status_page()
+        self.assertIs(solarstats.status_page(), page)
+        self.assertEqual(page.heading, solarstats.htmlTitle)
+
+class TestArgs(unittest.TestCase):
+
+    def test_captureSupervise(self):
+        saved = sys.argv, sys.stderr
+        sys.argv, sys.stderr = ['solarstats.py', '--capture', 'test.cap', '--supervise'], open(os.devnull, 'w')
+        try:
+            self.assertRaises(SystemExit, solarstats.parse_args)
+        finally:
+            sys.stderr.close()
+            sys.argv, sys.stderr = saved
+
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.saved = solarstats.sqliteDbName, solarstats.shardPeriod
+        solarstats.sqliteDbName = os.path.join(self.tmpDir, 'test.sqlt')
+        solarstats.shardPeriod = None
+        conn = sqlite3.connect(solarstats.sqliteDbName)
+        with open(solarstats.init_file()) as f:
+            conn.executescript(f.read())
+        for dateTime, power in [('2013-11-01 12:00:00.000000', 100.0), ('2013-11-01 12:05:00.000000', 200.0),
+                                ('2013-11-01 12:20:00.000000', 500.0)]:
+            conn.execute("INSERT INTO inverterdata (Inverter_ID, DateTime, PowerAC, EnergyToday, EnergyTotal, RawData) "
+                         "VALUES (2, ?, ?, 1.5, 300.0, '')", (dateTime, power))
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        solarstats.sqliteDbName, solarstats.shardPeriod = self.saved
+        shutil.rmtree(self.tmpDir)
+
+    def test_exportFillsGaps(self):
+        exportFile = os.path.join(self.tmpDir, 'solarInv_2.dmp')
+        solarstats.export_data('2', exportFile)
+        with open(exportFile) as f:
+            lines = f.read().splitlines()
+        start = int(time.mktime((2013, 11, 1, 12, 0, 0, 0, 0, -1)))
+        self.assertEqual(lines[0], 'rrdtool update %s %d:100.0:1.5:0.0' % (solarstats.rrdDbSol, start))
+        self.assertEqual([int(line.split()[3].split(':')[0]) - start for line in lines], [0, 300, 600, 900, 1200])
+        self.assertEqual([line.split(':')[1] for line in lines], ['100.0', '200.0', '500.0', '500.0', '500.0'])
+
+class TestRetries(unittest.TestCase):
+
+    def test_lastAttemptIsNoRetry(self):
+        saved = solarstats.retryDelay
+        solarstats.retryDelay = 0
+        try:
+            link = linkstats.LinkStats(1, '/dev/ttyUSB0')
+            solarstats.retry_wait('BLS3000', 1, link)
+            solarstats.retry_wait('BLS3000', 0, link)
+        finally:
+            solarstats.retryDelay = saved
+        self.assertEqual(link.counts['Retries'], 1)
+
+class TestStatus(unittest.TestCase):
+
+    def test_blacklinesolar(self):
+        self.assertEqual(solarstats.blacklinesolar_status(1, 1500.0), ("Inverter in operation", True))
+        self.assertEqual(solarstats.blacklinesolar_status(0, 0.0), ("Inverter not running", True))     # At night
+        self.assertEqual(solarstats.blacklinesolar_status(0, 300.0), ("Inverter not running", False))
+        self.assertEqual(solarstats.blacklinesolar_status(5, 0.0), ("Unknown: 5", False))
+
+    def test_soladin(self):
+        self.assertEqual(solarstats.soladin_status(0, 300.0), ("Inverter in operation", True))
+        self.assertEqual(solarstats.soladin_status(0x002, 0.0), ("Solar input voltage too low", True))
+        self.assertEqual(solarstats.soladin_status(0x002, 50.0), ("Solar input voltage too low", False))
+        self.assertEqual(solarstats.soladin_status(0x400, 600.0), ("Max solar output", True))
+        self.assertEqual(solarstats.soladin_status(0x080 | 0x400, 600.0), ("Temperature error", False))
+        self.assertEqual(solarstats.soladin_status(0x1000, 0.0), ("Unknown: 4096", False))
+
+class TestEndOfDay(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = dict((name, getattr(solarstats, name)) for name in ('create_html', 'end_of_day', 'cycleDay', 'forwardUrl'))
+        self.ended = []
+        solarstats.create_html = lambda results: None
+        solarstats.end_of_day = lambda conn, day=None: self.ended.append(day)
+        solarstats.forwardUrl = None
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(solarstats, name, value)
+
+    def test_dayChange(self):
+        start = time.mktime((2014, 6, 21, 23, 45, 0, 0, 0, -1))
+        for cycle in range(5):
+            solarstats.finish_cycle(None, start + 300 * cycle, [])
+        self.assertEqual(self.ended, ['2014-06-21'])
+
+class TestNightSupervised(unittest.TestCase):
+
+    port = '/dev/ttyUSB0'
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.names = ('sqliteDbName', 'nightStateFile', 'anomalyStateFile', 'supervised_ports', 'rrd_update_many',
+                      'publish_sample', 'nightSchedule', 'nightScheduleFile', 'energyCounters')
+        self.saved = dict((name, getattr(solarstats, name)) for name in self.names)
+        solarstats.sqliteDbName = os.path.join(self.tmpDir, 'test.sqlt')
+        solarstats.nightStateFile = os.path.join(self.tmpDir, 'SolarStats.night.json')
+        solarstats.anomalyStateFile = None
+        solarstats.supervised_ports = lambda: [(self.port, self.poll, 'SolarStats_BLS.rrd')]
+        solarstats.rrd_update_many = lambda rrdDb, updates: self.updates.extend(updates)
+        solarstats.publish_sample = lambda results: None
+        solarstats.energyCounters = None
+        self.conn = sqlite3.connect(solarstats.sqliteDbName)
+        with open(solarstats.init_file()) as f:
+            self.conn.executescript(f.read())
+        self.polls = []
+        self.updates = []
+        self.next = None
+        # The worker and the writer are separate processes, each with a night schedule of its own
+        self.schedules = {'worker': (None, None), 'writer': (None, None)}
+
+    def tearDown(self):
+        self.conn.close()
+        for name, value in self.saved.items():
+            setattr(solarstats, name, value)
+        shutil.rmtree(self.tmpDir)
+
+    def poll(self, conn, portID, attempts=None):
+        self.polls.append(attempts)
+        results = {'id': 1, 'name': 'BLS3000', 'success': self.next is not None}
+        if self.next is not None:
+            results.update({'PowerAC': self.next, 'EnergyToday': 5.0, 'EnergyTotal': 300.0})
+        return results
+
+    def run_in(self, process, function, *args):
+        solarstats.nightSchedule, solarstats.nightScheduleFile = self.schedules[process]
+        try:
+            return function(*args)
+        finally:
+            self.schedules[process] = solarstats.nightSchedule, solarstats.nightScheduleFile
+            if solarstats.nightSchedule is not None:
+                solarstats.nightSchedule.night = lambda now: True
+
+    def cycle(self, power=None):
+        self.next = power
+        del self.updates[:]
+        results = self.run_in('worker', solarstats.poll_port, self.conn, self.port)
+        self.run_in('writer', solarstats.store_port_results, self.conn, self.port, results)
+        return results
+
+    def test_nightCycles(self):
+        self.cycle(0.0)                     # Quiet
+        self.assertEqual(self.polls, [None])
+        results = self.cycle()              # No response: asleep
+        self.assertTrue(results['asleep'])
+        self.assertEqual([values for t, values in self.updates], ['0:5.0:0.0'])
+        self.cycle()                        # Not polled
+        self.assertEqual(self.polls, [None, None])
+        self.assertEqual(self.updates, [])
+        self.schedules['worker'][0].port(self.port).lastProbe -= 3600
+        self.cycle()                        # Probed: the cycles slept through are written
+        self.assertEqual(self.polls, [None, None, 1])
+        self.assertEqual([values for t, values in self.updates], ['0:5.0:0.0', '0:5.0:0.0'])
+        self.assertTrue(all(t is not None for t, values in self.updates))
+        for process in ('worker', 'writer'):
+            self.run_in(process, solarstats.save_night_state)
+        self.assertEqual(sorted(os.listdir(self.tmpDir)), ['SolarStats.night.dev_ttyUSB0.json', 'SolarStats.night.json',
+                                                           'test.sqlt'])
+
+class TestReplay(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        self.saved = (solarstats.serialPorts, solarstats.webDir, solarstats.nightStateFile, solarstats.retryDelay,
+                      solarstats.blsPort, solarstats.anomalyStateFile, solarstats.metricsFile)
+        solarstats.anomalyStateFile = None
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        (solarstats.serialPorts, solarstats.webDir, solarstats.nightStateFile, solarstats.retryDelay,
+         solarstats.blsPort, solarstats.anomalyStateFile, solarstats.metricsFile) = self.saved
+        shutil.rmtree(self.tmpDir)
+
+    def replay(self, port):
+        # The replay works in a scratch directory; what it imports lazily is imported before going there
+        from solarstats import counters, frametrace, rrdschema, rrdstore, simulator
+        solarstats.load_drivers()
+        captureFile = os.path.join(self.tmpDir, 'capture%d.sscp' % len(os.listdir(self.tmpDir)))
+        capture = frametrace.CaptureFile(captureFile)
+        capture.record(frametrace.TX, port, 'request', 1.0)
+        capture.record(frametrace.RX, port, 'response', 1.1)
+        capture.close()
+        solarstats.replay_capture(captureFile)
+        os.chdir(self.cwd)
+        shutil.rmtree(solarstats.webDir)    # The scratch directory
+        return solarstats.serialPorts[port].remaining()
+
+    def test_otherPorts(self):
+        self.assertEqual(self.replay('tcp://gw'), 1)     # Not polled: reported, and the replay ends
+        solarstats.blsPort = 'tcp://gw'
+        self.assertEqual(self.replay('tcp://gw'), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -51,3 +51,7 @@ class TestSolarUtils(unittest.TestCase):
         self.assertEqual(self.su.hex2int(['\xFF']), 255)
         self.assertEqual(self.su.hex2int(['\x12', '\x34']), 13330)
         self.assertEqual(self.su.hex2int(['\xAA', '\xAA']), 43690)
+
+    def test_lazyHex(self):
+        self.assertEqual(str(solarutils.LazyHex('\x02\xFF')), '02 FF')
+        self.assertEqual('%s' % solarutils.LazyHex(['\x02', '\x04']), '02 04')
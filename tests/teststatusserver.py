@@ -0,0 +1,203 @@
+#! /usr/bin/python
+
+import datetime
+import gzip
+import httplib
+import json
+import os
+import shutil
+import sqlite3
+import StringIO
+import tempfile
+import threading
+import time
+import unittest
+from solarstats import htmlpage
+from solarstats import inverters
+from solarstats import linkstats
+from solarstats import livefeed
+from solarstats import statusserver
+try:
+    from solarstats import downsample
+    from solarstats import ringbuffer
+except ImportError:
+    downsample = ringbuffer = None
+
+class TestStatusServer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.dbName = os.path.join(self.tmpDir, 'test.sqlt')
+        conn = sqlite3.connect(self.dbName)
+        with open(os.path.join(os.path.dirname(__file__), '..', 'db', 'SolarStatsInit.sql')) as f:
+            conn.executescript(f.read())
+        conn.execute("INSERT INTO inverterdata (Inverter_ID, DateTime, PowerAC, VoltsPV1, CurrentPV1, Temperature, FrequencyAC, VoltsAC1, "
+                     "MinToday, EnergyToday, HrsTotal, EnergyTotal, RawData) VALUES (1, ?, 1500.0, 300.0, 5.0, 40.0, 50.0, 230.0, 300, 8.5, 1000, 2500.0, '')",
+                     (str(datetime.datetime.now()),))
+        conn.commit()
+        conn.close()
+        with open(os.path.join(self.tmpDir, 'solarStats_last24hrs.png'), 'wb') as f:
+            f.write('\x89PNG fake')
+
+        samples = statusserver.LatestSamples(self.dbName, inverters.legacy_inverters())
+        self.hub = livefeed.FanoutHub()
+        self.server = statusserver.StatusServer(('127.0.0.1', 0), samples, htmlpage.StatusPage(), self.tmpDir, hub=self.hub)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.tmpDir)
+
+    def get(self, path, headers=None, method='GET'):
+        conn = httplib.HTTPConnection('127.0.0.1', self.server.server_address[1])
+        conn.request(method, path, headers=headers or {})
+        response = conn.getresponse()
+        body = response.read()
+        conn.close()
+        return response, body
+
+    def test_json(self):
+        response, body = self.get('/api/inverters')
+        self.assertEqual(response.status, 200)
+        samples = json.loads(body)
+        self.assertEqual([s['id'] for s in samples], [1, 2])
+        self.assertEqual(samples[0]['PowerAC'], 1500.0)
+        self.assertTrue(samples[0]['success'])
+        self.assertFalse(samples[1]['success'])
+
+    def test_conditional(self):
+        response, body = self.get('/')
+        self.assertEqual(response.status, 200)
+        self.assertIn('<SPAN ID="PowerAC1">1500.0</SPAN> W', body)
+        etag = response.getheader('ETag')
+        response, body = self.get('/', {'If-None-Match': etag})
+        self.assertEqual(response.status, 304)
+        self.assertEqual(body, '')
+
+    def test_gzip(self):
+        response, body = self.get('/api/inverters', {'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.getheader('Content-Encoding'), 'gzip')
+        plain = gzip.GzipFile(fileobj=StringIO.StringIO(body)).read()
+        self.assertEqual(json.loads(plain)[0]['id'], 1)
+
+    def test_graph(self):
+        mtime = int(os.stat(os.path.join(self.tmpDir, 'solarStats_last24hrs.png')).st_mtime)
+        response, body = self.get('/')
+        self.assertIn('solarStats_last24hrs.png?v=%d' % mtime, body)
+        response, body = self.get('/solarStats_last24hrs.png?v=%d' % mtime)
+        self.assertEqual(body, '\x89PNG fake')
+        self.assertEqual(response.getheader('Cache-Control'), 'public, max-age=31536000')
+        response, body = self.get('/solarStats_last24hrs.png')
+        self.assertEqual(response.getheader('Cache-Control'), 'no-cache')
+        response, body = self.get('/solarStats_last7days.png')
+        self.assertEqual(response.status, 404)
+
+    def test_linkstats(self):
+        response, body = self.get('/api/linkstats')
+        self.assertEqual(json.loads(body), {'1h': [], '24h': [], '7d': []})
+        conn = sqlite3.connect(self.dbName)
+        link = linkstats.LinkStats(2, '/dev/ttyUSB1')
+        link.count('Sent', 3)
+        link.count('Timeouts', 3)
+        link.store(conn)
+        conn.close()
+        response, body = self.get('/api/linkstats')
+        self.assertEqual(json.loads(body)['1h'][0]['Timeouts'], 3)
+        response, body = self.get('/')
+        self.assertIn('<TR><TD>Sol</TD><TD>3</TD><TD>0.0%</TD>', body)
+
+    @unittest.skipUnless(downsample, "numpy not installed")
+    def test_series(self):
+        response, body = self.get('/api/series?inverter=1&days=1')
+        self.assertEqual(response.status, 404)     # No downsampler
+        self.server.downsampler = downsample.Downsampler(lambda start, end: sqlite3.connect(self.dbName))
+        response, body = self.get('/api/series?inverter=1&days=1&points=100')
+        self.assertEqual(response.status, 200)
+        series = json.loads(body)
+        self.assertEqual((series['bucket'], series['v']), (900, [1500.0]))
+        response, body = self.get('/api/series?inverter=1&start=2014-06-01&end=2014-06-02')
+        self.assertEqual(json.loads(body)['t'], [])
+        response, body = self.get('/api/series?metric=RawData')
+        self.assertEqual(response.status, 400)
+        response, body = self.get('/api/series?start=June')
+        self.assertEqual(response.status, 400)
+
+    @unittest.skipUnless(ringbuffer, "numpy not installed")
+    def test_recent(self):
+        response, body = self.get('/api/recent?inverter=1')
+        self.assertEqual(response.status, 404)     # No recent samples kept
+        self.server.recent = ringbuffer.RecentSamples()
+        self.server.recent.load(sqlite3.connect(self.dbName))
+        self.server.recent.add({'id': 1, 't': time.time(), 'PowerAC': 1600.0})
+        response, body = self.get('/api/recent?inverter=1&minutes=10')
+        self.assertEqual(response.status, 200)
+        recent = json.loads(body)
+        self.assertEqual(recent['PowerAC'], [1500.0, 1600.0])
+        self.assertEqual(recent['MinToday'], [300.0, None])
+        response, body = self.get('/api/recent?inverter=2&today=1')
+        self.assertEqual(response.status, 404)
+        response, body = self.get('/api/recent?minutes=many')
+        self.assertEqual(response.status, 400)
+
+    def test_metrics(self):
+        response, body = self.get('/metrics')
+        self.assertEqual(response.status, 404)     # Not configured
+        self.server.metricsFile = os.path.join(self.tmpDir, 'SolarStats.prom')
+        response, body = self.get('/metrics')
+        self.assertEqual(response.status, 404)     # No cycle yet
+        with open(self.server.metricsFile, 'w') as f:
+            f.write('# TYPE solarstats_stage_seconds histogram\n')
+        response, body = self.get('/metrics')
+        self.assertEqual(response.status, 200)
+        self.assertTrue(response.getheader('Content-Type').startswith('text/plain'))
+        self.assertIn('solarstats_stage_seconds', body)
+
+    def test_events(self):
+        self.server.keepAlive = 0.05
+        self.hub.publish({'id': 1, 'PowerAC': 1500.0})
+        conn = httplib.HTTPConnection('127.0.0.1', self.server.server_address[1])
+        conn.request('GET', '/events')
+        response = conn.getresponse()
+        self.assertEqual(response.getheader('Content-Type'), 'text/event-stream')
+        self.assertEqual(response.fp.readline(), 'retry: 10000\n')
+        response.fp.readline()
+        self.assertEqual(response.fp.readline(), 'data: {"PowerAC":1500.0,"id":1}\n')
+        response.close()
+        conn.close()
+        for i in range(100):    # The handler notices the disconnect on its next keep-alive
+            if self.hub.clientCount() == 0:
+                break
+            time.sleep(0.05)
+        self.assertEqual(self.hub.clientCount(), 0)
+
+    def test_head(self):
+        response, body = self.get('/', method='HEAD')
+        self.assertEqual(response.status, 200)
+        self.assertNotEqual(response.getheader('Content-Length'), '0')
+        self.assertEqual(body, '')
+        response, body = self.get('/events', method='HEAD')     # Does not stream
+        self.assertEqual(response.getheader('Content-Type'), 'text/event-stream')
+        self.assertEqual(self.hub.clientCount(), 0)
+
+    def test_errors(self):
+        def fail(*args):
+            raise RuntimeError("Broken")
+        self.server.page = fail
+        response, body = self.get('/')
+        self.assertEqual((response.status, body), (500, 'Internal error\n'))
+        # After the response has started, the connection is closed instead
+        self.hub.subscribe = fail
+        response, body = self.get('/events')
+        self.assertEqual((response.status, body), (200, ''))
+
+    def test_samplesGetOld(self):
+        samples = self.server.samples
+        version, fresh = samples.get()
+        self.assertTrue(fresh[0]['success'])
+        oldVersion, old = samples.get(time.time() + samples.maxAge + 60)    # The database did not change
+        self.assertFalse(old[0]['success'])
+        self.assertNotEqual(oldVersion, version)
+        self.assertTrue(samples.get()[1][0]['success'])
@@ -0,0 +1,114 @@
+#! /usr/bin/python
+
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+from solarstats import supervisor, timing
+
+# Poll function of the workers: stores a row (through the channel) and reports the process and time
+def poll(conn, port):
+    conn.execute("INSERT INTO samples VALUES (?, ?, ?)", (port, os.getpid(), buffer('\x00\x01')))
+    conn.commit()
+    time.sleep(0.2)     # Waiting for the inverter
+    return {'port': port, 'pid': os.getpid(), 'time': time.time()}
+
+def crash(conn, port):
+    os._exit(3)
+
+def record_cycle(conn, cycle, results):
+    conn.execute("INSERT INTO cycles VALUES (?)", (','.join(r['port'] for r in results),))
+    conn.commit()
+
+class TestSupervisor(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.dbName = os.path.join(self.tmpDir, 'test.sqlt')
+        conn = sqlite3.connect(self.dbName)
+        conn.execute("CREATE TABLE samples (Port TEXT, Pid INTEGER, Data BLOB)")
+        conn.execute("CREATE TABLE cycles (Ports TEXT)")
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def test_channelConnection(self):
+        channel = multiprocessing.Queue()
+        conn = supervisor.ChannelConnection(channel, self.dbName)
+        self.assertIsNone(conn.execute("INSERT INTO samples VALUES ('a', 1, ?)", (buffer('\xff'),)))
+        conn.commit()
+        self.assertEqual(conn.execute("SELECT count(*) FROM samples").fetchone()[0], 0)   # Not written by the worker
+        self.assertEqual(conn.execute("WITH s AS (SELECT * FROM samples) SELECT count(*) FROM s").fetchone()[0], 0)
+        self.assertEqual(conn.execute("PRAGMA user_version").fetchone()[0], 0)
+        self.assertIsNone(conn.execute("PRAGMA user_version = 3"))
+        channel.put(('result', 1, 'a', {'port': 'a'}, []))
+        channel.put(None)
+        results = []
+        supervisor.writer_main(channel, self.dbName, ['a'], lambda c, port, r: results.append(port), record_cycle,
+                               lambda c: results.append('start'))
+        self.assertEqual(results, ['start', 'a'])
+        db = sqlite3.connect(self.dbName)
+        self.assertEqual(db.execute("SELECT Port, Data FROM samples").fetchall(), [(u'a', buffer('\xff'))])
+        self.assertEqual(db.execute("SELECT Ports FROM cycles").fetchall(), [(u'a',)])
+        self.assertEqual(db.execute("PRAGMA user_version").fetchone()[0], 3)
+        db.close()
+        conn.close()
+
+    def test_workerTimings(self):
+        def timed_poll(conn, port):
+            with timing.timings.span('request', 'BLS3000'):
+                pass
+            return {'port': port}
+        saved = timing.timings.enabled, timing.timings.histograms
+        timing.timings.enabled, timing.timings.histograms = True, {}
+        try:
+            channel = multiprocessing.Queue()
+            supervisor.worker_main('a', timed_poll, channel, self.dbName, 0.1, multiprocessing.Event(), cycles=1)
+            message = channel.get()
+            self.assertEqual([(stage, inverter) for stage, inverter, seconds in message[4]], [('request', 'BLS3000')])
+            timing.timings.histograms = {}      # The writer is another process
+            channel.put(message)
+            channel.put(None)
+            supervisor.writer_main(channel, self.dbName, ['a'])
+            self.assertEqual(timing.timings.histograms[('request', 'BLS3000')].count, 1)
+        finally:
+            timing.timings.enabled, timing.timings.histograms = saved
+
+    def test_workersInParallel(self):
+        ports = ['/dev/ttyUSB%d' % i for i in range(4)]
+        sup = supervisor.Supervisor(ports, poll, self.dbName, interval=0.5, handleCycle=record_cycle)
+        self.assertEqual(sup.check(), 5)
+        time.sleep(1.6)
+        sup.stop()
+        db = sqlite3.connect(self.dbName)
+        rows = db.execute("SELECT Port, Pid, Data FROM samples").fetchall()
+        cycles = db.execute("SELECT Ports FROM cycles").fetchall()
+        db.close()
+        self.assertGreaterEqual(len(rows), 4)
+        self.assertEqual(len(set(pid for port, pid, data in rows)), 4)     # One process per port
+        self.assertEqual(rows[0][2], buffer('\x00\x01'))
+        self.assertIn((','.join(ports),), cycles)  # All ports reported within the same cycle
+
+    def test_restartWithBackoff(self):
+        sup = supervisor.Supervisor(['a'], crash, self.dbName, interval=0.01, restartDelay=5, stableTime=60)
+        worker = sup.workers[0]
+        sup.check(now=1000.0)
+        worker.process.join()
+        self.assertEqual(worker.process.exitcode, 3)
+        self.assertEqual(sup.check(now=1001.0), 1)     # Only the writer runs
+        self.assertEqual(worker.restartAt, 1006.0)
+        self.assertIsNone(worker.process)
+        sup.check(now=1006.0)                           # Restarted; crashes again
+        worker.process.join()
+        sup.check(now=1007.0)
+        self.assertEqual(worker.restartAt, 1017.0)     # Waits twice as long
+        self.assertEqual(worker.crashes, 2)
+        sup.stop()
+
+if __name__ == '__main__':
+    unittest.main()
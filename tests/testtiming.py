@@ -0,0 +1,75 @@
+#! /usr/bin/python
+
+import os
+import shutil
+import tempfile
+import unittest
+from solarstats import timing
+
+class TestTiming(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.timings = timing.Timings(enabled=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def test_disabled(self):
+        timings = timing.Timings()
+        with timings.span('sqlite', 'BLS3000'):
+            pass
+        self.assertEqual(timings.histograms, {})
+        self.assertEqual(timings.summary(), '')
+
+    def test_span(self):
+        with self.timings.span('sqlite', 'BLS3000'):
+            pass
+        with self.timings.span('sqlite', 'BLS3000'):
+            pass
+        with self.timings.span('html'):
+            pass
+        self.assertEqual(self.timings.histograms[('sqlite', 'BLS3000')].count, 2)
+        self.assertIn('sqlite[BLS3000]=', self.timings.summary())
+        self.assertIn('html=', self.timings.summary())
+
+    def test_span_exception(self):
+        with self.assertRaises(ValueError):
+            with self.timings.span('crc', 'Soladin600'):
+                raise ValueError("Invalid CRC")
+        self.assertEqual(self.timings.histograms[('crc', 'Soladin600')].count, 1)
+
+    def test_prometheus(self):
+        self.timings.observe('request', 'BLS3000', 0.3)
+        self.timings.observe('request', 'BLS3000', 12.0)
+        text = self.timings.prometheus()
+        self.assertIn('# TYPE solarstats_stage_seconds histogram', text)
+        self.assertIn('solarstats_stage_seconds_bucket{stage="request",inverter="BLS3000",le="0.25"} 0', text)
+        self.assertIn('solarstats_stage_seconds_bucket{stage="request",inverter="BLS3000",le="0.5"} 1', text)
+        self.assertIn('solarstats_stage_seconds_bucket{stage="request",inverter="BLS3000",le="30"} 2', text)
+        self.assertIn('solarstats_stage_seconds_bucket{stage="request",inverter="BLS3000",le="+Inf"} 2', text)
+        self.assertIn('solarstats_stage_seconds_sum{stage="request",inverter="BLS3000"} 12.300000', text)
+        self.assertIn('solarstats_stage_seconds_count{stage="request",inverter="BLS3000"} 2', text)
+
+    def test_save_load(self):
+        stateFile = os.path.join(self.tmpDir, 'timing.json')
+        promFile = os.path.join(self.tmpDir, 'timing.prom')
+        self.timings.observe('rrd_update', 'Soladin600', 0.02)
+        self.timings.save(stateFile, promFile)
+        self.assertTrue(os.path.isfile(promFile))
+
+        # A later run continues the histograms
+        timings = timing.Timings(enabled=True)
+        timings.load(stateFile)
+        timings.observe('rrd_update', 'Soladin600', 0.04)
+        hist = timings.histograms[('rrd_update', 'Soladin600')]
+        self.assertEqual(hist.count, 2)
+        self.assertAlmostEqual(hist.total, 0.06)
+        self.assertEqual(timings.summary(), 'rrd_update[Soladin600]=0.040s')
+
+    def test_load_missing(self):
+        self.timings.load(os.path.join(self.tmpDir, 'missing.json'))
+        self.assertEqual(self.timings.histograms, {})
+
+if __name__ == '__main__':
+    unittest.main()
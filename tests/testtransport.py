@@ -0,0 +1,111 @@
+#! /usr/bin/python
+
+import socket
+import threading
+import unittest
+from solarstats import blacklinesolar3000
+from solarstats import simulator
+from solarstats import transport
+
+class TestTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.bls = blacklinesolar3000.BlackLineSolar()
+        self.devices = [simulator.SimulatedBlackLineSolar('02'),
+                        simulator.SimulatedBlackLineSolar('03', {'PowerAC': 2000.0}),
+                        simulator.SimulatedBlackLineSolar('04', {'PowerAC': 500.0})]
+        self.gateways = []
+        self.pool = transport.ConnectionPool(timeout=1.0)
+
+    def tearDown(self):
+        self.pool.close()
+        for gateway, thread in self.gateways:
+            gateway.shutdown()
+            gateway.server_close()
+            thread.join()
+
+    def gateway(self, **options):
+        gateway = simulator.SimulatedGateway(('127.0.0.1', 0), self.devices, **options)
+        thread = threading.Thread(target=gateway.serve_forever)
+        thread.start()
+        self.gateways.append((gateway, thread))
+        return gateway
+
+    def read(self, port):
+        data = ''
+        ch = port.read()
+        while ch:
+            data += ch
+            ch = port.read()
+        return data
+
+    # PowerAC is in registers 0x15-0x16 (the high word is 0)
+    def power(self, data):
+        return int(data[24:26].encode('hex'), 16) / 10.0
+
+    def test_modbusTcpPort(self):
+        gateway = self.gateway()
+        port = transport.open_port('tcp://127.0.0.1:%d' % gateway.server_address[1], self.pool)
+        self.assertEqual(port.framing, 'mbap')
+        port.write(self.bls.mb_readInputRegisters("03", "0A", "1F"))
+        address, command, byteCount, data = self.bls.mb_parseTcpResponse(self.read(port))
+        self.assertEqual((address, ord(byteCount)), ('\x03', 0x3E))
+        self.assertEqual(self.power(data), 2000.0)
+
+    def test_rtuOverTcpPort(self):
+        gateway = self.gateway(rtu=True)
+        port = transport.open_port('rtu+tcp://127.0.0.1:%d' % gateway.server_address[1], self.pool)
+        port.write(self.bls.mb_readInputRegisters("04", "0A", "1F"))
+        address, command, byteCount, data = self.bls.mb_parseResponse(self.read(port))     # CRC checked
+        self.assertEqual(self.power(data), 500.0)
+
+    def test_noResponse(self):
+        gateway = self.gateway()
+        port = transport.open_port('tcp://127.0.0.1:%d' % gateway.server_address[1], self.pool)
+        port.write(self.bls.mb_readInputRegisters("09", "0A", "1F"))
+        with self.assertRaises(ValueError):     # Gateway exception
+            self.bls.mb_parseTcpResponse(self.read(port))
+
+        self.pool.timeout = 0.2
+        gateway = self.gateway(rtu=True)
+        port = transport.open_port('rtu+tcp://127.0.0.1:%d' % gateway.server_address[1], self.pool)
+        port.write(self.bls.mb_readInputRegisters("09", "0A", "1F"))
+        self.assertEqual(self.read(port), '')   # Timeout
+
+    def test_gatewayDown(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        address = sock.getsockname()
+        sock.close()
+        port = transport.open_port('tcp://127.0.0.1:%d' % address[1], self.pool)
+        port.write(self.bls.mb_readInputRegisters("02", "0A", "1F"))
+        self.assertEqual(self.read(port), '')
+
+    def test_pipeline(self):
+        gateway = self.gateway(reorder=True)
+        client = transport.ModbusTcpClient(gateway.server_address, self.pool, window=3)
+        requests = [(unit, self.bls.mb_readInputRegisters('%02X' % unit, "0A", "1F")[1:-2]) for unit in (2, 3, 4, 3, 2)]
+        responses = client.pipeline(requests)
+        self.assertEqual([ord(frame[6]) for frame in responses], [2, 3, 4, 3, 2])
+        self.assertEqual([self.power(self.bls.mb_parseTcpResponse(frame)[3]) for frame in responses],
+                         [1287.0, 2000.0, 500.0, 2000.0, 1287.0])
+        self.assertEqual(gateway.requests, 5)
+
+    def test_pool(self):
+        gateway = self.gateway()
+        client = transport.ModbusTcpClient(gateway.server_address, self.pool)
+        pdu = self.bls.mb_readInputRegisters("02", "0A", "1F")[1:-2]
+        client.transact(2, pdu)
+        sock = self.pool._idle[gateway.server_address][0]
+        client.transact(2, pdu)
+        self.assertIs(self.pool._idle[gateway.server_address][0], sock)    # Connection reused
+
+    def test_openPort(self):
+        self.assertEqual(transport.open_port('tcp://gateway').client.address, ('gateway', 502))
+        with self.assertRaises(ValueError):
+            transport.open_port('rtu+tcp://gateway')
+        with self.assertRaises(ValueError):
+            transport.open_port('udp://gateway:502')
+
+if __name__ == '__main__':
+    unittest.main()